@@ -37,12 +37,137 @@ awslocal dynamodb create-table \
     --billing-mode PAY_PER_REQUEST \
     2>/dev/null || echo "Config table already exists"
 
+# Change counter of the config table (config_store.py, ConfigRepository::put)
+awslocal dynamodb create-table \
+    --table-name sidea-ai-clone-prod-config-version-table \
+    --attribute-definitions AttributeName=name,AttributeType=S \
+    --key-schema AttributeName=name,KeyType=HASH \
+    --billing-mode PAY_PER_REQUEST \
+    2>/dev/null || echo "Config version table already exists"
+
 echo "✓ Config table ready"
 
+# Retrieval cache table (shared tier of the KB retrieval cache)
+awslocal dynamodb create-table \
+    --table-name sidea-ai-clone-prod-retrieval-cache-table \
+    --attribute-definitions AttributeName=cache_key,AttributeType=S \
+    --key-schema AttributeName=cache_key,KeyType=HASH \
+    --billing-mode PAY_PER_REQUEST \
+    2>/dev/null || echo "Retrieval cache table already exists"
+
+awslocal dynamodb update-time-to-live \
+    --table-name sidea-ai-clone-prod-retrieval-cache-table \
+    --time-to-live-specification Enabled=true,AttributeName=expires_at \
+    2>/dev/null || true
+
+echo "✓ Retrieval cache table ready"
+
+# TTS audio cache index (content-addressed objects under audio/cache/ in the media bucket),
+# lru_index (lru_shard = L#0-3, last_hit_at) gives the eviction the least recently hit objects
+awslocal dynamodb create-table \
+    --table-name sidea-ai-clone-prod-tts-cache-table \
+    --attribute-definitions \
+        AttributeName=cache_key,AttributeType=S \
+        AttributeName=lru_shard,AttributeType=S \
+        AttributeName=last_hit_at,AttributeType=N \
+    --key-schema AttributeName=cache_key,KeyType=HASH \
+    --global-secondary-indexes \
+        '[{"IndexName":"lru_index","KeySchema":[{"AttributeName":"lru_shard","KeyType":"HASH"},{"AttributeName":"last_hit_at","KeyType":"RANGE"}],"Projection":{"ProjectionType":"INCLUDE","NonKeyAttributes":["s3_key","bytes"]}}]' \
+    --billing-mode PAY_PER_REQUEST \
+    2>/dev/null || echo "TTS cache table already exists"
+
+echo "✓ TTS cache table ready"
+
+# Transcription callback rendezvous (task token <-> transcript landed), one item per Transcribe job
+awslocal dynamodb create-table \
+    --table-name sidea-ai-clone-prod-transcription-callbacks-table \
+    --attribute-definitions AttributeName=job_name,AttributeType=S \
+    --key-schema AttributeName=job_name,KeyType=HASH \
+    --billing-mode PAY_PER_REQUEST \
+    2>/dev/null || echo "Transcription callbacks table already exists"
+
+awslocal dynamodb update-time-to-live \
+    --table-name sidea-ai-clone-prod-transcription-callbacks-table \
+    --time-to-live-specification Enabled=true,AttributeName=expires_at \
+    2>/dev/null || true
+
+echo "✓ Transcription callbacks table ready"
+
+# Per-contact message buffer of the coalescing window (one item per contact while it types,
+# plus one M#<message id> item per buffered message to drop SQS redeliveries)
+awslocal dynamodb create-table \
+    --table-name sidea-ai-clone-prod-message-buffer-table \
+    --attribute-definitions AttributeName=buffer_key,AttributeType=S \
+    --key-schema AttributeName=buffer_key,KeyType=HASH \
+    --billing-mode PAY_PER_REQUEST \
+    2>/dev/null || echo "Message buffer table already exists"
+
+awslocal dynamodb update-time-to-live \
+    --table-name sidea-ai-clone-prod-message-buffer-table \
+    --time-to-live-specification Enabled=true,AttributeName=expires_at \
+    2>/dev/null || true
+
+echo "✓ Message buffer table ready"
+
+# Topic-indexed session summaries (pk = messages key, sk = T#<topic_id>#S#<session_id>),
+# recent_index (recent = T#<topic_id>#<updated_at>) reads the latest sessions of a topic
+awslocal dynamodb create-table \
+    --table-name sidea-ai-clone-prod-topic-history-table \
+    --attribute-definitions \
+        AttributeName=pk,AttributeType=S \
+        AttributeName=sk,AttributeType=S \
+        AttributeName=recent,AttributeType=S \
+    --key-schema \
+        AttributeName=pk,KeyType=HASH \
+        AttributeName=sk,KeyType=RANGE \
+    --local-secondary-indexes \
+        '[{"IndexName":"recent_index","KeySchema":[{"AttributeName":"pk","KeyType":"HASH"},{"AttributeName":"recent","KeyType":"RANGE"}],"Projection":{"ProjectionType":"INCLUDE","NonKeyAttributes":["topic_id","session_id","summary","keywords","turns","updated_at"]}}]' \
+    --billing-mode PAY_PER_REQUEST \
+    2>/dev/null || echo "Topic history table already exists"
+
+echo "✓ Topic history table ready"
+
+# Per-contact topic registry (pk = messages key, sk = TOPIC#<topic_id> with the centroid embedding, or META)
+awslocal dynamodb create-table \
+    --table-name sidea-ai-clone-prod-topic-registry-table \
+    --attribute-definitions \
+        AttributeName=pk,AttributeType=S \
+        AttributeName=sk,AttributeType=S \
+    --key-schema \
+        AttributeName=pk,KeyType=HASH \
+        AttributeName=sk,KeyType=RANGE \
+    --billing-mode PAY_PER_REQUEST \
+    2>/dev/null || echo "Topic registry table already exists"
+
+echo "✓ Topic registry table ready"
+
+echo "Creating SQS Queue..."
+# Delayed flush messages of the coalescing window (consumed by message-coalescer-fn)
+awslocal sqs create-queue --queue-name sidea-ai-clone-prod-message-coalesce-queue \
+    2>/dev/null || echo "Queue already exists"
+echo "✓ SQS queue ready"
+
 echo "Creating S3 Bucket..."
 awslocal s3 mb s3://sidea-ai-clone-prod-wa-media-s3 2>/dev/null || echo "Bucket already exists"
 echo "✓ S3 bucket ready"
 
+echo "Publishing the shared Python layer..."
+# lambdas-local/shared under python/ (on sys.path as /opt/python) for the Python functions
+SHARED_LAYER_ZIP=/tmp/sidea-ai-clone-shared.zip
+python3 - "$SHARED_LAYER_ZIP" <<'PYEOF'
+import glob, os, sys, zipfile
+with zipfile.ZipFile(sys.argv[1], 'w', zipfile.ZIP_DEFLATED) as layer:
+    for path in glob.glob('/opt/project/lambdas-local/shared/*.py'):
+        layer.write(path, os.path.join('python', os.path.basename(path)))
+PYEOF
+SHARED_LAYER_ARN=$(awslocal lambda publish-layer-version \
+    --layer-name sidea-ai-clone-shared \
+    --zip-file fileb://$SHARED_LAYER_ZIP \
+    --compatible-runtimes python3.12 \
+    --query LayerVersionArn \
+    --output text)
+echo "✓ Shared layer ready: $SHARED_LAYER_ARN"
+
 echo "Deploying Lambda Functions with Hot Reload..."
 
 # Deploy Lambda functions using hot-reload magic bucket
@@ -96,6 +221,66 @@ awslocal lambda create-function \
     --memory-size 1024 \
     2>/dev/null || echo "get-file-contents-fn already exists"
 
+# 4b. get-file-contents-py-fn (Python, shared layer): streams the Transcribe JSON
+# and returns only the transcript (prepare_local_sfn.py --transcript-extract)
+awslocal lambda create-function \
+    --function-name get-file-contents-py-fn \
+    --runtime python3.12 \
+    --role arn:aws:iam::000000000000:role/lambda-role \
+    --handler handler.handler \
+    --code S3Bucket="hot-reload",S3Key="/opt/project/lambdas-local/get-file-contents-fn" \
+    --layers "$SHARED_LAYER_ARN" \
+    --environment "Variables={AWS_ACCESS_KEY_ID=$AWS_ACCESS_KEY_ID,AWS_SECRET_ACCESS_KEY=$AWS_SECRET_ACCESS_KEY,AWS_REGION=eu-west-1,LOCALSTACK_ENDPOINT_URL=http://host.docker.internal:4566}" \
+    --timeout 10 \
+    --memory-size 256 \
+    2>/dev/null || echo "get-file-contents-py-fn already exists"
+
+# 5. transcription-callback-fn (Python, shared layer): completes the task token of
+# 'Wait for transcript' (prepare_local_sfn.py --transcription-callback)
+awslocal lambda create-function \
+    --function-name transcription-callback-fn \
+    --runtime python3.12 \
+    --role arn:aws:iam::000000000000:role/lambda-role \
+    --handler handler.handler \
+    --code S3Bucket="hot-reload",S3Key="/opt/project/lambdas-local/transcription-callback-fn" \
+    --layers "$SHARED_LAYER_ARN" \
+    --environment "Variables={AWS_ACCESS_KEY_ID=$AWS_ACCESS_KEY_ID,AWS_SECRET_ACCESS_KEY=$AWS_SECRET_ACCESS_KEY,AWS_REGION=eu-west-1,LOCALSTACK_ENDPOINT_URL=http://host.docker.internal:4566}" \
+    --timeout 30 \
+    --memory-size 256 \
+    2>/dev/null || echo "transcription-callback-fn already exists"
+
+awslocal lambda wait function-active-v2 --function-name transcription-callback-fn 2>/dev/null || true
+TRANSCRIPTION_CALLBACK_ARN=arn:aws:lambda:eu-west-1:000000000000:function:transcription-callback-fn
+
+# Transcripts landing under transcripts/ resume the waiting execution
+awslocal lambda add-permission \
+    --function-name transcription-callback-fn \
+    --statement-id s3-transcripts \
+    --action lambda:InvokeFunction \
+    --principal s3.amazonaws.com \
+    --source-arn arn:aws:s3:::sidea-ai-clone-prod-wa-media-s3 \
+    2>/dev/null || true
+awslocal s3api put-bucket-notification-configuration \
+    --bucket sidea-ai-clone-prod-wa-media-s3 \
+    --notification-configuration '{"LambdaFunctionConfigurations":[{"Id":"transcripts","LambdaFunctionArn":"'"$TRANSCRIPTION_CALLBACK_ARN"'","Events":["s3:ObjectCreated:*"],"Filter":{"Key":{"FilterRules":[{"Name":"prefix","Value":"transcripts/"},{"Name":"suffix","Value":".json"}]}}}]}'
+
+# Failed Transcribe jobs fail the waiting execution instead of letting it time out
+awslocal events put-rule \
+    --name sidea-ai-clone-prod-transcribe-failed \
+    --event-pattern '{"source":["aws.transcribe"],"detail-type":["Transcribe Job State Change"],"detail":{"TranscriptionJobStatus":["FAILED"]}}' \
+    >/dev/null
+awslocal lambda add-permission \
+    --function-name transcription-callback-fn \
+    --statement-id events-transcribe-failed \
+    --action lambda:InvokeFunction \
+    --principal events.amazonaws.com \
+    --source-arn arn:aws:events:eu-west-1:000000000000:rule/sidea-ai-clone-prod-transcribe-failed \
+    2>/dev/null || true
+awslocal events put-targets \
+    --rule sidea-ai-clone-prod-transcribe-failed \
+    --targets "Id=transcription-callback-fn,Arn=$TRANSCRIPTION_CALLBACK_ARN" \
+    >/dev/null
+
 echo "✓ Lambda functions deployed with hot-reload"
 
 echo "Creating Step Function..."
@@ -119,9 +304,12 @@ echo ""
 echo "=== Setup Complete ===" 
 echo ""
 echo "Available resources:"
-echo "  • DynamoDB Tables: sidea-ai-clone-prod-messages-table, sidea-ai-clone-prod-sessions-table, sidea-ai-clone-prod-config-table"
+echo "  • DynamoDB Tables: sidea-ai-clone-prod-messages-table, sidea-ai-clone-prod-sessions-table, sidea-ai-clone-prod-config-table, sidea-ai-clone-prod-config-version-table, sidea-ai-clone-prod-retrieval-cache-table, sidea-ai-clone-prod-tts-cache-table, sidea-ai-clone-prod-transcription-callbacks-table, sidea-ai-clone-prod-message-buffer-table, sidea-ai-clone-prod-topic-history-table, sidea-ai-clone-prod-topic-registry-table"
+echo "  • SQS Queue: sidea-ai-clone-prod-message-coalesce-queue"
 echo "  • S3 Bucket: sidea-ai-clone-prod-wa-media-s3"
-echo "  • Lambda Functions: reply-strategy-fn, generate-response-fn, text-to-speech-fn, get-file-contents-fn (with hot-reload)"
+echo "  • Lambda Layer: sidea-ai-clone-shared (lambdas-local/shared)"
+echo "  • Lambda Functions: reply-strategy-fn, generate-response-fn, text-to-speech-fn, get-file-contents-fn, get-file-contents-py-fn, transcription-callback-fn (with hot-reload)"
+echo "  • Transcript callback: S3 ObjectCreated on transcripts/ and EventBridge rule sidea-ai-clone-prod-transcribe-failed -> transcription-callback-fn"
 echo "  • Step Function: sidea-ai-clone-prod-wa-message-processor-sfn"
 echo ""
 echo "⚠️  NOTE: PHP Lambda functions require Bref runtime. LocalStack Community may have limitations."
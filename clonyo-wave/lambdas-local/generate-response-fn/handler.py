@@ -1,22 +1,60 @@
 import json
 import os
-import boto3
+import sys
+import time
 from datetime import datetime
 
-# Initialize Bedrock client with real AWS credentials
-bedrock_runtime = boto3.client(
-    'bedrock-agent-runtime',
-    region_name='eu-west-1',
-    aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY')
-)
+# Shared helpers live in lambdas-local/shared (shipped as a Lambda layer under /opt/python)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
 
-bedrock = boto3.client(
-    'bedrock-runtime',
-    region_name='eu-west-1',
-    aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY')
-)
+import aws_clients
+import bedrock_stream
+import config_store
+import context_assembler
+import fetch_stage
+import history_window
+import messages_history
+import model_router
+import prompt_cache
+import retrieval_cache
+import whatsapp
+
+MESSAGES_TABLE = os.environ.get('WA_MESSAGES_TABLE', 'sidea-ai-clone-prod-messages-table')
+
+# Create clients during the init phase so warm invocations reuse them
+aws_clients.warm('bedrock-agent-runtime', 'bedrock-runtime', 'dynamodb')
+
+def fetch_history(messages_key):
+    """
+    (summary, turns) from the rolling history window; conversations that
+    have no window yet fall back to the last raw messages
+    """
+    window = history_window.load(aws_clients.dynamodb(), messages_key, MESSAGES_TABLE)
+    if window is not None:
+        return window.summary, window.turns
+    return '', messages_history.last_messages(aws_clients.dynamodb(), messages_key, table_name=MESSAGES_TABLE)
+
+def fetch_kb(kb_id, user_input, retrieval_results):
+    """KB documents through the retrieval cache"""
+    print(f"Querying Knowledge Base: {kb_id}")
+    return retrieval_cache.get_cache().retrieve(
+        aws_clients.bedrock_agent_runtime(),
+        kb_id,
+        user_input,
+        retrieval_results
+    )
+
+def fetch_config(wa_phone_number_arn):
+    """Stored response_generator options of the clone, if the event tells us which one"""
+    if not wa_phone_number_arn:
+        return {}
+    try:
+        config = config_store.get_store().get(wa_phone_number_arn)
+    except Exception as e:
+        # The options passed in the event are enough to answer
+        print(f"Config lookup failed: {str(e)}")
+        return {}
+    return dict((config or {}).get('response_generator') or {})
 
 def handler(event, context):
     """
@@ -24,6 +62,7 @@ def handler(event, context):
     Mimics the PHP Lambda behavior
     """
     print(f"Event: {json.dumps(event)}")
+    aws_clients.start_invocation()
     
     try:
         # Extract input
@@ -31,90 +70,176 @@ def handler(event, context):
         config = event.get('config', {})
         messages_key = event.get('messages_key', '')
         
+        complexity_factor = event.get('complexity_factor')
+        
+        # Values passed in the event win over the stored clone config. The lookup is
+        # served from the in-process config cache once warm, and the KB id and the
+        # retrieval depth below must come from the same merged config as the route
+        config = {**fetch_config(event.get('wa_phone_number_arn')), **config}
+        
         kb_id = config.get('kb_id', os.environ.get('KNOWLEDGE_BASE_ID', 'PDZQMPE5HM'))
-        model_id = config.get('model_id', 'anthropic.claude-3-sonnet-20240229-v1:0')
-        temperature = config.get('temperature', 0.5)
-        max_tokens = config.get('max_tokens', 4096)
-        system_prompt = config.get('system_prompt', 'Sei un assistente finanziario esperto.')
         
-        # Get conversation history from DynamoDB (LocalStack)
-        dynamodb = boto3.client(
-            'dynamodb',
-            endpoint_url='http://host.docker.internal:4566',
-            region_name='eu-west-1'
-        )
+        # Model, answer length and retrieval depth by complexity band, with the clone's overrides
+        route = model_router.choose(complexity_factor, config)
+        retrieval_results = route.retrieval_results
         
-        history_response = dynamodb.query(
-            TableName='sidea-ai-clone-prod-messages-table',
-            KeyConditionExpression='pk = :pk',
-            ExpressionAttributeValues={
-                ':pk': {'S': messages_key}
-            },
-            ScanIndexForward=False,
-            Limit=10
+        # Fan out history and KB retrieval: neither depends on the other
+        fetched, fetch_report = fetch_stage.run(
+            [
+                fetch_stage.Stage('history', lambda: fetch_history(messages_key), default=('', [])),
+                fetch_stage.Stage('kb', lambda: fetch_kb(kb_id, user_input, retrieval_results), default=([], None)),
+            ],
+            fetch_stage.budget_from_context(context)
         )
         
-        # Build conversation messages
-        messages = []
-        for item in reversed(history_response.get('Items', [])):
-            if item.get('sk', {}).get('S', '').startswith('M#'):
-                role = item.get('role', {}).get('S', 'user')
-                content = item.get('content', {}).get('S', '')
-                messages.append({
-                    'role': role,
-                    'content': content
-                })
-        
-        # Add current user input
-        messages.append({
-            'role': 'user',
-            'content': user_input
-        })
-        
-        # Query Knowledge Base
-        print(f"Querying Knowledge Base: {kb_id}")
-        kb_response = bedrock_runtime.retrieve(
-            knowledgeBaseId=kb_id,
-            retrievalQuery={
-                'text': user_input
-            }
-        )
+        model_id = route.model_id
+        temperature = float(config.get('temperature', 0.5))
+        max_tokens = route.max_tokens
+        system_prompt = config.get('system_prompt', 'Sei un assistente finanziario esperto.')
+        response_mode = event.get('response_mode', config.get('response_mode', 'sync'))
         
-        # Build context from KB results
-        kb_context = ""
-        if 'retrievalResults' in kb_response:
-            for result in kb_response['retrievalResults'][:3]:  # Top 3 results
-                if 'content' in result and 'text' in result['content']:
-                    kb_context += result['content']['text'] + "\n\n"
+        bedrock = aws_clients.bedrock_runtime()
         
-        # Enhance system prompt with KB context
-        enhanced_system = system_prompt
-        if kb_context:
-            enhanced_system += f"\n\nContesto dalla Knowledge Base:\n{kb_context}"
+        # A KB fetch that failed or missed its deadline reports that outcome ('error'/'timeout')
+        kb_source = fetched['kb'][1] or fetch_report['kb']['status']
+        print(f"KB results from: {kb_source}")
         
-        # Call Bedrock
-        print(f"Calling Bedrock model: {model_id}")
-        bedrock_request = {
-            'anthropic_version': 'bedrock-2023-05-31',
-            'temperature': temperature,
-            'max_tokens': max_tokens,
-            'system': enhanced_system,
-            'messages': messages
-        }
+        # Deduplicated KB, past topic summaries and the state machine's KB results,
+        # packed into a token budget that grows with the complexity of the reply
+        context_parts = context_assembler.assemble(
+            {
+                'kb': fetched['kb'][0],
+                'history': event.get('historical_context') or [],
+                'legacy': event.get('kb_docs') or (event.get('kbResult') or {}).get('RetrievalResults') or [],
+            },
+            complexity_factor=complexity_factor,
+            min_tokens=config.get('context_min_tokens'),
+            max_tokens=config.get('context_max_tokens')
+        )
+        context_report = context_parts.report()
+        
+        summary, history = fetched['history']
         
-        bedrock_response = bedrock.invoke_model(
-            modelId=model_id,
-            body=json.dumps(bedrock_request)
+        # Stable blocks first (system, summary, history) so they can be served from
+        # the prompt cache; the KB context changes every message and goes last
+        print(f"Calling Bedrock model: {model_id}")
+        bedrock_request = prompt_cache.build_request_for_model(
+            model_id,
+            system_prompt,
+            history,
+            user_input,
+            kb_context=context_parts.texts('kb', 'legacy'),
+            temperature=temperature,
+            max_tokens=max_tokens,
+            cache=bool(config.get('prompt_cache', True)),
+            summary=summary,
+            past_context=context_parts.texts('history')
         )
         
-        response_body = json.loads(bedrock_response['body'].read())
-        ai_response = response_body['content'][0]['text']
+        delivered = False
+        chunks = []
+        stream_metrics = None
+        delivery = None
+        started = time.perf_counter()
         
+        if response_mode == 'stream':
+            # Deliver sentence groups on WhatsApp as soon as they are generated
+            # (text replies only; audio replies get the chunks back as TTS segments)
+            deliver = (
+                event.get('output_message_type') == 'text'
+                and event.get('reply_to_wa_id')
+                and event.get('wa_phone_number_arn')
+            )
+            # Chunks already sent by an earlier attempt of this execution are skipped
+            delivery = whatsapp.ChunkDelivery(
+                event['wa_phone_number_arn'],
+                event['reply_to_wa_id'],
+                delivery_id=event.get('delivery_id'),
+                table_name=MESSAGES_TABLE
+            ) if deliver else None
+            if delivery is not None and delivery.partial:
+                # A new generation would not continue the chunks the user already has
+                raise whatsapp.PartialDeliveryError(
+                    f"An earlier attempt delivered {delivery.sent} chunk(s), not generating again"
+                )
+            
+            def on_chunk(chunk, index):
+                print(f"Chunk {index} ready ({len(chunk)} chars)")
+                if delivery is not None:
+                    delivery.send(chunk, index)
+            
+            try:
+                ai_response, chunks, stream_metrics = bedrock_stream.generate_streaming(
+                    bedrock,
+                    model_id,
+                    bedrock_request,
+                    on_chunk=on_chunk,
+                    min_chars=int(config.get('stream_min_chunk_chars', bedrock_stream.DEFAULT_MIN_CHUNK_CHARS)),
+                    max_chars=int(config.get('stream_max_chunk_chars', bedrock_stream.DEFAULT_MAX_CHUNK_CHARS))
+                )
+            except Exception as e:
+                if delivery is not None and delivery.sent:
+                    raise whatsapp.PartialDeliveryError(
+                        f"Reply failed after {delivery.sent} chunk(s) were delivered: {e}"
+                    ) from e
+                raise
+            delivered = bool(deliver)
+            usage = prompt_cache.CacheUsage(
+                stream_metrics.input_tokens,
+                stream_metrics.output_tokens,
+                stream_metrics.cache_read_tokens,
+                stream_metrics.cache_write_tokens
+            )
+            stop_reason = stream_metrics.stop_reason
+        else:
+            bedrock_response = bedrock.invoke_model(
+                modelId=model_id,
+                body=json.dumps(bedrock_request)
+            )
+            
+            response_body = json.loads(bedrock_response['body'].read())
+            ai_response = response_body['content'][0]['text']
+            usage = prompt_cache.usage_from_body(response_body)
+            stop_reason = response_body.get('stop_reason')
+        
+        latency_ms = round((time.perf_counter() - started) * 1000, 2)
         print(f"Generated response: {ai_response[:100]}...")
         
+        metrics = {
+            'clients': aws_clients.stats(),
+            'retrieval_cache': dict(retrieval_cache.get_cache().stats(), source=kb_source),
+            'fetch': fetch_report,
+            'history': {'turns': len(history), 'summary_chars': len(summary)},
+            'context': context_report,
+            'prompt_cache': prompt_cache.log_usage(
+                usage,
+                clone=event.get('wa_phone_number_arn'),
+                model_id=model_id,
+                latency_ms=latency_ms
+            ),
+            'route': model_router.log_route(
+                route,
+                clone=event.get('wa_phone_number_arn'),
+                latency_ms=latency_ms,
+                first_token_ms=stream_metrics.first_token_ms if stream_metrics is not None else None,
+                output_tokens=usage.output_tokens,
+                stop_reason=stop_reason,
+                retrieval_results=retrieval_results
+            )
+        }
+        if stream_metrics is not None:
+            metrics['stream'] = stream_metrics.to_dict()
+        if delivery is not None:
+            metrics['delivery'] = delivery.to_dict()
+        print(f"Metrics: {json.dumps(metrics)}")
+        
         return {
             'statusCode': 200,
-            'response': ai_response
+            'response': ai_response,
+            'response_mode': response_mode,
+            'segments': chunks,
+            'delivered': delivered,
+            'metrics': metrics
         }
         
     except Exception as e:
@@ -0,0 +1,49 @@
+import json
+import os
+import sys
+
+# Shared helpers live in lambdas-local/shared (shipped as a Lambda layer under /opt/python)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+import aws_clients
+import transcript_json
+
+# Create the clients during the init phase so warm invocations reuse them
+aws_clients.warm('s3')
+
+def handler(event, context):
+    """
+    Replacement of the PHP GetFileContentsHandler for Transcribe output:
+    {file_uri, confidence?} -> {file_uri, transcript, confidence}.
+
+    Only the transcript text goes back into the state machine payload,
+    not the whole JSON with its word-level items. The file is streamed:
+    without `confidence` the read stops at the transcript, with it the
+    word confidences are folded into summary stats on the way through.
+    """
+    print(f"Event: {json.dumps(event)}")
+    aws_clients.start_invocation()
+
+    try:
+        file_uri = event['file_uri']
+        result = transcript_json.extract(
+            transcript_json.open_chunks(file_uri, s3=aws_clients.s3()),
+            confidence=bool(event.get('confidence'))
+        )
+        if not result['found']:
+            raise ValueError(f"No transcript in {file_uri}")
+        print(f"Transcript: {json.dumps({k: v for k, v in result.items() if k != 'transcript'})}")
+
+        return {
+            'file_uri': file_uri,
+            'transcript': result['transcript'],
+            'confidence': result['confidence'],
+            'bytes_read': result['bytes_read'],
+            'clients': aws_clients.stats()
+        }
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise e
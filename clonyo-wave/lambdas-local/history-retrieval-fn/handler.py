@@ -0,0 +1,39 @@
+import json
+import os
+import sys
+
+# Shared helpers live in lambdas-local/shared (shipped as a Lambda layer under /opt/python)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+import aws_clients
+import topic_history
+
+# Create the clients during the init phase so warm invocations reuse them
+aws_clients.warm('dynamodb')
+
+def handler(event, context):
+    """
+    Get Session History: the top-K compact summaries of the conversation
+    for the message's topic (all topics while it is unknown), read with
+    one query on the topic history table. Feeds Check Sufficiency.
+    """
+    print(f"Event: {json.dumps(event)}")
+    aws_clients.start_invocation()
+
+    messages_key = event.get('messages_key')
+    if not messages_key:
+        return {'statusCode': 400, 'error': 'messages_key is required', 'history': []}
+
+    history, report = topic_history.retrieve(
+        aws_clients.dynamodb(),
+        messages_key,
+        event.get('topic_id') or None,
+        text=event.get('userInput', ''),
+        keywords=event.get('keywords') or []
+    )
+    print(f"History retrieval: {json.dumps(report)}")
+
+    return {
+        'statusCode': 200,
+        'history': history
+    }
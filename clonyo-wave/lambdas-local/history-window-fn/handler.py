@@ -0,0 +1,40 @@
+import json
+import os
+import sys
+
+# Shared helpers live in lambdas-local/shared (shipped as a Lambda layer under /opt/python)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+import aws_clients
+import history_window
+
+# Create the clients during the init phase so warm invocations reuse them
+aws_clients.warm('dynamodb', 'bedrock-runtime')
+
+def handler(event, context):
+    """
+    Update the rolling history window after a reply has been stored:
+    append the exchange, fold evicted turns into the running summary.
+    Runs after 'Store WA sent message'.
+    """
+    print(f"Event: {json.dumps(event)}")
+    aws_clients.start_invocation()
+
+    messages_key = event.get('messages_key')
+    if not messages_key:
+        return {'statusCode': 400, 'error': 'messages_key is required'}
+
+    window, report = history_window.update(
+        aws_clients.dynamodb(),
+        aws_clients.bedrock_runtime(),
+        messages_key,
+        event.get('session_id'),
+        event.get('user_message', ''),
+        event.get('assistant_message', '')
+    )
+    print(f"History window: {json.dumps(report)}")
+
+    return {
+        'statusCode': 200,
+        'window': report
+    }
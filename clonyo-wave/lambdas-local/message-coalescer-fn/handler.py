@@ -0,0 +1,44 @@
+import json
+import os
+import sys
+
+# Shared helpers live in lambdas-local/shared (shipped as a Lambda layer under /opt/python)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+import aws_clients
+import config_store
+import message_coalescer
+import wa_router
+
+# Create the clients during the init phase so warm invocations reuse them
+aws_clients.warm('dynamodb', 'sqs', 'stepfunctions')
+
+def handler(event, context):
+    """
+    Delayed flush messages of the coalescing queue ({buffer_key, generation},
+    sent by the router for every buffered text message): start one execution
+    per contact buffer that is due. Failed flushes are returned as
+    batchItemFailures and retried by SQS.
+    """
+    records = event.get('Records', [])
+    print(f"Event: {json.dumps({'records': len(records)})}")
+    aws_clients.start_invocation()
+
+    coalescer = message_coalescer.Coalescer(aws_clients.dynamodb(), aws_clients.sqs())
+    router = wa_router.Router(config_store.get_store(), aws_clients.stepfunctions(), None)
+    failures = []
+    outcomes = {}
+    for record in records:
+        try:
+            body = json.loads(record['body'])
+            outcome = coalescer.flush(body['buffer_key'], router.start, body.get('generation'))
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            failures.append({'itemIdentifier': record['messageId']})
+            outcome = 'failed'
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    print(f"Coalescer: {json.dumps(outcomes)}")
+
+    return {'batchItemFailures': failures}
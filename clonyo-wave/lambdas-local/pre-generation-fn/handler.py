@@ -0,0 +1,145 @@
+import json
+import os
+import sys
+
+# Shared helpers live in lambdas-local/shared (shipped as a Lambda layer under /opt/python)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+import aws_clients
+import prompt_cache
+import topic_registry
+
+MODEL_ID = os.environ.get('PRE_GENERATION_MODEL_ID', 'anthropic.claude-3-haiku-20240307-v1:0')
+
+# Create the client during the init phase so warm invocations reuse it
+bedrock = aws_clients.bedrock_runtime()
+
+SYSTEM_PROMPT = """Fai parte del sistema Clonyo. Analizza l'ultimo messaggio dell'utente e rispondi con UN SOLO JSON:
+
+{
+  "topic": "<argomento principale, 1-2 parole>",
+  "keywords": ["<3 parole chiave>"],
+  "continuation": <true se il messaggio continua il Previous Topic, altrimenti false>,
+  "sufficient": <true se la Memory basta per rispondere bene, false se serve conoscenza fattuale non presente>,
+  "mode": "<text|audio>",
+  "complexity_factor": <float tra 0 e 1>
+}
+
+Regole per mode e complexity_factor:
+- Richiesta esplicita di "audio" o "voce" -> mode="audio"; richiesta esplicita di "testo", "messaggio" o "scrivi" -> mode="text".
+- SMALL_TALK (saluti, ringraziamenti, conferme brevi come "Ok", "Grazie") -> mode="text", complexity_factor=0.1.
+- INFO_LOOKUP ("dove trovo...", link, libri, podcast) -> mode="text", complexity_factor=0.2-0.3.
+- FINANZA/TECNOLOGIA: domanda tecnica -> mode="audio", 0.8-1.0; consiglio pratico -> mode="audio", 0.6-0.8; confronto semplice -> mode="text", 0.3-0.5.
+- CONSIGLIO_PERSONALE, SALUTE/COMPORTAMENTO -> preferisci mode="audio", temi emotivi 0.8-1.0.
+- LAVORO_VALORI -> spesso mode="audio", 0.7-0.9.
+
+Se la Memory e' vuota o irrilevante, "sufficient" deve essere false.
+Restituisci solo JSON, nessun testo aggiuntivo."""
+
+def parse_model_json(text):
+    # Extract JSON from response (might have markdown code blocks)
+    if '```json' in text:
+        text = text.split('```json')[1].split('```')[0].strip()
+    elif '```' in text:
+        text = text.split('```')[1].split('```')[0].strip()
+    return json.loads(text)
+
+def handler(event, context):
+    """
+    Fused pre-generation step: topic analysis, context sufficiency and reply
+    strategy in a single Haiku call.
+    Replaces AnalyzeTopic -> Check Sufficiency -> Get reply strategy
+    """
+    print(f"Event: {json.dumps(event)}")
+    aws_clients.start_invocation()
+    
+    user_input = event.get('userInput', '')
+    original_input_type = event.get('original_input_type', 'text')
+    current_topic_id = event.get('current_topic_id')
+    messages_key = event.get('messages_key')
+    history = event.get('history') or []
+    
+    fallback = {
+        'statusCode': 200,
+        'topic_id': current_topic_id or 'general',
+        'topic_name': 'General',
+        'keywords': [],
+        'sufficient': False,
+        'mode': 'text',
+        'complexity_factor': 0.5
+    }
+    
+    if not user_input:
+        return fallback
+    
+    # Topic identity from the contact's topic registry (the call still decides sufficiency and strategy)
+    registry, embedding, match = None, None, None
+    if messages_key:
+        try:
+            registry = topic_registry.get_registry(messages_key)
+            embedding = topic_registry.embed(user_input)
+            match = registry.match(embedding, current_topic_id)
+        except Exception as e:
+            print(f"Topic registry unavailable: {str(e)}")
+            registry = None
+    
+    history_text = json.dumps(history) if isinstance(history, (list, dict)) else str(history)
+    prompt = (
+        f"User Input: {user_input}\n"
+        f"Input type: {original_input_type}\n"
+        f"Previous Topic ID: {current_topic_id or 'None'}\n"
+        f"Memory: {history_text if history else 'None'}"
+    )
+    
+    try:
+        response = bedrock.invoke_model(
+            modelId=MODEL_ID,
+            contentType='application/json',
+            body=json.dumps(prompt_cache.build_request_for_model(
+                MODEL_ID,
+                SYSTEM_PROMPT,
+                [],
+                prompt,
+                temperature=0,
+                max_tokens=300
+            ))
+        )
+        
+        response_body = json.loads(response['body'].read())
+        prompt_cache.log_usage(prompt_cache.usage_from_body(response_body), model_id=MODEL_ID)
+        analysis = parse_model_json(response_body['content'][0]['text'])
+        print(f"Analysis: {analysis}")
+        
+        topic_name = analysis.get('topic') or 'General'
+        keywords = analysis.get('keywords', [])
+        if registry is not None and match.continuation:
+            topic_id = match.topic_id
+            registry.observe(topic_id, embedding)
+        elif analysis.get('continuation') and current_topic_id:
+            topic_id = current_topic_id
+            if registry is not None:
+                registry.observe(topic_id, embedding)
+        elif registry is not None:
+            topic_id, how = registry.assign(embedding, match, topic_name, keywords)
+            print(f"Topic {how}: {topic_id} ({topic_name})")
+        else:
+            topic_id = topic_registry.topic_id_for(topic_name)
+        
+        mode = analysis.get('mode', 'text')
+        
+        return {
+            'statusCode': 200,
+            'topic_id': topic_id,
+            'topic_name': topic_name,
+            'keywords': keywords,
+            # Nothing to judge without memory (same short-circuit as context-evaluator-fn)
+            'sufficient': bool(history) and bool(analysis.get('sufficient', False)),
+            'mode': mode if mode in ('text', 'audio') else 'text',
+            'complexity_factor': min(1.0, max(0.0, float(analysis.get('complexity_factor', 0.5))))
+        }
+        
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return fallback
@@ -1,79 +1,106 @@
 import json
 import os
-import boto3
+import sys
+import time
 
-# Initialize Bedrock client with real AWS credentials
-bedrock = boto3.client(
-    'bedrock-runtime',
-    region_name='eu-west-1',
-    aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY')
-)
+# Shared helpers live in lambdas-local/shared (shipped as a Lambda layer under /opt/python)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+import aws_clients
+import prompt_cache
+import reply_classifier
+
+MODEL_ID = os.environ.get('REPLY_STRATEGY_MODEL_ID', 'eu.anthropic.claude-3-5-sonnet-20240620-v1:0')
+
+# Create the client during the init phase so warm invocations reuse it
+bedrock = aws_clients.bedrock_runtime()
+
+# Same scale and heuristics as ReplyStrategyService::getSystemPrompt
+SYSTEM_PROMPT = """Fai parte del sistema Clonyo. Analizza il messaggio dell'utente e restituisci SOLO un JSON:
+
+{"mode": "<text|audio>", "complexity_factor": <float tra 0 e 1>}
+
+Regole:
+- Richiesta esplicita di "audio" o "voce" -> mode="audio"; richiesta esplicita di "testo", "messaggio" o "scrivi" -> mode="text".
+- SMALL_TALK e follow-up brevi ("Ok", "Grazie") -> mode="text", complexity_factor=0.1-0.2.
+- INFO_LOOKUP ("dove trovo...", link, libri, podcast) -> mode="text", complexity_factor=0.2-0.3.
+- FINANZA/TECNOLOGIA: domanda tecnica -> mode="audio", 0.8-1.0; consiglio pratico -> mode="audio", 0.6-0.8; confronto semplice -> mode="text", 0.3-0.5.
+- CONSIGLIO_PERSONALE, SALUTE/COMPORTAMENTO -> preferisci mode="audio", temi emotivi 0.8-1.0.
+- LAVORO_VALORI -> spesso mode="audio", 0.7-0.9."""
+
+def ask_bedrock(user_input, original_input_type):
+    prompt = f"Messaggio ({original_input_type}): {user_input}"
+    response = bedrock.invoke_model(
+        modelId=MODEL_ID,
+        body=json.dumps(prompt_cache.build_request_for_model(
+            MODEL_ID,
+            SYSTEM_PROMPT,
+            [],
+            prompt,
+            temperature=0,
+            max_tokens=100
+        ))
+    )
+
+    response_body = json.loads(response['body'].read())
+    prompt_cache.log_usage(prompt_cache.usage_from_body(response_body), model_id=MODEL_ID)
+    ai_response = response_body['content'][0]['text']
+
+    # Extract JSON from response (might have markdown code blocks)
+    if '```json' in ai_response:
+        ai_response = ai_response.split('```json')[1].split('```')[0].strip()
+    elif '```' in ai_response:
+        ai_response = ai_response.split('```')[1].split('```')[0].strip()
+
+    return json.loads(ai_response)
 
 def handler(event, context):
     """
     Determine reply strategy (text/audio) and complexity factor
-    Mimics the PHP Lambda behavior
+    Mimics the PHP Lambda behavior, answering easy messages locally:
+    path is 'rules' or 'model' (local classifier), 'bedrock' or 'fallback'
     """
     print(f"Event: {json.dumps(event)}")
-    
+    aws_clients.start_invocation()
+
+    user_input = event.get('userInput', '')
+    original_input_type = event.get('original_input_type', 'text')
+
+    started = time.perf_counter()
+    local = reply_classifier.classify(user_input)
+    classifier_us = round((time.perf_counter() - started) * 1_000_000, 1)
+
+    result = {
+        'statusCode': 200,
+        'mode': local.mode,
+        'complexity_factor': local.complexity_factor,
+        'path': local.source,
+        'classifier': dict(local.to_dict(), us=classifier_us)
+    }
+
+    if local.confident():
+        print(f"Strategy ({local.source}): {local.to_dict()}")
+        return result
+
     try:
-        user_input = event.get('userInput', '')
-        original_input_type = event.get('original_input_type', 'text')
-        
-        # Simple strategy prompt
-        strategy_prompt = f"""Analizza questo messaggio e determina:
-1. Se la risposta dovrebbe essere testuale o audio (considera che l'utente ha inviato un messaggio {original_input_type})
-2. La complessità della domanda (1-5, dove 5 è molto complessa)
-
-Messaggio: {user_input}
-
-Rispondi SOLO con un JSON in questo formato:
-{{"mode": "text", "complexity_factor": 3}}"""
-        
-        # Call Bedrock with Claude 3.5 Sonnet
-        bedrock_request = {
-            'anthropic_version': 'bedrock-2023-05-31',
-            'temperature': 0.3,
-            'max_tokens': 200,
-            'messages': [{
-                'role': 'user',
-                'content': strategy_prompt
-            }]
-        }
-        
-        response = bedrock.invoke_model(
-            modelId='eu.anthropic.claude-3-5-sonnet-20240620-v1:0',
-            body=json.dumps(bedrock_request)
-        )
-        
-        response_body = json.loads(response['body'].read())
-        ai_response = response_body['content'][0]['text']
-        
-        # Parse JSON response
-        # Extract JSON from response (might have markdown code blocks)
-        if '```json' in ai_response:
-            ai_response = ai_response.split('```json')[1].split('```')[0].strip()
-        elif '```' in ai_response:
-            ai_response = ai_response.split('```')[1].split('```')[0].strip()
-        
-        strategy = json.loads(ai_response)
-        
-        print(f"Strategy: {strategy}")
-        
-        return {
-            'statusCode': 200,
-            'mode': strategy.get('mode', 'text'),
-            'complexity_factor': strategy.get('complexity_factor', 3)
-        }
-        
+        strategy = ask_bedrock(user_input, original_input_type)
+        print(f"Strategy (bedrock): {strategy}")
+
+        mode = strategy.get('mode', 'text')
+        requested_mode = reply_classifier.explicit_mode(reply_classifier.normalize(user_input))
+        result.update({
+            # An unambiguous explicit request wins over the model, as in the PHP rules
+            'mode': requested_mode or (mode if mode in ('text', 'audio') else 'text'),
+            'complexity_factor': min(1.0, max(0.0, float(strategy.get('complexity_factor', 0.5)))),
+            'path': 'bedrock',
+            'bedrock_ms': round((time.perf_counter() - started) * 1000, 2)
+        })
+
     except Exception as e:
         print(f"Error: {str(e)}")
         import traceback
         traceback.print_exc()
-        # Default fallback
-        return {
-            'statusCode': 200,
-            'mode': 'text',
-            'complexity_factor': 3
-        }
+        # Best local guess instead of a fixed default
+        result['path'] = 'fallback'
+
+    return result
@@ -0,0 +1,36 @@
+import json
+import os
+import sys
+
+# Shared helpers live in lambdas-local/shared (shipped as a Lambda layer under /opt/python)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+import aws_clients
+import session_manager
+
+# Create the clients during the init phase so warm invocations reuse them
+aws_clients.warm('dynamodb')
+
+def handler(event, context):
+    """
+    ManageSession: resume the contact's session if active in the last
+    SESSION_TIMEOUT_SECONDS, create a new one otherwise (the topic of the
+    expired session is carried over). Same input/output as the PHP
+    SessionManagerHandler, without its query-then-write race.
+    """
+    print(f"Event: {json.dumps(event)}")
+    aws_clients.start_invocation()
+
+    wa_contact_id = event.get('wa_contact_id')
+    if not wa_contact_id:
+        raise ValueError("Missing wa_contact_id")
+
+    try:
+        session = session_manager.resolve(aws_clients.dynamodb(), wa_contact_id)
+        print(f"Session: {json.dumps(session)}")
+        return session
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise e
@@ -0,0 +1,184 @@
+"""
+Shared boto3 client registry for the local Python Lambdas.
+
+Clients are created lazily on first use and kept at module scope, so warm
+invocations of the same container reuse both the client and its HTTP
+connection pool instead of paying the boto3/TLS setup on every message.
+"""
+
+import os
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+
+DEFAULT_REGION = os.environ.get('AWS_REGION', 'eu-west-1')
+
+
+def _local_endpoint_url():
+    """
+    LocalStack endpoint, only when the environment says we run against it:
+    LOCALSTACK_ENDPOINT_URL, or LOCALSTACK_HOSTNAME/EDGE_PORT that LocalStack
+    sets in its Lambda containers. None on real AWS.
+    """
+    if os.environ.get('LOCALSTACK_ENDPOINT_URL'):
+        return os.environ['LOCALSTACK_ENDPOINT_URL']
+    if os.environ.get('LOCALSTACK_HOSTNAME'):
+        return f"http://{os.environ['LOCALSTACK_HOSTNAME']}:{os.environ.get('EDGE_PORT', '4566')}"
+    return None
+
+
+# LocalStack endpoint used for the services we run locally (DynamoDB, S3, SQS)
+LOCAL_ENDPOINT_URL = _local_endpoint_url()
+
+# Services that talk to LocalStack rather than real AWS when running locally
+# (the local state machine runs there too: task tokens are sent back to it)
+LOCAL_SERVICES = ('dynamodb', 's3', 'stepfunctions', 'sqs')
+
+MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '20'))
+
+_lock = threading.Lock()
+_clients = {}
+_session = None
+
+_stats = {
+    'cold_start': True,
+    'invocations': 0,
+    'session_init_ms': 0.0,
+    'created': {},
+    'reused': {},
+    'init_ms': {},
+}
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        started = time.perf_counter()
+        # Default credential chain: picks up AWS_SESSION_TOKEN (the temporary
+        # credentials of a real Lambda role) as well as the static local keys
+        _session = boto3.session.Session()
+        _stats['session_init_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return _session
+
+
+def _default_endpoint(service):
+    if service in LOCAL_SERVICES:
+        return LOCAL_ENDPOINT_URL
+    return None
+
+
+def get_client(service, region_name=None, endpoint_url=None):
+    """
+    Return a pooled client for `service`, creating it on first use.
+    Clients are keyed by (service, region, endpoint).
+    """
+    region_name = region_name or DEFAULT_REGION
+    endpoint_url = endpoint_url or _default_endpoint(service)
+    key = (service, region_name, endpoint_url)
+    name = f"{service}@{region_name}"
+
+    client = _clients.get(key)
+    if client is not None:
+        _stats['reused'][name] = _stats['reused'].get(name, 0) + 1
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            started = time.perf_counter()
+            client = _get_session().client(
+                service,
+                region_name=region_name,
+                endpoint_url=endpoint_url,
+                config=Config(
+                    max_pool_connections=MAX_POOL_CONNECTIONS,
+                    tcp_keepalive=True,
+                    retries={'max_attempts': 3, 'mode': 'standard'},
+                ),
+            )
+            _clients[key] = client
+            _stats['created'][name] = _stats['created'].get(name, 0) + 1
+            _stats['init_ms'][name] = round((time.perf_counter() - started) * 1000, 2)
+            return client
+
+    _stats['reused'][name] = _stats['reused'].get(name, 0) + 1
+    return client
+
+
+def bedrock_runtime(region_name=None):
+    return get_client('bedrock-runtime', region_name)
+
+
+def bedrock_agent_runtime(region_name=None):
+    return get_client('bedrock-agent-runtime', region_name)
+
+
+def dynamodb(region_name=None, endpoint_url=None):
+    return get_client('dynamodb', region_name, endpoint_url)
+
+
+def s3(region_name=None, endpoint_url=None):
+    return get_client('s3', region_name, endpoint_url)
+
+
+def stepfunctions(region_name=None, endpoint_url=None):
+    return get_client('stepfunctions', region_name, endpoint_url)
+
+
+def sqs(region_name=None, endpoint_url=None):
+    return get_client('sqs', region_name, endpoint_url)
+
+
+def transcribe(region_name=None):
+    return get_client('transcribe', region_name)
+
+
+def social_messaging(region_name=None):
+    return get_client('socialmessaging', region_name)
+
+
+def warm(*services):
+    """Pre-create clients at module import time (Lambda init phase)."""
+    for service in services:
+        get_client(service)
+
+
+def start_invocation():
+    """
+    Mark the start of a handler invocation.
+    Returns True only for the first invocation of the container (cold start).
+    """
+    _stats['invocations'] += 1
+    cold = _stats['invocations'] == 1
+    _stats['cold_start'] = cold
+    return cold
+
+
+def stats():
+    """Snapshot of the init-time counters, safe to put in a handler payload."""
+    return {
+        'cold_start': _stats['cold_start'],
+        'invocations': _stats['invocations'],
+        'session_init_ms': _stats['session_init_ms'],
+        'created': dict(_stats['created']),
+        'reused': dict(_stats['reused']),
+        'init_ms': dict(_stats['init_ms']),
+    }
+
+
+def reset():
+    """Drop all cached clients and counters (used by local benchmarks)."""
+    global _session
+    with _lock:
+        _clients.clear()
+        _session = None
+        _stats.update({
+            'cold_start': True,
+            'invocations': 0,
+            'session_init_ms': 0.0,
+            'created': {},
+            'reused': {},
+            'init_ms': {},
+        })
@@ -0,0 +1,218 @@
+"""
+Streaming response generation on top of Bedrock `invoke_model_with_response_stream`.
+
+The pipeline is a chain of generators:
+
+    stream_text()  ->  iter_chunks()  ->  sink (WhatsApp text / TTS segment)
+
+so the first sentence group can be delivered while the model is still
+generating the rest of the answer.
+"""
+
+import json
+import re
+import time
+
+# End of sentence: punctuation followed by whitespace, or a blank line
+SENTENCE_END = re.compile(r'(?<=[.!?…:;])\s+|\n{2,}')
+
+DEFAULT_MIN_CHUNK_CHARS = 160
+DEFAULT_MAX_CHUNK_CHARS = 1000
+
+
+class StreamMetrics:
+    """Timings collected while consuming a stream (milliseconds from request start)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token_ms = None
+        self.first_chunk_ms = None
+        self.total_ms = None
+        self.chunks = 0
+        self.input_tokens = None
+        self.output_tokens = None
+        self.cache_read_tokens = None
+        self.cache_write_tokens = None
+        self.stop_reason = None
+
+    def elapsed_ms(self):
+        return round((time.perf_counter() - self.started) * 1000, 2)
+
+    def to_dict(self):
+        return {
+            'first_token_ms': self.first_token_ms,
+            'first_chunk_ms': self.first_chunk_ms,
+            'total_ms': self.total_ms,
+            'chunks': self.chunks,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'cache_read_tokens': self.cache_read_tokens,
+            'cache_write_tokens': self.cache_write_tokens,
+            'stop_reason': self.stop_reason,
+        }
+
+
+def stream_text(client, model_id, request, metrics=None):
+    """
+    Invoke the model in streaming mode and yield text deltas as they arrive.
+    `request` is the usual Anthropic messages body (dict).
+    """
+    metrics = metrics or StreamMetrics()
+
+    response = client.invoke_model_with_response_stream(
+        modelId=model_id,
+        contentType='application/json',
+        accept='application/json',
+        body=json.dumps(request)
+    )
+
+    for event in response['body']:
+        chunk = event.get('chunk')
+        if not chunk:
+            continue
+
+        payload = json.loads(chunk['bytes'])
+        event_type = payload.get('type')
+
+        if event_type == 'message_start':
+            usage = payload.get('message', {}).get('usage', {})
+            metrics.input_tokens = usage.get('input_tokens')
+            metrics.cache_read_tokens = usage.get('cache_read_input_tokens')
+            metrics.cache_write_tokens = usage.get('cache_creation_input_tokens')
+        elif event_type == 'content_block_delta':
+            text = payload.get('delta', {}).get('text', '')
+            if text:
+                if metrics.first_token_ms is None:
+                    metrics.first_token_ms = metrics.elapsed_ms()
+                yield text
+        elif event_type == 'message_delta':
+            usage = payload.get('usage', {})
+            metrics.output_tokens = usage.get('output_tokens', metrics.output_tokens)
+            metrics.stop_reason = payload.get('delta', {}).get('stop_reason', metrics.stop_reason)
+
+    metrics.total_ms = metrics.elapsed_ms()
+
+
+def iter_chunks(deltas, min_chars=DEFAULT_MIN_CHUNK_CHARS, max_chars=DEFAULT_MAX_CHUNK_CHARS, metrics=None):
+    """
+    Group text deltas into sentence-aligned chunks.
+
+    A chunk is flushed at the first sentence boundary after `min_chars`
+    characters, or forcibly at `max_chars` (WhatsApp-friendly sizes).
+    Whatever is left when the stream ends is flushed as the last chunk.
+    """
+    buffer = ''
+
+    for delta in deltas:
+        buffer += delta
+
+        while len(buffer) >= min_chars:
+            cut = None
+            for match in SENTENCE_END.finditer(buffer):
+                if match.start() >= min_chars:
+                    cut = match
+                    break
+
+            if cut is None:
+                if len(buffer) < max_chars:
+                    break
+                # No sentence boundary in sight: cut at the last space
+                split_at = buffer.rfind(' ', 0, max_chars)
+                split_at = split_at if split_at > 0 else max_chars
+                chunk, buffer = buffer[:split_at], buffer[split_at:].lstrip()
+            else:
+                chunk, buffer = buffer[:cut.start()], buffer[cut.end():]
+
+            chunk = chunk.strip()
+            if chunk:
+                _mark_chunk(metrics)
+                yield chunk
+
+    buffer = buffer.strip()
+    if buffer:
+        _mark_chunk(metrics)
+        yield buffer
+
+
+def _mark_chunk(metrics):
+    if metrics is None:
+        return
+    metrics.chunks += 1
+    if metrics.first_chunk_ms is None:
+        metrics.first_chunk_ms = metrics.elapsed_ms()
+
+
+def generate_streaming(client, model_id, request, on_chunk=None,
+                       min_chars=DEFAULT_MIN_CHUNK_CHARS, max_chars=DEFAULT_MAX_CHUNK_CHARS):
+    """
+    Run the full pipeline. `on_chunk(chunk, index)` is called for every
+    sentence group as soon as it is complete.
+
+    Returns (full_text, chunks, metrics).
+    """
+    metrics = StreamMetrics()
+    parts = []
+    chunks = []
+
+    def collect(deltas):
+        for delta in deltas:
+            parts.append(delta)
+            yield delta
+
+    deltas = collect(stream_text(client, model_id, request, metrics))
+    for chunk in iter_chunks(deltas, min_chars, max_chars, metrics):
+        if on_chunk is not None:
+            on_chunk(chunk, len(chunks))
+        chunks.append(chunk)
+
+    return ''.join(parts).strip(), chunks, metrics
+
+
+class LocalStreamingBedrock:
+    """
+    Local stand-in for the `bedrock-runtime` streaming endpoint.
+
+    Replays `text` as Anthropic stream events, one word per delta, sleeping
+    `token_delay` seconds between deltas (and `first_token_delay` before the
+    first one) to mimic generation speed. `invoke_model` is also provided so
+    blocking and streaming modes can be compared on the same fake model.
+    """
+
+    def __init__(self, text, token_delay=0.02, first_token_delay=0.3):
+        self.text = text
+        self.token_delay = token_delay
+        self.first_token_delay = first_token_delay
+
+    def _tokens(self):
+        return re.findall(r'\S+\s*', self.text)
+
+    def _events(self):
+        tokens = self._tokens()
+        yield {'type': 'message_start', 'message': {'usage': {'input_tokens': 0}}}
+        yield {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}}
+        time.sleep(self.first_token_delay)
+        for token in tokens:
+            yield {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': token}}
+            time.sleep(self.token_delay)
+        yield {'type': 'content_block_stop', 'index': 0}
+        yield {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'}, 'usage': {'output_tokens': len(tokens)}}
+        yield {'type': 'message_stop'}
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        return {
+            'body': ({'chunk': {'bytes': json.dumps(event).encode('utf-8')}} for event in self._events())
+        }
+
+    def invoke_model(self, **kwargs):
+        for _ in self._events():
+            pass
+        body = json.dumps({'content': [{'type': 'text', 'text': self.text}]}).encode('utf-8')
+        return {'body': _Body(body)}
+
+
+class _Body:
+    def __init__(self, data):
+        self._data = data
+
+    def read(self):
+        return self._data
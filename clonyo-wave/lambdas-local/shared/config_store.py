@@ -0,0 +1,248 @@
+"""
+Cached access to the clone configs (ConfigData) in the config table.
+
+The PHP router reads the config with a GetItem every time getConfig() is
+called, twice per SQS record. Here configs are kept per container:
+
+- entries expire after CONFIG_CACHE_TTL (missing configs after a shorter
+  NEGATIVE_TTL), the bound for edits made outside put();
+- every writer bumps a change counter kept in its own table
+  (CONFIG_VERSION_TABLE, so no reader of the config table ever sees it as
+  a clone): put() here, ConfigRepository::put in the PHP functions (and so
+  `ai-clone:config:create`). Every container re-reads that counter at most
+  every CONFIG_VERSION_CHECK_INTERVAL seconds: when it moved, the whole
+  cache is dropped, so edits show up within the check interval;
+- prefetch() loads every config of an SQS batch with BatchGetItem, so
+  per-record reads are served from memory.
+"""
+
+import os
+import threading
+import time
+from decimal import Decimal
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+import aws_clients
+import wa_events
+
+CONFIG_TABLE = os.environ.get('CONFIG_TABLE', 'sidea-ai-clone-prod-config-table')
+KEY_NAME = 'wa_phone_number_arn'
+
+CONFIG_CACHE_TTL = int(os.environ.get('CONFIG_CACHE_TTL', '300'))
+CONFIG_VERSION_CHECK_INTERVAL = float(os.environ.get('CONFIG_VERSION_CHECK_INTERVAL', '15'))
+NEGATIVE_TTL = 30
+
+# Table-wide change counter, one item in a table of its own
+CONFIG_VERSION_TABLE = os.environ.get('CONFIG_VERSION_TABLE', 'sidea-ai-clone-prod-config-version-table')
+VERSION_KEY_NAME = 'name'
+VERSION_KEY = 'config'
+VERSION_ATTRIBUTE = 'config_version'
+
+BATCH_GET_LIMIT = 100
+MAX_BATCH_RETRIES = 5
+RETRY_BACKOFF = 0.05
+
+deserializer = TypeDeserializer()
+serializer = TypeSerializer()
+
+
+def _plain(value):
+    """DynamoDB numbers (Decimal) back to int/float, so configs stay JSON-serializable."""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, set):
+        return [_plain(v) for v in sorted(value)]
+    return value
+
+
+def _dynamo(value):
+    """float -> Decimal, for TypeSerializer."""
+    if isinstance(value, float):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {k: _dynamo(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_dynamo(v) for v in value]
+    return value
+
+
+def unmarshal(item):
+    return _plain({name: deserializer.deserialize(value) for name, value in item.items()})
+
+
+def marshal(config):
+    return {name: serializer.serialize(value) for name, value in _dynamo(config).items()}
+
+
+class ConfigStore:
+
+    def __init__(self, table_name=CONFIG_TABLE, ttl=CONFIG_CACHE_TTL,
+                 version_check_interval=CONFIG_VERSION_CHECK_INTERVAL, negative_ttl=NEGATIVE_TTL,
+                 dynamodb=None, clock=time.monotonic, version_table_name=CONFIG_VERSION_TABLE):
+        self.table_name = table_name
+        self.version_table_name = version_table_name
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._dynamodb = dynamodb
+        self._entries = {}  # wa_phone_number_arn -> (expires_at, config or None)
+        self._version = None
+        self._version_checked_at = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0, 'misses': 0, 'reads': 0, 'batch_reads': 0, 'batch_keys': 0,
+            'version_checks': 0, 'invalidations': 0,
+        }
+
+    @property
+    def dynamodb(self):
+        if self._dynamodb is None:
+            self._dynamodb = aws_clients.dynamodb()
+        return self._dynamodb
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _store(self, arn, config, now):
+        ttl = self.ttl if config is not None else self.negative_ttl
+        with self._lock:
+            self._entries[arn] = (now + ttl, config)
+
+    def _cached(self, arn, now):
+        with self._lock:
+            entry = self._entries.get(arn)
+        if entry is None or entry[0] <= now:
+            return False, None
+        return True, entry[1]
+
+    def check_version(self, force=False):
+        """Drop the cache if the table-wide version moved (at most once per check interval)."""
+        now = self.clock()
+        with self._lock:
+            if not force and self._version_checked_at is not None \
+                    and now - self._version_checked_at < self.version_check_interval:
+                return
+            self._version_checked_at = now
+        try:
+            item = self.dynamodb.get_item(
+                TableName=self.version_table_name,
+                Key={VERSION_KEY_NAME: {'S': VERSION_KEY}},
+                ProjectionExpression=VERSION_ATTRIBUTE
+            ).get('Item')
+        except Exception as e:
+            # Keep serving what we have: the TTL still bounds staleness
+            print(f"Config version check failed: {str(e)}")
+            return
+        version = int(item[VERSION_ATTRIBUTE]['N']) if item and VERSION_ATTRIBUTE in item else 0
+        with self._lock:
+            self._stats['version_checks'] += 1
+            if self._version is not None and version != self._version:
+                self._entries.clear()
+                self._stats['invalidations'] += 1
+            self._version = version
+
+    def get(self, arn):
+        """ConfigRepository::get: the config of the clone behind `arn`, or None. Treat it as read-only."""
+        self.check_version()
+        now = self.clock()
+        found, config = self._cached(arn, now)
+        if found:
+            self._count('hits')
+            return config
+
+        self._count('misses')
+        self._count('reads')
+        item = self.dynamodb.get_item(TableName=self.table_name, Key={KEY_NAME: {'S': arn}}).get('Item')
+        config = unmarshal(item) if item else None
+        self._store(arn, config, now)
+        return config
+
+    def prefetch(self, arns):
+        """Load every config of `arns` not cached yet with BatchGetItem. Returns how many keys were read."""
+        self.check_version()
+        now = self.clock()
+        missing = sorted({arn for arn in arns if arn and not self._cached(arn, now)[0]})
+
+        for start in range(0, len(missing), BATCH_GET_LIMIT):
+            keys = [{KEY_NAME: {'S': arn}} for arn in missing[start:start + BATCH_GET_LIMIT]]
+            found = {}
+            request = {self.table_name: {'Keys': keys}}
+            for attempt in range(MAX_BATCH_RETRIES + 1):
+                self._count('batch_reads')
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in response.get('Responses', {}).get(self.table_name, []):
+                    found[item[KEY_NAME]['S']] = unmarshal(item)
+                request = response.get('UnprocessedKeys') or {}
+                if not request:
+                    break
+                time.sleep(RETRY_BACKOFF * (2 ** attempt))
+
+            unprocessed = {key[KEY_NAME]['S'] for key in request.get(self.table_name, {}).get('Keys', [])}
+            for key in keys:
+                arn = key[KEY_NAME]['S']
+                # Left unprocessed after the retries: get() will read it
+                if arn not in unprocessed:
+                    self._store(arn, found.get(arn), now)
+            self._count('batch_keys', len(keys) - len(unprocessed))
+
+        return len(missing)
+
+    def prefetch_sqs_batch(self, records):
+        """prefetch() for the phone numbers of an SQS batch of WhatsApp notifications."""
+        return self.prefetch(wa_events.record_phone_number_arn(record) for record in records)
+
+    def put(self, config):
+        """ConfigRepository::put, then bump the table version so other containers drop their copy."""
+        self.dynamodb.put_item(TableName=self.table_name, Item=marshal(config))
+        response = self.dynamodb.update_item(
+            TableName=self.version_table_name,
+            Key={VERSION_KEY_NAME: {'S': VERSION_KEY}},
+            UpdateExpression=f"ADD {VERSION_ATTRIBUTE} :one",
+            ExpressionAttributeValues={':one': {'N': '1'}},
+            ReturnValues='UPDATED_NEW'
+        )
+        version = int(response['Attributes'][VERSION_ATTRIBUTE]['N'])
+        now = self.clock()
+        with self._lock:
+            # Our own write: keep the cache, just move to the new version
+            if self._version is not None and version != self._version + 1:
+                self._entries.clear()
+                self._stats['invalidations'] += 1
+            self._version = version
+            self._version_checked_at = now
+        self._store(config[KEY_NAME], _plain(_dynamo(config)), now)
+        return version
+
+    def invalidate(self, arn=None):
+        with self._lock:
+            if arn is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(arn, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['version'] = self._version
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        return stats
+
+
+_default = None
+
+
+def get_store():
+    """Container-wide config store, kept across warm invocations."""
+    global _default
+    if _default is None:
+        _default = ConfigStore()
+    return _default
@@ -0,0 +1,212 @@
+"""
+Token-budgeted assembly of the per-message context of the reply prompt.
+
+The PHP BedrockService pastes `json_encode($kb_docs)` (the whole
+RetrievalResults, scores and S3 locations included), the JSON of the
+historical context and the legacy retrieve of the same KB into the last
+user turn; the local handler appended the top 3 KB texts whatever their
+length. Input tokens, and with them latency and cost, swing with whatever
+the retrieval returned. Here the candidates of three sections:
+
+    kb       results of the function's own KB retrieve (retrieval cache)
+    history  topic summaries of past sessions (historical_context)
+    legacy   the state machine's Query Static KB results (kb_docs), mostly
+             the same chunks as kb
+
+are reduced to their text, ranked by their score normalized within the
+section times the section weight, deduplicated (near-identical passages
+and the overlap between adjacent chunks) and packed greedily into a token
+budget that grows with complexity_factor, from MIN_TOKENS for small talk
+to MAX_TOKENS for the hardest questions. The last passage that does not
+fit is clipped when enough budget is left for it to be useful.
+
+Tokens are estimated from characters (CHARS_PER_TOKEN): the model reports
+the real prompt size in its usage, this is for packing and reporting.
+"""
+
+import math
+import os
+import string
+
+import history_window
+
+SECTIONS = ('kb', 'history', 'legacy')
+SECTION_WEIGHTS = {'kb': 1.0, 'history': 0.8, 'legacy': 0.9}
+
+CHARS_PER_TOKEN = float(os.environ.get('CONTEXT_CHARS_PER_TOKEN', '3.5'))
+MIN_TOKENS = int(os.environ.get('CONTEXT_MIN_TOKENS', '400'))
+MAX_TOKENS = int(os.environ.get('CONTEXT_MAX_TOKENS', '2400'))
+# Reply strategy default when the state machine passes no complexity_factor
+DEFAULT_COMPLEXITY = 0.5
+
+# Share of the shingles of a passage already in a kept one above which it is a duplicate
+DUPLICATE_THRESHOLD = 0.8
+SHINGLE_WORDS = 3
+# Shortest head/tail shared with a kept passage that is cut (chunk overlap)
+MIN_OVERLAP_WORDS = 8
+# A passage is clipped to the remaining budget only if at least this much is left
+MIN_PASSAGE_TOKENS = 60
+
+PUNCTUATION = string.punctuation + '«»“”‘’…'
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text or '') / CHARS_PER_TOKEN)
+
+
+def budget_for(complexity_factor, min_tokens=None, max_tokens=None):
+    """Context tokens for a reply of this complexity (0..1, linear between the bounds)."""
+    min_tokens = MIN_TOKENS if min_tokens is None else int(min_tokens)
+    max_tokens = MAX_TOKENS if max_tokens is None else int(max_tokens)
+    try:
+        factor = float(complexity_factor)
+    except (TypeError, ValueError):
+        factor = DEFAULT_COMPLEXITY
+    factor = min(1.0, max(0.0, factor))
+    return int(min_tokens + (max(max_tokens, min_tokens) - min_tokens) * factor)
+
+
+def passage_text(item):
+    """Text of a candidate, whatever its shape: KB result, topic summary, message or plain string."""
+    if isinstance(item, str):
+        return item
+    if not isinstance(item, dict):
+        return ''
+    if isinstance(item.get('content'), dict):
+        return item['content'].get('text') or ''
+    content = item.get('content')
+    return item.get('summary') or item.get('text') or (content if isinstance(content, str) else '')
+
+
+def candidates(section, items):
+    """Scored plain-text passages of a section, metadata stripped, best first."""
+    if isinstance(items, (str, dict)):
+        items = [items]
+    passages = []
+    for position, item in enumerate(items or []):
+        text = ' '.join(passage_text(item).split())
+        if not text:
+            continue
+        score = item.get('score') if isinstance(item, dict) else None
+        # Sections without scores come ranked: decay with the position
+        passages.append({'section': section, 'text': text,
+                         'score': float(score) if isinstance(score, (int, float)) else 1.0 / (1 + position)})
+    top = max((passage['score'] for passage in passages), default=0) or 1.0
+    for passage in passages:
+        passage['priority'] = SECTION_WEIGHTS.get(section, 1.0) * passage['score'] / top
+    return passages
+
+
+def _tokens(text):
+    """Lowercase words of `text` without surrounding punctuation, one per whitespace-separated token."""
+    return [word.strip(PUNCTUATION).lower() for word in text.split()]
+
+
+def _shingles(words):
+    words = [word for word in words if word]
+    if len(words) < SHINGLE_WORDS:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def _shared_edge(words, other):
+    """Length of the longest head of `words` that is a tail of `other`, if at least MIN_OVERLAP_WORDS."""
+    if not words:
+        return 0
+    for start, word in enumerate(other):
+        n = len(other) - start
+        if n < MIN_OVERLAP_WORDS:
+            break
+        if word == words[0] and n <= len(words) and words[:n] == other[start:]:
+            return n
+    return 0
+
+
+def trim_overlap(text, kept):
+    """`text` without the head/tail it shares with kept passages (overlapping KB chunks)."""
+    raw = text.split()
+    words = _tokens(text)
+    start, end = 0, len(words)
+    for other in kept:
+        start = max(start, _shared_edge(words, other))
+        end = min(end, len(words) - _shared_edge(other, words))
+    if start >= end:
+        return ''
+    return ' '.join(raw[start:end])
+
+
+class Context:
+    """Packed passages per section and the report of how the budget was spent."""
+
+    def __init__(self, budget, complexity_factor):
+        self.budget = budget
+        self.complexity_factor = complexity_factor
+        self.sections = {section: [] for section in SECTIONS}
+        self.stats = {section: {'candidates': 0, 'candidate_tokens': 0, 'duplicates': 0, 'overlap_chars': 0,
+                                'dropped': 0, 'clipped': 0, 'kept': 0, 'tokens': 0} for section in SECTIONS}
+
+    @property
+    def used(self):
+        return sum(stats['tokens'] for stats in self.stats.values())
+
+    def texts(self, *sections):
+        return [text for section in sections for text in self.sections.get(section, [])]
+
+    def report(self):
+        return {
+            'complexity_factor': self.complexity_factor,
+            'budget_tokens': self.budget,
+            'used_tokens': self.used,
+            'candidate_tokens': sum(stats['candidate_tokens'] for stats in self.stats.values()),
+            'sections': {section: dict(stats) for section, stats in self.stats.items()},
+        }
+
+
+def assemble(sections, complexity_factor=None, min_tokens=None, max_tokens=None, budget=None):
+    """
+    Pack the candidates of `sections` ({'kb': [...], 'history': [...],
+    'legacy': [...]}) into the token budget of `complexity_factor` (or an
+    explicit `budget`). Returns a Context.
+    """
+    budget = budget_for(complexity_factor, min_tokens, max_tokens) if budget is None else int(budget)
+    context = Context(budget, complexity_factor)
+
+    ranked = []
+    for section in SECTIONS:
+        passages = candidates(section, sections.get(section))
+        context.stats[section]['candidates'] = len(passages)
+        context.stats[section]['candidate_tokens'] = sum(estimate_tokens(p['text']) for p in passages)
+        ranked.extend(passages)
+    # Stable: equal priorities keep the section order (kb before legacy)
+    ranked.sort(key=lambda passage: passage['priority'], reverse=True)
+
+    kept_words, kept_shingles, remaining = [], [], budget
+    for passage in ranked:
+        stats = context.stats[passage['section']]
+        shingles = _shingles(_tokens(passage['text']))
+        if any(len(shingles & other) >= DUPLICATE_THRESHOLD * len(shingles) for other in kept_shingles):
+            stats['duplicates'] += 1
+            continue
+        text = trim_overlap(passage['text'], kept_words)
+        if not text:
+            stats['duplicates'] += 1
+            continue
+        stats['overlap_chars'] += len(passage['text']) - len(text)
+
+        tokens = estimate_tokens(text)
+        if tokens > remaining:
+            if remaining < MIN_PASSAGE_TOKENS:
+                stats['dropped'] += 1
+                continue
+            text = history_window.clip(text, int(remaining * CHARS_PER_TOKEN) - 2)
+            tokens = estimate_tokens(text)
+            stats['clipped'] += 1
+
+        context.sections[passage['section']].append(text)
+        kept_words.append(_tokens(text))
+        kept_shingles.append(shingles)
+        stats['kept'] += 1
+        stats['tokens'] += tokens
+        remaining -= tokens
+
+    return context
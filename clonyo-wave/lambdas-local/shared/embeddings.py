@@ -0,0 +1,70 @@
+"""
+Text embeddings as unit-length float32 NumPy vectors.
+
+- titan: Amazon Titan Text Embeddings v2 on Bedrock (256/512/1024 dims);
+- hashed: signed feature hashing of the content words, a lexical stand-in
+  with no model call, for LocalStack runs and the benches.
+
+Used by the topic registry and the local KB index; whoever builds vectors
+with one backend must query them with the same backend and dimensions.
+"""
+
+import hashlib
+import json
+
+import numpy as np
+
+import aws_clients
+import retrieval_cache
+
+TITAN_MODEL_ID = 'amazon.titan-embed-text-v2:0'
+BACKENDS = ('titan', 'hashed')
+
+# hashed backend only
+STEM_CHARS = 4
+STOPWORDS = frozenset('''
+    agli all alla alle che chi con dai dal dei del gli hai per poi sei sia sono sua sue sui sul suo tra una uno
+    anche avete come cosa dalla dalle degli della delle dello dove ecco essere fare hanno mentre mia mio miei
+    molto nella nelle ogni perche posso prima proprio quale quali quando quanto quella quelle quello questa
+    queste questo sarebbe senta sulla sulle tanto tornando tutti tutto vorrei vostri vostro
+'''.split())
+
+
+def unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def titan_embedding(text, dimensions, model_id=TITAN_MODEL_ID):
+    response = aws_clients.bedrock_runtime().invoke_model(
+        modelId=model_id,
+        contentType='application/json',
+        accept='application/json',
+        body=json.dumps({'inputText': text, 'dimensions': dimensions, 'normalize': True})
+    )
+    return unit(json.loads(response['body'].read())['embedding'])
+
+
+def hashed_embedding(text, dimensions):
+    """
+    Signed feature hashing of the content words, cut to their first
+    STEM_CHARS letters, so that "fondo"/"fondi" or "costa"/"costi" land
+    together without a model call.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in retrieval_cache.normalize_query(text).split():
+        if len(word) < 3 or word in STOPWORDS:
+            continue
+        digest = hashlib.blake2b(word[:STEM_CHARS].encode('utf-8'), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], 'little') % dimensions
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    return unit(vector)
+
+
+def embed(text, backend, dimensions, model_id=TITAN_MODEL_ID):
+    if backend == 'hashed':
+        return hashed_embedding(text, dimensions)
+    if backend == 'titan':
+        return titan_embedding(text, dimensions, model_id)
+    raise ValueError(f"Unknown embedding backend: {backend}")
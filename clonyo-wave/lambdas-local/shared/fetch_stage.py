@@ -0,0 +1,84 @@
+"""
+Concurrent fetch stage: run independent I/O calls (DynamoDB history, KB
+retrieve) on a shared thread pool with per-stage deadlines, so the
+stage costs roughly the slowest call instead of the sum of all of them.
+
+boto3 clients are thread-safe; the pool in aws_clients is sized for this.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+MAX_WORKERS = int(os.environ.get('FETCH_STAGE_MAX_WORKERS', '8'))
+
+# Share of the remaining Lambda time the fetch stage may use; the rest is
+# kept for generation and for returning the payload
+FETCH_BUDGET_FRACTION = float(os.environ.get('FETCH_BUDGET_FRACTION', '0.3'))
+RESERVED_MS = int(os.environ.get('FETCH_RESERVED_MS', '1000'))
+DEFAULT_BUDGET_MS = 5000
+
+# Kept at module scope so warm invocations reuse the threads
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='fetch')
+
+
+def budget_from_context(context, fraction=FETCH_BUDGET_FRACTION, reserved_ms=RESERVED_MS):
+    """Milliseconds available to the fetch stage given the Lambda context."""
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return DEFAULT_BUDGET_MS
+    remaining = context.get_remaining_time_in_millis() - reserved_ms
+    return max(0, int(remaining * fraction))
+
+
+class Stage:
+    """A named call with its own deadline and a fallback value."""
+
+    def __init__(self, name, fn, default=None, max_ms=None):
+        self.name = name
+        self.fn = fn
+        self.default = default
+        self.max_ms = max_ms
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    value = fn()
+    return value, round((time.perf_counter() - started) * 1000, 2)
+
+
+def run(stages, budget_ms):
+    """
+    Run all stages concurrently.
+
+    Each stage waits at most min(stage.max_ms, budget_ms) from the start of
+    the fan-out. A stage that fails or misses its deadline yields its
+    `default` (its thread keeps running, the result is just ignored).
+
+    Returns (values, report) where values maps name -> value and report
+    maps name -> {'ms', 'status'} plus the overall wall time.
+    """
+    started = time.perf_counter()
+    futures = {stage.name: (stage, _executor.submit(_timed, stage.fn)) for stage in stages}
+
+    values = {}
+    report = {}
+    for name, (stage, future) in futures.items():
+        deadline_ms = budget_ms if stage.max_ms is None else min(stage.max_ms, budget_ms)
+        waited_ms = (time.perf_counter() - started) * 1000
+        try:
+            value, elapsed_ms = future.result(timeout=max(0.0, (deadline_ms - waited_ms) / 1000))
+            values[name] = value
+            report[name] = {'ms': elapsed_ms, 'status': 'ok'}
+        except FutureTimeoutError:
+            values[name] = stage.default
+            report[name] = {'ms': deadline_ms, 'status': 'timeout'}
+            print(f"Fetch stage '{name}' missed its {deadline_ms}ms deadline")
+        except Exception as e:
+            values[name] = stage.default
+            report[name] = {'ms': round((time.perf_counter() - started) * 1000, 2), 'status': 'error'}
+            print(f"Fetch stage '{name}' failed: {str(e)}")
+
+    report['wall_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    report['budget_ms'] = budget_ms
+    return values, report
@@ -0,0 +1,198 @@
+"""
+Rolling conversation history: a running summary plus the last N raw turns.
+
+One item per conversation lives next to the messages in the messages
+table (same pk, sk 'WINDOW', so `begins_with(sk, 'M#')` queries never see
+it). It is updated after every reply ("Store WA sent message"): the new
+user/assistant pair is appended and the pairs that fall out of the window
+are folded into the summary with a short Haiku call. Only the evicted
+turns are sent to the summarizer, so each update costs the same whatever
+the length of the conversation, and so does every prompt built from it.
+
+The window restarts when the session changes (session-manager-fn opens a
+new session after inactivity).
+"""
+
+import json
+import os
+import re
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+import prompt_cache
+
+MESSAGES_TABLE = os.environ.get('WA_MESSAGES_TABLE', 'sidea-ai-clone-prod-messages-table')
+WINDOW_SK = 'WINDOW'
+
+# Raw messages kept verbatim (user + assistant, so keep it even)
+MAX_TURNS = int(os.environ.get('HISTORY_WINDOW_TURNS', '6'))
+# Long voice transcripts are clipped so a single turn cannot blow the prompt up
+TURN_MAX_CHARS = int(os.environ.get('HISTORY_TURN_MAX_CHARS', '1500'))
+SUMMARY_MAX_CHARS = int(os.environ.get('HISTORY_SUMMARY_MAX_CHARS', '1200'))
+
+SUMMARY_MODEL_ID = os.environ.get('HISTORY_SUMMARY_MODEL_ID', 'anthropic.claude-3-haiku-20240307-v1:0')
+
+SUMMARY_PROMPT = """Aggiorna il riassunto di una conversazione WhatsApp tra un utente e un assistente.
+Mantieni fatti, preferenze e domande aperte dell'utente e le risposte date; elimina saluti e ripetizioni.
+Massimo 120 parole, in italiano, solo il testo del riassunto."""
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+
+def clip(text, max_chars=TURN_MAX_CHARS):
+    text = (text or '').strip()
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rsplit(' ', 1)[0] + ' […]'
+
+
+class HistoryWindow:
+
+    def __init__(self, session_id=None, summary='', turns=None, version=0):
+        self.session_id = session_id
+        self.summary = summary
+        self.turns = turns or []
+        self.version = version
+
+    @classmethod
+    def from_item(cls, item):
+        data = {k: deserializer.deserialize(v) for k, v in item.items()}
+        return cls(
+            session_id=data.get('session_id'),
+            summary=data.get('summary', ''),
+            turns=data.get('turns', []),
+            version=int(data.get('version', 0))
+        )
+
+    def to_item(self, messages_key):
+        item = {
+            'pk': messages_key,
+            'sk': WINDOW_SK,
+            'summary': self.summary,
+            'turns': self.turns,
+            'version': self.version,
+        }
+        if self.session_id:
+            item['session_id'] = self.session_id
+        return {k: serializer.serialize(v) for k, v in item.items()}
+
+    def append(self, role, content):
+        if content:
+            self.turns.append({'role': role, 'content': clip(content)})
+
+    def evict(self, max_turns=MAX_TURNS):
+        """Drop the oldest turns beyond max_turns (whole pairs, so history still starts with the user)."""
+        overflow = len(self.turns) - max_turns
+        if overflow <= 0:
+            return []
+        overflow += overflow % 2
+        evicted, self.turns = self.turns[:overflow], self.turns[overflow:]
+        while self.turns and self.turns[0]['role'] != 'user':
+            evicted.append(self.turns.pop(0))
+        return evicted
+
+    def to_dict(self):
+        return {'summary': self.summary, 'turns': self.turns}
+
+
+def load(dynamodb, messages_key, table_name=MESSAGES_TABLE):
+    item = dynamodb.get_item(
+        TableName=table_name,
+        Key={'pk': {'S': messages_key}, 'sk': {'S': WINDOW_SK}},
+        ConsistentRead=True
+    ).get('Item')
+    return HistoryWindow.from_item(item) if item else None
+
+
+def save(dynamodb, messages_key, window, table_name=MESSAGES_TABLE):
+    """Optimistic write: fails with ConditionalCheckFailedException if someone else updated it first."""
+    expected = window.version
+    window.version += 1
+    dynamodb.put_item(
+        TableName=table_name,
+        Item=window.to_item(messages_key),
+        ConditionExpression='attribute_not_exists(pk) OR version = :v',
+        ExpressionAttributeValues={':v': {'N': str(expected)}}
+    )
+
+
+def _turns_text(turns):
+    return '\n'.join(f"{turn['role']}: {turn['content']}" for turn in turns)
+
+
+def extractive_summary(summary, evicted, max_chars=SUMMARY_MAX_CHARS):
+    """Fallback when the summarizer is unavailable: first sentence of each turn, newest kept."""
+    lines = [summary] if summary else []
+    for turn in evicted:
+        first = re.split(r'(?<=[.!?])\s', turn['content'], maxsplit=1)[0]
+        lines.append(f"{turn['role']}: {clip(first, 200)}")
+    text = '\n'.join(lines)
+    return text[-max_chars:] if len(text) > max_chars else text
+
+
+def summarize(bedrock, summary, evicted, model_id=SUMMARY_MODEL_ID):
+    prompt = (
+        f"Riassunto attuale:\n{summary or 'Nessuno'}\n\n"
+        f"Nuovi messaggi:\n{_turns_text(evicted)}"
+    )
+    response = bedrock.invoke_model(
+        modelId=model_id,
+        body=json.dumps(prompt_cache.build_request_for_model(
+            model_id,
+            SUMMARY_PROMPT,
+            [],
+            prompt,
+            temperature=0,
+            max_tokens=300
+        ))
+    )
+    response_body = json.loads(response['body'].read())
+    prompt_cache.log_usage(prompt_cache.usage_from_body(response_body), model_id=model_id)
+    return clip(response_body['content'][0]['text'], SUMMARY_MAX_CHARS)
+
+
+def update(dynamodb, bedrock, messages_key, session_id, user_message, assistant_message,
+           max_turns=MAX_TURNS, table_name=MESSAGES_TABLE, attempts=3):
+    """
+    Append one exchange and fold the evicted turns into the summary.
+    Returns (window, report).
+    """
+    for attempt in range(attempts):
+        window = load(dynamodb, messages_key, table_name)
+        if window is None or (session_id and window.session_id != session_id):
+            window = HistoryWindow(session_id=session_id, version=window.version if window else 0)
+
+        window.append('user', user_message)
+        window.append('assistant', assistant_message)
+        evicted = window.evict(max_turns)
+
+        summarizer = None
+        if evicted:
+            try:
+                window.summary = summarize(bedrock, window.summary, evicted)
+                summarizer = 'bedrock'
+            except Exception as e:
+                print(f"Summarizer failed, using extractive summary: {str(e)}")
+                window.summary = extractive_summary(window.summary, evicted)
+                summarizer = 'extractive'
+
+        try:
+            save(dynamodb, messages_key, window, table_name)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            print(f"History window changed concurrently, retrying ({attempt + 1}/{attempts})")
+            continue
+
+        return window, {
+            'turns': len(window.turns),
+            'evicted': len(evicted),
+            'summarizer': summarizer,
+            'summary_chars': len(window.summary),
+            'version': window.version,
+            'attempts': attempt + 1
+        }
+
+    raise RuntimeError(f"History window for {messages_key} kept changing, gave up after {attempts} attempts")
@@ -0,0 +1,188 @@
+"""
+Local vector index over the Knowledge Base chunks of a clone.
+
+Every KB lookup is a `retrieve` round trip to Bedrock, although the KB of
+a clone is a few hundred documents. scripts/build_kb_index.py embeds the
+chunks of the KB's S3 source documents offline into a directory:
+
+    manifest.json   kb_id, embedding backend/model/dimensions, chunking, ivf
+    vectors.npy     (n_chunks, dimensions) float32 unit rows
+    chunks.json     text and S3 location of each row
+    ivf_centroids.npy, ivf_offsets.npy   optional inverted file layer: rows
+                    grouped by nearest centroid, offsets[i]:offsets[i+1]
+
+The directory ships with the Lambda (KB_INDEX_DIR/<kb_id>) or is fetched
+once per container from S3 to /tmp. vectors.npy is memory-mapped, so a
+search is a matrix-vector product over pages the OS already has: flat
+(exact) by default, or only the `nprobe` closest IVF lists.
+
+search() returns results in the shape of retrieval_cache.compact_results,
+or None when there is no index for the KB or its best score is below
+KB_INDEX_MIN_SCORE: the caller then asks the remote KB. The query is
+embedded with the backend the index was built with.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+import aws_clients
+import embeddings
+
+ENABLED = os.environ.get('KB_INDEX_ENABLED', '0') == '1'
+# Shipped with the function (e.g. a layer at /opt/kb-index/<kb_id>), else fetched from S3 to /tmp
+KB_INDEX_DIR = os.environ.get('KB_INDEX_DIR', '/opt/kb-index')
+KB_INDEX_BUCKET = os.environ.get('KB_INDEX_BUCKET', '')
+KB_INDEX_PREFIX = os.environ.get('KB_INDEX_PREFIX', 'kb-index')
+TMP_DIR = os.environ.get('KB_INDEX_TMP_DIR', '/tmp/kb-index')
+
+# Cosine of the best chunk. Questions on the KB's documents score about 0.5 and
+# off-topic ones under 0.15 (scripts/bench_kb_index.py corpus, hashed backend)
+MIN_SCORE = float(os.environ.get('KB_INDEX_MIN_SCORE', '0.3'))
+DEFAULT_RESULTS = 4
+DEFAULT_NPROBE = int(os.environ.get('KB_INDEX_NPROBE', '4'))
+
+# KBs without an index are looked up again after this long
+NEGATIVE_TTL = 300
+
+FILES = ('manifest.json', 'vectors.npy', 'chunks.json')
+IVF_FILES = ('ivf_centroids.npy', 'ivf_offsets.npy')
+
+
+def top_k(scores, k):
+    """Indices of the `k` highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+class KbIndex:
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with open(os.path.join(path, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(path, 'chunks.json')) as f:
+            self.chunks = json.load(f)
+        self.vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r' if mmap else None)
+        self.centroids, self.offsets = None, None
+        if self.manifest.get('ivf'):
+            self.centroids = np.load(os.path.join(path, 'ivf_centroids.npy'))
+            self.offsets = np.load(os.path.join(path, 'ivf_offsets.npy'))
+        if self.vectors.shape != (len(self.chunks), self.dimensions):
+            raise ValueError(f"Index {path} is inconsistent: {self.vectors.shape} vectors, {len(self.chunks)} chunks")
+
+    @property
+    def kb_id(self):
+        return self.manifest['kb_id']
+
+    @property
+    def dimensions(self):
+        return self.manifest['embedding']['dimensions']
+
+    def embed(self, text):
+        embedding = self.manifest['embedding']
+        return embeddings.embed(text, embedding['backend'], embedding['dimensions'],
+                                embedding.get('model_id', embeddings.TITAN_MODEL_ID))
+
+    def search_vector(self, query, k=DEFAULT_RESULTS, nprobe=None):
+        """(rows, scores) of the `k` chunks closest to the unit vector `query`."""
+        if self.centroids is None or nprobe == 0:
+            scores = self.vectors @ query
+            rows = top_k(scores, k)
+            return rows, scores[rows]
+
+        nprobe = DEFAULT_NPROBE if nprobe is None else nprobe
+        lists = top_k(self.centroids @ query, nprobe)
+        # Rows of a list are contiguous: score slices of the map, no gather copy
+        spans = [(self.offsets[i], self.offsets[i + 1]) for i in lists]
+        rows = np.concatenate([np.arange(start, end) for start, end in spans])
+        scores = np.concatenate([self.vectors[start:end] @ query for start, end in spans])
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+    def search(self, text, k=DEFAULT_RESULTS, nprobe=None):
+        rows, scores = self.search_vector(self.embed(text), k, nprobe)
+        return [
+            {
+                'content': {'text': self.chunks[row]['text']},
+                'score': float(score),
+                'location': self.chunks[row].get('location'),
+            }
+            for row, score in zip(rows.tolist(), scores.tolist())
+        ]
+
+
+def download(kb_id, bucket=None, prefix=None, tmp_dir=None):
+    """Fetch the index of `kb_id` from S3 to /tmp; None if there is none."""
+    bucket = bucket or KB_INDEX_BUCKET
+    if not bucket:
+        return None
+    prefix = f"{prefix or KB_INDEX_PREFIX}/{kb_id}"
+    path = os.path.join(tmp_dir or TMP_DIR, kb_id)
+    s3 = aws_clients.s3()
+    try:
+        manifest = json.loads(s3.get_object(Bucket=bucket, Key=f"{prefix}/manifest.json")['Body'].read())
+    except s3.exceptions.NoSuchKey:
+        return None
+    # Write to a sibling directory and rename, so a concurrent reader never sees half an index
+    partial = f"{path}.{os.getpid()}.{threading.get_ident()}.partial"
+    os.makedirs(partial, exist_ok=True)
+    for name in FILES + (IVF_FILES if manifest.get('ivf') else ()):
+        s3.download_file(bucket, f"{prefix}/{name}", os.path.join(partial, name))
+    try:
+        os.rename(partial, path)
+    except OSError:
+        # Another thread got there first: drop our copy
+        shutil.rmtree(partial, ignore_errors=True)
+    return path
+
+
+def locate(kb_id):
+    """Directory of the index of `kb_id`: shipped, already in /tmp, or fetched from S3."""
+    for base in (KB_INDEX_DIR, TMP_DIR):
+        path = os.path.join(base, kb_id)
+        if os.path.exists(os.path.join(path, 'manifest.json')):
+            return path
+    return download(kb_id)
+
+
+_indexes = {}  # kb_id -> (KbIndex or None, checked_at)
+_lock = threading.Lock()
+
+
+def get_index(kb_id):
+    """Container-wide open index of `kb_id`, or None."""
+    now = time.monotonic()
+    with _lock:
+        entry = _indexes.get(kb_id)
+    if entry is not None and (entry[0] is not None or now - entry[1] < NEGATIVE_TTL):
+        return entry[0]
+    try:
+        path = locate(kb_id)
+        index = KbIndex(path) if path else None
+    except Exception as e:
+        print(f"KB index for {kb_id} unavailable: {str(e)}")
+        index = None
+    with _lock:
+        _indexes[kb_id] = (index, now)
+    return index
+
+
+def search(kb_id, query, number_of_results=None):
+    """Local results for the KB query, or None to fall back to the remote KB."""
+    index = get_index(kb_id)
+    if index is None:
+        return None
+    started = time.perf_counter()
+    results = index.search(query, int(number_of_results or DEFAULT_RESULTS))
+    print(f"KB index {kb_id}: {len(results)} results in {(time.perf_counter() - started) * 1000:.2f} ms")
+    if not results or results[0]['score'] < MIN_SCORE:
+        return None
+    return results
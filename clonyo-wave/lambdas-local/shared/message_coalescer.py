@@ -0,0 +1,261 @@
+"""
+Per-contact coalescing of WhatsApp text messages before the state machine.
+
+Users often send one thought as three or four short messages; each one
+used to start its own execution (and Bedrock generation). Here the router
+buffers text messages per contact instead, and one execution is started
+with the merged text once the contact stops typing:
+
+- add() appends the message to the contact's buffer item (keyed like the
+  messages table, 'S#<phone number arn>#C#<wa_contact_id>') with an
+  update that bumps a `generation` counter, then schedules a flush by
+  sending {buffer_key, generation} to the flush queue with DelaySeconds;
+- the flush is due when COALESCE_WINDOW_SECONDS passed since the last
+  message, or COALESCE_MAX_WAIT_SECONDS since the first one: the delay of
+  each flush message is capped accordingly, so the added latency is
+  bounded even for a contact who never stops typing;
+- flush() claims the buffer with a DeleteItem conditional on the
+  generation it read (a message arriving meanwhile makes it re-read), then
+  starts one execution whose `text.body` is the messages joined in order.
+  If the start fails the messages are put back and the error re-raised,
+  so the flush message is retried.
+
+SQS redeliveries of the same WhatsApp message are dropped on add() by
+their message id: a 'M#<message id>' item in the same table, written in
+one transaction with the buffer update and kept for SEEN_TTL, so a
+redelivery after the flush is dropped too. A dropped redelivery still
+schedules a flush of the buffer it belongs to, in case the first delivery
+failed after buffering but before scheduling. Non-text messages are not
+buffered: the router flushes the contact's pending text first, so the
+order is kept.
+"""
+
+import json
+import math
+import os
+import time
+
+COALESCE_TABLE = os.environ.get('COALESCE_TABLE', 'sidea-ai-clone-prod-message-buffer-table')
+COALESCE_QUEUE_URL = os.environ.get('COALESCE_QUEUE_URL', '')
+
+# 0 disables coalescing (every message starts its own execution)
+COALESCE_WINDOW_SECONDS = int(os.environ.get('COALESCE_WINDOW_SECONDS', '0'))
+COALESCE_MAX_WAIT_SECONDS = int(os.environ.get('COALESCE_MAX_WAIT_SECONDS', '10'))
+# Flush right away once a buffer holds this many messages
+MAX_BUFFERED_MESSAGES = int(os.environ.get('COALESCE_MAX_MESSAGES', '8'))
+
+# SQS delivers delayed messages on time, give or take the poller's clock
+DUE_TOLERANCE_MS = 250
+MAX_DELAY_SECONDS = 900
+MAX_CLAIM_ATTEMPTS = 3
+# Buffers are short-lived; TTL only cleans up after a lost flush
+ITEM_TTL = 3600
+# Message ids are kept past the flush for as long as SQS may redeliver them
+SEEN_TTL = 86400
+
+
+def buffer_key(wa_phone_number_arn, wa_contact_id):
+    """Same key as the messages table partition of the conversation."""
+    return f"S#{wa_phone_number_arn}#C#{wa_contact_id}"
+
+
+def seen_key(message_id):
+    """Key of the item that marks a WhatsApp message as buffered."""
+    return f"M#{message_id}"
+
+
+def merge(item):
+    """State machine input for a claimed buffer: the latest message's input with all the texts joined."""
+    messages = sorted(
+        ({'ts': int(m['M']['ts']['N']), 'body': m['M']['body']['S']} for m in item['messages']['L']),
+        key=lambda m: m['ts']
+    )
+    sfn_input = json.loads(item['sfn_input']['S'])
+    sfn_input['text'] = {'body': '\n'.join(m['body'] for m in messages)}
+    sfn_input['message_ts'] = str(messages[-1]['ts'])
+    sfn_input['coalesced'] = {
+        'messages': len(messages),
+        'first_message_ts': str(messages[0]['ts']),
+        'buffered_ms': int(item['last_at_ms']['N']) - int(item['first_at_ms']['N']),
+    }
+    return sfn_input
+
+
+class Coalescer:
+
+    def __init__(self, dynamodb, sqs, queue_url=None, table_name=None, window=None, max_wait=None,
+                 max_messages=MAX_BUFFERED_MESSAGES, clock=time.time):
+        self.dynamodb = dynamodb
+        self.sqs = sqs
+        self.queue_url = queue_url or COALESCE_QUEUE_URL
+        self.table_name = table_name or COALESCE_TABLE
+        self.window = COALESCE_WINDOW_SECONDS if window is None else window
+        self.max_wait = COALESCE_MAX_WAIT_SECONDS if max_wait is None else max_wait
+        self.max_messages = max_messages
+        self.clock = clock
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def _now_ms(self):
+        return int(self.clock() * 1000)
+
+    def _schedule(self, key, generation, delay_seconds):
+        self.sqs.send_message(
+            QueueUrl=self.queue_url,
+            MessageBody=json.dumps({'buffer_key': key, 'generation': generation}),
+            DelaySeconds=max(0, min(MAX_DELAY_SECONDS, delay_seconds))
+        )
+
+    def _delay_seconds(self, item, now_ms):
+        """Seconds until the buffer is due: the window, capped by the max wait of its first message."""
+        first_at = int(item['first_at_ms']['N'])
+        until_max_wait = (first_at + self.max_wait * 1000 - now_ms) / 1000
+        return math.ceil(min(self.window, until_max_wait))
+
+    def add(self, key, sfn_input, message_id, start):
+        """
+        Buffer a text message (`sfn_input` as the router would start it).
+        Returns 'buffered', 'duplicate', or the flush() outcome if the
+        buffer had to be flushed right away.
+        """
+        now_ms = self._now_ms()
+        message = {'M': {'ts': {'N': str(int(sfn_input['message_ts']))}, 'body': {'S': sfn_input['text']['body']}}}
+        try:
+            self.dynamodb.transact_write_items(TransactItems=[
+                {'Put': {
+                    'TableName': self.table_name,
+                    'Item': {
+                        'buffer_key': {'S': seen_key(message_id)},
+                        'contact_key': {'S': key},
+                        'expires_at': {'N': str(now_ms // 1000 + SEEN_TTL)},
+                    },
+                    'ConditionExpression': "attribute_not_exists(buffer_key)",
+                }},
+                {'Update': {
+                    'TableName': self.table_name,
+                    'Key': {'buffer_key': {'S': key}},
+                    'UpdateExpression': (
+                        "SET messages = list_append(if_not_exists(messages, :empty), :message), "
+                        "first_at_ms = if_not_exists(first_at_ms, :now), last_at_ms = :now, "
+                        "sfn_input = :input, expires_at = :expires_at "
+                        "ADD generation :one"
+                    ),
+                    'ExpressionAttributeValues': {
+                        ':empty': {'L': []},
+                        ':message': {'L': [message]},
+                        ':now': {'N': str(now_ms)},
+                        ':input': {'S': json.dumps(sfn_input)},
+                        ':expires_at': {'N': str(now_ms // 1000 + ITEM_TTL)},
+                        ':one': {'N': '1'},
+                    },
+                }},
+            ])
+        except self.dynamodb.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get('CancellationReasons') or []
+            if not reasons or reasons[0].get('Code') != 'ConditionalCheckFailed':
+                raise
+            print(f"Message {message_id} already buffered")
+            # The first delivery may have failed before scheduling its flush
+            self._reschedule(key, start)
+            return 'duplicate'
+
+        item = self._read(key)
+        if item is None:
+            # Flushed between the write and the read (forced by another message)
+            return 'buffered'
+        return self._schedule_due(key, item, now_ms, start)
+
+    def _read(self, key):
+        return self.dynamodb.get_item(
+            TableName=self.table_name, Key={'buffer_key': {'S': key}}, ConsistentRead=True
+        ).get('Item')
+
+    def _reschedule(self, key, start):
+        """Schedule a flush of the current generation of the buffer of `key`, if there is one."""
+        item = self._read(key)
+        if item is not None:
+            self._schedule_due(key, item, self._now_ms(), start)
+
+    def _schedule_due(self, key, item, now_ms, start):
+        """Schedule the flush of `item` when it is due, or flush it now if it is full or overdue."""
+        generation = int(item['generation']['N'])
+        delay = self._delay_seconds(item, now_ms)
+        if len(item['messages']['L']) >= self.max_messages or delay <= 0:
+            return self.flush(key, start, generation, force=True)
+        self._schedule(key, generation, delay)
+        return 'buffered'
+
+    def flush(self, key, start, generation=None, force=False):
+        """
+        Start one execution for the buffer of `key` if it is due (or `force`).
+        Returns 'started', 'empty', 'pending' (a later flush message covers
+        it) or 'rescheduled' (delivered early: scheduled again).
+        """
+        for _ in range(MAX_CLAIM_ATTEMPTS):
+            item = self._read(key)
+            if item is None:
+                return 'empty'
+
+            current = int(item['generation']['N'])
+            now_ms = self._now_ms()
+            quiet_since = now_ms - int(item['last_at_ms']['N'])
+            waiting_since = now_ms - int(item['first_at_ms']['N'])
+            due = force \
+                or quiet_since >= self.window * 1000 - DUE_TOLERANCE_MS \
+                or waiting_since >= self.max_wait * 1000 - DUE_TOLERANCE_MS
+            if not due:
+                if generation is not None and generation != current:
+                    # The newer message scheduled its own flush
+                    return 'pending'
+                remaining_ms = min(self.window * 1000 - quiet_since, self.max_wait * 1000 - waiting_since)
+                self._schedule(key, current, max(1, math.ceil(remaining_ms / 1000)))
+                return 'rescheduled'
+
+            try:
+                claimed = self.dynamodb.delete_item(
+                    TableName=self.table_name,
+                    Key={'buffer_key': {'S': key}},
+                    ConditionExpression="generation = :generation",
+                    ExpressionAttributeValues={':generation': {'N': str(current)}},
+                    ReturnValues='ALL_OLD'
+                )['Attributes']
+            except self.dynamodb.exceptions.ConditionalCheckFailedException:
+                # A message landed between the read and the claim
+                continue
+
+            sfn_input = merge(claimed)
+            try:
+                start(sfn_input)
+            except Exception:
+                # The retried flush message may carry a stale generation: schedule a fresh one
+                self._schedule(key, self._restore(key, claimed), self.window)
+                raise
+            print(f"Coalesced: {json.dumps(dict(sfn_input['coalesced'], buffer_key=key, waited_ms=waiting_since))}")
+            return 'started'
+        return 'pending'
+
+    def _restore(self, key, claimed):
+        """Put the messages of a claimed buffer back in front of whatever arrived since. Returns the generation."""
+        item = self.dynamodb.update_item(
+            TableName=self.table_name,
+            Key={'buffer_key': {'S': key}},
+            UpdateExpression=(
+                "SET messages = list_append(:messages, if_not_exists(messages, :empty)), "
+                "first_at_ms = :first_at, last_at_ms = if_not_exists(last_at_ms, :last_at), "
+                "sfn_input = if_not_exists(sfn_input, :input), expires_at = :expires_at "
+                "ADD generation :one"
+            ),
+            ExpressionAttributeValues={
+                ':messages': claimed['messages'],
+                ':empty': {'L': []},
+                ':first_at': claimed['first_at_ms'],
+                ':last_at': claimed['last_at_ms'],
+                ':input': claimed['sfn_input'],
+                ':expires_at': claimed['expires_at'],
+                ':one': {'N': '1'},
+            },
+            ReturnValues='UPDATED_NEW'
+        )['Attributes']
+        return int(item['generation']['N'])
@@ -0,0 +1,68 @@
+"""
+Last N messages of a conversation from the messages table.
+
+Replaces the "query everything, keep the last 10" pattern of
+MessagesRepository::all and the `Limit=10` + client-side `M#` filter of the
+local handler (which returns fewer than 10 messages as soon as another item,
+e.g. the history WINDOW, sorts among the last ones):
+
+- newest first (`ScanIndexForward=False`) with `begins_with(sk, 'M#')` in
+  the key condition, so Limit counts messages only;
+- `ProjectionExpression` of role and content, nothing else is transferred;
+- pages until N messages are collected, then stops.
+
+Note that DynamoDB bills read capacity on the items read, not on the
+projected attributes: the RCU saving comes from reading N items instead of
+the whole conversation, the projection saves transfer and deserialization.
+"""
+
+import os
+
+MESSAGES_TABLE = os.environ.get('WA_MESSAGES_TABLE', 'sidea-ai-clone-prod-messages-table')
+MESSAGE_PREFIX = 'M#'
+DEFAULT_LIMIT = 10
+
+
+def last_messages(dynamodb, messages_key, limit=DEFAULT_LIMIT, consistent=False,
+                  table_name=MESSAGES_TABLE, stats=None):
+    """
+    Up to `limit` messages, oldest first, as {'role', 'content'} dicts.
+
+    `stats` (optional dict) is filled with pages, items read and the read
+    capacity consumed.
+    """
+    stats = {} if stats is None else stats
+    stats.update(pages=0, items=0, consumed_rcu=0.0)
+
+    params = {
+        'TableName': table_name,
+        'KeyConditionExpression': 'pk = :pk AND begins_with(sk, :prefix)',
+        'ExpressionAttributeNames': {'#role': 'role', '#content': 'content'},
+        'ExpressionAttributeValues': {
+            ':pk': {'S': messages_key},
+            ':prefix': {'S': MESSAGE_PREFIX}
+        },
+        'ProjectionExpression': '#role, #content',
+        'ScanIndexForward': False,
+        'ConsistentRead': consistent,
+        'ReturnConsumedCapacity': 'TOTAL',
+    }
+
+    items = []
+    while len(items) < limit:
+        response = dynamodb.query(Limit=limit - len(items), **params)
+        stats['pages'] += 1
+        stats['consumed_rcu'] += response.get('ConsumedCapacity', {}).get('CapacityUnits', 0.0)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            break
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    stats['items'] = len(items)
+    return [
+        {
+            'role': item.get('role', {}).get('S', 'user'),
+            'content': item.get('content', {}).get('S', '')
+        }
+        for item in reversed(items)
+    ]
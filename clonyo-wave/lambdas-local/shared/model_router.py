@@ -0,0 +1,149 @@
+"""
+Model, max_tokens and retrieval depth of a reply, by complexity_factor.
+
+The reply strategy scores every message 0..1 (small talk 0.1, lookups
+0.2-0.3, comparisons 0.3-0.5, advice and technical questions 0.6-1.0) and
+the state machine passes it to "Build Knowledge based response", but the
+reply was always generated by the same model with the config max_tokens:
+a "Grazie!" paid Sonnet latency. Here the factor picks a band:
+
+    light     <= 0.3   fast tier (Haiku), short answer, 2 KB results
+    standard  <= 0.6   smart tier, 1024 tokens, 4 KB results
+    deep               smart tier, the clone's max_tokens and retrieval depth
+
+The smart tier is the clone's model_id when it has one. The clone's
+max_tokens and retrieval_results are ceilings for every band. Clones
+override the routing in the config table (response_generator.routing,
+read through config_store):
+
+    "routing": {
+        "enabled": true,
+        "tiers": {"fast": "<model id>", "smart": "<model id>"},
+        "bands": {"light": {"max_complexity": 0.2, "max_tokens": 300},
+                  "standard": {"tier": "fast"}}
+    }
+
+Messages without a complexity_factor, and clones with routing disabled,
+keep the unrouted behaviour (the config model and max_tokens).
+log_route() writes one line per reply with the route and the observed
+latency, so the bands can be tuned from the logs.
+"""
+
+import json
+import os
+
+ENABLED = os.environ.get('MODEL_ROUTING_ENABLED', '1') == '1'
+
+# Unrouted replies: the config values, else these. Claude 3 Sonnet takes no
+# prompt-cache breakpoints: set BEDROCK_MODEL_ID (and ROUTE_SMART_MODEL_ID) to a
+# model of prompt_cache.PROMPT_CACHE_MODELS to opt in to caching
+DEFAULT_MODEL_ID = os.environ.get('BEDROCK_MODEL_ID', 'anthropic.claude-3-sonnet-20240229-v1:0')
+DEFAULT_MAX_TOKENS = 4096
+
+# Haiku 3 has no prompt caching: light-band prompts are short and rarely reach
+# the minimum cacheable prefix anyway
+TIERS = {
+    'fast': os.environ.get('ROUTE_FAST_MODEL_ID', 'anthropic.claude-3-haiku-20240307-v1:0'),
+    'smart': os.environ.get('ROUTE_SMART_MODEL_ID', 'eu.anthropic.claude-3-5-sonnet-20240620-v1:0'),
+}
+
+# Lowest max_complexity first; None means the clone's value
+BANDS = (
+    {'name': 'light', 'max_complexity': 0.3, 'tier': 'fast', 'max_tokens': 512, 'retrieval_results': 2},
+    {'name': 'standard', 'max_complexity': 0.6, 'tier': 'smart', 'max_tokens': 1024, 'retrieval_results': 4},
+    {'name': 'deep', 'max_complexity': 1.0, 'tier': 'smart', 'max_tokens': None, 'retrieval_results': None},
+)
+
+
+class Route:
+
+    def __init__(self, band, complexity_factor, tier, model_id, max_tokens, retrieval_results, source):
+        self.band = band
+        self.complexity_factor = complexity_factor
+        self.tier = tier
+        self.model_id = model_id
+        self.max_tokens = max_tokens
+        self.retrieval_results = retrieval_results
+        self.source = source  # 'default', 'clone' (overridden bands/tiers) or 'unrouted'
+
+    def to_dict(self):
+        return {
+            'band': self.band,
+            'complexity_factor': self.complexity_factor,
+            'tier': self.tier,
+            'model_id': self.model_id,
+            'max_tokens': self.max_tokens,
+            'retrieval_results': self.retrieval_results,
+            'source': self.source,
+        }
+
+
+def _ceiling(value, ceiling):
+    if value is None:
+        return ceiling
+    return min(int(value), int(ceiling)) if ceiling is not None else int(value)
+
+
+def _factor(complexity_factor):
+    try:
+        return min(1.0, max(0.0, float(complexity_factor)))
+    except (TypeError, ValueError):
+        return None
+
+
+def bands_for(routing):
+    """Default bands with the clone's per-band overrides, lowest max_complexity first."""
+    overrides = routing.get('bands') or {}
+    bands = [dict(band, **(overrides.get(band['name']) or {})) for band in BANDS]
+    return sorted(bands, key=lambda band: float(band['max_complexity']))
+
+
+def unrouted(config, complexity_factor=None):
+    return Route(None, complexity_factor, None, config.get('model_id', DEFAULT_MODEL_ID),
+                 int(config.get('max_tokens', DEFAULT_MAX_TOKENS)), config.get('retrieval_results'), 'unrouted')
+
+
+def choose(complexity_factor, config):
+    """Route of a reply of this complexity for the clone `config` (response_generator options)."""
+    routing = config.get('routing')
+    if routing is None or routing is True:
+        routing = {}
+    factor = _factor(complexity_factor)
+    if not ENABLED or routing is False or not routing.get('enabled', True) or factor is None:
+        return unrouted(config, complexity_factor)
+
+    bands = bands_for(routing)
+    band = next((band for band in bands if factor <= float(band['max_complexity'])), bands[-1])
+    tiers = dict(TIERS)
+    if config.get('model_id'):
+        tiers['smart'] = config['model_id']
+    tiers.update(routing.get('tiers') or {})
+
+    return Route(
+        band['name'],
+        factor,
+        band['tier'],
+        band.get('model_id') or tiers[band['tier']],
+        _ceiling(band.get('max_tokens'), config.get('max_tokens', DEFAULT_MAX_TOKENS)),
+        _ceiling(band.get('retrieval_results'), config.get('retrieval_results')),
+        'clone' if routing.get('bands') or routing.get('tiers') else 'default'
+    )
+
+
+def log_route(route, clone=None, latency_ms=None, first_token_ms=None, output_tokens=None, stop_reason=None,
+              retrieval_results=None):
+    """One structured line per reply, so latency per band and model can be aggregated from the logs."""
+    line = dict(
+        route.to_dict(),
+        clone=clone,
+        latency_ms=latency_ms,
+        first_token_ms=first_token_ms,
+        output_tokens=output_tokens,
+        ms_per_output_token=round(latency_ms / output_tokens, 2) if latency_ms and output_tokens else None,
+        # 'max_tokens' means the band cut the answer short
+        stop_reason=stop_reason,
+    )
+    if retrieval_results is not None:
+        line['retrieval_results'] = retrieval_results
+    print(f"Model route: {json.dumps(line)}")
+    return line
@@ -0,0 +1,261 @@
+"""
+Ogg/Opus stream joining without re-encoding.
+
+Byte-concatenating Ogg files gives a *chained* stream (one logical stream
+per segment, each with its own OpusHead): players that do not follow
+chains stop after the first link, and even those that do report the
+duration of the last link only. OggOpusJoiner instead remuxes the segments
+into one logical stream at the page level:
+
+- OpusHead/OpusTags are kept from the first segment only;
+- every audio page is rewritten with the serial number of the first
+  segment, a continuous page sequence and a granule position offset by the
+  samples decoded so far (packet durations come from the Opus TOC byte);
+- BOS is left on the first page only and EOS is set on the last one;
+- the page CRC is recomputed.
+
+The Opus packets themselves are copied untouched. Each segment after the
+first starts with its own encoder pre-skip (312 samples, 6.5 ms at 48 kHz)
+and the previous one keeps its end padding: both are now played instead of
+trimmed, a few milliseconds at a sentence boundary.
+"""
+
+import struct
+import zlib
+
+CAPTURE_PATTERN = b'OggS'
+HEADER = struct.Struct('<4sBBqIII')  # capture, version, flags, granule, serial, sequence, crc
+HEADER_SIZE = HEADER.size + 1        # + number of lacing values
+
+FLAG_CONTINUED = 0x01
+FLAG_BOS = 0x02
+FLAG_EOS = 0x04
+
+NO_GRANULE = -1
+
+OPUS_HEAD = b'OpusHead'
+OPUS_TAGS = b'OpusTags'
+SAMPLE_RATE = 48000
+
+# Frame duration (in 48 kHz samples) per TOC config, RFC 6716 section 3.1
+_FRAME_SAMPLES = (
+    [480, 960, 1920, 2880] * 3 +   # SILK NB/MB/WB: 10, 20, 40, 60 ms
+    [480, 960] * 2 +               # Hybrid SWB/FB: 10, 20 ms
+    [120, 240, 480, 960] * 4       # CELT NB/WB/SWB/FB: 2.5, 5, 10, 20 ms
+)
+
+# Ogg CRC-32 is the non-reflected 0x04C11DB7 polynomial, init 0, no final
+# xor. zlib computes the reflected variant (init and final xor 0xFFFFFFFF)
+# in C: feeding it bit-reversed bytes, cancelling its init/xor with the CRC
+# of as many zero bytes and reversing the result gives the Ogg CRC.
+_REVERSED_BYTES = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+
+def _reverse32(value):
+    return int(f"{value:032b}"[::-1], 2)
+
+
+def ogg_crc(data):
+    reflected = zlib.crc32(data.translate(_REVERSED_BYTES)) ^ zlib.crc32(bytes(len(data)))
+    return _reverse32(reflected)
+
+
+class Page:
+    """One Ogg page: header fields, lacing values and body."""
+
+    def __init__(self, flags, granule, serial, sequence, lacing, body):
+        self.flags = flags
+        self.granule = granule
+        self.serial = serial
+        self.sequence = sequence
+        self.lacing = lacing
+        self.body = body
+
+    def packet_ends(self):
+        """Number of packets that end on this page."""
+        return sum(1 for value in self.lacing if value < 255)
+
+    def to_bytes(self):
+        header = HEADER.pack(CAPTURE_PATTERN, 0, self.flags, self.granule, self.serial, self.sequence, 0)
+        data = bytearray(header + bytes([len(self.lacing)]) + bytes(self.lacing) + self.body)
+        struct.pack_into('<I', data, 22, ogg_crc(bytes(data)))
+        return bytes(data)
+
+
+def parse_pages(data):
+    """Yield the pages of an Ogg stream. Raises ValueError on truncated/corrupt input."""
+    offset = 0
+    while offset < len(data):
+        if len(data) - offset < HEADER_SIZE:
+            raise ValueError(f"Truncated Ogg page header at byte {offset}")
+        capture, version, flags, granule, serial, sequence, crc = HEADER.unpack_from(data, offset)
+        if capture != CAPTURE_PATTERN or version != 0:
+            raise ValueError(f"Not an Ogg page at byte {offset}")
+        count = data[offset + HEADER.size]
+        lacing = data[offset + HEADER_SIZE:offset + HEADER_SIZE + count]
+        body_start = offset + HEADER_SIZE + count
+        body_end = body_start + sum(lacing)
+        if len(lacing) != count or body_end > len(data):
+            raise ValueError(f"Truncated Ogg page at byte {offset}")
+        yield Page(flags, granule, serial, sequence, list(lacing), bytes(data[body_start:body_end]))
+        offset = body_end
+
+
+def iter_packets(page, partial=b''):
+    """
+    Complete packets of `page`, given the unfinished packet carried over from
+    the previous page. Returns (packets, new_partial).
+    """
+    packets = []
+    position = 0
+    current = partial
+    for value in page.lacing:
+        current += page.body[position:position + value]
+        position += value
+        if value < 255:
+            packets.append(current)
+            current = b''
+    return packets, current
+
+
+def packet_samples(packet):
+    """Duration of an Opus packet in 48 kHz samples, from its TOC byte."""
+    if not packet:
+        return 0
+    toc = packet[0]
+    frame = _FRAME_SAMPLES[toc >> 3]
+    code = toc & 0x03
+    if code == 0:
+        frames = 1
+    elif code in (1, 2):
+        frames = 2
+    else:
+        frames = packet[1] & 0x3F if len(packet) > 1 else 0
+    return frame * frames
+
+
+def opus_head(page):
+    """Channel count, pre-skip and input rate from an OpusHead page."""
+    body = page.body
+    if not body.startswith(OPUS_HEAD) or len(body) < 19:
+        raise ValueError("Not an Ogg Opus stream (missing OpusHead)")
+    channels, pre_skip, input_rate = struct.unpack_from('<BHI', body, 9)
+    return {'channels': channels, 'pre_skip': pre_skip, 'input_rate': input_rate}
+
+
+class OggOpusJoiner:
+    """
+    Incremental joiner: add() the segments in playback order, write what
+    each call returns, then write finish(). The last page of every segment
+    is held back until the next add()/finish() because its granule and EOS
+    flag depend on whether another segment follows.
+    """
+
+    def __init__(self):
+        self.serial = None
+        self.channels = None
+        self.sequence = 0
+        self.samples = 0
+        self.segments = 0
+        self.pending = None
+
+    def _emit(self, page, granule, flags):
+        page = Page(flags, granule, self.serial, self.sequence, page.lacing, page.body)
+        self.sequence += 1
+        return page.to_bytes()
+
+    def _flush_pending(self, last):
+        if self.pending is None:
+            return b''
+        page, decoded, original = self.pending
+        self.pending = None
+        flags = page.flags & ~(FLAG_BOS | FLAG_EOS)
+        if last:
+            # Keep the end trimming of the final segment
+            return self._emit(page, self.samples - decoded + original, flags | FLAG_EOS)
+        return self._emit(page, self.samples, flags)
+
+    def add(self, data):
+        pages = list(parse_pages(data))
+        if len(pages) < 3:
+            raise ValueError("Ogg Opus segment without audio pages")
+
+        head = opus_head(pages[0])
+        if self.channels is None:
+            self.serial = pages[0].serial
+            self.channels = head['channels']
+        elif head['channels'] != self.channels:
+            raise ValueError(f"Channel count mismatch: {head['channels']} != {self.channels}")
+
+        out = [self._flush_pending(last=False)]
+
+        # Header packets: OpusHead alone on the first page, then OpusTags
+        # (possibly spanning pages); audio always starts on a fresh page
+        headers_done = 0
+        index = 0
+        while index < len(pages) and headers_done < 2:
+            if self.segments == 0:
+                out.append(self._emit(pages[index], 0, pages[index].flags & ~FLAG_EOS))
+            headers_done += pages[index].packet_ends()
+            index += 1
+
+        audio_pages = [page for page in pages[index:] if page.serial == pages[0].serial]
+        if not audio_pages:
+            raise ValueError("Ogg Opus segment without audio pages")
+
+        partial = b''
+        decoded = 0
+        for page in audio_pages[:-1]:
+            packets, partial = iter_packets(page, partial)
+            decoded += sum(packet_samples(packet) for packet in packets)
+            granule = self.samples + decoded if packets else NO_GRANULE
+            out.append(self._emit(page, granule, page.flags & ~(FLAG_BOS | FLAG_EOS)))
+
+        last_page = audio_pages[-1]
+        packets, _ = iter_packets(last_page, partial)
+        decoded += sum(packet_samples(packet) for packet in packets)
+        self.samples += decoded
+        self.pending = (last_page, decoded, last_page.granule)
+        self.segments += 1
+        return b''.join(out)
+
+    def finish(self):
+        return self._flush_pending(last=True)
+
+
+def concat(segments):
+    """Join complete Ogg Opus files (bytes) into one logical stream."""
+    joiner = OggOpusJoiner()
+    parts = [joiner.add(segment) for segment in segments]
+    parts.append(joiner.finish())
+    return b''.join(parts)
+
+
+def build_stream(packets, serial=1, channels=1, pre_skip=312, end_trim=0, packets_per_page=50):
+    """
+    Minimal Ogg Opus file from raw Opus packets (OpusHead, OpusTags, audio
+    pages). Used by the fake TTS server and the benchmarks.
+    """
+    head = OPUS_HEAD + struct.pack('<BBHIhB', 1, channels, pre_skip, SAMPLE_RATE, 0, 0)
+    vendor = b'clonyo-wave'
+    tags = OPUS_TAGS + struct.pack('<I', len(vendor)) + vendor + struct.pack('<I', 0)
+
+    def lacing(packet):
+        return [255] * (len(packet) // 255) + [len(packet) % 255]
+
+    pages = [
+        Page(FLAG_BOS, 0, serial, 0, lacing(head), head),
+        Page(0, 0, serial, 1, lacing(tags), tags),
+    ]
+    samples = 0
+    for start in range(0, len(packets), packets_per_page):
+        group = packets[start:start + packets_per_page]
+        samples += sum(packet_samples(packet) for packet in group)
+        pages.append(Page(
+            0, samples, serial, len(pages),
+            [value for packet in group for value in lacing(packet)],
+            b''.join(group)
+        ))
+    pages[-1].flags |= FLAG_EOS
+    pages[-1].granule = max(0, pages[-1].granule - end_trim)
+    return b''.join(page.to_bytes() for page in pages)
@@ -0,0 +1,185 @@
+"""
+Prompt-cache-aware request builder for Bedrock Anthropic (messages API) calls.
+
+Blocks are ordered from the most stable to the most volatile:
+
+    system prompt  ->  conversation summary  ->  history  ->  past topic
+    summaries + KB context + question
+
+and `cache_control` breakpoints are placed after the system prompt and
+after the history, so consecutive messages of the same conversation
+re-read the cached prefix instead of paying for it again. KB context
+and the past summaries of the topic change on every message, so they go
+in the last user turn, after the last breakpoint (putting them in
+`system` would bust the cache every time).
+
+Only the models in PROMPT_CACHE_MODELS get breakpoints. The default
+models of generate-response-fn (model_router: Claude 3 Sonnet, Sonnet
+3.5 v1 on the smart tier, Haiku 3 on the fast one) are not among them,
+so caching is opt-in: a model_id in the clone config, or
+BEDROCK_MODEL_ID / ROUTE_SMART_MODEL_ID, naming a cache-capable model
+such as Sonnet 3.7. The others run without caching (`cache_supported`
+is false in their log line). Bedrock also ignores breakpoints before the
+minimum cacheable prefix (1024 tokens for Sonnet, 2048 for Haiku).
+
+Usage reported by the model (`cache_read_input_tokens`,
+`cache_creation_input_tokens`) is collected by `usage_from_body` /
+`CacheUsage` so savings can be measured per clone.
+"""
+
+import json
+
+ANTHROPIC_VERSION = 'bedrock-2023-05-31'
+
+CACHE_CONTROL = {'type': 'ephemeral'}
+
+# Bedrock models that accept `cache_control`; other models get the same
+# block layout without breakpoints (the API rejects the field for them)
+PROMPT_CACHE_MODELS = (
+    'claude-3-5-haiku',
+    'claude-3-5-sonnet-20241022',
+    'claude-3-7-sonnet',
+    'claude-sonnet-4',
+    'claude-opus-4',
+    'claude-haiku-4',
+)
+
+# Billing multipliers relative to a regular input token
+CACHE_WRITE_COST = 1.25
+CACHE_READ_COST = 0.1
+
+KB_CONTEXT_HEADER = 'Contesto dalla Knowledge Base:'
+SUMMARY_HEADER = 'Riassunto della conversazione precedente:'
+PAST_CONTEXT_HEADER = 'Conversazioni passate sullo stesso argomento:'
+
+
+def supports_prompt_cache(model_id):
+    return any(name in (model_id or '') for name in PROMPT_CACHE_MODELS)
+
+
+def _text_block(text, cache=False):
+    block = {'type': 'text', 'text': text}
+    if cache:
+        block['cache_control'] = dict(CACHE_CONTROL)
+    return block
+
+
+def _as_blocks(content):
+    if isinstance(content, list):
+        return [dict(block) for block in content]
+    return [_text_block(str(content))]
+
+
+def build_request(system_prompt, history, user_input, kb_context=None,
+                  temperature=0.5, max_tokens=4096, cache=True, summary=None, past_context=None):
+    """
+    Anthropic messages body with the stable-first layout.
+
+    `history` is a list of {'role', 'content'} (oldest first), `kb_context`
+    a string or a list of passages, `summary` the running summary of the
+    turns no longer in `history` (see history_window), `past_context` a
+    string or a list of summaries of past sessions on the same topic. With
+    `cache=False` the layout is kept but no breakpoint is emitted.
+    """
+    request = {
+        'anthropic_version': ANTHROPIC_VERSION,
+        'temperature': temperature,
+        'max_tokens': max_tokens,
+    }
+
+    system = []
+    if system_prompt:
+        system.append(_text_block(system_prompt, cache))
+    if summary:
+        # Changes only when turns leave the window: after the system prompt breakpoint
+        system.append(_text_block(f"{SUMMARY_HEADER}\n{summary}"))
+    if system:
+        request['system'] = system
+
+    # Empty text blocks are rejected by the API
+    messages = [{'role': m['role'], 'content': _as_blocks(m['content'])} for m in history or [] if m.get('content')]
+    if messages and cache:
+        # Breakpoint on the last history block: the whole conversation so far is the prefix
+        messages[-1]['content'][-1]['cache_control'] = dict(CACHE_CONTROL)
+
+    if isinstance(kb_context, (list, tuple)):
+        kb_context = '\n\n'.join(passage for passage in kb_context if passage)
+    if isinstance(past_context, (list, tuple)):
+        past_context = '\n\n'.join(passage for passage in past_context if passage)
+
+    user_content = []
+    if past_context:
+        user_content.append(_text_block(f"{PAST_CONTEXT_HEADER}\n{past_context}"))
+    if kb_context:
+        user_content.append(_text_block(f"{KB_CONTEXT_HEADER}\n{kb_context}"))
+    user_content.append(_text_block(user_input))
+    messages.append({'role': 'user', 'content': user_content})
+
+    request['messages'] = messages
+    return request
+
+
+def build_request_for_model(model_id, *args, cache=True, **kwargs):
+    """build_request, with breakpoints only if `model_id` supports prompt caching."""
+    return build_request(*args, cache=cache and supports_prompt_cache(model_id), **kwargs)
+
+
+class CacheUsage:
+    """Token usage of one call, cache reads and writes included."""
+
+    def __init__(self, input_tokens=0, output_tokens=0, cache_read_tokens=0, cache_write_tokens=0):
+        self.input_tokens = input_tokens or 0
+        self.output_tokens = output_tokens or 0
+        self.cache_read_tokens = cache_read_tokens or 0
+        self.cache_write_tokens = cache_write_tokens or 0
+
+    @classmethod
+    def from_usage(cls, usage):
+        usage = usage or {}
+        return cls(
+            input_tokens=usage.get('input_tokens'),
+            output_tokens=usage.get('output_tokens'),
+            cache_read_tokens=usage.get('cache_read_input_tokens'),
+            cache_write_tokens=usage.get('cache_creation_input_tokens'),
+        )
+
+    @property
+    def prompt_tokens(self):
+        """All prompt tokens: `input_tokens` only counts the ones after the last breakpoint."""
+        return self.input_tokens + self.cache_read_tokens + self.cache_write_tokens
+
+    @property
+    def input_cost_ratio(self):
+        """Billed prompt cost relative to the same prompt without caching (1.0 = no saving)."""
+        if not self.prompt_tokens:
+            return 1.0
+        billed = (
+            self.input_tokens
+            + self.cache_write_tokens * CACHE_WRITE_COST
+            + self.cache_read_tokens * CACHE_READ_COST
+        )
+        return round(billed / self.prompt_tokens, 4)
+
+    def to_dict(self):
+        return {
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'cache_read_tokens': self.cache_read_tokens,
+            'cache_write_tokens': self.cache_write_tokens,
+            'cache_hit': self.cache_read_tokens > 0,
+            'input_cost_ratio': self.input_cost_ratio,
+        }
+
+
+def usage_from_body(response_body):
+    """CacheUsage from a parsed `invoke_model` response body."""
+    return CacheUsage.from_usage(response_body.get('usage'))
+
+
+def log_usage(usage, clone=None, model_id=None, latency_ms=None):
+    """One structured line per call, so cache savings can be aggregated per clone in the logs."""
+    line = dict(usage.to_dict(), clone=clone, model_id=model_id, latency_ms=latency_ms)
+    if model_id:
+        line['cache_supported'] = supports_prompt_cache(model_id)
+    print(f"Prompt cache: {json.dumps(line)}")
+    return line
@@ -0,0 +1,207 @@
+"""
+Local reply-strategy classifier: decides mode (text/audio) and
+complexity_factor (0-1) without calling Bedrock when the message is easy.
+
+Two stages, both pure Python and in the microsecond range:
+
+1. Rules (regex/keywords) encoding the deterministic heuristics of
+   ReplyStrategyService::getSystemPrompt: explicit "audio"/"voce" or
+   "testo"/"scrivi" requests fix the mode, short SMALL_TALK and follow-ups
+   ("Ok", "Grazie", "ciao") are text at 0.1.
+2. A small scored model: keyword-family features, a linear score per
+   category and a softmax. The winning category maps to the mode and
+   complexity_factor of the same heuristics table.
+
+`classify()` returns a Classification; `confident` tells the caller whether
+to trust it or fall through to the LLM.
+"""
+
+import math
+import os
+import re
+import unicodedata
+
+MIN_CONFIDENCE = float(os.environ.get('REPLY_CLASSIFIER_MIN_CONFIDENCE', '0.7'))
+
+# --- Rules -------------------------------------------------------------------
+
+AUDIO_REQUEST = re.compile(r'\b(audio|vocale|vocali|voce|voice|registrazione)\b')
+TEXT_REQUEST = re.compile(r'\b(testo|scritto|iscritto|scrivi|scrivimi|scrivermi|text|write)\b')
+# The negation must govern the audio noun: "non mandarmi un audio", "niente audio",
+# "senza vocali", "testo, non un audio", "per iscritto, non con un vocale".
+# A bare interjection is not one ("No, mandami un audio" asks for audio)
+NEGATED_AUDIO = re.compile(
+    r'\b(?:non\s+(?:(?:mi|me|ce|ci|lo|la|li|le|ne|piu)\s+){0,2}'
+    r'(?:mand\w*|invi\w*|voglio|vorrei|fare|farmi|registr\w*|serv\w*)\s+(?:\w+\s+){0,2}'
+    r'|non\s+(?:(?:un|uno|una|con|col|per|in|via|tramite|il|l|i|gli|dei|degli)\s+){0,2}'
+    r'|(?:niente|senza|basta|evita\w*|no)\s+(?:(?:un|gli|i|l|il|di|con|piu|altri)\s+){0,2})'
+    r'(?:audio|vocale|vocali|voce)\b'
+)
+
+# Every word of the message in this set (and at most SMALL_TALK_MAX_WORDS) -> SMALL_TALK
+SMALL_TALK_WORDS = {
+    'ok', 'okay', 'okk', 'grazie', 'mille', 'tante', 'infinite', 'ciao', 'buongiorno', 'buonasera',
+    'buonanotte', 'salve', 'hey', 'ehi', 'si', 'no', 'perfetto', 'va', 'bene', 'benissimo',
+    'daccordo', 'd', 'accordo', 'capito', 'chiaro', 'ottimo', 'top', 'fantastico', 'certo', 'esatto',
+    'thanks', 'thank', 'you', 'hi', 'hello', 'yes', 'a', 'presto', 'dopo', 'domani', 'davvero',
+    'molto', 'gentile', 'gentilissimo', 'gentilissima', 'anche', 'altrettanto', 'sei', 'grande',
+    'allora', 'e', 'tu', 'te', 'ah', 'ahah', 'ahahah', 'bello', 'bellissimo', 'interessante',
+}
+SMALL_TALK_MAX_WORDS = 6
+
+# --- Scored model --------------------------------------------------------------
+
+MAX_HITS = 3
+
+FEATURES = {
+    'info': re.compile(
+        r'\b(dove (trovo|posso trovare|si trova|lo trovo|la trovo)|link|titolo|come si chiama|'
+        r'libro|libri|podcast|corso|canale|sito|video|orari|orario|indirizzo|contatti)\b'
+    ),
+    'finance': re.compile(
+        r'\b(etf|azioni|azionario|obbligazion\w*|bitcoin|crypto|cripto\w*|invest\w*|portafoglio|'
+        r'asset allocation|rendiment\w*|interessi|mutu\w*|pension\w*|risparmi\w*|inflazione|borsa|'
+        r'fond[oi]|dividend\w*|tass[ei]|pac|polizz\w*|assicura\w*|software|app|tecnologia|'
+        r'intelligenza artificiale|codice|excel)\b'
+    ),
+    'technical': re.compile(
+        r'\b(percentual\w*|calcol\w*|formula|rischio|volatilit\w*|ribilanci\w*|correlazion\w*|'
+        r'tassazione|diversific\w*|come funziona|ter|benchmark|duration|cedol\w*)\b'
+    ),
+    'personal': re.compile(
+        r'\b(ansia|ansios\w*|stress|stressat\w*|paura|trist\w*|depress\w*|relazion\w*|partner|moglie|'
+        r'marito|fidanzat\w*|figli\w*|genitori|famiglia|amic\w*|solitudine|autostima|rabbia|litig\w*|'
+        r'separazione|lutto|emozion\w*|sento|sentirmi|abitudin\w*|tic|dormire|sonno|benessere|'
+        r'motivazione|felic\w*)\b'
+    ),
+    'work': re.compile(
+        r'\b(lavoro|lavorare|carriera|capo|collegh\w*|licenzi\w*|dimission\w*|azienda|valori|scopo|'
+        r'senso|passione|professione|stipendio|colloquio)\b'
+    ),
+    'howto': re.compile(
+        r'\b(come (posso|faccio|fare|si fa|devo|dovrei|iniziare|inizio|gestire|affrontare)|passi|step|'
+        r'strategia|piano|guida|consigl\w*|cosa dovrei|cosa mi consigli|aiutami|mi aiuti)\b'
+    ),
+    'compare': re.compile(r'\b(meglio|oppure|vs|differenza|differenze|conviene|preferibile)\b|\w+ o \w+\?'),
+}
+
+# category -> (mode, complexity_factor), from the ReplyStrategyService heuristics
+CATEGORIES = {
+    'small_talk': ('text', 0.1),
+    'info_lookup': ('text', 0.25),
+    'simple_comparison': ('text', 0.4),
+    'finance_advice': ('audio', 0.7),
+    'finance_technical': ('audio', 0.9),
+    'personal': ('audio', 0.9),
+    'work_values': ('audio', 0.8),
+}
+
+# Linear weights per category over the features (+ 'bias', 'short', 'long', 'question')
+WEIGHTS = {
+    'small_talk': {'bias': 0.0, 'short': 2.0, 'question': -1.5, 'info': -2.0, 'finance': -2.5,
+                   'personal': -2.5, 'work': -2.5, 'howto': -2.0, 'technical': -2.0},
+    'info_lookup': {'bias': -0.5, 'info': 3.5, 'short': 0.5, 'question': 0.5, 'howto': -1.0,
+                    'personal': -1.0, 'technical': -1.0, 'long': -1.0},
+    'simple_comparison': {'bias': -1.0, 'compare': 3.5, 'finance': 1.5, 'short': 1.0,
+                          'technical': -1.0, 'howto': -1.0, 'long': -1.5},
+    'finance_advice': {'bias': -0.5, 'finance': 2.5, 'howto': 1.5, 'question': 0.5, 'compare': -1.0,
+                       'short': -0.5},
+    'finance_technical': {'bias': -2.0, 'finance': 2.0, 'technical': 2.0, 'long': 1.0},
+    'personal': {'bias': -0.5, 'personal': 3.5, 'howto': 0.5, 'long': 0.5},
+    'work_values': {'bias': -0.5, 'work': 3.5, 'howto': 0.5, 'long': 0.5},
+}
+
+
+class Classification:
+
+    def __init__(self, mode, complexity_factor, confidence, source, label):
+        self.mode = mode
+        self.complexity_factor = complexity_factor
+        self.confidence = confidence
+        self.source = source  # 'rules' or 'model'
+        self.label = label
+
+    def confident(self, min_confidence=MIN_CONFIDENCE):
+        return self.confidence >= min_confidence
+
+    def to_dict(self):
+        return {
+            'mode': self.mode,
+            'complexity_factor': self.complexity_factor,
+            'confidence': round(self.confidence, 3),
+            'source': self.source,
+            'label': self.label,
+        }
+
+
+def normalize(text):
+    """Lowercase, strip accents, keep letters/digits/'?' and single spaces."""
+    text = unicodedata.normalize('NFKD', (text or '').lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s?]", ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def explicit_mode(text):
+    """
+    'audio' / 'text' if the user asks for it explicitly, else None. A
+    refused audio means text; audio and text both asked for, with no
+    refusal, is ambiguous (None), so the caller keeps the model's answer.
+    """
+    if NEGATED_AUDIO.search(text):
+        return 'text'
+    audio = AUDIO_REQUEST.search(text)
+    text_request = TEXT_REQUEST.search(text)
+    if audio and text_request:
+        return None
+    if audio:
+        return 'audio'
+    if text_request:
+        return 'text'
+    return None
+
+
+def is_small_talk(words):
+    # Emoji-only messages normalize to nothing
+    return len(words) <= SMALL_TALK_MAX_WORDS and all(word in SMALL_TALK_WORDS for word in words)
+
+
+def features(text, words):
+    # Keyword families count their hits (capped), so several technical terms outweigh one
+    values = {name: float(min(MAX_HITS, len(pattern.findall(text)))) for name, pattern in FEATURES.items()}
+    values['bias'] = 1.0
+    values['short'] = float(len(words) <= 6)
+    values['long'] = float(len(words) >= 25)
+    values['question'] = float('?' in text)
+    return values
+
+
+def score(values):
+    """Softmax over the linear category scores: {category: probability}."""
+    logits = {
+        category: sum(weight * values.get(name, 0.0) for name, weight in weights.items())
+        for category, weights in WEIGHTS.items()
+    }
+    top = max(logits.values())
+    exp = {category: math.exp(logit - top) for category, logit in logits.items()}
+    total = sum(exp.values())
+    return {category: value / total for category, value in exp.items()}
+
+
+def classify(user_input):
+    text = normalize(user_input)
+    words = text.replace('?', ' ').split()
+    requested_mode = explicit_mode(text)
+
+    if is_small_talk(words):
+        return Classification('text', 0.1, 1.0, 'rules', 'small_talk')
+
+    probabilities = score(features(text, words))
+    label = max(probabilities, key=probabilities.get)
+    mode, complexity_factor = CATEGORIES[label]
+
+    if requested_mode is not None:
+        # An explicit request always decides the mode; complexity still comes from the model
+        return Classification(requested_mode, complexity_factor, probabilities[label], 'rules', label)
+
+    return Classification(mode, complexity_factor, probabilities[label], 'model', label)
@@ -0,0 +1,263 @@
+"""
+Two-tier cache in front of the Knowledge Base `retrieve` call.
+
+L1 is an in-process LRU with TTL (per warm container). On an exact-key miss
+it can optionally fall back to an embedding-similarity lookup among the
+cached queries of the same KB, then to the local vector index of the KB
+(kb_index, when one is shipped or published for it). L2 is a DynamoDB
+table shared by every container, so a cold container still benefits from
+what warm ones fetched.
+
+Keys are sha256(kb_id + normalized query + number of results).
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import aws_clients
+import embeddings
+import kb_index
+
+CACHE_TABLE = os.environ.get('RETRIEVAL_CACHE_TABLE', 'sidea-ai-clone-prod-retrieval-cache-table')
+CACHE_TTL = int(os.environ.get('RETRIEVAL_CACHE_TTL', '3600'))
+CACHE_MAX_ENTRIES = int(os.environ.get('RETRIEVAL_CACHE_MAX_ENTRIES', '256'))
+
+# Embedding lookup is opt-in: it costs one (cheap) embedding call per miss
+SEMANTIC_ENABLED = os.environ.get('RETRIEVAL_CACHE_SEMANTIC', '0') == '1'
+SEMANTIC_THRESHOLD = float(os.environ.get('RETRIEVAL_CACHE_SIMILARITY', '0.92'))
+EMBEDDING_MODEL_ID = os.environ.get('RETRIEVAL_CACHE_EMBEDDING_MODEL', 'amazon.titan-embed-text-v2:0')
+EMBEDDING_DIMENSIONS = int(os.environ.get('RETRIEVAL_CACHE_EMBEDDING_DIMENSIONS', '1024'))
+
+# numberOfResults of a retrieve call that does not set it
+KB_DEFAULT_RESULTS = 5
+
+# DynamoDB items are capped at 400KB; keep a safety margin
+MAX_ITEM_BYTES = 350 * 1024
+
+
+def normalize_query(text):
+    """Lowercase, strip accents and punctuation, collapse whitespace."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r'[^\w\s]', ' ', text.lower())
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def cache_key(kb_id, normalized_query, number_of_results):
+    raw = f"{kb_id}\n{number_of_results}\n{normalized_query}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def query_embedding(text):
+    return embeddings.titan_embedding(text, EMBEDDING_DIMENSIONS, EMBEDDING_MODEL_ID)
+
+
+def compact_results(results):
+    """Keep only what the handlers use from RetrievalResults."""
+    return [
+        {
+            'content': {'text': result.get('content', {}).get('text', '')},
+            'score': result.get('score'),
+            'location': result.get('location'),
+        }
+        for result in results
+    ]
+
+
+class RetrievalCache:
+
+    def __init__(self, table_name=CACHE_TABLE, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES,
+                 embed_fn=None, similarity_threshold=SEMANTIC_THRESHOLD, dynamodb=None, local_search=None):
+        self.table_name = table_name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+        self._dynamodb = dynamodb
+        # kb_index.search signature: results, or None to go on to L2 and the remote KB
+        self.local_search = local_search
+        self._entries = OrderedDict()  # key -> (expires_at, kb_id, embedding, results)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'semantic_hits': 0, 'local_hits': 0, 'shared_hits': 0, 'misses': 0,
+                       'evictions': 0}
+
+    @property
+    def dynamodb(self):
+        if self._dynamodb is None:
+            self._dynamodb = aws_clients.dynamodb()
+        return self._dynamodb
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    # -- L1 -----------------------------------------------------------------
+
+    def _get_local(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[3]
+
+    def _get_similar(self, kb_id, embedding, now, number_of_results=None):
+        # A similar query cached with fewer results cannot answer a deeper retrieval
+        wanted = int(number_of_results or KB_DEFAULT_RESULTS)
+        best_score, best_results = 0.0, None
+        with self._lock:
+            for expires_at, entry_kb_id, entry_embedding, results in self._entries.values():
+                if entry_kb_id != kb_id or entry_embedding is None or expires_at <= now or len(results) < wanted:
+                    continue
+                score = cosine(embedding, entry_embedding)
+                if score > best_score:
+                    best_score, best_results = score, results
+        if best_score >= self.similarity_threshold:
+            return best_results[:wanted]
+        return None
+
+    def _put_local(self, key, kb_id, embedding, results, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, kb_id, embedding, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    # -- L2 -----------------------------------------------------------------
+
+    def _get_shared(self, key, now):
+        if not self.table_name:
+            return None
+        try:
+            item = self.dynamodb.get_item(
+                TableName=self.table_name,
+                Key={'cache_key': {'S': key}},
+                ProjectionExpression='results, expires_at'
+            ).get('Item')
+        except Exception as e:
+            print(f"Retrieval cache read failed: {str(e)}")
+            return None
+
+        if not item or int(item['expires_at']['N']) <= now:
+            return None
+        return json.loads(item['results']['S']), int(item['expires_at']['N'])
+
+    def _put_shared(self, key, kb_id, results, expires_at):
+        if not self.table_name:
+            return
+        body = json.dumps(results)
+        if len(body.encode('utf-8')) > MAX_ITEM_BYTES:
+            return
+        try:
+            self.dynamodb.put_item(
+                TableName=self.table_name,
+                Item={
+                    'cache_key': {'S': key},
+                    'kb_id': {'S': kb_id},
+                    'results': {'S': body},
+                    'expires_at': {'N': str(expires_at)},
+                }
+            )
+        except Exception as e:
+            print(f"Retrieval cache write failed: {str(e)}")
+
+    # -- API ----------------------------------------------------------------
+
+    def retrieve(self, client, kb_id, query, number_of_results=None):
+        """
+        Drop-in replacement for `client.retrieve(...)['retrievalResults']`.
+        Returns (results, source) where source is one of
+        'memory', 'semantic', 'local', 'shared' or 'kb'.
+        """
+        now = int(time.time())
+        key = cache_key(kb_id, normalize_query(query), number_of_results)
+
+        results = self._get_local(key, now)
+        if results is not None:
+            self._count('hits')
+            return results, 'memory'
+
+        embedding = None
+        if self.embed_fn is not None:
+            try:
+                embedding = self.embed_fn(normalize_query(query))
+            except Exception as e:
+                print(f"Retrieval cache embedding failed: {str(e)}")
+            if embedding is not None:
+                results = self._get_similar(kb_id, embedding, now, number_of_results)
+                if results is not None:
+                    self._count('semantic_hits')
+                    return results, 'semantic'
+
+        if self.local_search is not None:
+            try:
+                results = self.local_search(kb_id, query, number_of_results)
+            except Exception as e:
+                print(f"Local KB index search failed: {str(e)}")
+                results = None
+            if results is not None:
+                self._put_local(key, kb_id, embedding, results, now + self.ttl)
+                self._count('local_hits')
+                return results, 'local'
+
+        shared = self._get_shared(key, now)
+        if shared is not None:
+            results, expires_at = shared
+            self._put_local(key, kb_id, embedding, results, expires_at)
+            self._count('shared_hits')
+            return results, 'shared'
+
+        self._count('misses')
+        request = {
+            'knowledgeBaseId': kb_id,
+            'retrievalQuery': {'text': query},
+        }
+        if number_of_results:
+            request['retrievalConfiguration'] = {
+                'vectorSearchConfiguration': {'numberOfResults': int(number_of_results)}
+            }
+        results = compact_results(client.retrieve(**request).get('retrievalResults', []))
+
+        expires_at = now + self.ttl
+        self._put_local(key, kb_id, embedding, results, expires_at)
+        self._put_shared(key, kb_id, results, expires_at)
+        return results, 'kb'
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['semantic_hits'] + stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_rate'] = round((lookups - stats['misses']) / lookups, 3) if lookups else 0.0
+        return stats
+
+
+_default = None
+
+
+def get_cache():
+    """Container-wide cache instance, kept across warm invocations."""
+    global _default
+    if _default is None:
+        _default = RetrievalCache(
+            embed_fn=query_embedding if SEMANTIC_ENABLED else None,
+            local_search=kb_index.search if kb_index.ENABLED else None
+        )
+    return _default
@@ -0,0 +1,134 @@
+"""
+Resume-or-create of the conversation session of a contact.
+
+SessionManagerHandler (PHP) queries the wa_contact_id_index GSI and then
+puts or updates the session: two round trips on an eventually consistent
+index (with no sort key, so "latest" is not even guaranteed), and two
+messages of the same contact arriving together can both miss the session
+and create one each.
+
+Here every contact has a "current session" item in the sessions table
+(session_id 'CURRENT#<wa_contact_id>') pointing at its session, and the
+decision is made by DynamoDB in one conditional UpdateItem:
+
+    SET last_active_at = :now,
+        current_session_id = if_not_exists(current_session_id, :new_id), ...
+    IF  attribute_not_exists(last_active_at) OR last_active_at >= :cutoff
+
+which resumes the active session, or creates the first one, atomically.
+Only when the session expired does the condition fail; the session is
+then rotated with a second UpdateItem conditional on the last_active_at
+just read, so one of the racing invocations rotates and the others resume
+what it created. Whoever created a session also writes its session item
+(session_id = uuid, as before), read by 'Update Session Meta' and the GSI.
+
+The topic handed back is `current_topic_id` of the current-session item:
+the state machine copies the topic of each reply there ('Update Current
+Session Topic', after 'Update Session Meta'), and a rotation keeps it, so
+the expired session's topic is carried over as with the PHP handler.
+"""
+
+import os
+import time
+import uuid
+
+SESSIONS_TABLE = os.environ.get('WA_SESSIONS_TABLE', 'sidea-ai-clone-prod-sessions-table')
+SESSION_TIMEOUT = int(os.environ.get('SESSION_TIMEOUT_SECONDS', str(30 * 60)))
+CURRENT_PREFIX = 'CURRENT#'
+MAX_ATTEMPTS = 4
+
+
+def current_key(wa_contact_id):
+    return f"{CURRENT_PREFIX}{wa_contact_id}"
+
+
+def _result(item, new_id):
+    session_id = item['current_session_id']['S']
+    return {
+        'session_id': session_id,
+        'topic_id': item.get('current_topic_id', {}).get('S'),
+        'is_new_session': session_id == new_id,
+    }
+
+
+def _write_session(dynamodb, table_name, session_id, wa_contact_id, now, topic_id):
+    item = {
+        'session_id': {'S': session_id},
+        'wa_contact_id': {'S': wa_contact_id},
+        'started_at': {'N': str(now)},
+        'last_active_at': {'N': str(now)},
+        'status': {'S': 'ACTIVE'},
+    }
+    if topic_id:
+        item['current_topic_id'] = {'S': topic_id}
+    dynamodb.put_item(TableName=table_name, Item=item, ConditionExpression="attribute_not_exists(session_id)")
+
+
+def resolve(dynamodb, wa_contact_id, now=None, table_name=None, timeout=None):
+    """
+    Session of `wa_contact_id` for a message arriving at `now`:
+    {session_id, topic_id, is_new_session}, as the PHP handler returns.
+    """
+    table_name = table_name or SESSIONS_TABLE
+    timeout = SESSION_TIMEOUT if timeout is None else timeout
+    now = int(time.time()) if now is None else now
+    key = {'session_id': {'S': current_key(wa_contact_id)}}
+
+    for _ in range(MAX_ATTEMPTS):
+        new_id = str(uuid.uuid4())
+        try:
+            item = dynamodb.update_item(
+                TableName=table_name,
+                Key=key,
+                UpdateExpression=(
+                    "SET last_active_at = :now, current_session_id = if_not_exists(current_session_id, :new_id), "
+                    "started_at = if_not_exists(started_at, :now), contact = :contact"
+                ),
+                ConditionExpression="attribute_not_exists(last_active_at) OR last_active_at >= :cutoff",
+                ExpressionAttributeValues={
+                    ':now': {'N': str(now)},
+                    ':new_id': {'S': new_id},
+                    ':contact': {'S': wa_contact_id},
+                    ':cutoff': {'N': str(now - timeout)},
+                },
+                ReturnValues='ALL_NEW',
+                ReturnValuesOnConditionCheckFailure='ALL_OLD'
+            )['Attributes']
+        except dynamodb.exceptions.ConditionalCheckFailedException as e:
+            expired = e.response.get('Item') or dynamodb.get_item(
+                TableName=table_name, Key=key, ConsistentRead=True
+            ).get('Item')
+        else:
+            result = _result(item, new_id)
+            if result['is_new_session']:
+                _write_session(dynamodb, table_name, new_id, wa_contact_id, now, result['topic_id'])
+            return result
+
+        # Expired: rotate, unless another invocation got there first (then resume its session)
+        if expired is None:
+            continue
+        try:
+            item = dynamodb.update_item(
+                TableName=table_name,
+                Key=key,
+                UpdateExpression=(
+                    "SET current_session_id = :new_id, started_at = :now, last_active_at = :now, "
+                    "previous_session_id = :previous"
+                ),
+                ConditionExpression="last_active_at = :last_active_at",
+                ExpressionAttributeValues={
+                    ':new_id': {'S': new_id},
+                    ':now': {'N': str(now)},
+                    ':previous': expired['current_session_id'],
+                    ':last_active_at': expired['last_active_at'],
+                },
+                ReturnValues='ALL_NEW'
+            )['Attributes']
+        except dynamodb.exceptions.ConditionalCheckFailedException:
+            continue
+        # The expired session's topic is carried over as context, like the PHP handler does
+        result = _result(item, new_id)
+        _write_session(dynamodb, table_name, new_id, wa_contact_id, now, result['topic_id'])
+        return result
+
+    raise RuntimeError(f"Could not resolve the session of {wa_contact_id} after {MAX_ATTEMPTS} attempts")
@@ -0,0 +1,278 @@
+"""
+Pluggable speech-to-text for WhatsApp voice notes.
+
+Two backends behind the same call, selected per clone or per container:
+
+- 'local': an in-process, CPU-only Whisper-class model (faster-whisper on
+  CTranslate2, int8-quantized). The Ogg/Opus voice note saved by
+  AudioMessageProcessor::saveWaMedia is decoded in memory and transcribed
+  in the Lambda itself: no job to start, no output file to fetch.
+  Segments come out of the decoder lazily, so partial transcripts are
+  available (on_partial) before the whole note is done.
+- 'transcribe': the Amazon Transcribe batch job the state machine uses
+  today (StartTranscriptionJob, poll, read the transcript JSON), kept as
+  the fallback and as the reference for the benchmark.
+
+faster-whisper (which brings PyAV and NumPy) is only imported by the
+local backend; the model is loaded once per container. Neither fits in the
+shared layer: the local backend runs from the speech-to-text-fn container
+image (lambdas-local/speech-to-text-fn/Dockerfile, which sets
+STT_BACKEND=local and bakes the model in), everything else defaults to
+Transcribe.
+"""
+
+import io
+import os
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+import aws_clients
+import transcription_callback
+
+STT_BACKEND = os.environ.get('STT_BACKEND', 'transcribe')
+DEFAULT_LANGUAGE = 'it-IT'
+
+# Whisper-class model for the local backend: 'small' int8 is the best
+# accuracy/latency trade-off for Italian voice notes on 2-3 vCPU
+STT_MODEL = os.environ.get('STT_MODEL', 'small')
+STT_COMPUTE_TYPE = os.environ.get('STT_COMPUTE_TYPE', 'int8')
+STT_CPU_THREADS = int(os.environ.get('STT_CPU_THREADS', str(os.cpu_count() or 2)))
+STT_BEAM_SIZE = int(os.environ.get('STT_BEAM_SIZE', '1'))
+# Model files baked into the image or a layer; unset downloads to the HF cache
+STT_MODEL_DIR = os.environ.get('STT_MODEL_DIR') or None
+
+SAMPLE_RATE = 16000
+
+WA_MEDIA_BUCKET = os.environ.get('WA_MEDIA_BUCKET_NAME', 'sidea-ai-clone-prod-wa-media-s3')
+TRANSCRIBE_POLL_INTERVAL = 1.0
+TRANSCRIBE_TIMEOUT = 300
+
+
+def parse_s3_uri(uri):
+    """s3://bucket/key -> (bucket, key)"""
+    parsed = urlparse(uri)
+    if parsed.scheme != 's3' or not parsed.netloc or not parsed.path.lstrip('/'):
+        raise ValueError(f"Not an S3 URI: {uri}")
+    return parsed.netloc, parsed.path.lstrip('/')
+
+
+def whisper_language(language):
+    """Transcribe language codes (it-IT) -> Whisper codes (it)"""
+    return language.split('-')[0].lower() if language else None
+
+
+def decode_audio(data, sample_rate=SAMPLE_RATE):
+    """Decode an encoded voice note (Ogg/Opus, or anything FFmpeg reads) to mono float32 PCM."""
+    import av
+    import numpy as np
+
+    chunks = []
+    with av.open(io.BytesIO(data)) as container:
+        resampler = av.AudioResampler(format='flt', layout='mono', rate=sample_rate)
+        for frame in container.decode(audio=0):
+            chunks.extend(out.to_ndarray().reshape(-1) for out in resampler.resample(frame))
+        chunks.extend(out.to_ndarray().reshape(-1) for out in resampler.resample(None))
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(chunks)
+
+
+class LocalWhisperBackend:
+    """In-process Whisper-class model on CPU (faster-whisper, int8)."""
+
+    name = 'local'
+
+    def __init__(self, model=STT_MODEL, compute_type=STT_COMPUTE_TYPE, cpu_threads=STT_CPU_THREADS,
+                 beam_size=STT_BEAM_SIZE, model_dir=STT_MODEL_DIR, s3=None):
+        self.model = model
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.beam_size = beam_size
+        self.model_dir = model_dir
+        self.load_ms = None
+        self._model = None
+        self._lock = threading.Lock()
+        self._s3 = s3
+
+    @property
+    def s3(self):
+        if self._s3 is None:
+            self._s3 = aws_clients.s3()
+        return self._s3
+
+    def load(self):
+        """Load the model once per container (call it from the init phase)."""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    try:
+                        from faster_whisper import WhisperModel
+                    except ImportError as e:
+                        raise RuntimeError("The local STT backend needs faster-whisper (pip install faster-whisper)") from e
+                    started = time.perf_counter()
+                    self._model = WhisperModel(
+                        self.model,
+                        device='cpu',
+                        compute_type=self.compute_type,
+                        cpu_threads=self.cpu_threads,
+                        download_root=self.model_dir
+                    )
+                    self.load_ms = round((time.perf_counter() - started) * 1000, 1)
+        return self._model
+
+    def stream(self, samples, language=DEFAULT_LANGUAGE, vad_filter=True):
+        """
+        Yield partial transcripts as the decoder emits segments:
+        {text (so far), segment, start, end} with times in audio seconds.
+        """
+        segments, _ = self.load().transcribe(
+            samples,
+            language=whisper_language(language),
+            beam_size=self.beam_size,
+            vad_filter=vad_filter,
+            condition_on_previous_text=False
+        )
+        parts = []
+        for segment in segments:
+            text = segment.text.strip()
+            if not text:
+                continue
+            parts.append(text)
+            yield {
+                'text': ' '.join(parts),
+                'segment': text,
+                'start': round(segment.start, 2),
+                'end': round(segment.end, 2),
+            }
+
+    def transcribe_audio(self, data, language=DEFAULT_LANGUAGE, on_partial=None, vad_filter=True):
+        """Transcribe an encoded voice note held in memory."""
+        started = time.perf_counter()
+        samples = decode_audio(data)
+        decoded = time.perf_counter()
+
+        transcript = ''
+        partials = 0
+        first_partial_ms = None
+        for partial in self.stream(samples, language, vad_filter=vad_filter):
+            partials += 1
+            transcript = partial['text']
+            if first_partial_ms is None:
+                first_partial_ms = round((time.perf_counter() - started) * 1000, 1)
+            if on_partial is not None:
+                on_partial(partial)
+        finished = time.perf_counter()
+
+        audio_seconds = len(samples) / SAMPLE_RATE
+        total_ms = (finished - started) * 1000
+        return {
+            'transcript': transcript,
+            'backend': self.name,
+            'model': f"{self.model}/{self.compute_type}",
+            'audio_seconds': round(audio_seconds, 2),
+            'partials': partials,
+            'first_partial_ms': first_partial_ms,
+            'decode_ms': round((decoded - started) * 1000, 1),
+            'transcribe_ms': round((finished - decoded) * 1000, 1),
+            'total_ms': round(total_ms, 1),
+            'rtf': round(total_ms / 1000 / audio_seconds, 3) if audio_seconds else None,
+        }
+
+    def transcribe(self, s3_uri, language=DEFAULT_LANGUAGE, on_partial=None):
+        started = time.perf_counter()
+        bucket, key = parse_s3_uri(s3_uri)
+        data = self.s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+        fetch_ms = round((time.perf_counter() - started) * 1000, 1)
+        result = self.transcribe_audio(data, language, on_partial)
+        result['fetch_ms'] = fetch_ms
+        return result
+
+
+class TranscribeBackend:
+    """Amazon Transcribe batch job, polled until the transcript is written to the media bucket."""
+
+    name = 'transcribe'
+
+    def __init__(self, output_bucket=WA_MEDIA_BUCKET, poll_interval=TRANSCRIBE_POLL_INTERVAL,
+                 timeout=TRANSCRIBE_TIMEOUT, transcribe=None, s3=None):
+        self.output_bucket = output_bucket
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self._transcribe = transcribe
+        self._s3 = s3
+
+    @property
+    def transcribe_client(self):
+        if self._transcribe is None:
+            self._transcribe = aws_clients.transcribe()
+        return self._transcribe
+
+    @property
+    def s3(self):
+        if self._s3 is None:
+            self._s3 = aws_clients.s3()
+        return self._s3
+
+    def transcribe(self, s3_uri, language=DEFAULT_LANGUAGE, on_partial=None):
+        started = time.perf_counter()
+        job_name = f"ai-clone-demo_{uuid.uuid4()}"
+        self.transcribe_client.start_transcription_job(
+            TranscriptionJobName=job_name,
+            LanguageCode=language,
+            Media={'MediaFileUri': s3_uri},
+            OutputBucketName=self.output_bucket,
+            OutputKey=transcription_callback.TRANSCRIPTS_PREFIX
+        )
+
+        polls = 0
+        while True:
+            job = self.transcribe_client.get_transcription_job(TranscriptionJobName=job_name)['TranscriptionJob']
+            polls += 1
+            status = job['TranscriptionJobStatus']
+            if status == 'COMPLETED':
+                break
+            if status == 'FAILED':
+                raise RuntimeError(f"Transcription job {job_name} failed: {job.get('FailureReason')}")
+            if time.perf_counter() - started > self.timeout:
+                raise TimeoutError(f"Transcription job {job_name} not finished after {self.timeout}s")
+            time.sleep(self.poll_interval)
+
+        key = f"{transcription_callback.TRANSCRIPTS_PREFIX}{job_name}.json"
+        transcript = transcription_callback.read_transcript(self.s3, self.output_bucket, key)
+        if on_partial is not None and transcript:
+            on_partial({'text': transcript, 'segment': transcript, 'start': None, 'end': None})
+        return {
+            'transcript': transcript,
+            'backend': self.name,
+            'job_name': job_name,
+            'polls': polls,
+            'partials': 1 if transcript else 0,
+            'total_ms': round((time.perf_counter() - started) * 1000, 1),
+        }
+
+
+BACKENDS = {
+    LocalWhisperBackend.name: LocalWhisperBackend,
+    TranscribeBackend.name: TranscribeBackend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name=None):
+    """Shared backend instance for `name` (default STT_BACKEND), created on first use."""
+    name = name or STT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown STT backend '{name}' (available: {', '.join(sorted(BACKENDS))})")
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = BACKENDS[name]()
+        return _backends[name]
+
+
+def transcribe(s3_uri, language=DEFAULT_LANGUAGE, backend=None, on_partial=None):
+    """Transcribe the voice note at `s3_uri` with the selected backend."""
+    return get_backend(backend).transcribe(s3_uri, language, on_partial)
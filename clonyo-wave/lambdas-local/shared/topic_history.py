@@ -0,0 +1,164 @@
+"""
+Topic-indexed conversation memory: compact per-session summaries by topic.
+
+'Get Session History' used to be a Pass returning an empty history, so
+Check Sufficiency never had any memory to judge and every message went to
+the Knowledge Base. Here a sidecar table keeps, for every contact, one
+small item per (topic, session):
+
+    pk  messages_key               'S#<phone number arn>#C#<wa_contact_id>'
+    sk  'T#<topic_id>#S#<session_id>'
+        summary (at most SUMMARY_MAX_CHARS), keywords, turns, updated_at,
+        recent 'T#<topic_id>#<updated_at>' (sort key of the RECENT_INDEX LSI)
+
+- record() runs after each reply and folds the exchange into the item of
+  the current topic and session (extractive, no model call; optimistic
+  write on a version like the history window);
+- retrieve() reads the most recent items of the message's topic with a
+  single Query on the LSI (newest first, Limit QUERY_LIMIT, projected
+  attributes only), ranks them by keyword overlap and recency and returns
+  the top K within
+  MAX_HISTORY_CHARS, so the state payload stays small whatever the length
+  of the conversation.
+"""
+
+import math
+import os
+import re
+import time
+
+from botocore.exceptions import ClientError
+
+import history_window
+
+TOPIC_HISTORY_TABLE = os.environ.get('TOPIC_HISTORY_TABLE', 'sidea-ai-clone-prod-topic-history-table')
+RECENT_INDEX = 'recent_index'
+
+TOP_K = int(os.environ.get('TOPIC_HISTORY_TOP_K', '3'))
+# Items read per query: the most recent sessions of the topic
+QUERY_LIMIT = int(os.environ.get('TOPIC_HISTORY_QUERY_LIMIT', '20'))
+SUMMARY_MAX_CHARS = int(os.environ.get('TOPIC_HISTORY_SUMMARY_MAX_CHARS', '600'))
+MAX_HISTORY_CHARS = int(os.environ.get('TOPIC_HISTORY_MAX_CHARS', '1800'))
+# Recency weight halves every RECENCY_HALF_LIFE seconds
+RECENCY_HALF_LIFE = 7 * 24 * 3600
+
+PROJECTED = ('topic_id', 'session_id', 'summary', 'keywords', 'turns', 'updated_at')
+WORD = re.compile(r'\w{3,}', re.UNICODE)
+
+
+def sort_key(topic_id, session_id):
+    return f"T#{topic_id}#S#{session_id}"
+
+
+def recent_key(topic_id, updated_at):
+    return f"T#{topic_id}#{updated_at:010d}"
+
+
+def topic_prefix(topic_id=None):
+    return f"T#{topic_id}#" if topic_id else 'T#'
+
+
+def _words(values):
+    return {word.lower() for value in values if value for word in WORD.findall(value)}
+
+
+def _item(item):
+    return {
+        'topic_id': item['topic_id']['S'],
+        'session_id': item['session_id']['S'],
+        'summary': item.get('summary', {}).get('S', ''),
+        'keywords': item.get('keywords', {}).get('SS', []),
+        'turns': int(item.get('turns', {}).get('N', '0')),
+        'updated_at': int(item.get('updated_at', {}).get('N', '0')),
+    }
+
+
+def score(entry, query_words, now, half_life=RECENCY_HALF_LIFE):
+    """Keyword overlap with the message (Jaccard over keywords + summary words) plus a recency decay."""
+    entry_words = _words(entry['keywords']) | _words([entry['summary']])
+    overlap = len(query_words & entry_words) / len(query_words | entry_words) if query_words and entry_words else 0.0
+    recency = math.exp(-math.log(2) * max(0, now - entry['updated_at']) / half_life)
+    return overlap + recency
+
+
+def retrieve(dynamodb, messages_key, topic_id, text='', keywords=None, k=TOP_K, max_chars=MAX_HISTORY_CHARS,
+             table_name=None, now=None):
+    """
+    Top-`k` summaries of `topic_id` (all topics if unknown) for the
+    conversation, most relevant first, within `max_chars` of summary text.
+    Returns (history, report).
+    """
+    now = int(time.time()) if now is None else now
+    response = dynamodb.query(
+        TableName=table_name or TOPIC_HISTORY_TABLE,
+        IndexName=RECENT_INDEX,
+        KeyConditionExpression='pk = :pk AND begins_with(recent, :prefix)',
+        ExpressionAttributeValues={':pk': {'S': messages_key}, ':prefix': {'S': topic_prefix(topic_id)}},
+        ProjectionExpression=', '.join(f"#{name}" for name in PROJECTED),
+        ExpressionAttributeNames={f"#{name}": name for name in PROJECTED},
+        ScanIndexForward=False,
+        Limit=QUERY_LIMIT,
+        ReturnConsumedCapacity='TOTAL'
+    )
+    entries = [_item(item) for item in response.get('Items', [])]
+    query_words = _words(list(keywords or []) + [text])
+    entries.sort(key=lambda entry: score(entry, query_words, now), reverse=True)
+
+    history, chars = [], 0
+    for entry in entries[:k]:
+        if chars + len(entry['summary']) > max_chars:
+            break
+        chars += len(entry['summary'])
+        history.append({key: entry[key] for key in ('topic_id', 'session_id', 'summary', 'updated_at')})
+
+    return history, {
+        'items_read': len(entries),
+        'returned': len(history),
+        'chars': chars,
+        'read_capacity': response.get('ConsumedCapacity', {}).get('CapacityUnits'),
+    }
+
+
+def record(dynamodb, messages_key, topic_id, session_id, user_message, assistant_message, keywords=None,
+           table_name=None, now=None, attempts=3):
+    """Fold one exchange into the (topic, session) summary. Returns the report."""
+    table_name = table_name or TOPIC_HISTORY_TABLE
+    key = {'pk': {'S': messages_key}, 'sk': {'S': sort_key(topic_id, session_id)}}
+    turns = [{'role': role, 'content': history_window.clip(content)}
+             for role, content in (('user', user_message), ('assistant', assistant_message)) if content]
+
+    for attempt in range(attempts):
+        now_ts = int(time.time()) if now is None else now
+        item = dynamodb.get_item(TableName=table_name, Key=key, ConsistentRead=True).get('Item') or {}
+        version = int(item.get('version', {}).get('N', '0'))
+        summary = history_window.extractive_summary(item.get('summary', {}).get('S', ''), turns, SUMMARY_MAX_CHARS)
+        merged_keywords = sorted(set(item.get('keywords', {}).get('SS', [])) | {kw for kw in keywords or [] if kw})
+
+        new_item = dict(key, **{
+            'topic_id': {'S': topic_id},
+            'session_id': {'S': session_id},
+            'summary': {'S': summary},
+            'turns': {'N': str(int(item.get('turns', {}).get('N', '0')) + len(turns))},
+            'started_at': item.get('started_at', {'N': str(now_ts)}),
+            'updated_at': {'N': str(now_ts)},
+            'recent': {'S': recent_key(topic_id, now_ts)},
+            'version': {'N': str(version + 1)},
+        })
+        if merged_keywords:
+            new_item['keywords'] = {'SS': merged_keywords}
+        try:
+            dynamodb.put_item(
+                TableName=table_name,
+                Item=new_item,
+                ConditionExpression='attribute_not_exists(pk) OR version = :v',
+                ExpressionAttributeValues={':v': {'N': str(version)}}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            print(f"Topic history changed concurrently, retrying ({attempt + 1}/{attempts})")
+            continue
+        return {'topic_id': topic_id, 'turns': int(new_item['turns']['N']), 'summary_chars': len(summary),
+                'attempts': attempt + 1}
+
+    raise RuntimeError(f"Topic history for {messages_key} kept changing, gave up after {attempts} attempts")
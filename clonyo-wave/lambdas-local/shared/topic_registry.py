@@ -0,0 +1,271 @@
+"""
+Per-contact topic registry: topic identity by embedding, not by name.
+
+AnalyzeTopicHandler derives topic_id = md5(lowercased topic name), so
+"ETF" and "Investimenti ETF" are two topics and the history (and anything
+cached per topic) of the contact is split between them. Here every
+contact has a registry of its topics, each with the centroid of the
+embeddings of the messages assigned to it:
+
+    pk  messages_key            'S#<phone number arn>#C#<wa_contact_id>'
+    sk  'TOPIC#<topic_id>'      name, keywords, embedding (float32 bytes),
+                                count, updated_at
+    sk  'META'                  version, bumped whenever a topic is minted
+
+Assignment is a single matrix-vector product over the centroids (NumPy):
+
+- the message is close to the current topic, and the current topic is
+  the best match: an obvious continuation, no model call at all;
+- otherwise the model names the topic and the message goes to the best
+  matching topic if above ASSIGN_THRESHOLD, to the topic with the same
+  name if there is one, or mints a new topic, whose centroid starts from
+  the message and the embedding of its name and keywords (one more
+  embedding call, only when minting).
+
+Minted ids are still md5(name), so topics created before the registry
+keep their id. Registries are cached per container and reloaded only when
+the META version moved (one small GetItem per message).
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import aws_clients
+import embeddings
+
+TOPIC_REGISTRY_TABLE = os.environ.get('TOPIC_REGISTRY_TABLE', 'sidea-ai-clone-prod-topic-registry-table')
+EMBEDDING_MODEL_ID = os.environ.get('TOPIC_EMBEDDING_MODEL', embeddings.TITAN_MODEL_ID)
+EMBEDDING_DIMENSIONS = int(os.environ.get('TOPIC_EMBEDDING_DIMENSIONS', '256'))
+# titan (Bedrock) or hashed (local feature hashing, no model call: LocalStack and benches)
+EMBEDDING_BACKEND = os.environ.get('TOPIC_EMBEDDING_BACKEND', 'titan')
+
+# Cosine similarity to join an existing topic / to skip the model as an obvious continuation
+ASSIGN_THRESHOLD = float(os.environ.get('TOPIC_ASSIGN_THRESHOLD', '0.55'))
+CONTINUATION_THRESHOLD = float(os.environ.get('TOPIC_CONTINUATION_THRESHOLD', '0.70'))
+
+CACHE_MAX_CONTACTS = int(os.environ.get('TOPIC_REGISTRY_CACHE_CONTACTS', '256'))
+
+META_KEY = 'META'
+TOPIC_PREFIX = 'TOPIC#'
+
+
+def topic_id_for(topic_name):
+    # Same mapping as topic-analyzer-fn: md5 of the lowercased topic name
+    return hashlib.md5(topic_name.lower().encode('utf-8')).hexdigest()
+
+
+def embed(text):
+    return embeddings.embed(text, EMBEDDING_BACKEND, EMBEDDING_DIMENSIONS, EMBEDDING_MODEL_ID)
+
+
+class Match:
+
+    def __init__(self, topic_id=None, name=None, keywords=None, similarity=0.0, continuation=False):
+        self.topic_id = topic_id
+        self.name = name
+        self.keywords = keywords or []
+        self.similarity = similarity
+        self.continuation = continuation
+
+
+class TopicRegistry:
+    """The topics of one contact, as an (n_topics, dimensions) matrix of unit centroids."""
+
+    def __init__(self, dynamodb, messages_key, table_name=None, dimensions=EMBEDDING_DIMENSIONS, embed_fn=None):
+        self.dynamodb = dynamodb
+        self.embed_fn = embed_fn or embed
+        self.messages_key = messages_key
+        self.table_name = table_name or TOPIC_REGISTRY_TABLE
+        self.dimensions = dimensions
+        self.version = None
+        self.ids = []
+        self.names = []
+        self.keywords = []
+        self.counts = []
+        self.matrix = np.zeros((0, dimensions), dtype=np.float32)
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _key(self, sk):
+        return {'pk': {'S': self.messages_key}, 'sk': {'S': sk}}
+
+    def remote_version(self):
+        item = self.dynamodb.get_item(
+            TableName=self.table_name, Key=self._key(META_KEY), ProjectionExpression='version'
+        ).get('Item')
+        return int(item['version']['N']) if item else 0
+
+    def load(self, version=None):
+        """Read every topic of the contact (paginated Query on the partition)."""
+        ids, names, keywords, counts, rows = [], [], [], [], []
+        kwargs = {}
+        while True:
+            response = self.dynamodb.query(
+                TableName=self.table_name,
+                KeyConditionExpression='pk = :pk AND begins_with(sk, :prefix)',
+                ExpressionAttributeValues={':pk': {'S': self.messages_key}, ':prefix': {'S': TOPIC_PREFIX}},
+                **kwargs
+            )
+            for item in response.get('Items', []):
+                ids.append(item['sk']['S'][len(TOPIC_PREFIX):])
+                names.append(item.get('name', {}).get('S', ''))
+                keywords.append(item.get('keywords', {}).get('SS', []))
+                counts.append(int(item.get('count', {}).get('N', '1')))
+                rows.append(np.frombuffer(item['embedding']['B'], dtype=np.float32))
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        with self._lock:
+            self.ids, self.names, self.keywords, self.counts = ids, names, keywords, counts
+            self.matrix = np.vstack(rows) if rows else np.zeros((0, self.dimensions), dtype=np.float32)
+            self._index = {topic_id: row for row, topic_id in enumerate(ids)}
+            self.version = self.remote_version() if version is None else version
+        return self
+
+    def match(self, embedding, current_topic_id=None):
+        """Best topic for the message embedding; `continuation` when it obviously stays on the current one."""
+        with self._lock:
+            if not self.ids:
+                return Match()
+            similarities = self.matrix @ embedding
+            best = int(np.argmax(similarities))
+            current = self._index.get(current_topic_id)
+            continuation = (
+                current is not None and current == best
+                and similarities[best] >= CONTINUATION_THRESHOLD
+            )
+            return Match(self.ids[best], self.names[best], self.keywords[best], float(similarities[best]),
+                         continuation)
+
+    def assign(self, embedding, match, topic_name, keywords=None, now=None):
+        """
+        Topic of a message the model named `topic_name`: the matched topic
+        if close enough, else the topic with that name, else a new one.
+        Returns (topic_id, how) with how in 'matched', 'named', 'minted'.
+        """
+        if match.topic_id is not None and match.similarity >= ASSIGN_THRESHOLD:
+            self.observe(match.topic_id, embedding, now)
+            return match.topic_id, 'matched'
+        topic_id = topic_id_for(topic_name)
+        if topic_id not in self._index:
+            label = self.embed_fn(' '.join([topic_name] + list(keywords or [])))
+            if self.mint(topic_id, topic_name, embeddings.unit(embedding + label), keywords, now):
+                return topic_id, 'minted'
+        # Same name as a known topic (or minted meanwhile by another execution)
+        self.observe(topic_id, embedding, now)
+        return topic_id, 'named'
+
+    def mint(self, topic_id, topic_name, embedding, keywords=None, now=None):
+        now = int(time.time()) if now is None else now
+        item = dict(self._key(TOPIC_PREFIX + topic_id), **{
+            'name': {'S': topic_name},
+            'embedding': {'B': np.asarray(embedding, dtype=np.float32).tobytes()},
+            'count': {'N': '1'},
+            'updated_at': {'N': str(now)},
+        })
+        if keywords:
+            item['keywords'] = {'SS': sorted(set(keywords))}
+        try:
+            self.dynamodb.transact_write_items(TransactItems=[
+                {'Put': {'TableName': self.table_name, 'Item': item,
+                         'ConditionExpression': 'attribute_not_exists(sk)'}},
+                {'Update': {'TableName': self.table_name, 'Key': self._key(META_KEY),
+                            'UpdateExpression': 'ADD version :one',
+                            'ExpressionAttributeValues': {':one': {'N': '1'}}}},
+            ])
+        except self.dynamodb.exceptions.TransactionCanceledException:
+            self.load()
+            return False
+
+        with self._lock:
+            self._index[topic_id] = len(self.ids)
+            self.ids.append(topic_id)
+            self.names.append(topic_name)
+            self.keywords.append(sorted(set(keywords or [])))
+            self.counts.append(1)
+            self.matrix = np.vstack([self.matrix, np.asarray(embedding, dtype=np.float32)[None, :]])
+            if self.version is not None:
+                self.version += 1
+        return True
+
+    def observe(self, topic_id, embedding, now=None):
+        """
+        Move the centroid of `topic_id` towards the message (running mean, kept
+        unit length). If another execution moved it first, its row is taken
+        from the failed write and the update retried once on top of it.
+        """
+        now = int(time.time()) if now is None else now
+        with self._lock:
+            row = self._index.get(topic_id)
+            if row is None:
+                return
+            base, count = self.matrix[row], self.counts[row]
+        for attempt in range(2):
+            centroid = embeddings.unit(base * count + embedding)
+            with self._lock:
+                self.matrix[row] = centroid
+                self.counts[row] = count + 1
+            try:
+                self.dynamodb.update_item(
+                    TableName=self.table_name,
+                    Key=self._key(TOPIC_PREFIX + topic_id),
+                    UpdateExpression='SET embedding = :embedding, #count = :count, updated_at = :now',
+                    ConditionExpression='#count = :previous',
+                    ExpressionAttributeNames={'#count': 'count'},
+                    ExpressionAttributeValues={
+                        ':embedding': {'B': centroid.tobytes()},
+                        ':count': {'N': str(count + 1)},
+                        ':previous': {'N': str(count)},
+                        ':now': {'N': str(now)},
+                    },
+                    ReturnValuesOnConditionCheckFailure='ALL_OLD'
+                )
+                return
+            except self.dynamodb.exceptions.ConditionalCheckFailedException as e:
+                current = e.response.get('Item')
+                if not current:
+                    print(f"Topic {topic_id} was removed concurrently, not updated")
+                    return
+                # Another execution moved it first: continue from its centroid and count
+                base = np.frombuffer(current['embedding']['B'], dtype=np.float32)
+                count = int(current['count']['N'])
+                with self._lock:
+                    self.matrix[row] = base
+                    self.counts[row] = count
+        print(f"Topic {topic_id} centroid changed concurrently twice, not updated")
+
+
+_registries = OrderedDict()  # messages_key -> TopicRegistry
+_registries_lock = threading.Lock()
+
+
+def get_registry(messages_key, dynamodb=None, table_name=None):
+    """Container-wide registry of the contact, reloaded when its META version moved."""
+    dynamodb = dynamodb or aws_clients.dynamodb()
+    with _registries_lock:
+        registry = _registries.get(messages_key)
+        if registry is not None:
+            _registries.move_to_end(messages_key)
+    if registry is None:
+        registry = TopicRegistry(dynamodb, messages_key, table_name)
+        version = registry.remote_version()
+        registry.load(version)
+        with _registries_lock:
+            _registries[messages_key] = registry
+            while len(_registries) > CACHE_MAX_CONTACTS:
+                _registries.popitem(last=False)
+        return registry
+
+    version = registry.remote_version()
+    if version != registry.version:
+        registry.load(version)
+    return registry
@@ -0,0 +1,266 @@
+"""
+Streaming extraction of the transcript from an Amazon Transcribe output file.
+
+The Transcribe JSON carries the transcript once and then every word again
+as an item, with timestamps and alternatives: tens of KB per minute of
+audio, of which the state machine only needs results.transcripts[0].
+Here the file is read in chunks and tokenized incrementally, so memory
+stays at one chunk plus the token being read, however long the recording:
+
+- without confidence stats the read stops as soon as the transcript is
+  found (Transcribe writes it before the items);
+- with confidence stats the items are folded into running totals on the
+  way through, never materialized.
+"""
+
+import codecs
+import heapq
+import json
+import re
+from urllib.parse import urlparse
+
+import requests
+
+CHUNK_SIZE = 64 * 1024
+
+TRANSCRIPT_PATH = ('results', 'transcripts', 0, 'transcript')
+LOW_CONFIDENCE = 0.5
+LOWEST_WORDS = 5
+
+# One JSON token, after optional whitespace: string (unrolled, no
+# backtracking blow-up on long strings), punctuation, number, literal
+TOKEN = re.compile(
+    r'\s*(?:"([^"\\]*(?:\\.[^"\\]*)*)"|([{}\[\],:])|(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)|(true|false|null))',
+    re.DOTALL
+)
+STRING, PUNCT, NUMBER, LITERAL = 1, 2, 3, 4
+# iter_values kind of a container decoded whole
+VALUE = 5
+
+DECODER = json.JSONDecoder()
+
+# https://s3.<region>.amazonaws.com/<bucket>/<key>, as in TranscriptFileUri
+S3_HTTPS_HOST = re.compile(r'^s3(?:[.-][a-z0-9-]+)?\.amazonaws\.com$')
+
+
+def decode_string(raw):
+    """Raw JSON string body -> str (escapes are rare: skip json.loads when there are none)"""
+    return raw if '\\' not in raw else json.loads(f'"{raw}"')
+
+
+class JsonReader:
+    """
+    Incremental tokenizer over a JSON document read from `chunks` (bytes).
+    Keeps the unread tail of the last chunk only; `rest_of_value` hands a
+    whole (small) container to the C decoder instead of tokenizing it.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.start = 0
+        self.eof = False
+        self.bytes_read = 0
+
+    def _fill(self):
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self.buffer = self.buffer[self.pos:] + self._decoder.decode(b'', final=True)
+            self.eof = True
+        else:
+            self.bytes_read += len(chunk)
+            self.buffer = self.buffer[self.pos:] + self._decoder.decode(chunk)
+        self.pos = 0
+
+    def token(self):
+        """Next (kind, raw) token, None at the end of the document."""
+        while True:
+            match = TOKEN.match(self.buffer, self.pos)
+            # A number or literal touching the end of the buffer may continue in the next chunk
+            if match is not None and (self.eof or match.end() < len(self.buffer)
+                                      or match.lastindex not in (NUMBER, LITERAL)):
+                self.start = match.start(match.lastindex) - (match.lastindex == STRING)
+                self.pos = match.end()
+                return match.lastindex, match.group(match.lastindex)
+            if self.eof:
+                if self.buffer[self.pos:].strip():
+                    raise ValueError(f"Malformed JSON near: {self.buffer[self.pos:self.pos + 40]!r}")
+                return None
+            self._fill()
+
+    def rest_of_value(self):
+        """Decode the container whose opening token was just read."""
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self.buffer, self.start)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise ValueError(f"Malformed JSON near: {self.buffer[self.start:self.start + 40]!r}")
+                self.pos = self.start
+                self._fill()
+                self.start = 0
+                continue
+            self.pos = end
+            return value
+
+    def close(self):
+        if hasattr(self._chunks, 'close'):
+            self._chunks.close()
+
+
+def iter_values(reader, materialize=None):
+    """
+    (path, kind, value) for every scalar of the document, path being the
+    tuple of keys and array indexes leading to it. Strings are left raw
+    (see decode_string). Containers for which materialize(path) is true
+    are decoded whole and yielded as (path, VALUE, object).
+    """
+    # One [is_array, key or index] frame per open container
+    stack = []
+    while True:
+        token = reader.token()
+        if token is None:
+            return
+        kind, raw = token
+        if kind == PUNCT:
+            if raw in '{[':
+                if materialize is not None and materialize(tuple([frame[1] for frame in stack])):
+                    yield tuple([frame[1] for frame in stack]), VALUE, reader.rest_of_value()
+                else:
+                    stack.append([raw == '[', 0 if raw == '[' else None])
+            elif raw in '}]':
+                stack.pop()
+            elif raw == ',':
+                frame = stack[-1]
+                if frame[0]:
+                    frame[1] += 1
+                else:
+                    frame[1] = None
+            continue
+        if stack and not stack[-1][0] and stack[-1][1] is None:
+            stack[-1][1] = decode_string(raw)
+            continue
+        yield tuple([frame[1] for frame in stack]), kind, raw
+
+
+class ConfidenceStats:
+    """Running word-confidence totals over results.items (punctuation items left out)."""
+
+    def __init__(self, low_confidence=LOW_CONFIDENCE, lowest=LOWEST_WORDS):
+        self.low_confidence = low_confidence
+        self.lowest = lowest
+        self.words = 0
+        self.total = 0.0
+        self.minimum = None
+        self.low = 0
+        self._lowest = []  # heap of the `lowest` least confident words, by negated confidence
+
+    def add(self, item):
+        alternatives = item.get('alternatives') or [{}]
+        if item.get('type') != 'pronunciation' or 'confidence' not in alternatives[0]:
+            return
+        confidence = float(alternatives[0]['confidence'])
+        self.words += 1
+        self.total += confidence
+        self.minimum = confidence if self.minimum is None else min(self.minimum, confidence)
+        if confidence < self.low_confidence:
+            self.low += 1
+        entry = (-confidence, self.words, alternatives[0].get('content', ''))
+        if len(self._lowest) < self.lowest:
+            heapq.heappush(self._lowest, entry)
+        elif entry > self._lowest[0]:
+            heapq.heapreplace(self._lowest, entry)
+
+    def to_dict(self):
+        return {
+            'words': self.words,
+            'mean': round(self.total / self.words, 4) if self.words else None,
+            'min': self.minimum,
+            'low_confidence_words': self.low,
+            'low_confidence_share': round(self.low / self.words, 4) if self.words else None,
+            'lowest': [
+                {'word': word, 'confidence': -negated}
+                for negated, _, word in sorted(self._lowest, reverse=True)
+            ],
+        }
+
+
+def _is_item(path):
+    return len(path) == 3 and path[0] == 'results' and path[1] == 'items'
+
+
+def extract(chunks, confidence=False, low_confidence=LOW_CONFIDENCE):
+    """
+    Transcript text (results.transcripts[0].transcript) of the Transcribe
+    output read from `chunks`, plus word-confidence stats if asked. The
+    read stops once everything asked for is known, and the chunk iterator
+    is closed.
+    """
+    reader = JsonReader(chunks)
+    stats = ConfidenceStats(low_confidence) if confidence else None
+    transcript = None
+    items_seen = False
+    complete = True
+    try:
+        for path, kind, value in iter_values(reader, _is_item if stats is not None else None):
+            if kind == VALUE:
+                stats.add(value)
+                items_seen = True
+                continue
+            if path == TRANSCRIPT_PATH:
+                transcript = decode_string(value)
+            # Items are contiguous: past them (or without stats) nothing else is needed
+            if transcript is not None and (stats is None or (items_seen and path[:2] != ('results', 'items'))):
+                complete = False
+                break
+    finally:
+        reader.close()
+
+    return {
+        'transcript': transcript if transcript is not None else '',
+        'found': transcript is not None,
+        'confidence': stats.to_dict() if stats is not None else None,
+        'bytes_read': reader.bytes_read,
+        'read_to_end': complete,
+    }
+
+
+def s3_chunks(s3, bucket, key, chunk_size=CHUNK_SIZE):
+    body = s3.get_object(Bucket=bucket, Key=key)['Body']
+    try:
+        yield from body.iter_chunks(chunk_size)
+    finally:
+        body.close()
+
+
+def http_chunks(url, chunk_size=CHUNK_SIZE, timeout=30, session=None):
+    with (session or requests).get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        yield from response.iter_content(chunk_size)
+
+
+def s3_location(uri):
+    """(bucket, key) for s3:// URIs and unsigned path-style S3 URLs, else None (read over HTTP)."""
+    parsed = urlparse(uri)
+    if parsed.scheme == 's3':
+        return parsed.netloc, parsed.path.lstrip('/')
+    if parsed.scheme == 'https' and S3_HTTPS_HOST.match(parsed.hostname or '') and not parsed.query:
+        bucket, _, key = parsed.path.lstrip('/').partition('/')
+        if bucket and key:
+            return bucket, key
+    return None
+
+
+def open_chunks(uri, s3=None, chunk_size=CHUNK_SIZE, timeout=30):
+    """
+    Chunks of the file at `uri`: objects in our buckets are read with the
+    S3 client (Transcribe output with OutputBucketName), pre-signed
+    TranscriptFileUri links of the service bucket over HTTPS.
+    """
+    location = s3_location(uri)
+    if location is not None and s3 is not None:
+        return s3_chunks(s3, *location, chunk_size=chunk_size)
+    return http_chunks(uri, chunk_size=chunk_size, timeout=timeout)
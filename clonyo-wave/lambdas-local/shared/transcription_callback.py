@@ -0,0 +1,132 @@
+"""
+Event-driven completion of Amazon Transcribe jobs for the state machine.
+
+Instead of looping Wait (5 s) -> GetTranscriptionJob -> Job finished?, the
+state machine waits on a task token (`lambda:invoke.waitForTaskToken`) and
+the execution resumes as soon as the transcript JSON lands in S3:
+
+    StartTranscriptionJob (OutputBucketName + OutputKey 'transcripts/')
+        -> Wait for transcript   register(job_name, task_token)
+    S3 ObjectCreated transcripts/<job>.json  -> on_transcript()
+    Transcribe job FAILED (EventBridge)      -> on_job_failed()
+
+The two sides can arrive in any order (a short voice note may be
+transcribed before the token is registered), so they meet on one DynamoDB
+item per job: each side writes its half with an UpdateItem returning the
+whole item, and whoever completes the pair sends the task result. A
+duplicate send is rejected by Step Functions and ignored here.
+
+The task output is the transcript text itself, in the shape of the
+'Get transcript file content' output ({"transcript": ...}), so the
+execution goes straight to TransformForResponse.
+"""
+
+import json
+import os
+import time
+
+import transcript_json
+
+TRANSCRIPTION_CALLBACK_TABLE = os.environ.get(
+    'TRANSCRIPTION_CALLBACK_TABLE', 'sidea-ai-clone-prod-transcription-callbacks-table'
+)
+TRANSCRIPTS_PREFIX = 'transcripts/'
+# Items are only needed while an execution waits
+ITEM_TTL = 24 * 3600
+
+FAILED_ERROR = 'Transcription.Failed'
+
+
+def job_name_from_key(key, prefix=TRANSCRIPTS_PREFIX):
+    """Transcribe writes <OutputKey><job name>.json (plus a write-access check file)."""
+    if not key.startswith(prefix) or not key.endswith('.json'):
+        return None
+    return key[len(prefix):-len('.json')] or None
+
+
+def read_transcript(s3, bucket, key):
+    """results.transcripts[0].transcript, read up to the transcript only"""
+    return transcript_json.extract(transcript_json.s3_chunks(s3, bucket, key))['transcript']
+
+
+def _rendezvous(dynamodb, job_name, expression, values, table_name=None):
+    now = int(time.time())
+    values = dict(values, **{':expires_at': {'N': str(now + ITEM_TTL)}})
+    response = dynamodb.update_item(
+        TableName=table_name or TRANSCRIPTION_CALLBACK_TABLE,
+        Key={'job_name': {'S': job_name}},
+        UpdateExpression=f"{expression}, expires_at = :expires_at",
+        ExpressionAttributeValues=values,
+        ReturnValues='ALL_NEW'
+    )
+    return response['Attributes']
+
+
+def _complete(item, s3, sfn):
+    """Send the task result if both the token and the outcome are known."""
+    if 'task_token' not in item:
+        return None
+    token = item['task_token']['S']
+    job_name = item['job_name']['S']
+    waited_ms = None
+    if 'registered_at_ms' in item and 'landed_at_ms' in item:
+        waited_ms = max(0, int(item['landed_at_ms']['N']) - int(item['registered_at_ms']['N']))
+
+    try:
+        if 'failure_reason' in item:
+            sfn.send_task_failure(taskToken=token, error=FAILED_ERROR, cause=item['failure_reason']['S'])
+            outcome = 'failed'
+        elif 'transcript_key' in item:
+            bucket, key = item['transcript_bucket']['S'], item['transcript_key']['S']
+            output = {
+                'transcript': read_transcript(s3, bucket, key),
+                'job_name': job_name,
+                'transcript_uri': f"s3://{bucket}/{key}",
+            }
+            sfn.send_task_success(taskToken=token, output=json.dumps(output))
+            outcome = 'completed'
+        else:
+            return None
+    except (sfn.exceptions.TaskTimedOut, sfn.exceptions.TaskDoesNotExist, sfn.exceptions.InvalidToken) as e:
+        # Already resumed by the other side, or the execution gave up waiting
+        print(f"Transcription callback for {job_name} not delivered: {str(e)}")
+        return 'stale'
+
+    print(f"Transcription callback: {json.dumps({'job_name': job_name, 'outcome': outcome, 'waited_ms': waited_ms})}")
+    return outcome
+
+
+def register(dynamodb, s3, sfn, job_name, task_token, table_name=None):
+    """Token side, called by the waiting state. Returns the outcome if the transcript was already there."""
+    item = _rendezvous(
+        dynamodb, job_name,
+        'SET task_token = :token, registered_at_ms = if_not_exists(registered_at_ms, :now)',
+        {':token': {'S': task_token}, ':now': {'N': str(int(time.time() * 1000))}},
+        table_name
+    )
+    return _complete(item, s3, sfn)
+
+
+def on_transcript(dynamodb, s3, sfn, bucket, key, table_name=None):
+    """Transcript side, called for every S3 ObjectCreated record."""
+    job_name = job_name_from_key(key)
+    if job_name is None:
+        return None
+    item = _rendezvous(
+        dynamodb, job_name,
+        'SET transcript_bucket = :bucket, transcript_key = :key, landed_at_ms = :now',
+        {':bucket': {'S': bucket}, ':key': {'S': key}, ':now': {'N': str(int(time.time() * 1000))}},
+        table_name
+    )
+    return _complete(item, s3, sfn)
+
+
+def on_job_failed(dynamodb, s3, sfn, job_name, reason, table_name=None):
+    """Failure side, called for the Transcribe 'Job State Change' FAILED event."""
+    item = _rendezvous(
+        dynamodb, job_name,
+        'SET failure_reason = :reason, landed_at_ms = :now',
+        {':reason': {'S': reason or 'FAILED'}, ':now': {'N': str(int(time.time() * 1000))}},
+        table_name
+    )
+    return _complete(item, s3, sfn)
@@ -0,0 +1,399 @@
+"""
+Content-addressed cache of synthesized audio replies.
+
+Greetings, "dove trovo il podcast", disclaimers: many replies are repeated
+word for word, and each one used to be synthesized by ElevenLabs and
+uploaded again under AUDIO_OUT. Here the audio is stored once under
+
+    <TTS_CACHE_PREFIX>/<sha256>.<ext>
+
+where the hash covers the normalized text, voice_id, output_format and the
+voice settings (TextToSpeechData::getVoiceSettingsForElevenLabs), so a hit
+returns the existing bucket_name/key for one GetItem (plus the hit
+counters) instead of a synthesis and an upload.
+
+- L1: in-process LRU of known keys (per warm container), with a TTL shorter
+  than the eviction grace period so it never points at a deleted object.
+  An L1 hit writes nothing: the index learns about it when the entry
+  expires and is read again, well within the grace period;
+- index: DynamoDB table shared by every container, one item per cached
+  object (size, hits, last hit) plus a STATS item with the global totals.
+  Size and entry count are updated with every store (the new total comes
+  back from the same UpdateItem); hit/miss counters are batched per
+  container and flushed every STATS_FLUSH_INTERVAL seconds, so the STATS
+  item is not written on the lookup path;
+- eviction: when the total size exceeds TTS_CACHE_MAX_BYTES the least
+  recently hit objects are deleted, skipping anything hit within the grace
+  period (a reply may still be fetching it). Candidates come oldest first
+  from the LRU_INDEX GSI (lru_shard, last_hit_at), spread over LRU_SHARDS
+  partitions, instead of a table scan.
+
+Text normalization only removes what cannot change the audio (Unicode
+form, typographic quotes, whitespace): case and punctuation drive the
+intonation and stay in the key.
+"""
+
+import hashlib
+import heapq
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import aws_clients
+
+CACHE_TABLE = os.environ.get('TTS_CACHE_TABLE', 'sidea-ai-clone-prod-tts-cache-table')
+CACHE_PREFIX = os.environ.get('TTS_CACHE_PREFIX', 'audio/cache')
+CACHE_MAX_BYTES = int(os.environ.get('TTS_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+# Long answers are unlikely to be repeated verbatim: not worth the space
+CACHE_MAX_CHARS = int(os.environ.get('TTS_CACHE_MAX_CHARS', '600'))
+EVICTION_GRACE = int(os.environ.get('TTS_CACHE_EVICTION_GRACE', '900'))
+MEMORY_ENTRIES = int(os.environ.get('TTS_CACHE_MEMORY_ENTRIES', '512'))
+
+# Bump to invalidate every key when the audio pipeline changes
+KEY_VERSION = 'v1'
+STATS_KEY = 'STATS'
+# Evict down to this share of the bound, so eviction does not run on every miss
+EVICT_TO = 0.9
+# A hit refreshes last_hit_at at most this often (saves a write per hit)
+TOUCH_INTERVAL = 60
+# Hit/miss counters go to the STATS item at most this often, or every STATS_FLUSH_EVENTS lookups
+STATS_FLUSH_INTERVAL = int(os.environ.get('TTS_CACHE_STATS_FLUSH_INTERVAL', '30'))
+STATS_FLUSH_EVENTS = 100
+# GSI over (lru_shard, last_hit_at) read by the eviction, oldest first
+LRU_INDEX = os.environ.get('TTS_CACHE_LRU_INDEX', 'lru_index')
+LRU_SHARDS = 4
+EVICTION_PAGE = 100
+
+QUOTES = str.maketrans({'‘': "'", '’': "'", '“': '"', '”': '"', '«': '"', '»': '"'})
+
+
+def normalize_text(text):
+    text = unicodedata.normalize('NFC', text or '').translate(QUOTES)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def cache_key(text, voice_id, output_format, voice_settings=None):
+    raw = json.dumps(
+        [KEY_VERSION, voice_id, output_format, voice_settings or {}, normalize_text(text)],
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def lru_shard(key):
+    return f"L#{int(key[:8], 16) % LRU_SHARDS}"
+
+
+class TtsCache:
+
+    def __init__(self, bucket, table_name=CACHE_TABLE, prefix=CACHE_PREFIX, max_bytes=CACHE_MAX_BYTES,
+                 max_chars=CACHE_MAX_CHARS, eviction_grace=EVICTION_GRACE,
+                 memory_entries=MEMORY_ENTRIES, dynamodb=None, s3=None):
+        self.bucket = bucket
+        self.table_name = table_name
+        self.prefix = prefix.strip('/')
+        self.max_bytes = max_bytes
+        self.max_chars = max_chars
+        self.eviction_grace = eviction_grace
+        self.memory_ttl = eviction_grace // 2
+        self.memory_entries = memory_entries
+        self._dynamodb = dynamodb
+        self._s3 = s3
+        self._entries = OrderedDict()  # cache_key -> [expires_at, s3_key, bytes, last_hit_at]
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0, 'memory_hits': 0, 'misses': 0, 'skipped': 0, 'stored': 0,
+            'evictions': 0, 'evicted_bytes': 0, 'bytes_saved': 0, 'chars_saved': 0,
+        }
+        # Hit/miss counts not yet added to the STATS item
+        self._pending = {'hits': 0, 'misses': 0}
+        self._flushed_at = time.time()
+
+    @property
+    def dynamodb(self):
+        if self._dynamodb is None:
+            self._dynamodb = aws_clients.dynamodb()
+        return self._dynamodb
+
+    @property
+    def s3(self):
+        if self._s3 is None:
+            self._s3 = aws_clients.s3()
+        return self._s3
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self._stats[name] += delta
+
+    def cacheable(self, text):
+        """Short enough to be worth caching (counted as skipped otherwise)."""
+        if 0 < len(normalize_text(text)) <= self.max_chars:
+            return True
+        self._count(skipped=1)
+        return False
+
+    def object_key(self, key, extension):
+        return f"{self.prefix}/{key}.{extension}"
+
+    # -- L1 -----------------------------------------------------------------
+
+    def _get_local(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _put_local(self, key, s3_key, size, last_hit_at, now):
+        with self._lock:
+            self._entries[key] = [now + self.memory_ttl, s3_key, size, last_hit_at]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.memory_entries:
+                self._entries.popitem(last=False)
+
+    # -- index --------------------------------------------------------------
+
+    def _update_stats_item(self, expression, values):
+        """Apply `expression` to the STATS item; returns the updated totals ({} on failure)."""
+        try:
+            response = self.dynamodb.update_item(
+                TableName=self.table_name,
+                Key={'cache_key': {'S': STATS_KEY}},
+                UpdateExpression=expression,
+                ExpressionAttributeValues=values,
+                ReturnValues='UPDATED_NEW'
+            )
+        except Exception as e:
+            print(f"TTS cache stats update failed: {str(e)}")
+            return {}
+        return {name: int(value['N']) for name, value in response.get('Attributes', {}).items() if 'N' in value}
+
+    def _pend(self, name, now):
+        """Count a hit or miss for the STATS item, flushing the batch when it is due."""
+        with self._lock:
+            self._pending[name] += 1
+            due = (now - self._flushed_at >= STATS_FLUSH_INTERVAL
+                   or sum(self._pending.values()) >= STATS_FLUSH_EVENTS)
+        if due:
+            self.flush_stats()
+
+    def flush_stats(self):
+        """Add the batched hit/miss counts to the STATS item (one UpdateItem)."""
+        with self._lock:
+            pending = self._pending
+            self._pending = {'hits': 0, 'misses': 0}
+            self._flushed_at = time.time()
+        if not any(pending.values()):
+            return
+        self._update_stats_item(
+            'ADD hits :hits, misses :misses',
+            {':hits': {'N': str(pending['hits'])}, ':misses': {'N': str(pending['misses'])}}
+        )
+
+    def _touch(self, key, last_hit_at, now):
+        """
+        Count the hit on the entry; refresh last_hit_at if it is older than
+        TOUCH_INTERVAL. Returns the last_hit_at now stored.
+        """
+        expression = 'ADD hits :one'
+        values = {':one': {'N': '1'}}
+        if now - last_hit_at >= TOUCH_INTERVAL:
+            expression += ' SET last_hit_at = :now'
+            values[':now'] = {'N': str(now)}
+            last_hit_at = now
+        try:
+            self.dynamodb.update_item(
+                TableName=self.table_name,
+                Key={'cache_key': {'S': key}},
+                UpdateExpression=expression,
+                ConditionExpression='attribute_exists(cache_key)',
+                ExpressionAttributeValues=values
+            )
+        except Exception as e:
+            print(f"TTS cache touch failed: {str(e)}")
+        return last_hit_at
+
+    def lookup(self, key, chars=0):
+        """
+        s3 key of the cached audio, or None. On an index hit the entry's hit
+        count and last hit time are updated; in-process hits write nothing.
+        """
+        now = int(time.time())
+        local = self._get_local(key, now)
+        if local is not None:
+            _, s3_key, size, _ = local
+            self._count(hits=1, memory_hits=1, bytes_saved=size, chars_saved=chars)
+            self._pend('hits', now)
+            return s3_key
+
+        try:
+            item = self.dynamodb.get_item(
+                TableName=self.table_name,
+                Key={'cache_key': {'S': key}},
+                ProjectionExpression='s3_key, #bytes, last_hit_at',
+                ExpressionAttributeNames={'#bytes': 'bytes'}
+            ).get('Item')
+        except Exception as e:
+            print(f"TTS cache read failed: {str(e)}")
+            item = None
+
+        if not item:
+            self._count(misses=1)
+            self._pend('misses', now)
+            return None
+
+        s3_key = item['s3_key']['S']
+        size = int(item['bytes']['N'])
+        last_hit_at = self._touch(key, int(item['last_hit_at']['N']), now)
+        self._put_local(key, s3_key, size, last_hit_at, now)
+        self._count(hits=1, bytes_saved=size, chars_saved=chars)
+        self._pend('hits', now)
+        return s3_key
+
+    def store(self, key, s3_key, size, chars=0):
+        """
+        Register audio already uploaded at s3_key. Runs the eviction when the
+        cache grows past max_bytes. Returns the number of evicted objects.
+        """
+        now = int(time.time())
+        try:
+            self.dynamodb.put_item(
+                TableName=self.table_name,
+                Item={
+                    'cache_key': {'S': key},
+                    's3_key': {'S': s3_key},
+                    'bytes': {'N': str(size)},
+                    'chars': {'N': str(chars)},
+                    'hits': {'N': '0'},
+                    'created_at': {'N': str(now)},
+                    'last_hit_at': {'N': str(now)},
+                    'lru_shard': {'S': lru_shard(key)},
+                },
+                ConditionExpression='attribute_not_exists(cache_key)'
+            )
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            # Another container stored the same audio in the meantime
+            self._put_local(key, s3_key, size, now, now)
+            return 0
+        except Exception as e:
+            print(f"TTS cache write failed: {str(e)}")
+            return 0
+
+        self._put_local(key, s3_key, size, now, now)
+        self._count(stored=1)
+        totals = self._update_stats_item(
+            'ADD total_bytes :bytes, entries :one',
+            {':bytes': {'N': str(size)}, ':one': {'N': '1'}}
+        )
+        if totals.get('total_bytes', 0) <= self.max_bytes:
+            return 0
+        try:
+            return self.evict(totals['total_bytes'], now)
+        except Exception as e:
+            # The reply is ready: a failed eviction is retried on the next miss
+            print(f"TTS cache eviction failed: {str(e)}")
+            return 0
+
+    def evict(self, total_bytes, now=None):
+        """
+        Delete the least recently hit objects until the cache is back under
+        EVICT_TO * max_bytes. Entries hit within the grace period are kept.
+        """
+        now = now or int(time.time())
+        shards = [self._lru_candidates(f"L#{shard}", now - self.eviction_grace) for shard in range(LRU_SHARDS)]
+
+        target = int(self.max_bytes * EVICT_TO)
+        evicted = 0
+        for last_hit_at, key, s3_key, size in heapq.merge(*shards, key=lambda candidate: candidate[0]):
+            if total_bytes <= target:
+                break
+            try:
+                # Conditional on last_hit_at: a hit since the scan keeps the entry,
+                # and a concurrent eviction cannot subtract the size twice
+                self.dynamodb.delete_item(
+                    TableName=self.table_name,
+                    Key={'cache_key': {'S': key}},
+                    ConditionExpression='last_hit_at = :seen',
+                    ExpressionAttributeValues={':seen': {'N': str(last_hit_at)}}
+                )
+            except self.dynamodb.exceptions.ConditionalCheckFailedException:
+                continue
+            self.s3.delete_object(Bucket=self.bucket, Key=s3_key)
+            with self._lock:
+                self._entries.pop(key, None)
+            self._update_stats_item(
+                'ADD total_bytes :bytes, entries :minus_one, evictions :one',
+                {':bytes': {'N': str(-size)}, ':minus_one': {'N': '-1'}, ':one': {'N': '1'}}
+            )
+            self._count(evictions=1, evicted_bytes=size)
+            total_bytes -= size
+            evicted += 1
+        return evicted
+
+    def _lru_candidates(self, shard, cutoff):
+        """(last_hit_at, cache_key, s3_key, bytes) of a shard, oldest first, last hit at or before `cutoff`."""
+        params = {
+            'TableName': self.table_name,
+            'IndexName': LRU_INDEX,
+            'KeyConditionExpression': 'lru_shard = :shard AND last_hit_at <= :cutoff',
+            'ExpressionAttributeValues': {':shard': {'S': shard}, ':cutoff': {'N': str(cutoff)}},
+            'ProjectionExpression': 'cache_key, s3_key, #bytes, last_hit_at',
+            'ExpressionAttributeNames': {'#bytes': 'bytes'},
+            'Limit': EVICTION_PAGE,
+        }
+        while True:
+            response = self.dynamodb.query(**params)
+            for item in response.get('Items', []):
+                yield (int(item['last_hit_at']['N']), item['cache_key']['S'], item['s3_key']['S'],
+                       int(item['bytes']['N']))
+            if 'LastEvaluatedKey' not in response:
+                return
+            params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    # -- metrics ------------------------------------------------------------
+
+    def global_stats(self):
+        """Totals across containers from the STATS item (hits, misses, size, entries)."""
+        self.flush_stats()
+        try:
+            item = self.dynamodb.get_item(
+                TableName=self.table_name,
+                Key={'cache_key': {'S': STATS_KEY}},
+                ConsistentRead=True
+            ).get('Item') or {}
+        except Exception as e:
+            print(f"TTS cache stats read failed: {str(e)}")
+            return {}
+        totals = {name: int(value['N']) for name, value in item.items() if 'N' in value}
+        lookups = totals.get('hits', 0) + totals.get('misses', 0)
+        totals['hit_rate'] = round(totals.get('hits', 0) / lookups, 3) if lookups else 0.0
+        return totals
+
+    def stats(self):
+        """Counters of this container."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        return stats
+
+
+_default = None
+
+
+def get_cache(bucket):
+    """Container-wide cache instance, kept across warm invocations."""
+    global _default
+    if _default is None or _default.bucket != bucket:
+        _default = TtsCache(bucket)
+    return _default
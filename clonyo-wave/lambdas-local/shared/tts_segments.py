@@ -0,0 +1,259 @@
+"""
+Sentence-segmented, parallel text-to-speech.
+
+One ElevenLabs request for a whole answer takes time proportional to its
+length. Here the text (or SSML) is split into sentence groups, the groups
+are synthesized concurrently on a bounded worker pool, and the segments
+are stitched back in order:
+
+- opus_* (the production format, Ogg Opus): remuxed into one logical Ogg
+  stream by ogg_opus.OggOpusJoiner, no re-encoding;
+- mp3_* / pcm_* / ulaw_*: frame- or sample-aligned, plain concatenation.
+
+Each request carries the neighbouring text as `previous_text`/`next_text`
+so the prosody stays continuous across segment boundaries.
+
+Segments are written to S3 as soon as every segment before them is done,
+so the upload overlaps the synthesis of the rest of the answer.
+"""
+
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ogg_opus
+import tts_stream
+from bedrock_stream import iter_chunks
+
+DEFAULT_OUTPUT_FORMAT = 'opus_48000_32'
+
+# ElevenLabs concurrency limits are per plan (5-15 requests): stay below
+MAX_WORKERS = int(os.environ.get('TTS_MAX_WORKERS', '4'))
+MIN_SEGMENT_CHARS = int(os.environ.get('TTS_MIN_SEGMENT_CHARS', '120'))
+MAX_SEGMENT_CHARS = int(os.environ.get('TTS_MAX_SEGMENT_CHARS', '600'))
+CONTEXT_CHARS = 300
+
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.5
+
+# TextToSpeechData fields sent as voice_settings
+VOICE_SETTINGS = ('stability', 'use_speaker_boost', 'similarity_boost', 'style', 'speed')
+
+FILE_EXTENSIONS = {'opus': 'ogg', 'mp3': 'mp3', 'pcm': 'pcm', 'ulaw': 'ulaw'}
+
+# PathGenerationType::AUDIO_OUT
+AUDIO_OUT_PREFIX = 'audio/out'
+
+# Non self-closing SSML tags (<prosody>, <emphasis>, ...) must not be split
+TAG = re.compile(r'<(/?)([A-Za-z][\w:-]*)[^>]*?(/?)>')
+SPEAK = re.compile(r'^\s*<speak[^>]*>(.*)</speak>\s*$', re.DOTALL)
+
+# Kept at module scope so warm invocations reuse the threads
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='tts')
+
+
+def voice_settings_from_config(config):
+    """TextToSpeechData::getVoiceSettingsForElevenLabs, unset values left out."""
+    return {name: config[name] for name in VOICE_SETTINGS if config.get(name) is not None}
+
+
+def file_extension(output_format):
+    """TextToSpeechData::guessFileExtFromOutputFormat."""
+    extension = FILE_EXTENSIONS.get(output_format.split('_', 1)[0])
+    if extension is None:
+        raise ValueError(f"Can't guess extension for {output_format}")
+    return extension
+
+
+def audio_out_key(wa_phone_number_arn, filename):
+    """PathGenerationService::buildPath for AUDIO_OUT: <phone number id>/audio/out/<filename>."""
+    phone_number_id = wa_phone_number_arn.rsplit('/', 1)[-1]
+    return f"{phone_number_id}/{AUDIO_OUT_PREFIX}/{filename}"
+
+
+def _inside_markup(text):
+    """True if `text` ends inside a tag or leaves an SSML element open."""
+    if text.rfind('<') > text.rfind('>'):
+        return True
+    depth = 0
+    for match in TAG.finditer(text):
+        if match.group(3):
+            continue
+        depth += -1 if match.group(1) else 1
+    return depth > 0
+
+
+def split_segments(text, min_chars=MIN_SEGMENT_CHARS, max_chars=MAX_SEGMENT_CHARS):
+    """
+    Sentence groups of min_chars..max_chars characters, in order.
+
+    A <speak> wrapper is removed and put back around every segment; groups
+    that would cut a tag or leave an SSML element open are merged with the
+    next one.
+    """
+    wrapper = SPEAK.match(text)
+    body = wrapper.group(1) if wrapper else text
+
+    segments = []
+    current = ''
+    for chunk in iter_chunks([body], min_chars, max_chars):
+        current = f"{current} {chunk}" if current else chunk
+        if not _inside_markup(current):
+            segments.append(current)
+            current = ''
+    if current:
+        segments.append(current)
+
+    if wrapper:
+        segments = [f"<speak>{segment}</speak>" for segment in segments]
+    return segments
+
+
+def _context(segments, index):
+    """Plain text around segment `index`, for previous_text/next_text."""
+    previous_text = TAG.sub('', ' '.join(segments[:index]))[-CONTEXT_CHARS:]
+    next_text = TAG.sub('', ' '.join(segments[index + 1:]))[:CONTEXT_CHARS]
+    return previous_text.strip(), next_text.strip()
+
+
+def synthesize_segment(text, voice_id, api_key, output_format=DEFAULT_OUTPUT_FORMAT,
+                       voice_settings=None, previous_text='', next_text='',
+                       base_url=None, timeout=tts_stream.READ_TIMEOUT, session=None):
+    """
+    One ElevenLabs request, audio returned as bytes. 429 (concurrency limit)
+    and 5xx responses are retried with backoff.
+    """
+    session = session or tts_stream.http_session()
+    url = f"{base_url or tts_stream.ELEVENLABS_BASE_URL}/v1/text-to-speech/{voice_id}/stream"
+    payload = {'text': text}
+    if voice_settings:
+        payload['voice_settings'] = voice_settings
+    if previous_text:
+        payload['previous_text'] = previous_text
+    if next_text:
+        payload['next_text'] = next_text
+
+    for attempt in range(MAX_RETRIES + 1):
+        response = session.post(
+            url,
+            params={'output_format': output_format},
+            headers={'Content-Type': 'application/json', 'xi-api-key': api_key},
+            json=payload,
+            timeout=(tts_stream.CONNECT_TIMEOUT, timeout)
+        )
+        if response.status_code == 429 or response.status_code >= 500:
+            if attempt < MAX_RETRIES:
+                time.sleep(RETRY_BACKOFF * (2 ** attempt))
+                continue
+        response.raise_for_status()
+        return response.content, attempt
+
+
+class _BytesJoiner:
+    """Joiner for formats whose segments can simply be appended."""
+
+    def add(self, data):
+        return data
+
+    def finish(self):
+        return b''
+
+
+def joiner_for(output_format):
+    if output_format.startswith('opus'):
+        return ogg_opus.OggOpusJoiner()
+    return _BytesJoiner()
+
+
+def synthesize(text, voice_id, api_key, write, output_format=DEFAULT_OUTPUT_FORMAT,
+               voice_settings=None, base_url=None, max_workers=MAX_WORKERS,
+               min_chars=MIN_SEGMENT_CHARS, max_chars=MAX_SEGMENT_CHARS,
+               timeout=tts_stream.READ_TIMEOUT, session=None):
+    """
+    Synthesize `text` segment by segment and pass the joined audio to
+    `write(bytes)` in playback order.
+
+    At most `max_workers` requests are in flight (and never more than the
+    module pool size); segments are sized so there are about as many as
+    workers, between min_chars and max_chars. Returns a report with
+    per-segment and total timings.
+    """
+    started = time.perf_counter()
+    window = max(1, min(max_workers, MAX_WORKERS))
+    # About one segment per worker: every request pays the time to first
+    # byte, more segments than workers only add round-trips
+    min_chars = min(max_chars, max(min_chars, len(text) // window))
+    segments = split_segments(text, min_chars, max_chars)
+    if not segments:
+        raise ValueError("Nothing to synthesize")
+
+    def run(index):
+        segment_started = time.perf_counter()
+        previous_text, next_text = _context(segments, index)
+        audio, retries = synthesize_segment(
+            segments[index], voice_id, api_key, output_format, voice_settings,
+            previous_text, next_text, base_url, timeout, session
+        )
+        return audio, {
+            'index': index,
+            'chars': len(segments[index]),
+            'bytes': len(audio),
+            'retries': retries,
+            'started_ms': round((segment_started - started) * 1000, 2),
+            'ms': round((time.perf_counter() - segment_started) * 1000, 2),
+        }
+
+    # Bounded window of in-flight segments over the shared pool
+    futures = {}
+    report_segments = []
+    joiner = joiner_for(output_format)
+    total_bytes = 0
+    next_submit = 0
+
+    try:
+        for index in range(len(segments)):
+            while next_submit < len(segments) and next_submit < index + window:
+                futures[next_submit] = _executor.submit(run, next_submit)
+                next_submit += 1
+            audio, timing = futures.pop(index).result()
+            report_segments.append(timing)
+            data = joiner.add(audio)
+            total_bytes += len(data)
+            write(data)
+        data = joiner.finish()
+        total_bytes += len(data)
+        write(data)
+    finally:
+        for future in futures.values():
+            future.cancel()
+
+    synthesis_ms = sum(timing['ms'] for timing in report_segments)
+    total_ms = round((time.perf_counter() - started) * 1000, 2)
+    return {
+        'output_format': output_format,
+        'segments': report_segments,
+        'segment_count': len(segments),
+        'workers': window,
+        'bytes': total_bytes,
+        'first_segment_ms': round(report_segments[0]['started_ms'] + report_segments[0]['ms'], 2),
+        'synthesis_ms': round(synthesis_ms, 2),
+        'total_ms': total_ms,
+        'speedup': round(synthesis_ms / total_ms, 2) if total_ms else None,
+    }
+
+
+def synthesize_to_s3(s3, text, voice_id, api_key, bucket, key, output_format=DEFAULT_OUTPUT_FORMAT,
+                     voice_settings=None, **kwargs):
+    """
+    Segmented synthesis uploaded to s3://bucket/key through a multipart
+    writer; the upload is aborted if any segment fails.
+    """
+    content_type = tts_stream.content_type_for(output_format)
+    with tts_stream.S3MultipartWriter(s3, bucket, key, content_type) as writer:
+        report = synthesize(
+            text, voice_id, api_key, writer.write, output_format, voice_settings, **kwargs
+        )
+    report.update(bucket_name=bucket, key=key, parts=len(writer.parts) or 1)
+    return report
+
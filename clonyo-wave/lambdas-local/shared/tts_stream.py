@@ -0,0 +1,174 @@
+"""
+Streaming text-to-speech: ElevenLabs `/stream` body -> S3 multipart upload.
+
+The HTTP body is read in small chunks and fed to an S3 multipart upload as
+the bytes arrive, so memory stays bounded by one upload part (5 MiB, the S3
+minimum) whatever the length of the audio, and the upload overlaps the
+synthesis instead of starting after it.
+
+The HTTP session is kept at module scope: warm invocations reuse the
+keep-alive connection to ElevenLabs (TLS handshake included).
+"""
+
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+ELEVENLABS_BASE_URL = os.environ.get('ELEVENLABS_BASE_URL', 'https://api.elevenlabs.io')
+
+# S3 rejects non-final parts smaller than 5 MiB
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+HTTP_POOL_SIZE = int(os.environ.get('TTS_HTTP_POOL_SIZE', '10'))
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 60
+
+CONTENT_TYPES = {
+    'mp3': 'audio/mpeg',
+    'opus': 'audio/ogg',
+    'pcm': 'audio/pcm',
+    'ulaw': 'audio/basic',
+}
+
+_lock = threading.Lock()
+_session = None
+
+
+def http_session():
+    """Pooled keep-alive session, created once per container."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def content_type_for(output_format):
+    return CONTENT_TYPES.get(output_format.split('_', 1)[0], 'application/octet-stream')
+
+
+class S3MultipartWriter:
+    """
+    File-like writer that uploads to S3 in parts of `part_size` bytes.
+
+    Anything smaller than one part is sent with a single put_object on
+    close(); on error the multipart upload is aborted so no orphan parts
+    are left (and billed) in the bucket.
+    """
+
+    def __init__(self, s3, bucket, key, content_type='application/octet-stream', part_size=MIN_PART_SIZE):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = None
+        self.bytes_written = 0
+        self.peak_buffer = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.bytes_written += len(data)
+        self.peak_buffer = max(self.peak_buffer, len(self.buffer))
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+
+    def _upload_part(self, body):
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type
+            )['UploadId']
+        number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=body
+        )
+        self.parts.append({'PartNumber': number, 'ETag': response['ETag']})
+
+    def close(self):
+        if self.upload_id is None:
+            self.s3.put_object(
+                Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer), ContentType=self.content_type
+            )
+        else:
+            if self.buffer:
+                self._upload_part(bytes(self.buffer))
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                MultipartUpload={'Parts': self.parts}
+            )
+        self.buffer = bytearray()
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+        self.buffer = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def stream_tts_to_s3(s3, text, voice_id, api_key, bucket, key, output_format='mp3_22050_32',
+                     voice_settings=None, base_url=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                     part_size=MIN_PART_SIZE, session=None):
+    """
+    Synthesize `text` and upload the audio to s3://bucket/key while it streams.
+
+    Returns a report with sizes and timings (first_byte_ms, total_ms).
+    Raises requests.RequestException / botocore ClientError like the
+    blocking version did.
+    """
+    session = session or http_session()
+    url = f"{base_url or ELEVENLABS_BASE_URL}/v1/text-to-speech/{voice_id}/stream"
+    payload = {'text': text}
+    if voice_settings:
+        payload['voice_settings'] = voice_settings
+
+    started = time.perf_counter()
+    first_byte_ms = None
+
+    with session.post(
+        url,
+        params={'optimize_streaming_latency': 0, 'output_format': output_format},
+        headers={'Content-Type': 'application/json', 'xi-api-key': api_key},
+        json=payload,
+        stream=True,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+    ) as response:
+        response.raise_for_status()
+        with S3MultipartWriter(s3, bucket, key, content_type_for(output_format), part_size) as writer:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if not chunk:
+                    continue
+                if first_byte_ms is None:
+                    first_byte_ms = round((time.perf_counter() - started) * 1000, 2)
+                writer.write(chunk)
+
+    return {
+        'bucket_name': bucket,
+        'key': key,
+        'bytes': writer.bytes_written,
+        'parts': len(writer.parts) or 1,
+        'peak_buffer_bytes': writer.peak_buffer,
+        'first_byte_ms': first_byte_ms,
+        'total_ms': round((time.perf_counter() - started) * 1000, 2),
+    }
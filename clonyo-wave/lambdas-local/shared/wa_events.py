@@ -0,0 +1,50 @@
+"""
+Parsing of the WhatsApp events delivered to the message router.
+
+AWS End User Messaging Social publishes each inbound WhatsApp message to
+SNS, which fans out to the router's SQS queue. An SQS record body is the
+SNS notification, whose `Message` is the plain message read by
+WaMessageRouter\\Service:
+
+    {"context": {"MetaPhoneNumberIds": [{"arn": ...}], ...},
+     "whatsAppWebhookEntry": "<webhook entry JSON>",
+     "aws_account_id": ..., "message_timestamp": ...}
+"""
+
+import json
+
+
+def sns_message(record):
+    """Plain message of an SQS record (SNS envelope unwrapped if present)."""
+    body = record['body']
+    body = json.loads(body) if isinstance(body, str) else body
+    message = body.get('Message', body) if isinstance(body, dict) else body
+    return json.loads(message) if isinstance(message, str) else message
+
+
+def origination_phone_number_arn(message):
+    """MessageData::getOriginationPhoneNumberId: the clone's phone number ARN (config table key)."""
+    phone_number_ids = (message.get('context') or {}).get('MetaPhoneNumberIds') or []
+    return phone_number_ids[0].get('arn') if phone_number_ids else None
+
+
+def webhook_entry(message):
+    entry = message.get('whatsAppWebhookEntry')
+    return json.loads(entry) if isinstance(entry, str) else entry
+
+
+def received_message(entry):
+    """First message of the webhook entry (the router handles one per notification), or None."""
+    for change in entry.get('changes', []):
+        messages = change.get('value', {}).get('messages') or []
+        if messages:
+            return messages[0]
+    return None
+
+
+def record_phone_number_arn(record):
+    """Phone number ARN of an SQS record, None if the record cannot be parsed."""
+    try:
+        return origination_phone_number_arn(sns_message(record))
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
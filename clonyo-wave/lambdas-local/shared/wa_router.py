@@ -0,0 +1,250 @@
+"""
+WhatsApp message router: SQS batch -> one state machine execution per message.
+
+Port of WaMessageRouter\\Service and its Text/Audio processors, with the
+batch handled concurrently instead of record by record:
+
+- records are grouped by contact (clone phone number + sender wa_id);
+  each group runs in arrival order, groups run in parallel on a bounded
+  pool, so a slow media download only delays the messages of its contact;
+- a failed record fails the records after it in the same group too (they
+  would otherwise overtake it on the retry), everything else goes on;
+- the failed records are returned as `batchItemFailures`, so SQS retries
+  only those (the event source mapping needs ReportBatchItemFailures);
+- records not started when the invocation is about to time out are
+  reported as failures rather than lost;
+- with a coalescing window (message_coalescer), text messages are
+  buffered per contact and started together by the flush.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import message_coalescer
+import wa_events
+
+MAX_WORKERS = int(os.environ.get('ROUTER_MAX_WORKERS', '8'))
+
+# config('ai-clone.router.wa_message_processor')
+SFN_ARN = os.environ.get('ROUTER_WA_MESSAGE_PROCESSOR_SFN_ARN', '')
+DEV_WA_IDS = [wa_id for wa_id in os.environ.get('ROUTER_DEV_WA_IDS', '').split(',') if wa_id]
+
+# config('ai-clone.commons.wa_media.bucket_name'), PathGenerationType::AUDIO_IN
+WA_MEDIA_BUCKET = os.environ.get('WA_MEDIA_BUCKET_NAME', 'sidea-ai-clone-prod-wa-media-s3')
+AUDIO_IN_PREFIX = 'audio/in'
+
+# Stop starting records this close to the Lambda timeout
+DEADLINE_MARGIN_MS = 3000
+
+# Kept at module scope so warm invocations reuse the threads
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='router')
+
+
+class UnsupportedMessage(Exception):
+    pass
+
+
+def kebab(value):
+    """Laravel Str::kebab"""
+    if not value.islower():
+        value = re.sub(r'\s+', '', ' '.join(word[:1].upper() + word[1:] for word in value.split(' ')))
+        value = re.sub(r'(.)(?=[A-Z])', r'\1-', value).lower()
+    return value
+
+
+def execution_name(config):
+    """AbstractMessageProcessor::getSfnExecutionName"""
+    return f"{kebab(config['name'])}_{uuid.uuid4()}"
+
+
+def sfn_arn(from_wa_id, base_arn=None, dev_wa_ids=None):
+    """AbstractMessageProcessor::getSfnArn: dev contacts run the unpublished version, the rest ':live'."""
+    base_arn = SFN_ARN if base_arn is None else base_arn
+    dev_wa_ids = DEV_WA_IDS if dev_wa_ids is None else dev_wa_ids
+    if from_wa_id in dev_wa_ids:
+        return base_arn
+    return base_arn if base_arn.endswith(':live') else f"{base_arn}:live"
+
+
+def audio_file_name(audio):
+    """EntryChangeValueMessageAudioData::getFileName: <media id>.<subtype of the mime type>"""
+    mime_type = audio.get('mime_type', '')
+    if not mime_type.startswith('audio/'):
+        raise UnsupportedMessage(f"Unknown mime type: {mime_type}")
+    return f"{audio['id']}.{mime_type[len('audio/'):].split(';')[0]}"
+
+
+def audio_in_prefix(wa_phone_number_arn):
+    """PathGenerationService::buildPrefix for AUDIO_IN: <phone number id>/audio/in/"""
+    return f"{wa_phone_number_arn.rsplit('/', 1)[-1]}/{AUDIO_IN_PREFIX}/"
+
+
+class Record:
+    """One SQS record, parsed."""
+
+    def __init__(self, record):
+        self.message_id = record['messageId']
+        self.message = wa_events.sns_message(record)
+        self.phone_number_arn = wa_events.origination_phone_number_arn(self.message)
+        self.entry = wa_events.webhook_entry(self.message)
+        self.received = wa_events.received_message(self.entry)
+        value = self.entry['changes'][0]['value']
+        self.contact = (value.get('contacts') or [{}])[0]
+        self.wa_id = self.contact.get('wa_id')
+
+    @property
+    def ordering_key(self):
+        return self.phone_number_arn, self.wa_id
+
+    def enrich(self, base_input, config):
+        """AbstractMessageProcessor::enrichSfnInput"""
+        return dict(base_input, **{
+            'message_ts': self.received['timestamp'],
+            'reply_to_wa_id': self.wa_id if self.wa_id.startswith('+') else f"+{self.wa_id}",
+            'wa_contact': self.contact,
+            'config': config,
+        })
+
+
+class Router:
+    """Processes parsed records: the Text/Audio message processors."""
+
+    def __init__(self, config_store, stepfunctions, social_messaging, media_bucket=WA_MEDIA_BUCKET,
+                 base_sfn_arn=None, dev_wa_ids=None, coalescer=None):
+        self.config_store = config_store
+        self.stepfunctions = stepfunctions
+        self.social_messaging = social_messaging
+        self.media_bucket = media_bucket
+        self.base_sfn_arn = base_sfn_arn
+        self.dev_wa_ids = dev_wa_ids
+        # message_coalescer.Coalescer: text messages are buffered per contact instead of started
+        self.coalescer = coalescer if coalescer is not None and coalescer.enabled else None
+
+    def base_input(self, record):
+        message_type = record.received.get('type') if record.received else None
+        if message_type == 'text':
+            return {'text': {'body': record.received['text']['body']}}
+        if message_type == 'audio':
+            audio = record.received['audio']
+            # AudioMessageProcessor::saveWaMedia
+            self.social_messaging.get_whatsapp_message_media(
+                mediaId=audio['id'],
+                originationPhoneNumberId=record.phone_number_arn,
+                destinationS3File={'bucketName': self.media_bucket, 'key': audio_in_prefix(record.phone_number_arn)}
+            )
+            key = f"{audio_in_prefix(record.phone_number_arn)}{audio_file_name(audio)}"
+            return {'audio': {'s3_uri': f"s3://{self.media_bucket}/{key}"}}
+        raise UnsupportedMessage(f"Unsupported message type: {message_type}")
+
+    def start(self, sfn_input):
+        """AbstractMessageProcessor::startStateMachine"""
+        self.stepfunctions.start_execution(
+            stateMachineArn=sfn_arn(sfn_input['wa_contact']['wa_id'], self.base_sfn_arn, self.dev_wa_ids),
+            name=execution_name(sfn_input['config']),
+            input=json.dumps(sfn_input)
+        )
+
+    def process(self, record):
+        config = self.config_store.get(record.phone_number_arn)
+        if config is None:
+            raise LookupError(f"No config for {record.phone_number_arn}")
+        base_input = self.base_input(record)
+        message_type = next(iter(base_input))
+        sfn_input = record.enrich(base_input, config)
+
+        if self.coalescer is not None:
+            key = message_coalescer.buffer_key(record.phone_number_arn, record.wa_id)
+            if message_type == 'text':
+                self.coalescer.add(key, sfn_input, record.received.get('id') or record.message_id, self.start)
+                return message_type
+            # Pending text of the contact goes first
+            self.coalescer.flush(key, self.start, force=True)
+
+        self.start(sfn_input)
+        return message_type
+
+
+def route_batch(records, process, max_workers=MAX_WORKERS, remaining_ms=None, executor=None):
+    """
+    Run process(record) for the raw SQS `records`, per-contact in order and
+    contacts in parallel. Returns (batchItemFailures, report).
+
+    `remaining_ms` is a callable (context.get_remaining_time_in_millis):
+    records not started before the deadline margin are failed, to be retried.
+    """
+    started = time.perf_counter()
+    failures = []
+    outcomes = {'processed': 0, 'failed': 0, 'skipped': 0, 'unparseable': 0, 'unsupported': 0, 'deferred': 0}
+    types = {}
+    lock = threading.Lock()
+
+    groups = OrderedDict()
+    for raw in records:
+        try:
+            record = Record(raw)
+        except (KeyError, IndexError, TypeError, ValueError, AttributeError) as e:
+            print(f"Unparseable record {raw.get('messageId')}: {str(e)}")
+            failures.append(raw.get('messageId'))
+            outcomes['unparseable'] += 1
+            continue
+        groups.setdefault(record.ordering_key, []).append(record)
+
+    def fail(record, outcome):
+        with lock:
+            failures.append(record.message_id)
+            outcomes[outcome] += 1
+
+    def run_group(group):
+        for index, record in enumerate(group):
+            if remaining_ms is not None and remaining_ms() < DEADLINE_MARGIN_MS:
+                for deferred in group[index:]:
+                    fail(deferred, 'deferred')
+                return
+            try:
+                message_type = process(record)
+            except UnsupportedMessage as e:
+                # Retrying would not help (Service logs a warning and moves on)
+                print(f"Skipping {record.message_id}: {str(e)}")
+                with lock:
+                    outcomes['unsupported'] += 1
+                continue
+            except Exception as e:
+                print(f"Record {record.message_id} failed: {str(e)}")
+                fail(record, 'failed')
+                for skipped in group[index + 1:]:
+                    fail(skipped, 'skipped')
+                return
+            with lock:
+                outcomes['processed'] += 1
+                types[message_type] = types.get(message_type, 0) + 1
+
+    pool = executor or _executor
+    if max_workers <= 1 or len(groups) <= 1:
+        for group in groups.values():
+            run_group(group)
+    else:
+        # The module pool is shared: cap this batch at max_workers groups in flight
+        slots = threading.BoundedSemaphore(max_workers)
+
+        def run_slot(group):
+            try:
+                run_group(group)
+            finally:
+                slots.release()
+
+        futures = []
+        for group in groups.values():
+            slots.acquire()
+            futures.append(pool.submit(run_slot, group))
+        for future in futures:
+            future.result()
+
+    report = dict(outcomes, records=len(records), contacts=len(groups), types=types,
+                  elapsed_ms=round((time.perf_counter() - started) * 1000, 1))
+    return [{'itemIdentifier': message_id} for message_id in failures], report
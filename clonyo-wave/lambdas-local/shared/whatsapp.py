@@ -0,0 +1,116 @@
+"""
+Minimal WhatsApp sender through AWS End User Messaging Social, mirroring the
+`sendWhatsAppMessage` tasks of the state machine.
+"""
+
+import json
+import os
+import time
+
+import aws_clients
+
+META_API_VERSION = os.environ.get('WA_META_API_VERSION', 'v21.0')
+
+MESSAGES_TABLE = os.environ.get('WA_MESSAGES_TABLE', 'sidea-ai-clone-prod-messages-table')
+# Delivery progress only matters while the execution can still retry
+DELIVERY_TTL = 86400
+
+
+def send_text(wa_phone_number_arn, reply_to_wa_id, body):
+    message = {
+        'messaging_product': 'whatsapp',
+        'to': reply_to_wa_id,
+        'type': 'text',
+        'text': {
+            'body': body
+        }
+    }
+
+    return aws_clients.social_messaging().send_whatsapp_message(
+        originationPhoneNumberId=wa_phone_number_arn,
+        message=json.dumps(message).encode('utf-8'),
+        metaApiVersion=META_API_VERSION
+    )
+
+
+class PartialDeliveryError(Exception):
+    """
+    The reply failed after some of its chunks reached the user. The state
+    machine does not retry it (the Lambda errorType is this class name):
+    a retry would generate a different reply and send its rest after the
+    chunks of this one. It catches it instead and stores the chunks that
+    were sent (kept on the delivery item) as the reply.
+    """
+
+
+class ChunkDelivery:
+    """
+    Sends the chunks of one streamed reply, each index at most once across
+    the retries of the same execution: the chunks sent are kept in the
+    messages table under D#<delivery_id> (the execution id). An attempt that
+    finds some already sent must not generate again (`partial`): the rest
+    would come from another generation. Without a delivery_id it only sends.
+    """
+
+    def __init__(self, wa_phone_number_arn, reply_to_wa_id, delivery_id=None, table_name=MESSAGES_TABLE,
+                 dynamodb=None):
+        self.wa_phone_number_arn = wa_phone_number_arn
+        self.reply_to_wa_id = reply_to_wa_id
+        self.delivery_id = delivery_id
+        self.table_name = table_name
+        self.dynamodb = dynamodb
+        self.sent = 0
+        self.skipped = 0
+        self.delivered = 0  # by this invocation
+        self.chunks = []
+        if delivery_id:
+            item = self._client().get_item(
+                TableName=table_name,
+                Key=self._key(),
+                ProjectionExpression='sent_chunks, chunks',
+                ConsistentRead=True
+            ).get('Item')
+            if item:
+                self.sent = int(item['sent_chunks']['N'])
+                self.chunks = [chunk['S'] for chunk in item.get('chunks', {}).get('L', [])]
+
+    @property
+    def partial(self):
+        """An earlier attempt of this execution already sent part of the reply."""
+        return self.delivered == 0 and self.sent > 0
+
+    def _client(self):
+        return self.dynamodb or aws_clients.dynamodb()
+
+    def _key(self):
+        return {'pk': {'S': f"D#{self.delivery_id}"}, 'sk': {'S': 'STREAM'}}
+
+    def send(self, chunk, index):
+        """Send chunk `index` unless an earlier attempt already did; True if sent now."""
+        if index < self.sent:
+            self.skipped += 1
+            return False
+        send_text(self.wa_phone_number_arn, self.reply_to_wa_id, chunk)
+        self.sent = index + 1
+        self.delivered += 1
+        self.chunks.append(chunk)
+        if self.delivery_id:
+            self._client().update_item(
+                TableName=self.table_name,
+                Key=self._key(),
+                UpdateExpression=(
+                    'SET sent_chunks = :sent, chunks = list_append(if_not_exists(chunks, :empty), :chunk), '
+                    'expires_at = :expires_at'
+                ),
+                ExpressionAttributeValues={
+                    ':sent': {'N': str(self.sent)},
+                    ':empty': {'L': []},
+                    ':chunk': {'L': [{'S': chunk}]},
+                    ':expires_at': {'N': str(int(time.time()) + DELIVERY_TTL)},
+                }
+            )
+        return True
+
+    def to_dict(self):
+        return {'delivery_id': self.delivery_id, 'sent_chunks': self.sent, 'delivered': self.delivered,
+                'skipped': self.skipped}
@@ -0,0 +1,52 @@
+import json
+import os
+import sys
+
+# Shared helpers live in lambdas-local/shared (shipped as a Lambda layer under /opt/python)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+import aws_clients
+import speech_to_text
+
+# Clients and the Whisper model are loaded during the init phase, so warm
+# invocations only pay for decoding and transcribing the voice note
+aws_clients.warm('s3')
+if speech_to_text.STT_BACKEND == speech_to_text.LocalWhisperBackend.name:
+    speech_to_text.get_backend().load()
+
+def log_partial(partial):
+    print(f"STT partial: {json.dumps(partial, ensure_ascii=False)}")
+
+def handler(event, context):
+    """
+    'Transcribe locally' state: {s3_uri, language?, backend?} -> {transcript, stt}.
+
+    The backend defaults to STT_BACKEND: 'local' (in-process Whisper on CPU)
+    in the container image built by scripts/package-stt-image.sh,
+    'transcribe' otherwise. The state machine falls back to the Transcribe
+    job if this task fails.
+    """
+    print(f"Event: {json.dumps(event)}")
+    aws_clients.start_invocation()
+
+    try:
+        result = speech_to_text.transcribe(
+            event['s3_uri'],
+            language=event.get('language') or speech_to_text.DEFAULT_LANGUAGE,
+            backend=event.get('backend'),
+            on_partial=log_partial
+        )
+        transcript = result.pop('transcript')
+        print(f"STT: {json.dumps(result)}")
+
+        return {
+            'transcript': transcript,
+            'stt': result,
+            'clients': aws_clients.stats()
+        }
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise e
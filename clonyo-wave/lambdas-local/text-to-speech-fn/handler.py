@@ -0,0 +1,110 @@
+import json
+import os
+import sys
+
+# Shared helpers live in lambdas-local/shared (shipped as a Lambda layer under /opt/python)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+import aws_clients
+import tts_cache
+import tts_segments
+import tts_stream
+
+WA_MEDIA_BUCKET = os.environ.get('WA_MEDIA_BUCKET_NAME', 'sidea-ai-clone-prod-wa-media-s3')
+
+# config('ai-clone.text_to_speech.default_options')
+DEFAULT_OPTIONS = {
+    'api_key': os.environ.get('ELEVENLABS_API_KEY'),
+    'voice_id': os.environ.get('ELEVENLABS_VOICE_ID'),
+    'output_format': tts_segments.DEFAULT_OUTPUT_FORMAT,
+    'stability': 0.76,
+    'use_speaker_boost': None,
+    'similarity_boost': 0.88,
+    'style': 0.10,
+    'speed': None,
+    'request_timeout': 58,
+}
+
+# Repeated replies (greetings, disclaimers) are served from the content-addressed cache
+CACHE_ENABLED = os.environ.get('TTS_CACHE_ENABLED', '1') == '1'
+
+# Module-scope clients and keep-alive ElevenLabs session, reused on warm invocations
+aws_clients.warm('s3', 'dynamodb')
+tts_stream.http_session()
+
+def request_timeout(config, context, default=30):
+    """ElevenlabsService::getHttpRequestTimeout: never outlive the Lambda"""
+    timeout = config['request_timeout'] or default
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        timeout = min(timeout, context.get_remaining_time_in_millis() / 1000 - 1)
+    return max(1, timeout)
+
+def handler(event, context):
+    """
+    Same contract as the PHP TextToSpeechHandler: {text, config,
+    wa_phone_number_arn} -> {bucket_name, key}. The text is synthesized in
+    sentence segments, in parallel, and stitched back in order.
+
+    Short replies go through the TTS cache: a hit returns the key of the
+    audio already in the bucket, a miss stores the new audio under its
+    content-addressed key. Longer ones are saved under the AUDIO_OUT prefix
+    of the phone number, as before.
+    """
+    print(f"Event: {json.dumps({k: v for k, v in event.items() if k != 'config'})}")
+    aws_clients.start_invocation()
+
+    try:
+        config = dict(DEFAULT_OPTIONS, **{k: v for k, v in (event.get('config') or {}).items() if v is not None})
+        text = event['text']
+        voice_settings = tts_segments.voice_settings_from_config(config)
+        extension = tts_segments.file_extension(config['output_format'])
+
+        cache = tts_cache.get_cache(WA_MEDIA_BUCKET) if CACHE_ENABLED else None
+        cache_key = None
+        if cache is not None and cache.cacheable(text):
+            cache_key = tts_cache.cache_key(text, config['voice_id'], config['output_format'], voice_settings)
+            cached = cache.lookup(cache_key, chars=len(text))
+            if cached is not None:
+                print(f"TTS cache hit: {cached}")
+                return {
+                    'bucket_name': WA_MEDIA_BUCKET,
+                    'key': cached,
+                    'cache': cache.stats(),
+                    'clients': aws_clients.stats()
+                }
+
+        if cache_key is not None:
+            key = cache.object_key(cache_key, extension)
+        else:
+            request_id = getattr(context, 'aws_request_id', None) or 'local'
+            key = tts_segments.audio_out_key(event['wa_phone_number_arn'], f"{request_id}.{extension}")
+
+        report = tts_segments.synthesize_to_s3(
+            aws_clients.s3(),
+            text,
+            config['voice_id'],
+            config['api_key'],
+            WA_MEDIA_BUCKET,
+            key,
+            output_format=config['output_format'],
+            voice_settings=voice_settings,
+            timeout=request_timeout(config, context)
+        )
+        print(f"TTS segments: {json.dumps(report)}")
+
+        if cache_key is not None:
+            cache.store(cache_key, key, report['bytes'], chars=len(text))
+
+        return {
+            'bucket_name': WA_MEDIA_BUCKET,
+            'key': key,
+            'tts': {k: v for k, v in report.items() if k not in ('bucket_name', 'key')},
+            'cache': cache.stats() if cache is not None else None,
+            'clients': aws_clients.stats()
+        }
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise e
@@ -0,0 +1,106 @@
+import json
+import os
+import sys
+import time
+
+# Shared helpers live in lambdas-local/shared (shipped as a Lambda layer under /opt/python)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+import aws_clients
+import topic_registry
+
+MODEL_ID = os.environ.get('TOPIC_ANALYZER_MODEL_ID', 'anthropic.claude-3-haiku-20240307-v1:0')
+
+# Create the clients during the init phase so warm invocations reuse them
+aws_clients.warm('bedrock-runtime', 'dynamodb')
+
+# Same prompt as AnalyzeTopicHandler
+SYSTEM_PROMPT = """You are a Topic Analyzer. Analyze the user input. Extract the main topic (1-2 words) and 3 keywords.
+        If a Previous Topic is provided, check if the input is a continuation. If yes, reuse the same Topic ID (if it was passed as keyword, otherwise output the topic name).
+        Output ONLY JSON: {"topic": "string", "keywords": ["string"]}"""
+
+def ask_bedrock(text, current_topic_id):
+    response = aws_clients.bedrock_runtime().invoke_model(
+        modelId=MODEL_ID,
+        contentType='application/json',
+        body=json.dumps({
+            'anthropic_version': 'bedrock-2023-05-31',
+            'max_tokens': 300,
+            'system': SYSTEM_PROMPT,
+            'messages': [
+                {'role': 'user', 'content': f"User Input: {text}\nPrevious Topic ID: {current_topic_id or 'None'}"}
+            ]
+        })
+    )
+    response_body = json.loads(response['body'].read())
+    return json.loads(response_body['content'][0]['text'])
+
+def handler(event, context):
+    """
+    AnalyzeTopic: topic_id, topic_name and keywords of the message.
+    Same input/output as the PHP AnalyzeTopicHandler; with `messages_key`
+    the topic comes from the contact's topic registry (embedding match)
+    instead of md5(topic name), and obvious continuations of the current
+    topic skip Haiku ('source': 'registry').
+    """
+    print(f"Event: {json.dumps(event)}")
+    aws_clients.start_invocation()
+
+    text = event.get('text', '')
+    current_topic_id = event.get('current_topic_id')
+    messages_key = event.get('messages_key')
+
+    if not text:
+        print("Empty text, returning current topic")
+        return {'topic_id': current_topic_id or 'general', 'keywords': []}
+
+    started = time.perf_counter()
+    registry, embedding, match = None, None, None
+    if messages_key:
+        try:
+            registry = topic_registry.get_registry(messages_key)
+            embedding = topic_registry.embed(text)
+            match = registry.match(embedding, current_topic_id)
+        except Exception as e:
+            # Without the registry: the md5 topic ids, as before
+            print(f"Topic registry unavailable: {str(e)}")
+            registry = None
+        else:
+            print(f"Topic match: {match.topic_id} similarity {match.similarity:.3f} of {len(registry)} topics, "
+                  f"{(time.perf_counter() - started) * 1000:.1f} ms")
+            if match.continuation:
+                registry.observe(match.topic_id, embedding)
+                return {
+                    'topic_id': match.topic_id,
+                    'topic_name': match.name,
+                    'keywords': match.keywords,
+                    'source': 'registry'
+                }
+
+    try:
+        content = ask_bedrock(text, current_topic_id)
+        topic_name = content.get('topic') or 'General'
+        keywords = content.get('keywords') or []
+    except Exception as e:
+        print(f"Bedrock Error: {str(e)}")
+        return {
+            'topic_id': current_topic_id or 'general',
+            'topic_name': 'General',
+            'keywords': []
+        }
+
+    if registry is None:
+        return {
+            'topic_id': topic_registry.topic_id_for(topic_name),
+            'topic_name': topic_name,
+            'keywords': keywords
+        }
+
+    topic_id, how = registry.assign(embedding, match, topic_name, keywords)
+    print(f"Topic {how}: {topic_id} ({topic_name})")
+    return {
+        'topic_id': topic_id,
+        'topic_name': topic_name,
+        'keywords': keywords,
+        'source': how
+    }
@@ -0,0 +1,43 @@
+import json
+import os
+import sys
+
+# Shared helpers live in lambdas-local/shared (shipped as a Lambda layer under /opt/python)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+import aws_clients
+import topic_history
+
+# Create the clients during the init phase so warm invocations reuse them
+aws_clients.warm('dynamodb')
+
+def handler(event, context):
+    """
+    Fold the exchange just sent into the compact summary of its topic and
+    session, read back by history-retrieval-fn. Runs after
+    'Store WA sent message'.
+    """
+    print(f"Event: {json.dumps(event)}")
+    aws_clients.start_invocation()
+
+    messages_key = event.get('messages_key')
+    topic_id = event.get('topic_id')
+    session_id = event.get('session_id')
+    if not (messages_key and topic_id and session_id):
+        return {'statusCode': 400, 'error': 'messages_key, topic_id and session_id are required'}
+
+    report = topic_history.record(
+        aws_clients.dynamodb(),
+        messages_key,
+        topic_id,
+        session_id,
+        event.get('user_message', ''),
+        event.get('assistant_message', ''),
+        keywords=event.get('keywords') or []
+    )
+    print(f"Topic history: {json.dumps(report)}")
+
+    return {
+        'statusCode': 200,
+        'topic_history': report
+    }
@@ -0,0 +1,48 @@
+import json
+import os
+import sys
+from urllib.parse import unquote_plus
+
+# Shared helpers live in lambdas-local/shared (shipped as a Lambda layer under /opt/python)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+import aws_clients
+import transcription_callback
+
+# Create the clients during the init phase so warm invocations reuse them
+aws_clients.warm('dynamodb', 's3', 'stepfunctions')
+
+def handler(event, context):
+    """
+    Three event sources, one rendezvous per transcription job:
+
+    - 'Wait for transcript' state (waitForTaskToken): {task_token, job_name}
+    - S3 ObjectCreated on transcripts/ in the media bucket: {Records: [...]}
+    - EventBridge 'Transcribe Job State Change' with status FAILED
+    """
+    print(f"Event: {json.dumps(event)}")
+    aws_clients.start_invocation()
+    clients = (aws_clients.dynamodb(), aws_clients.s3(), aws_clients.stepfunctions())
+
+    if 'task_token' in event:
+        outcome = transcription_callback.register(*clients, event['job_name'], event['task_token'])
+        return {'statusCode': 200, 'job_name': event['job_name'], 'outcome': outcome or 'waiting'}
+
+    if 'Records' in event:
+        outcomes = []
+        for record in event['Records']:
+            if not record.get('eventName', '').startswith('ObjectCreated'):
+                continue
+            bucket = record['s3']['bucket']['name']
+            key = unquote_plus(record['s3']['object']['key'])
+            outcomes.append({'key': key, 'outcome': transcription_callback.on_transcript(*clients, bucket, key)})
+        return {'statusCode': 200, 'records': outcomes}
+
+    detail = event.get('detail', {})
+    if event.get('detail-type') == 'Transcribe Job State Change' and detail.get('TranscriptionJobStatus') == 'FAILED':
+        outcome = transcription_callback.on_job_failed(
+            *clients, detail['TranscriptionJobName'], detail.get('FailureReason')
+        )
+        return {'statusCode': 200, 'job_name': detail['TranscriptionJobName'], 'outcome': outcome}
+
+    return {'statusCode': 400, 'error': 'Unsupported event'}
@@ -0,0 +1,46 @@
+import json
+import os
+import sys
+
+# Shared helpers live in lambdas-local/shared (shipped as a Lambda layer under /opt/python)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'shared'))
+
+import aws_clients
+import config_store
+import message_coalescer
+import wa_router
+
+# Create the clients during the init phase so warm invocations reuse them
+aws_clients.warm('dynamodb', 'stepfunctions', 'socialmessaging')
+
+def handler(event, context):
+    """
+    SQS batch of WhatsApp notifications -> one state machine execution per
+    message, like the PHP WaMessageRouterHandler, but with the records
+    processed concurrently (in order per contact) and only the failed ones
+    returned for retry: {batchItemFailures: [{itemIdentifier}]}.
+    """
+    records = event.get('Records', [])
+    print(f"Event: {json.dumps({'records': len(records)})}")
+    aws_clients.start_invocation()
+
+    store = config_store.get_store()
+    try:
+        # One BatchGetItem for every clone in the batch; per-record lookups then hit memory
+        store.prefetch_sqs_batch(records)
+    except Exception as e:
+        print(f"Config prefetch failed: {str(e)}")
+
+    coalescer = None
+    if message_coalescer.COALESCE_WINDOW_SECONDS > 0:
+        coalescer = message_coalescer.Coalescer(aws_clients.dynamodb(), aws_clients.sqs())
+    router = wa_router.Router(store, aws_clients.stepfunctions(), aws_clients.social_messaging(),
+                              coalescer=coalescer)
+    failures, report = wa_router.route_batch(
+        records,
+        router.process,
+        remaining_ms=getattr(context, 'get_remaining_time_in_millis', None)
+    )
+    print(f"Router: {json.dumps(dict(report, config=store.stats()))}")
+
+    return {'batchItemFailures': failures}
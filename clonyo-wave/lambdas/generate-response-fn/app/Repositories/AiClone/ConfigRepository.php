@@ -12,10 +12,15 @@ class ConfigRepository implements \App\Contracts\AiClone\ConfigRepository
 {
     public const KEY_NAME = 'wa_phone_number_arn';
 
+    public const VERSION_KEY_NAME = 'name';
+
+    public const VERSION_KEY = 'config';
+
     public function __construct(
         protected string $table_name,
         protected DynamoDbClient $client,
-        protected Marshaler $marshaler
+        protected Marshaler $marshaler,
+        protected ?string $version_table_name = null
     ) {}
 
     public function get(string $key_value, string $key_name = self::KEY_NAME): ?ConfigData
@@ -46,6 +51,8 @@ public function put(ConfigData $config): bool
                 'Item' => $this->marshaler->marshalJson($config->jsonEncode()),
             ]);
 
+            $this->bumpVersion();
+
             return $result->get('@metadata')['statusCode'] == 200;
         } catch (AwsException $exception) {
             Log::error($exception->getMessage(), [
@@ -55,4 +62,30 @@ public function put(ConfigData $config): bool
             return false;
         }
     }
+
+    /**
+     * Move the table-wide change counter, so the containers caching configs
+     * (lambdas-local/shared/config_store.py) drop their copy.
+     */
+    protected function bumpVersion(): void
+    {
+        if (empty($this->version_table_name)) {
+            return;
+        }
+
+        $this->client->updateItem([
+            'TableName' => $this->version_table_name,
+            'Key' => [
+                self::VERSION_KEY_NAME => [
+                    'S' => self::VERSION_KEY,
+                ],
+            ],
+            'UpdateExpression' => 'ADD config_version :one',
+            'ExpressionAttributeValues' => [
+                ':one' => [
+                    'N' => '1',
+                ],
+            ],
+        ]);
+    }
 }
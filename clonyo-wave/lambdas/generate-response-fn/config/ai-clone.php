@@ -21,6 +21,8 @@
             ],
         ],
         'config_table' => env('ROUTER_CONFIG_TABLE', 'config-table'),
+        // Change counter bumped on every put, read by the Python config cache (config_store.py)
+        'config_version_table' => env('ROUTER_CONFIG_VERSION_TABLE'),
     ],
 
     'response_generator' => [
@@ -1,50 +1,49 @@
 import json
-import boto3
-import requests
 import os
+import sys
+import requests
 from botocore.exceptions import ClientError
 
+# Shared helpers from lambdas-local/shared: this path from the repo, the
+# sidea-ai-clone-shared layer (/opt/python) when packaged (scripts/package-shared-layer.sh)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'lambdas-local', 'shared'))
+
+import aws_clients
+import tts_stream
+
+# Module-scope clients: the S3 client and the keep-alive ElevenLabs session
+# are created once per container and reused on warm invocations
+aws_clients.warm('s3')
+tts_stream.http_session()
+
+OUTPUT_FORMAT = 'mp3_22050_32'
+
 def lambda_handler(event, context):
     # Configurazione
     ELEVENLABS_API_KEY = os.environ['ELEVENLABS_API_KEY']
     VOICE_ID = os.environ['VOICE_ID']  # ID della voce da utilizzare
     S3_BUCKET = os.environ['S3_BUCKET']  # Nome del bucket S3
+    aws_clients.start_invocation()
     
     try:
-        # URL ElevenLabs
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{VOICE_ID}/stream"
-        url += "?optimize_streaming_latency=0&output_format=mp3_22050_32"
+        # Nome file audio (puoi personalizzarlo)
+        audio_file = f"audio_{context.aws_request_id}.mp3"
         
-        # Preparazione payload
-        payload = {
-            "text": event.get('text', ''),  # Testo da convertire
-            "voice_settings": {
+        # Streaming ElevenLabs -> upload multipart su S3: l'audio non viene mai
+        # tenuto tutto in memoria (al massimo una parte da 5 MiB)
+        upload = tts_stream.stream_tts_to_s3(
+            aws_clients.s3(),
+            event.get('text', ''),  # Testo da convertire
+            VOICE_ID,
+            ELEVENLABS_API_KEY,
+            S3_BUCKET,
+            audio_file,
+            output_format=OUTPUT_FORMAT,
+            voice_settings={
                 "stability": 0.48,
                 "similarity_boost": 0.5,
                 "style": 0.78
             }
-        }
-        
-        # Headers per la richiesta
-        headers = {
-            'Content-Type': 'application/json',
-            'xi-api-key': ELEVENLABS_API_KEY
-        }
-        
-        # Chiamata API ElevenLabs
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        
-        # Nome file audio (puoi personalizzarlo)
-        audio_file = f"audio_{context.aws_request_id}.mp3"
-        
-        # Upload su S3
-        s3 = boto3.client('s3')
-        s3.put_object(
-            Bucket=S3_BUCKET,
-            Key=audio_file,
-            Body=response.content,
-            ContentType='audio/mpeg'
         )
         
         return {
@@ -52,7 +51,9 @@ def lambda_handler(event, context):
             'body': json.dumps({
                 'message': 'Audio generato e salvato con successo',
                 'file': audio_file,
-                'bucket': S3_BUCKET
+                'bucket': S3_BUCKET,
+                'upload': upload,
+                'clients': aws_clients.stats()
             })
         }
         
@@ -79,4 +80,4 @@ def lambda_handler(event, context):
                 'error': 'Errore generico',
                 'details': str(e)
             })
-        }
\ No newline at end of file
+        }
@@ -30,7 +30,10 @@ public function register(): void
 
         $this->app->singleton(
             \App\Contracts\AiClone\ConfigRepository::class,
-            fn (Application $app) => $app->makeWith(ConfigRepository::class, ['table_name' => $app->make('config')->get('ai-clone.router.config_table')])
+            fn (Application $app) => $app->makeWith(ConfigRepository::class, [
+                'table_name' => $app->make('config')->get('ai-clone.router.config_table'),
+                'version_table_name' => $app->make('config')->get('ai-clone.router.config_version_table'),
+            ])
         );
 
         $this->app->bind(
@@ -1,12 +1,23 @@
-import boto3
 import os
+import sys
 import json
 
+# Shared client registry from lambdas-local/shared: this path from the repo, the
+# sidea-ai-clone-shared layer (/opt/python) when packaged (scripts/package-shared-layer.sh)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'lambdas-local', 'shared'))
+
+import aws_clients
+import prompt_cache
+
+# Module-scope clients: created once per container, reused on warm invocations
+aws_clients.warm('bedrock-agent-runtime')
+aws_clients.get_client('bedrock-runtime', 'eu-west-3')
+
+MODEL_ID = os.environ.get('BEDROCK_MODEL_ID', 'eu.anthropic.claude-3-5-sonnet-20240620-v1:0')
 
 
 def get_knowledge_base_content(message=None, id_kbase='WLSH0SUKNB'):
-    session = boto3.Session(region_name='eu-west-1')
-    client = session.client('bedrock-agent-runtime')
+    client = aws_clients.bedrock_agent_runtime('eu-west-1')
     response = client.retrieve(
         knowledgeBaseId=id_kbase,
         retrievalConfiguration={
@@ -14,30 +25,41 @@ def get_knowledge_base_content(message=None, id_kbase='WLSH0SUKNB'):
         },
         retrievalQuery={"text": message}
     )
-    docs_content = "\n\n".join([doc['content']['text'] for doc in response['retrievalResults']])
-    return docs_content
+    return [doc['content']['text'] for doc in response['retrievalResults']]
 
-def build_prompt(domanda, text):
-    system_prompt = "Agisci come Luca Mazzucchelli, psicologo, psicoterapeuta e divulgatore italiano. Rispondi alla {domanda} con chiarezza, empatia e uno stile motivazionale. Date le informazioni rilevanti dalla domanda {text} devi generarmi una risposta come farebbe un psicologo. Utilizza i seguenti tag SSML per modulare la voce: <emphasis> per enfatizzare concetti chiave. <break time=\"x.xs\"/> per inserire pause naturali. <prosody rate=\"...\" pitch=\"...\"> per variare velocità e intonazione."
-    user_prompt = "\n\nHuman: {domanda}\n\nAssistant:"
-    prompt_text = system_prompt + user_prompt
-    return prompt_text
+# Persona only: it is the same for every question, so it is the cacheable prefix
+SYSTEM_PROMPT = "Agisci come Luca Mazzucchelli, psicologo, psicoterapeuta e divulgatore italiano. Rispondi alla domanda con chiarezza, empatia e uno stile motivazionale. Date le informazioni rilevanti dal contesto devi generarmi una risposta come farebbe un psicologo. Utilizza i seguenti tag SSML per modulare la voce: <emphasis> per enfatizzare concetti chiave. <break time=\"x.xs\"/> per inserire pause naturali. <prosody rate=\"...\" pitch=\"...\"> per variare velocità e intonazione."
+
+def build_request(domanda, docs, history=None):
+    # KB docs change with every question: they go after the cached system prompt and history
+    return prompt_cache.build_request_for_model(
+        MODEL_ID,
+        SYSTEM_PROMPT,
+        history or [],
+        domanda,
+        kb_context=docs,
+        temperature=0.5,
+        max_tokens=4096
+    )
 
 
 def lambda_handler(event, context):
-    session = boto3.Session(region_name='eu-west-3')
-    bedrock_runtime = session.client('bedrock-runtime')
+    aws_clients.start_invocation()
+    bedrock_runtime = aws_clients.bedrock_runtime('eu-west-3')
     domanda = event['message']
-    text = get_knowledge_base_content(domanda)
-    prompt = build_prompt(domanda, text)
+    docs = get_knowledge_base_content(domanda)
+    request = build_request(domanda, docs, event.get('history'))
     response = bedrock_runtime.invoke_model(
-        modelId="eu.anthropic.claude-3-5-sonnet-20240620-v1:0",
-        body=bytes(json.dumps({"prompt": prompt, "temperature": 0.5,"max_tokens_to_sample":4096}), encoding='utf-8'),
+        modelId=MODEL_ID,
+        body=bytes(json.dumps(request), encoding='utf-8'),
         contentType="application/json",
         accept="application/json"
     )
     result = json.loads(response['body'].read())
+    usage = prompt_cache.usage_from_body(result)
     return {
         'statusCode': 200,
-        'body': result
+        'body': result,
+        'clients': aws_clients.stats(),
+        'prompt_cache': prompt_cache.log_usage(usage, clone=event.get('clone'), model_id=MODEL_ID)
     }
@@ -1,3 +1,4 @@
+import argparse
 import json
 
 def load_definition():
@@ -5,8 +6,8 @@ def load_definition():
         data = json.load(f)
     return json.loads(data['definition'])
 
-def save_definition(def_json):
-    with open('step-function-definition-local.json', 'w') as f:
+def save_definition(def_json, path='step-function-definition-local.json'):
+    with open(path, 'w') as f:
         json.dump(def_json, f, indent=4)
 
 def transform(def_json):
@@ -36,6 +37,11 @@ def transform(def_json):
         }
     }
     
+    # 3b. Expose the message text as a variable: AnalyzeTopic and Check Sufficiency read $userInput
+    states['TransformForResponse']['Assign'] = {
+        "userInput": states['TransformForResponse']['Output']['userInput']
+    }
+    
     # 4. Modify 'Evaluate message type' & 'Store WA received message'
     # Store WA received message: Next -> AnalyzeTopic
     states['Store WA received message']['Next'] = "AnalyzeTopic"
@@ -53,6 +59,7 @@ def transform(def_json):
         "Type": "Task",
         "Resource": "arn:aws:states:::lambda:invoke",
         "ResultPath": "$.topicResult",
+        "Output": "{% $states.input %}", # results are consumed through Assign only
         "Arguments": {
             "FunctionName": "arn:aws:lambda:eu-west-1:000000000000:function:topic-analyzer-fn",
             "Payload": {
@@ -95,6 +102,7 @@ def transform(def_json):
         "Type": "Task",
         "Resource": "arn:aws:states:::lambda:invoke",
         "ResultPath": "$.sufficiencyResult",
+        "Output": "{% $states.input %}",
         "Arguments": {
             "FunctionName": "arn:aws:lambda:eu-west-1:000000000000:function:context-evaluator-fn",
             "Payload": {
@@ -133,6 +141,7 @@ def transform(def_json):
             }
         },
         "ResultPath": "$.kbResult",
+        "Output": "{% $states.input %}",
         "Next": "Get reply strategy",
         "Assign": {
             "kb_docs": "{% $states.result.RetrievalResults %}"
@@ -145,8 +154,13 @@ def transform(def_json):
     # 11. Update Get Reply Strategy Lambda ARN
     states['Get reply strategy']['Arguments']['FunctionName'] = "arn:aws:lambda:eu-west-1:000000000000:function:reply-strategy-fn"
     
-    # 12. Update Build Knowledge based response Lambda ARN
+    # 12. Update Build Knowledge based response Lambda ARN; pass the clone's
+    # phone number ARN so generate-response-fn can look up its stored config
     states['Build Knowledge based response']['Arguments']['FunctionName'] = "arn:aws:lambda:eu-west-1:000000000000:function:generate-response-fn"
+    states['Build Knowledge based response']['Arguments']['Payload'] = (
+        "{% $merge([$states.input,{\"complexity_factor\": $complexity_factor, "
+        "\"wa_phone_number_arn\": $wa_phone_number_arn}]) %}"
+    )
     
     # 13. Update Generate audio from text Lambda ARN
     states['Generate audio from text']['Arguments']['FunctionName'] = "arn:aws:lambda:eu-west-1:000000000000:function:text-to-speech-fn"
@@ -161,7 +175,8 @@ def transform(def_json):
     # 16. Update Store WA sent message Next -> Update Session Meta
     states['Store WA sent message']['Next'] = "Update Session Meta"
     
-    # 17. Add Update Session Meta
+    # 17. Add Update Session Meta (the topic of the reply is what ManageSession
+    # hands back when the session is resumed or rotated)
     states['Update Session Meta'] = {
         "Type": "Task",
         "Resource": "arn:aws:states:::dynamodb:updateItem",
@@ -170,18 +185,490 @@ def transform(def_json):
             "Key": {
                 "session_id": {"S": "{% $session_id %}"}
             },
-            "UpdateExpression": "SET last_active_at = :now",
+            "UpdateExpression": "SET last_active_at = :now, current_topic_id = :topic",
             "ExpressionAttributeValues": {
-                ":now": {"N": "{% $string($round($millis() / 1000)) %}"}
+                ":now": {"N": "{% $string($round($millis() / 1000)) %}"},
+                ":topic": {"S": "{% $topic_id %}"}
             }
         },
+        "Next": "Update Current Session Topic"
+    }
+    
+    # 18. Copy the topic to the contact's current-session item, read by the
+    # Python session-manager-fn (after the reply: best effort)
+    states['Update Current Session Topic'] = {
+        "Type": "Task",
+        "Resource": "arn:aws:states:::dynamodb:updateItem",
+        "Arguments": {
+            "TableName": "sidea-ai-clone-prod-sessions-table",
+            "Key": {
+                "session_id": {"S": "{% 'CURRENT#' & $wa_contact_id %}"}
+            },
+            "UpdateExpression": "SET current_topic_id = :topic",
+            "ExpressionAttributeValues": {
+                ":topic": {"S": "{% $topic_id %}"}
+            }
+        },
+        "Catch": [
+            {
+                "ErrorEquals": ["States.ALL"],
+                "Next": "Success"
+            }
+        ],
         "Next": "Success"
     }
 
     return def_json
 
+def enable_streaming(def_json):
+    """
+    Switch 'Build Knowledge based response' to the streaming response mode.
+    The Lambda delivers text replies on WhatsApp chunk by chunk, so the
+    'Reply to WA User with text' step is skipped when it reports delivered.
+
+    The sends happen inside the Task, so its retries must not send the reply
+    again: the execution id goes in as delivery_id and a PartialDeliveryError,
+    raised when the reply fails after some chunks reached the user (or an
+    attempt finds chunks sent by an earlier one), is not retried but caught:
+    'Load delivered chunks' reads the chunks that were sent from the delivery
+    item and stores them as the reply.
+    """
+    states = def_json['States']
+    build = states['Build Knowledge based response']
+
+    build['Arguments']['Payload'] = (
+        "{% $merge([$states.input,{"
+        "\"complexity_factor\": $complexity_factor, "
+        "\"response_mode\": \"stream\", "
+        "\"output_message_type\": $output_message_type, "
+        "\"reply_to_wa_id\": $reply_to_wa_id, "
+        "\"wa_phone_number_arn\": $wa_phone_number_arn, "
+        "\"delivery_id\": $states.context.Execution.Id"
+        "}]) %}"
+    )
+    # First matching retrier wins: partial deliveries stop here, the rest keep the original policy
+    build['Retry'] = [
+        {"ErrorEquals": ["PartialDeliveryError"], "MaxAttempts": 0}
+    ] + [retrier for retrier in build.get('Retry', []) if 'PartialDeliveryError' not in retrier['ErrorEquals']]
+    build['Catch'] = [
+        {"ErrorEquals": ["PartialDeliveryError"], "Next": "Load delivered chunks"}
+    ] + [catcher for catcher in build.get('Catch', []) if 'PartialDeliveryError' not in catcher['ErrorEquals']]
+    build['Assign']['response_delivered'] = (
+        "{% $exists($states.result.Payload.delivered) ? $states.result.Payload.delivered : false %}"
+    )
+    build['Next'] = "Already delivered?"
+
+    states['Load delivered chunks'] = {
+        "Type": "Task",
+        "Resource": "arn:aws:states:::dynamodb:getItem",
+        "Arguments": {
+            "TableName": "sidea-ai-clone-prod-messages-table",
+            "Key": {
+                "pk": {"S": "{% 'D#' & $states.context.Execution.Id %}"},
+                "sk": {"S": "STREAM"}
+            },
+            "ConsistentRead": True
+        },
+        "Output": "{% $states.input %}",
+        "Assign": {
+            "output_message_content": "{% $join([$states.result.Item.chunks.L.S], ' ') %}",
+            "response_delivered": True
+        },
+        "Next": "Store WA sent message"
+    }
+
+    states['Already delivered?'] = {
+        "Type": "Choice",
+        "Choices": [
+            {
+                "Condition": "{% $response_delivered = true %}",
+                "Next": "Store WA sent message"
+            }
+        ],
+        "Default": "Choose output type"
+    }
+
+    return def_json
+
+def enable_pre_generation(def_json):
+    """
+    Replace AnalyzeTopic, Check Sufficiency and Get reply strategy with the
+    fused pre-generation-fn (one Haiku call for all three decisions).
+
+    Store WA received message -> Get Session History -> PreGeneration
+        -> Is Sufficient? -> (Query Static KB) -> Build Knowledge based response
+    """
+    states = def_json['States']
+
+    states['Store WA received message']['Next'] = "Get Session History"
+    states['Get Session History']['Next'] = "PreGeneration"
+
+    states['PreGeneration'] = {
+        "Type": "Task",
+        "Resource": "arn:aws:states:::lambda:invoke",
+        "Output": "{% $states.input %}",
+        "Arguments": {
+            "FunctionName": "arn:aws:lambda:eu-west-1:000000000000:function:pre-generation-fn",
+            "Payload": {
+                "userInput": "{% $states.input.userInput %}",
+                "original_input_type": "{% $states.input.original_input_type %}",
+                "current_topic_id": "{% $current_topic_id %}",
+                "history": "{% $historical_context %}"
+            }
+        },
+        "Retry": [
+            {
+                "ErrorEquals": [
+                    "Lambda.ServiceException",
+                    "Lambda.AWSLambdaException",
+                    "Lambda.SdkClientException",
+                    "Lambda.TooManyRequestsException"
+                ],
+                "IntervalSeconds": 1,
+                "MaxAttempts": 3,
+                "BackoffRate": 2,
+                "JitterStrategy": "FULL"
+            }
+        ],
+        "Next": "Is Sufficient?",
+        "Assign": {
+            "topic_id": "{% $states.result.Payload.topic_id %}",
+            "topic_keywords": "{% $states.result.Payload.keywords %}",
+            "is_sufficient": "{% $states.result.Payload.sufficient %}",
+            "output_message_type": "{% $states.result.Payload.mode %}",
+            "complexity_factor": "{% $states.result.Payload.complexity_factor %}"
+        }
+    }
+
+    states['Is Sufficient?']['Choices'][0]['Next'] = "Build Knowledge based response"
+    states['Query Static KB']['Next'] = "Build Knowledge based response"
+
+    for name in ('AnalyzeTopic', 'Check Sufficiency', 'Get reply strategy'):
+        del states[name]
+
+    return def_json
+
+def enable_history_window(def_json):
+    """
+    Keep the rolling history window (running summary + last turns) up to
+    date: history-window-fn runs right after 'Store WA sent message'.
+    generate-response-fn reads the window instead of the raw last messages.
+    """
+    states = def_json['States']
+
+    states['Update History Window'] = {
+        "Type": "Task",
+        "Resource": "arn:aws:states:::lambda:invoke",
+        "Output": "{% $states.input %}",
+        "Arguments": {
+            "FunctionName": "arn:aws:lambda:eu-west-1:000000000000:function:history-window-fn",
+            "Payload": {
+                "messages_key": "{% 'S#' & $wa_phone_number_arn & '#C#' & $wa_contact_id %}",
+                "session_id": "{% $session_id %}",
+                "user_message": "{% $userInput %}",
+                "assistant_message": "{% $output_message_content %}"
+            }
+        },
+        # The reply is already out: a failed update must not fail the execution
+        "Catch": [
+            {
+                "ErrorEquals": ["States.ALL"],
+                "Output": "{% $states.input %}",
+                "Next": states['Store WA sent message']['Next']
+            }
+        ],
+        "Next": states['Store WA sent message']['Next']
+    }
+    states['Store WA sent message']['Next'] = "Update History Window"
+
+    return def_json
+
+# Seconds 'Wait for transcript' waits for the callback before falling back to
+# polling: about what Transcribe takes for a WhatsApp voice note, so when the
+# callback is missing the job is done by the first poll and the fallback costs
+# at most this instead of the old loop's 0-5 s lag on top of the job
+TRANSCRIPTION_CALLBACK_TIMEOUT = 30
+
+def enable_transcription_callback(def_json):
+    """
+    Replace the Wait (5s) -> GetTranscriptionJob -> Job finished? loop with a
+    task-token wait: Transcribe writes the transcript to the media bucket and
+    transcription-callback-fn resumes the execution from the S3 event, with
+    the transcript text as output. The polling loop stays as the fallback
+    if the callback times out (TRANSCRIPTION_CALLBACK_TIMEOUT) or the token
+    cannot be registered. init-scripts/01-setup.sh registers the function,
+    the S3 notification on transcripts/ and the EventBridge FAILED rule.
+    """
+    states = def_json['States']
+
+    start = states['StartTranscriptionJob']
+    start['Arguments']['OutputBucketName'] = "sidea-ai-clone-prod-wa-media-s3"
+    start['Arguments']['OutputKey'] = "transcripts/"
+    start['Next'] = "Wait for transcript"
+
+    states['Wait for transcript'] = {
+        "Type": "Task",
+        "Resource": "arn:aws:states:::lambda:invoke.waitForTaskToken",
+        "Arguments": {
+            "FunctionName": "arn:aws:lambda:eu-west-1:000000000000:function:transcription-callback-fn",
+            "Payload": {
+                "task_token": "{% $states.context.Task.Token %}",
+                "job_name": "{% $transcriptionJobName %}"
+            }
+        },
+        "TimeoutSeconds": TRANSCRIPTION_CALLBACK_TIMEOUT,
+        "Output": {
+            "transcript": "{% $states.result.transcript %}"
+        },
+        "Catch": [
+            {
+                "ErrorEquals": ["Transcription.Failed"],
+                "Next": "Fail"
+            },
+            {
+                "ErrorEquals": ["States.ALL"],
+                "Output": "{% $states.input %}",
+                "Next": "Wait for job to complete"
+            }
+        ],
+        "Next": "TransformForResponse"
+    }
+
+    return def_json
+
+def enable_local_stt(def_json):
+    """
+    Transcribe voice notes in speech-to-text-fn (in-process Whisper on CPU)
+    instead of an Amazon Transcribe job. A clone can still opt out with
+    config.transcription_backend = 'transcribe', and a failed local
+    transcription falls back to the Transcribe job.
+    """
+    states = def_json['States']
+
+    for choice in states['Evaluate message type']['Choices']:
+        if choice['Next'] == 'StartTranscriptionJob':
+            choice['Next'] = "Select transcription backend"
+
+    states['Select transcription backend'] = {
+        "Type": "Choice",
+        "Choices": [
+            {
+                "Next": "StartTranscriptionJob",
+                "Condition": "{% $exists($config.transcription_backend) and $config.transcription_backend = 'transcribe' %}",
+                "Comment": "transcribe"
+            }
+        ],
+        "Default": "Transcribe locally"
+    }
+
+    states['Transcribe locally'] = {
+        "Type": "Task",
+        "Resource": "arn:aws:states:::lambda:invoke",
+        "Arguments": {
+            "FunctionName": "arn:aws:lambda:eu-west-1:000000000000:function:speech-to-text-fn",
+            "Payload": {
+                "s3_uri": "{% $states.input.audio.s3_uri %}",
+                "language": "it-IT"
+            }
+        },
+        "TimeoutSeconds": 60,
+        "Retry": [
+            {
+                "ErrorEquals": [
+                    "Lambda.ServiceException",
+                    "Lambda.AWSLambdaException",
+                    "Lambda.SdkClientException",
+                    "Lambda.TooManyRequestsException"
+                ],
+                "IntervalSeconds": 1,
+                "MaxAttempts": 2,
+                "BackoffRate": 2,
+                "JitterStrategy": "FULL"
+            }
+        ],
+        "Catch": [
+            {
+                "ErrorEquals": ["States.ALL"],
+                "Output": "{% $states.input %}",
+                "Next": "StartTranscriptionJob"
+            }
+        ],
+        "Output": {
+            "transcript": "{% $states.result.Payload.transcript %}"
+        },
+        "Next": "TransformForResponse"
+    }
+
+    return def_json
+
+def enable_transcript_extract(def_json):
+    """
+    Have the Python get-file-contents-fn (registered by init-scripts/01-setup.sh
+    as get-file-contents-py-fn) stream the Transcribe JSON and return only the
+    transcript text, instead of the whole file as `content` parsed with
+    JSONata in the state output. A `content` answer (the PHP handler) is
+    still parsed as before.
+    """
+    states = def_json['States']
+
+    get_file = states['Get transcript file content']
+    get_file['Arguments']['FunctionName'] = "arn:aws:lambda:eu-west-1:000000000000:function:get-file-contents-py-fn"
+    get_file['Output'] = {
+        "transcript": "{% $exists($states.result.Payload.transcript) ? $states.result.Payload.transcript : $parse($states.result.Payload.content).results.transcripts[0].transcript %}"
+    }
+
+    return def_json
+
+def enable_topic_history(def_json):
+    """
+    Replace the empty 'Get Session History' Pass with history-retrieval-fn:
+    the top-K compact summaries of the message's topic, read with one query
+    on the topic history table, so Check Sufficiency has real memory to
+    judge. topic-history-fn folds every exchange into its topic summary
+    after 'Store WA sent message'. Both fall back to no memory on error.
+    """
+    states = def_json['States']
+    messages_key = "{% 'S#' & $wa_phone_number_arn & '#C#' & $wa_contact_id %}"
+    # With --fused the topic of the message is only known after PreGeneration
+    topic = "{% $topic_id %}" if 'AnalyzeTopic' in states else "{% $current_topic_id %}"
+    keywords = "{% $topic_keywords %}" if 'AnalyzeTopic' in states else []
+    after = states['Get Session History']['Next']
+
+    states['Get Session History'] = {
+        "Type": "Task",
+        "Resource": "arn:aws:states:::lambda:invoke",
+        "Output": "{% $states.input %}",
+        "Arguments": {
+            "FunctionName": "arn:aws:lambda:eu-west-1:000000000000:function:history-retrieval-fn",
+            "Payload": {
+                "messages_key": messages_key,
+                "topic_id": topic,
+                "keywords": keywords,
+                "userInput": "{% $userInput %}"
+            }
+        },
+        "Catch": [
+            {
+                "ErrorEquals": ["States.ALL"],
+                "Output": "{% $states.input %}",
+                "Assign": {
+                    "historical_context": []
+                },
+                "Next": after
+            }
+        ],
+        "Next": after,
+        "Assign": {
+            "historical_context": "{% $states.result.Payload.history %}"
+        }
+    }
+
+    states['Record Topic History'] = {
+        "Type": "Task",
+        "Resource": "arn:aws:states:::lambda:invoke",
+        "Output": "{% $states.input %}",
+        "Arguments": {
+            "FunctionName": "arn:aws:lambda:eu-west-1:000000000000:function:topic-history-fn",
+            "Payload": {
+                "messages_key": messages_key,
+                "topic_id": "{% $topic_id %}",
+                "keywords": "{% $topic_keywords %}",
+                "session_id": "{% $session_id %}",
+                "user_message": "{% $userInput %}",
+                "assistant_message": "{% $output_message_content %}"
+            }
+        },
+        # The reply is already out: a failed update must not fail the execution
+        "Catch": [
+            {
+                "ErrorEquals": ["States.ALL"],
+                "Output": "{% $states.input %}",
+                "Next": states['Store WA sent message']['Next']
+            }
+        ],
+        "Next": states['Store WA sent message']['Next']
+    }
+    states['Store WA sent message']['Next'] = "Record Topic History"
+
+    return def_json
+
+def enable_topic_registry(def_json):
+    """
+    Pass the contact to AnalyzeTopic (or the fused PreGeneration), so the
+    Python topic-analyzer-fn/pre-generation-fn take the topic from the
+    contact's topic registry (embedding match) instead of md5(topic name).
+    """
+    states = def_json['States']
+    messages_key = "{% 'S#' & $wa_phone_number_arn & '#C#' & $wa_contact_id %}"
+    for name in ('AnalyzeTopic', 'PreGeneration'):
+        if name in states:
+            states[name]['Arguments']['Payload']['messages_key'] = messages_key
+
+    return def_json
+
+def enable_context_assembly(def_json):
+    """
+    Pass the state machine's KB results and the retrieved topic history to
+    generate-response-fn, which packs them with its own KB retrieve into the
+    token budget of the complexity_factor. kb_docs starts empty where the
+    sufficiency is decided, for the messages that skip Query Static KB.
+    """
+    states = def_json['States']
+    decision = 'Check Sufficiency' if 'Check Sufficiency' in states else 'PreGeneration'
+    states[decision]['Assign']['kb_docs'] = []
+
+    build = states['Build Knowledge based response']
+    build['Arguments']['Payload'] = build['Arguments']['Payload'].replace(
+        "$merge([$states.input,{",
+        "$merge([$states.input,{\"kb_docs\": $kb_docs, \"historical_context\": $historical_context, ",
+        1
+    )
+
+    return def_json
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the LocalStack Step Function definition")
+    parser.add_argument('--streaming', action='store_true',
+                        help="use the streaming response mode of generate-response-fn")
+    parser.add_argument('--fused', action='store_true',
+                        help="use the fused pre-generation-fn instead of the AnalyzeTopic/Check Sufficiency/Get reply strategy chain")
+    parser.add_argument('--history-window', action='store_true',
+                        help="update the rolling history window (summary + last turns) after each reply")
+    parser.add_argument('--transcription-callback', action='store_true',
+                        help="resume audio messages from the transcript S3 event instead of polling Transcribe every 5s")
+    parser.add_argument('--transcript-extract', action='store_true',
+                        help="return only the transcript text from get-file-contents-fn, not the whole Transcribe JSON")
+    parser.add_argument('--stt-backend', choices=('transcribe', 'local'), default='transcribe',
+                        help="default transcription backend for voice notes (per clone: config.transcription_backend)")
+    parser.add_argument('--topic-history', action='store_true',
+                        help="read topic-indexed session summaries in 'Get Session History' instead of an empty history")
+    parser.add_argument('--topic-registry', action='store_true',
+                        help="assign topics from the per-contact embedding registry instead of md5(topic name)")
+    parser.add_argument('--context-assembly', action='store_true',
+                        help="pass the KB results and topic history to generate-response-fn for its token-budgeted context")
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_args()
     definition = load_definition()
     new_def = transform(definition)
+    if args.fused:
+        new_def = enable_pre_generation(new_def)
+    if args.topic_registry:
+        new_def = enable_topic_registry(new_def)
+    if args.streaming:
+        new_def = enable_streaming(new_def)
+    if args.history_window:
+        new_def = enable_history_window(new_def)
+    if args.topic_history:
+        new_def = enable_topic_history(new_def)
+    if args.context_assembly:
+        new_def = enable_context_assembly(new_def)
+    if args.transcription_callback:
+        new_def = enable_transcription_callback(new_def)
+    if args.transcript_extract:
+        new_def = enable_transcript_extract(new_def)
+    if args.stt_backend == 'local':
+        new_def = enable_local_stt(new_def)
     save_definition(new_def)
     print("Local definition created.")
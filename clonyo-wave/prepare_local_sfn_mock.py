@@ -36,36 +36,59 @@ def mock_lambda_states(states):
         }
     }
     
-    # 2. AnalyzeTopic - Mock
-    states['AnalyzeTopic'] = {
-        "Type": "Pass",
-        "Comment": "MOCKED: Returns fake topic analysis",
-        "Result": {
-            "topic_id": "finance-etf-123",
-            "topic_name": "Finanza - ETF",
-            "keywords": ["ETF", "investimenti", "fondi"]
-        },
-        "ResultPath": "$.topicResult",
-        "Next": "Get Session History",
-        "Assign": {
-            "topic_id": "{% $states.result.topic_id %}",
-            "topic_keywords": "{% $states.result.keywords %}"
+    # 2. AnalyzeTopic - Mock (assente nella versione fused)
+    if 'AnalyzeTopic' in states:
+        states['AnalyzeTopic'] = {
+            "Type": "Pass",
+            "Comment": "MOCKED: Returns fake topic analysis",
+            "Result": {
+                "topic_id": "finance-etf-123",
+                "topic_name": "Finanza - ETF",
+                "keywords": ["ETF", "investimenti", "fondi"]
+            },
+            "ResultPath": "$.topicResult",
+            "Next": "Get Session History",
+            "Assign": {
+                "topic_id": "{% $states.result.topic_id %}",
+                "topic_keywords": "{% $states.result.keywords %}"
+            }
+        }
+    
+    # 2b. Get Session History - Mock (solo con --topic-history, altrimenti è già un Pass)
+    if states.get('Get Session History', {}).get('Type') == 'Task':
+        states['Get Session History'] = {
+            "Type": "Pass",
+            "Comment": "MOCKED: Returns topic history summaries",
+            "Result": {
+                "history": [
+                    {
+                        "topic_id": "investimenti",
+                        "session_id": "mock-session-00001",
+                        "summary": "user: Vorrei informazioni sui fondi comuni di investimento.\nassistant: I fondi obbligazionari sono i meno volatili.",
+                        "updated_at": 1738330000
+                    }
+                ]
+            },
+            "Next": states['Get Session History']['Next'],
+            "Assign": {
+                "historical_context": "{% $states.result.history %}"
+            }
         }
-    }
     
     # 3. Check Sufficiency - Mock (sempre insufficient per testare KB query)
-    states['Check Sufficiency'] = {
-        "Type": "Pass",
-        "Comment": "MOCKED: Returns insufficient to test KB path",
-        "Result": {
-            "sufficient": False
-        },
-        "ResultPath": "$.sufficiencyResult",
-        "Next": "Is Sufficient?",
-        "Assign": {
-            "is_sufficient": "{% $states.result.sufficient %}"
+    if 'Check Sufficiency' in states:
+        states['Check Sufficiency'] = {
+            "Type": "Pass",
+            "Comment": "MOCKED: Returns insufficient to test KB path",
+            "Result": {
+                "sufficient": False
+            },
+            "ResultPath": "$.sufficiencyResult",
+            "Next": "Is Sufficient?",
+            "Assign": {
+                "is_sufficient": "{% $states.result.sufficient %}"
+            }
         }
-    }
     
     # 4. Query Static KB - Mock (sostituisce Bedrock Agent Runtime)
     states['Query Static KB'] = {
@@ -86,27 +109,52 @@ def mock_lambda_states(states):
             ]
         },
         "ResultPath": "$.kbResult",
-        "Next": "Get reply strategy",
+        "Next": states['Query Static KB']['Next'],
         "Assign": {
             "kb_docs": "{% $states.result.RetrievalResults %}"
         }
     }
     
-    # 5. Get reply strategy - Mock
-    states['Get reply strategy'] = {
-        "Type": "Pass",
-        "Comment": "MOCKED: Returns text mode with medium complexity",
-        "Result": {
-            "mode": "text",
-            "complexity_factor": 0.6
-        },
-        "ResultPath": "$.strategyResult",
-        "Next": "Build Knowledge based response",
-        "Assign": {
-            "output_message_type": "{% $states.result.mode %}",
-            "complexity_factor": "{% $states.result.complexity_factor %}"
+    # 5. Get reply strategy - Mock (assente nella versione fused)
+    if 'Get reply strategy' in states:
+        states['Get reply strategy'] = {
+            "Type": "Pass",
+            "Comment": "MOCKED: Returns text mode with medium complexity",
+            "Result": {
+                "mode": "text",
+                "complexity_factor": 0.6
+            },
+            "ResultPath": "$.strategyResult",
+            "Next": "Build Knowledge based response",
+            "Assign": {
+                "output_message_type": "{% $states.result.mode %}",
+                "complexity_factor": "{% $states.result.complexity_factor %}"
+            }
+        }
+    
+    # 5b. PreGeneration - Mock (solo versione fused: topic + sufficiency + strategy)
+    if 'PreGeneration' in states:
+        states['PreGeneration'] = {
+            "Type": "Pass",
+            "Comment": "MOCKED: Returns fake fused pre-generation analysis",
+            "Result": {
+                "topic_id": "finance-etf-123",
+                "topic_name": "Finanza - ETF",
+                "keywords": ["ETF", "investimenti", "fondi"],
+                "sufficient": False,
+                "mode": "text",
+                "complexity_factor": 0.6
+            },
+            "ResultPath": "$.preGenerationResult",
+            "Next": "Is Sufficient?",
+            "Assign": {
+                "topic_id": "{% $states.result.topic_id %}",
+                "topic_keywords": "{% $states.result.keywords %}",
+                "is_sufficient": "{% $states.result.sufficient %}",
+                "output_message_type": "{% $states.result.mode %}",
+                "complexity_factor": "{% $states.result.complexity_factor %}"
+            }
         }
-    }
     
     # 6. Build Knowledge based response - Mock
     states['Build Knowledge based response'] = {
@@ -116,11 +164,14 @@ def mock_lambda_states(states):
             "response": "Gli ETF sono fondi indicizzati che replicano l'andamento di un indice di mercato. Per investire in ETF, ti consiglio di: 1) Aprire un conto titoli presso una banca o broker online, 2) Identificare gli ETF più adatti al tuo profilo di rischio, 3) Considerare ETF ad accumulazione per beneficiare dell'interesse composto."
         },
         "ResultPath": "$.responseResult",
-        "Next": "Choose output type",
+        "Next": states['Build Knowledge based response']['Next'],
         "Assign": {
             "output_message_content": "{% $states.result.response %}"
         }
     }
+    if states['Build Knowledge based response']['Next'] == 'Already delivered?':
+        # Versione streaming: il mock non consegna nulla su WhatsApp
+        states['Build Knowledge based response']['Assign']['response_delivered'] = False
     
     # 7. Generate audio from text - Mock (se mai chiamato)
     if 'Generate audio from text' in states:
@@ -134,6 +185,22 @@ def mock_lambda_states(states):
             "Next": "PostWhatsAppMessageMedia"
         }
     
+    # 7b. Update History Window - Mock (solo con --history-window)
+    if 'Update History Window' in states:
+        states['Update History Window'] = {
+            "Type": "Pass",
+            "Comment": "MOCKED: History window update",
+            "Next": states['Update History Window']['Next']
+        }
+    
+    # 7c. Record Topic History - Mock (solo con --topic-history)
+    if 'Record Topic History' in states:
+        states['Record Topic History'] = {
+            "Type": "Pass",
+            "Comment": "MOCKED: Topic history update",
+            "Next": states['Record Topic History']['Next']
+        }
+    
     # 8. Get transcript file content - Mock (per audio input)
     if 'Get transcript file content' in states:
         states['Get transcript file content'] = {
@@ -216,6 +283,28 @@ def mock_transcribe_states(states):
             }
         }
     
+    # Wait for transcript - Mock (solo con --transcription-callback)
+    if 'Wait for transcript' in states:
+        states['Wait for transcript'] = {
+            "Type": "Pass",
+            "Comment": "MOCKED: Transcript delivered by the S3 event callback",
+            "Result": {
+                "transcript": "Ciao, vorrei sapere come investire in ETF"
+            },
+            "Next": "TransformForResponse"
+        }
+    
+    # Transcribe locally - Mock (solo con --stt-backend local)
+    if 'Transcribe locally' in states:
+        states['Transcribe locally'] = {
+            "Type": "Pass",
+            "Comment": "MOCKED: Voice note transcribed by speech-to-text-fn",
+            "Result": {
+                "transcript": "Ciao, vorrei sapere come investire in ETF"
+            },
+            "Next": "TransformForResponse"
+        }
+    
     # Wait - Riduci a 1 secondo per test più veloci
     if 'Wait for job to complete' in states:
         states['Wait for job to complete']['Seconds'] = 1
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Dependency-aware Parallel transform for the local Step Function definition.
+
+Reads step-function-definition-local.json (created by prepare_local_sfn.py),
+looks at the variables each state Assigns and consumes ($topic_id,
+$historical_context, $userInput, ...) inside the pre-generation stage and
+groups independent Tasks into ASL Parallel states.
+
+Writes step-function-definition-local-parallel.json and prints the
+critical-path latency estimate of both definitions (sfn_latency.py).
+"""
+
+import argparse
+import copy
+import json
+import re
+
+import sfn_latency
+
+# $name not followed by "(" -> variable (JSONata functions are $name(...))
+VARIABLE = re.compile(r'\$([A-Za-z_]\w*)(?!\w)(?!\s*\()')
+
+STATES_INPUT = '$states.input'
+PASSTHROUGH = '{% $states.input %}'
+
+# Only these can be moved into a Parallel branch; other Tasks (DynamoDB
+# writes, WhatsApp calls) have side effects and keep their position
+GROUPABLE_RESOURCES = ('arn:aws:states:::lambda:invoke',)
+
+
+def load_local_definition(path='step-function-definition-local.json'):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_parallel_definition(def_json, path='step-function-definition-local-parallel.json'):
+    with open(path, 'w') as f:
+        json.dump(def_json, f, indent=4)
+
+
+class Node:
+    """A single state, or a Choice block (the Choice plus its branches up to the join)."""
+
+    def __init__(self, names, states):
+        self.names = names
+        self.states = [states[name] for name in names]
+        self.reads = set()
+        self.writes = set()
+        self.reads_input = False
+        for state in self.states:
+            body = {k: v for k, v in state.items() if k not in ('Assign', 'Next', 'Default', 'Comment')}
+            text = json.dumps(body) + json.dumps(list(state.get('Assign', {}).values()))
+            self.reads |= {name for name in VARIABLE.findall(text) if name != 'states'}
+            self.writes |= set(state.get('Assign', {}).keys())
+            self.reads_input = self.reads_input or STATES_INPUT in text
+
+    @property
+    def name(self):
+        return self.names[0]
+
+    @property
+    def is_block(self):
+        return len(self.names) > 1 or self.states[0].get('Type') == 'Choice'
+
+    @property
+    def groupable(self):
+        if self.is_block:
+            return False
+        state = self.states[0]
+        if state.get('Type') == 'Pass':
+            return True
+        return state.get('Type') == 'Task' and state.get('Resource', '').startswith(GROUPABLE_RESOURCES)
+
+    @property
+    def transparent(self):
+        """True if the node hands its own input on unchanged."""
+        for state in self.states:
+            if state.get('Type') in ('Choice', 'Wait'):
+                continue
+            if 'Output' in state:
+                if state['Output'] != PASSTHROUGH:
+                    return False
+            elif state.get('Type') != 'Pass':
+                return False
+        return True
+
+
+def _linear_path(states, start, stop, limit=50):
+    path = []
+    name = start
+    while name and name != stop and len(path) < limit:
+        path.append(name)
+        state = states[name]
+        if state.get('Type') in ('Choice', 'Succeed', 'Fail') or state.get('End'):
+            break
+        name = state.get('Next')
+    return path
+
+
+def _choice_block(states, choice_name, stop):
+    """States of a Choice region and the state where all its branches join."""
+    choice = states[choice_name]
+    targets = [c['Next'] for c in choice.get('Choices', [])] + [choice.get('Default')]
+    # Join = first state of the first path reached by every other path
+    reach = [set(_linear_path(states, t, None)) | {t} for t in targets if t]
+    for candidate in _linear_path(states, targets[0], None) or [targets[0]]:
+        if all(candidate in r for r in reach):
+            join = candidate
+            break
+    else:
+        return None, None
+
+    members = [choice_name]
+    for target in targets:
+        for name in _linear_path(states, target, join):
+            if name not in members:
+                members.append(name)
+    return members, join
+
+
+def collect_nodes(states, start, until):
+    """Nodes on the main path from `start` up to (excluding) `until`."""
+    nodes = []
+    name = start
+    while name and name != until:
+        state = states[name]
+        if state.get('Type') == 'Choice':
+            members, join = _choice_block(states, name, until)
+            if members is None:
+                break
+            nodes.append(Node(members, states))
+            name = join
+        else:
+            nodes.append(Node([name], states))
+            name = state.get('Next')
+    return nodes
+
+
+def schedule(nodes):
+    """
+    ASAP levels: a node goes one level after the latest earlier node it
+    depends on (reads its writes, overwrites what it reads or writes, or
+    consumes its output through $states.input). Blocks keep their order.
+    """
+    levels = []
+    for i, node in enumerate(nodes):
+        level = 0
+        for j in range(i):
+            other = nodes[j]
+            depends = (
+                node.reads & other.writes
+                or node.writes & (other.reads | other.writes)
+                or (node.is_block and other.is_block)
+                or (node.reads_input and not other.transparent and not any(
+                    not nodes[k].transparent for k in range(j + 1, i)
+                ))
+            )
+            if depends:
+                level = max(level, levels[j] + 1)
+        levels.append(level)
+    return levels
+
+
+def _branch(name, state):
+    state = copy.deepcopy(state)
+    state.pop('Next', None)
+    state['End'] = True
+    # Assignments inside a branch are not visible outside: return them as the
+    # branch output and re-assign them on the Parallel state
+    state['Output'] = state.pop('Assign', {})
+    return {"StartAt": name, "States": {name: state}}
+
+
+def parallelize(def_json, start, until):
+    states = def_json['States']
+    nodes = collect_nodes(states, start, until)
+    levels = schedule(nodes)
+
+    # Emit nodes level by level, groupable nodes of a level first
+    ordered = []
+    for level in sorted(set(levels)):
+        members = [n for n, l in zip(nodes, levels) if l == level]
+        groupable = [n for n in members if n.groupable]
+        others = [n for n in members if not n.groupable]
+        if len(groupable) > 1:
+            ordered.append(('parallel', groupable))
+        else:
+            others = groupable + others
+        ordered.extend(('node', [n]) for n in others)
+
+    groups = []
+    new_names = []
+    for kind, members in ordered:
+        if kind == 'parallel':
+            name = ("Parallel: " + " + ".join(n.name for n in members))[:80]  # ASL name limit
+            assign = {}
+            for index, node in enumerate(members):
+                for var in node.states[0].get('Assign', {}):
+                    assign[var] = f"{{% $states.result[{index}].{var} %}}"
+            states[name] = {
+                "Type": "Parallel",
+                "Comment": "Generated by prepare_local_sfn_parallel.py",
+                "Branches": [_branch(n.name, n.states[0]) for n in members],
+                "Output": PASSTHROUGH,
+                "Assign": assign,
+            }
+            for node in members:
+                del states[node.name]
+            groups.append([n.name for n in members])
+        else:
+            name = members[0].name
+        new_names.append((name, kind, members[0]))
+
+    # Re-link: predecessor of the region, each node's exit, the block joins
+    predecessor = next(k for k, v in states.items() if v.get('Next') == start)
+    states[predecessor]['Next'] = new_names[0][0]
+    for (name, kind, node), (next_name, _, _) in zip(new_names, new_names[1:] + [(until, None, None)]):
+        if kind == 'node' and node.is_block:
+            for member in node.names:
+                _relink_block_exit(states[member], node.names, next_name)
+        else:
+            states[name]['Next'] = next_name
+
+    return def_json, groups
+
+
+def _relink_block_exit(state, members, next_name):
+    for choice in state.get('Choices', []):
+        if choice['Next'] not in members:
+            choice['Next'] = next_name
+    if state.get('Type') == 'Choice':
+        if state.get('Default') not in members:
+            state['Default'] = next_name
+    elif state.get('Next') not in members:
+        state['Next'] = next_name
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Group independent pre-generation Tasks into Parallel states")
+    parser.add_argument('--from', dest='start', default='AnalyzeTopic',
+                        help="first state of the region to parallelize")
+    parser.add_argument('--until', default='Build Knowledge based response',
+                        help="state that ends the region (not included)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    definition = load_local_definition()
+    sequential_ms, _ = sfn_latency.walk(definition)
+
+    parallel_def, groups = parallelize(copy.deepcopy(definition), args.start, args.until)
+    save_parallel_definition(parallel_def)
+
+    parallel_ms, path = sfn_latency.walk(parallel_def)
+
+    print("✅ Parallel definition created: step-function-definition-local-parallel.json\n")
+    for group in groups:
+        print(f"Parallel branches: {', '.join(group)}")
+    print("\nCritical path (warm, text message, KB path):")
+    print(sfn_latency.format_path(path))
+    print(f"\nSequential: {sequential_ms:.0f} ms")
+    print(f"Parallel:   {parallel_ms:.0f} ms")
+    print(f"Saved:      {sequential_ms - parallel_ms:.0f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+DynamoDB reads per SQS record for the clone config lookups of the router.
+
+Replays SQS batches of WhatsApp messages spread over --clones clones and
+resolves each record's config twice, as AbstractMessageProcessor does
+(enrichSfnInput + getSfnExecutionName), with:
+
+  getitem          a GetItem per lookup (the PHP ConfigRepository)
+  store            config_store.ConfigStore, per-container TTL cache
+  store+prefetch   the same, plus one BatchGetItem per SQS batch
+
+Reads count every DynamoDB request (GetItem, BatchGetItem, version
+checks). The first batch is the cold container, the rest are warm.
+Then a config is changed through put() in one "container" and the time
+until another one sees it is measured, against the version check
+interval. DynamoDB is LocalStack by default, or moto with --moto.
+
+Usage:
+    python3 scripts/bench_config_store.py [--moto] [--batches 20] [--batch-size 10] [--clones 5]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'lambdas-local', 'shared'))
+
+import config_store
+import wa_events
+from fake_wa_events import phone_number_arn, sqs_record
+
+ENDPOINT = os.environ.get('AWS_ENDPOINT_URL', 'http://localhost:4566')
+REGION = 'eu-west-1'
+TABLE = 'bench-config-table'
+VERSION_TABLE = 'bench-config-version-table'
+
+
+class Clock:
+    """Settable monotonic clock, to step over TTLs and check intervals."""
+
+    def __init__(self):
+        self.offset = 0.0
+
+    def __call__(self):
+        return time.monotonic() + self.offset
+
+
+class RequestCounter:
+
+    def __init__(self, client):
+        self.count = 0
+        client.meta.events.register('before-call.dynamodb', self._before_call)
+
+    def _before_call(self, **kwargs):
+        self.count += 1
+
+
+def clone_config(arn, index):
+    return {
+        'wa_phone_number_arn': arn,
+        'name': f"Bench Clone {index}",
+        'response_generator': {'kb_id': f"KB{index:04d}", 'temperature': 0.5, 'max_tokens': 1024,
+                               'system_prompt': "Sei un consulente finanziario esperto. " * 20},
+        'text_to_speech': {'voice_id': f"voice-{index}", 'stability': 0.76, 'similarity_boost': 0.88},
+    }
+
+
+def batches(args, seed=11):
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(args.clones)]
+    for b in range(args.batches):
+        yield [
+            sqs_record(phone_number_arn(rng.choices(range(args.clones), weights)[0]),
+                       f"3934{rng.randrange(10 ** 8):08d}", f"Messaggio {b}-{i}")
+            for i in range(args.batch_size)
+        ]
+
+
+def replay(dynamodb, counter, args, mode):
+    store = config_store.ConfigStore(table_name=TABLE, version_table_name=VERSION_TABLE, dynamodb=dynamodb) if mode != 'getitem' else None
+    reads, timings = [], []
+    for records in batches(args):
+        before = counter.count
+        started = time.perf_counter()
+        if mode == 'store+prefetch':
+            store.prefetch_sqs_batch(records)
+        for record in records:
+            arn = wa_events.record_phone_number_arn(record)
+            for _ in range(2):  # enrichSfnInput + getSfnExecutionName
+                if store is None:
+                    config = dynamodb.get_item(TableName=TABLE, Key={'wa_phone_number_arn': {'S': arn}}).get('Item')
+                else:
+                    config = store.get(arn)
+                assert config is not None
+        timings.append((time.perf_counter() - started) * 1000 / len(records))
+        reads.append((counter.count - before) / len(records))
+    return reads, timings, store
+
+
+def run(dynamodb, args):
+    dynamodb.create_table(
+        TableName=TABLE,
+        AttributeDefinitions=[{'AttributeName': 'wa_phone_number_arn', 'AttributeType': 'S'}],
+        KeySchema=[{'AttributeName': 'wa_phone_number_arn', 'KeyType': 'HASH'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.create_table(
+        TableName=VERSION_TABLE,
+        AttributeDefinitions=[{'AttributeName': 'name', 'AttributeType': 'S'}],
+        KeySchema=[{'AttributeName': 'name', 'KeyType': 'HASH'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    for table in (TABLE, VERSION_TABLE):
+        dynamodb.get_waiter('table_exists').wait(TableName=table)
+    writer = config_store.ConfigStore(table_name=TABLE, version_table_name=VERSION_TABLE, dynamodb=dynamodb)
+    for index in range(args.clones):
+        writer.put(clone_config(phone_number_arn(index), index))
+
+    counter = RequestCounter(dynamodb)
+    print(f"{args.batches} batches x {args.batch_size} records, {args.clones} clones, 2 lookups per record\n")
+    print(f"{'mode':<16}{'cold reads/rec':>15}{'warm reads/rec':>15}{'warm ms/rec':>12}{'hit rate':>10}")
+    for mode in ('getitem', 'store', 'store+prefetch'):
+        reads, timings, store = replay(dynamodb, counter, args, mode)
+        hit_rate = f"{store.stats()['hit_rate']:.1%}" if store is not None else '-'
+        warm = reads[1:] or reads
+        print(f"{mode:<16}{reads[0]:>15.2f}{statistics.mean(warm):>15.3f}"
+              f"{statistics.median(timings[1:] or timings):>12.3f}{hit_rate:>10}")
+
+    # Change propagation between two containers
+    clock = Clock()
+    reader = config_store.ConfigStore(table_name=TABLE, version_table_name=VERSION_TABLE, dynamodb=dynamodb, clock=clock)
+    arn = phone_number_arn(0)
+    reader.get(arn)
+    changed = dict(clone_config(arn, 0), name="Bench Clone 0 (edited)")
+    writer.put(changed)
+    stale_for = None
+    step = reader.version_check_interval / 10
+    for tick in range(30):
+        if reader.get(arn)['name'] == changed['name']:
+            stale_for = tick * step
+            break
+        clock.offset += step
+    print(f"\nedit visible to another container after {stale_for:.1f} s "
+          f"(version check every {reader.version_check_interval:g} s, TTL {reader.ttl} s): {reader.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--moto', action='store_true', help="in-process moto DynamoDB instead of LocalStack")
+    parser.add_argument('--batches', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--clones', type=int, default=5)
+    args = parser.parse_args()
+
+    import boto3
+
+    if args.moto:
+        from moto import mock_aws
+
+        with mock_aws():
+            run(boto3.client('dynamodb', region_name=REGION), args)
+    else:
+        run(boto3.client('dynamodb', endpoint_url=ENDPOINT, region_name=REGION), args)
+
+
+if __name__ == "__main__":
+    main()
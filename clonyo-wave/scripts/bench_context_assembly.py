@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Size and content of the per-message context: PHP, old local handler and
+the token-budgeted context_assembler.
+
+The KB is the generated corpus of scripts/bench_kb_index.py (product
+sheets, --chunk-chars chunks with --overlap, hashed embeddings, searched
+with kb_index). For each of --queries questions:
+
+- kb: the top --results chunks of the question (the function's retrieve);
+- legacy: the same search as raw RetrievalResults (score, S3 location and
+  metadata), what Query Static KB assigns to kb_docs;
+- history: 0-3 topic summaries of past sessions, as history-retrieval-fn
+  returns them.
+
+Compared, in estimated tokens of the context (context_assembler.
+CHARS_PER_TOKEN) of the last user turn: the PHP getUserContent
+(json_encode of kb_docs and history plus the legacy context), the old
+local handler (top 3 KB texts) and the assembler at complexity_factor
+0.1/0.5/0.9. Printed: p50/p95/max tokens and their spread, tokens per
+section and passages dropped as duplicates, share of questions whose
+answer (the paragraph the question was written from) is in the context,
+and assembly time.
+
+Usage:
+    python3 scripts/bench_context_assembly.py [--queries 300] [--results 5] [--chunk-chars 600] [--overlap 150]
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'lambdas-local', 'shared'))
+
+import bench_kb_index
+import build_kb_index
+import context_assembler
+import embeddings
+import kb_index
+import prompt_cache
+
+DIMENSIONS = 1024
+COMPLEXITY_FACTORS = (0.1, 0.5, 0.9)
+OLD_TOP_RESULTS = 3
+
+
+def raw_results(results, kb_id, rng):
+    """What Bedrock `retrieve` returns and the state machine passes on: text plus metadata."""
+    raw = []
+    for result in results:
+        uri = f"s3://sidea-ai-clone-kb/{result['location']['customDocumentLocation']['id']}"
+        raw.append({
+            'content': {'text': result['content']['text'], 'type': 'TEXT'},
+            'location': {'s3Location': {'uri': uri}, 'type': 'S3'},
+            'metadata': {
+                'x-amz-bedrock-kb-source-uri': uri,
+                'x-amz-bedrock-kb-chunk-id': f"1%3A0%3A{rng.getrandbits(64):016x}",
+                'x-amz-bedrock-kb-data-source-id': kb_id,
+            },
+            'score': result['score'],
+        })
+    return raw
+
+
+def topic_summaries(name, rng):
+    """0-3 compact summaries as topic_history.retrieve returns them."""
+    summaries = []
+    for index in range(rng.randint(0, 3)):
+        facets = rng.sample(list(bench_kb_index.QUESTIONS), 2)
+        summary = ' '.join(
+            f"Utente: {bench_kb_index.QUESTIONS[facet].format(name=name)} "
+            f"Assistente: ne abbiamo parlato, {'con i dettagli della scheda' if rng.random() < 0.5 else 'in breve'}."
+            for facet in facets
+        ) * rng.randint(1, 3)
+        summaries.append({'topic_id': name, 'session_id': f"session-{index}",
+                          'summary': summary, 'updated_at': 1760000000 - index * 86400})
+    return summaries
+
+
+def php_context(kb_docs, topic, history, legacy_texts):
+    """BedrockService::getUserContent, context part."""
+    context = ''
+    if kb_docs:
+        context += f"RELEVANT DOCUMENTATION:\n{json.dumps(kb_docs)}\n\n"
+    if topic:
+        context += f"CURRENT TOPIC: {topic}\n"
+    if history:
+        context += f"RELEVANT PAST CONVERSATIONS:\n{json.dumps(history)}\n\n"
+    joined = '\n\n'.join(legacy_texts)
+    context += f"INIZIO Contesto (Legacy)\n{joined}\nFINE Contesto"
+    return f"CONTEXT:\n{context}\n\n"
+
+
+def user_turn_text(request):
+    return '\n'.join(block['text'] for block in request['messages'][-1]['content'][:-1])
+
+
+def has_answer(texts, name, facet):
+    template = bench_kb_index.FACETS[facet]
+    marker = template.split('{name}')[0][:25] or template.split('{name}')[1][:25]
+    return any(name in text and marker in text for text in texts)
+
+
+def tokens_line(label, tokens, answered, extra=''):
+    print(f"{label:<26}{statistics.median(tokens):>8.0f}{bench_kb_index.percentile(tokens, 0.95):>8.0f}"
+          f"{max(tokens):>8}{statistics.pstdev(tokens):>9.0f}{statistics.mean(answered):>10.1%}  {extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=300)
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--results', type=int, default=5, help="KB results per retrieve (retrieval_results)")
+    parser.add_argument('--chunk-chars', type=int, default=600)
+    parser.add_argument('--overlap', type=int, default=150)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        source, out = os.path.join(tmp, 'docs'), os.path.join(tmp, 'index')
+        os.makedirs(source)
+        questions = bench_kb_index.write_corpus(source, args.documents, rng)
+        rng.shuffle(questions)
+        chunks = build_kb_index.collect_chunks(build_kb_index.local_documents(source), args.chunk_chars, args.overlap)
+        vectors = build_kb_index.embed_all([chunk['text'] for chunk in chunks], 'hashed', DIMENSIONS)
+        build_kb_index.build(chunks, vectors, 'bench-kb', out, 'hashed', DIMENSIONS, embeddings.TITAN_MODEL_ID,
+                             args.chunk_chars, args.overlap)
+        index = kb_index.KbIndex(out)
+
+        cases = []
+        for text, name, facet in questions[:args.queries]:
+            results = index.search(text, args.results)
+            cases.append({'text': text, 'name': name, 'facet': facet, 'kb': results,
+                          'legacy': raw_results(results, 'bench-kb', rng), 'history': topic_summaries(name, rng)})
+
+    print(f"{len(chunks)} chunks of ~{args.chunk_chars} chars (overlap {args.overlap}), {len(cases)} questions, "
+          f"{args.results} KB results each; tokens estimated at {context_assembler.CHARS_PER_TOKEN} chars/token\n")
+    print(f"{'context':<26}{'p50':>8}{'p95':>8}{'max':>8}{'stdev':>9}{'answer in':>10}")
+
+    estimate = context_assembler.estimate_tokens
+    php = [php_context(case['legacy'], case['name'].title(), case['history'],
+                       [result['content']['text'] for result in case['kb']]) for case in cases]
+    tokens_line('PHP getUserContent', [estimate(text) for text in php],
+                [has_answer([text], case['name'], case['facet']) for text, case in zip(php, cases)],
+                'kb_docs JSON + history JSON + legacy texts')
+
+    old = [user_turn_text(prompt_cache.build_request(
+        '', [], case['text'], kb_context=[result['content']['text'] for result in case['kb'][:OLD_TOP_RESULTS]]
+    )) for case in cases]
+    tokens_line('old handler (top 3 KB)', [estimate(text) for text in old],
+                [has_answer([text], case['name'], case['facet']) for text, case in zip(old, cases)],
+                'no history, no budget')
+
+    sections = {}
+    for factor in COMPLEXITY_FACTORS:
+        tokens, answered, timings, reports = [], [], [], []
+        for case in cases:
+            started = time.perf_counter()
+            context = context_assembler.assemble(
+                {'kb': case['kb'], 'history': case['history'], 'legacy': case['legacy']}, complexity_factor=factor
+            )
+            timings.append((time.perf_counter() - started) * 1_000_000)
+            text = user_turn_text(prompt_cache.build_request('', [], case['text'],
+                                                              kb_context=context.texts('kb', 'legacy'),
+                                                              past_context=context.texts('history')))
+            tokens.append(estimate(text))
+            answered.append(has_answer(context.texts('kb', 'legacy'), case['name'], case['facet']))
+            reports.append(context.report())
+        budget = reports[0]['budget_tokens']
+        tokens_line(f"assembler cf {factor} ({budget})", tokens, answered,
+                    f"assembly p50 {statistics.median(timings):.0f} us")
+        sections[factor] = reports
+
+    print(f"\n{'per message, mean':<26}" + ''.join(f"{section + ' tok':>12}{'dup':>6}{'drop':>6}"
+                                                  for section in context_assembler.SECTIONS))
+    for factor, reports in sections.items():
+        line = f"{'assembler cf ' + str(factor):<26}"
+        for section in context_assembler.SECTIONS:
+            stats = [report['sections'][section] for report in reports]
+            line += (f"{statistics.mean(s['tokens'] for s in stats):>12.0f}"
+                     f"{statistics.mean(s['duplicates'] for s in stats):>6.1f}"
+                     f"{statistics.mean(s['dropped'] for s in stats):>6.1f}")
+        print(line)
+    overlap = statistics.mean(report['sections']['kb']['overlap_chars'] for report in sections[COMPLEXITY_FACTORS[-1]])
+    print(f"{'kb chunk overlap cut':<26}{overlap:>12.0f}  chars per message (head/tail shared with a kept chunk)")
+    candidate = statistics.mean(report['candidate_tokens'] for report in sections[COMPLEXITY_FACTORS[0]])
+    print(f"{'candidates (text only)':<26}{candidate:>12.0f}  tokens of kb + history + legacy before dedup/budget")
+
+
+if __name__ == "__main__":
+    main()
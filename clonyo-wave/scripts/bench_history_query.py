@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Read capacity and latency of the conversation-history queries on LocalStack.
+
+Seeds a throwaway table (same schema as sidea-ai-clone-prod-messages-table)
+with conversations of increasing length, voice-transcript sized messages,
+plus the META and WINDOW items that share the partition, then compares:
+
+  full      MessagesRepository::all - every M# item, every attribute
+  limit10   old local handler - Limit=10 newest items, M# filtered client-side
+  accessor  messages_history.last_messages - begins_with + projection + stop at N
+
+Usage:
+    python3 scripts/bench_history_query.py [--lengths 20,200,1000] [--runs 5] [--consistent]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'lambdas-local', 'shared'))
+
+import messages_history
+
+ENDPOINT = os.environ.get('AWS_ENDPOINT_URL', 'http://localhost:4566')
+REGION = 'eu-west-1'
+TABLE = 'bench-history-messages-table'
+LIMIT = 10
+
+# ~1.5 KB per message, the size of a one-minute voice transcript
+CONTENT = ("Allora, volevo capire meglio come funziona la diversificazione del portafoglio "
+           "e se ha senso aggiungere una quota di obbligazioni adesso. ") * 12
+
+
+def create_table(dynamodb):
+    dynamodb.create_table(
+        TableName=TABLE,
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'S'},
+        ],
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.get_waiter('table_exists').wait(TableName=TABLE)
+
+
+def seed(dynamodb, messages_key, length):
+    def put(item):
+        return {'PutRequest': {'Item': item}}
+
+    requests = [
+        put({'pk': {'S': messages_key}, 'sk': {'S': 'META'}, 'wa_contact_id': {'S': 'bench'}}),
+        put({'pk': {'S': messages_key}, 'sk': {'S': 'WINDOW'}, 'summary': {'S': ''}, 'version': {'N': '1'}}),
+    ]
+    for i in range(length):
+        requests.append(put({
+            'pk': {'S': messages_key},
+            'sk': {'S': f"M#{1738162800 + i}"},
+            'role': {'S': 'user' if i % 2 == 0 else 'assistant'},
+            'type': {'S': 'audio'},
+            'content': {'S': CONTENT},
+            'session_id': {'S': 'bench-session'},
+            'topic_id': {'S': 'bench-topic'},
+        }))
+    for start in range(0, len(requests), 25):
+        dynamodb.batch_write_item(RequestItems={TABLE: requests[start:start + 25]})
+
+
+def query_full(dynamodb, messages_key, consistent):
+    params = {
+        'TableName': TABLE,
+        'KeyConditionExpression': 'pk = :pk AND begins_with(sk, :sk)',
+        'ExpressionAttributeValues': {':pk': {'S': messages_key}, ':sk': {'S': 'M#'}},
+        'ConsistentRead': consistent,
+        'ReturnConsumedCapacity': 'TOTAL',
+    }
+    items, rcu, pages = [], 0.0, 0
+    while True:
+        response = dynamodb.query(**params)
+        pages += 1
+        rcu += response.get('ConsumedCapacity', {}).get('CapacityUnits', 0.0)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return len(items[-LIMIT:]), pages, rcu
+
+
+def query_limit10(dynamodb, messages_key, consistent):
+    response = dynamodb.query(
+        TableName=TABLE,
+        KeyConditionExpression='pk = :pk',
+        ExpressionAttributeValues={':pk': {'S': messages_key}},
+        ScanIndexForward=False,
+        Limit=LIMIT,
+        ConsistentRead=consistent,
+        ReturnConsumedCapacity='TOTAL'
+    )
+    messages = [item for item in response['Items'] if item['sk']['S'].startswith('M#')]
+    return len(messages), 1, response.get('ConsumedCapacity', {}).get('CapacityUnits', 0.0)
+
+
+def query_accessor(dynamodb, messages_key, consistent):
+    stats = {}
+    messages = messages_history.last_messages(
+        dynamodb, messages_key, LIMIT, consistent=consistent, table_name=TABLE, stats=stats
+    )
+    return len(messages), stats['pages'], stats['consumed_rcu']
+
+
+STRATEGIES = {'full': query_full, 'limit10': query_limit10, 'accessor': query_accessor}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lengths', default='20,200,1000')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--consistent', action='store_true', help="strongly consistent reads (2x RCU)")
+    args = parser.parse_args()
+
+    import boto3
+
+    dynamodb = boto3.client('dynamodb', endpoint_url=ENDPOINT, region_name=REGION)
+    create_table(dynamodb)
+    try:
+        print(f"{'messages':>8}  {'strategy':<9}{'returned':>9}{'pages':>7}{'RCU':>9}{'median ms':>11}")
+        for length in (int(n) for n in args.lengths.split(',')):
+            messages_key = f"S#bench#C#{length}"
+            seed(dynamodb, messages_key, length)
+            for name, strategy in STRATEGIES.items():
+                timings = []
+                for _ in range(args.runs):
+                    started = time.perf_counter()
+                    returned, pages, rcu = strategy(dynamodb, messages_key, args.consistent)
+                    timings.append((time.perf_counter() - started) * 1000)
+                print(f"{length:>8}  {name:<9}{returned:>9}{pages:>7}{rcu:>9.1f}{statistics.median(timings):>11.1f}")
+            print()
+    finally:
+        dynamodb.delete_table(TableName=TABLE)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+What 'Get Session History' hands Check Sufficiency, and what it costs.
+
+The test-payloads/conversation-flow conversation (investimenti ->
+assicurazione -> mutuo -> back to investimenti -> generale) is replayed
+through history-retrieval-fn and topic-history-fn, as the definition built
+with --topic-history runs them: before each message the summaries of its
+topic are retrieved, after the (canned) reply the exchange is recorded.
+Printed per message: the summaries returned (message 06 must get back the
+investimenti one) and their size.
+
+Then the contact gets --summaries compact summaries spread over 10
+topics and as many sessions, and retrieval is timed against reading the
+whole memory of the contact (every summary, one Query on the partition),
+at 10/100/1000 summaries: items read, state payload bytes, p50/p95 ms.
+DynamoDB is LocalStack, or moto with --moto.
+
+Always prints the latency-model estimate (sfn_latency.py) of the text
+path with the empty-history Pass and with --topic-history, when the
+memory is sufficient and when the Knowledge Base is still needed; with
+--fused, of the definition built with --fused (pre-generation-fn).
+
+Usage:
+    python3 scripts/bench_history_retrieval.py [--moto] [--summaries 10 100 1000] [--queries 50] [--fused]
+"""
+
+import argparse
+import contextlib
+import glob
+import importlib.util
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'lambdas-local', 'shared'))
+
+import aws_clients
+import prepare_local_sfn
+import sfn_latency
+import topic_history
+
+ENDPOINT = os.environ.get('AWS_ENDPOINT_URL', 'http://localhost:4566')
+REGION = 'eu-west-1'
+TABLE = 'bench-topic-history-table'
+FLOW_DIR = os.path.join(ROOT, 'test-payloads', 'conversation-flow')
+
+# Topic of each conversation-flow payload (test-payloads/conversation-flow/README.md) and a canned reply
+FLOW = [
+    ('topic-investimenti', ['fondi', 'investimento'],
+     "I fondi obbligazionari e monetari sono i più prudenti, con un orizzonte di almeno tre anni."),
+    ('topic-investimenti', ['fondi', 'rendimenti', 'obbligazionario'],
+     "Un fondo obbligazionario rende indicativamente tra il 2% e il 4% annuo, senza garanzia sul capitale."),
+    ('topic-assicurazione', ['polizza', 'vita'],
+     "Offriamo polizze vita temporanee caso morte e miste, con premio fisso o decrescente."),
+    ('topic-assicurazione', ['polizza', 'vita', 'costo'],
+     "Per 200.000 euro di copertura il premio parte da circa 250 euro l'anno, secondo età e salute."),
+    ('topic-mutuo', ['mutuo', 'casa', 'tassi'],
+     "Per la prima casa il tasso fisso parte dal 3,1%, il variabile dal 3,4%, con agevolazioni under 36."),
+    ('topic-investimenti', ['investimenti', 'pac', 'versamenti'],
+     "Sì, il PAC parte da 50 euro al mese su gran parte dei nostri fondi, sospendibile in ogni momento."),
+    ('topic-generale', ['orari', 'filiale'],
+     "Le filiali sono aperte dal lunedì al venerdì, dalle 8:30 alle 13:30 e dalle 14:30 alle 16:00."),
+]
+
+SCALE_TOPICS = ['investimenti', 'assicurazione', 'mutuo', 'pensione', 'conto', 'carte', 'prestiti', 'successione',
+                'tasse', 'generale']
+
+
+def load_handler(name):
+    path = os.path.join(ROOT, 'lambdas-local', name, 'handler.py')
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def quiet(function, event):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(event, None)
+
+
+def messages_key(payload):
+    return f"S#{payload['config']['wa_phone_number_arn']}#C#{payload['wa_contact']['wa_id']}"
+
+
+def replay(retrieve, record):
+    payloads = [json.load(open(path)) for path in sorted(glob.glob(os.path.join(FLOW_DIR, '0*.json')))]
+    session_id = 'bench-session-flow'
+    print(f"{'#':<4}{'topic':<22}{'retrieved':<48}{'chars':>7}{'bytes':>7}")
+    for index, (payload, (topic_id, keywords, reply)) in enumerate(zip(payloads, FLOW), start=1):
+        text = payload['text']['body']
+        response = quiet(retrieve, {'messages_key': messages_key(payload), 'topic_id': topic_id,
+                                    'keywords': keywords, 'userInput': text})
+        history = response['history']
+        retrieved = ', '.join(f"{entry['topic_id']} ({len(entry['summary'])})" for entry in history) or '-'
+        print(f"{index:02d}  {topic_id:<22}{retrieved:<48}{sum(len(e['summary']) for e in history):>7}"
+              f"{len(json.dumps(history)):>7}")
+        quiet(record, {'messages_key': messages_key(payload), 'topic_id': topic_id, 'keywords': keywords,
+                       'session_id': session_id, 'user_message': text, 'assistant_message': reply})
+
+
+def seed(dynamodb, key, summaries, topics, now, rng):
+    """`summaries` (topic, session) items, as record() leaves them, over the last months."""
+    for index in range(summaries):
+        topic = topics[index % len(topics)]
+        session_id = f"bench-session-{index:05d}"
+        turns = [{'role': 'user', 'content': f"Domanda {index} su {topic}: come funziona e quanto costa?"},
+                 {'role': 'assistant', 'content': f"Risposta {index} su {topic}, con i dettagli dell'offerta " * 4}]
+        summary = topic_history.history_window.extractive_summary('', turns, topic_history.SUMMARY_MAX_CHARS)
+        updated_at = now - rng.randint(0, 180 * 24 * 3600)
+        dynamodb.put_item(TableName=TABLE, Item={
+            'pk': {'S': key}, 'sk': {'S': topic_history.sort_key(f"topic-{topic}", session_id)},
+            'topic_id': {'S': f"topic-{topic}"}, 'session_id': {'S': session_id},
+            'summary': {'S': summary}, 'keywords': {'SS': [topic, 'costo']}, 'turns': {'N': '2'},
+            'started_at': {'N': str(updated_at - 600)}, 'updated_at': {'N': str(updated_at)},
+            'recent': {'S': topic_history.recent_key(f"topic-{topic}", updated_at)},
+            'version': {'N': '1'},
+        })
+
+
+def whole_memory(dynamodb, key):
+    """Every summary of the contact, paginated: what a memory without the topic index would load."""
+    items, kwargs = [], {}
+    while True:
+        response = dynamodb.query(TableName=TABLE, KeyConditionExpression='pk = :pk',
+                                  ExpressionAttributeValues={':pk': {'S': key}}, **kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return [{'topic_id': i['topic_id']['S'], 'session_id': i['session_id']['S'],
+                     'summary': i['summary']['S'], 'updated_at': int(i['updated_at']['N'])} for i in items]
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def scale(dynamodb, retrieve, sizes, queries):
+    print(f"\n{'summaries':>10}  {'read':<16}{'items read':>11}{'payload B':>11}{'p50 ms':>9}{'p95 ms':>9}")
+    rng = random.Random(7)
+    now = int(time.time())
+    for size in sizes:
+        key = f"S#bench#C#scale-{size}"
+        seed(dynamodb, key, size, SCALE_TOPICS, now, rng)
+        for name in ('whole memory', 'topic top-K'):
+            timings, read, payload = [], 0, 0
+            for _ in range(queries):
+                topic = rng.choice(SCALE_TOPICS)
+                started = time.perf_counter()
+                if name == 'whole memory':
+                    history = whole_memory(dynamodb, key)
+                    read = len(history)
+                else:
+                    history = quiet(retrieve, {'messages_key': key, 'topic_id': f"topic-{topic}",
+                                               'keywords': [topic], 'userInput': f"Quanto costa {topic}?"})['history']
+                    read = min(-(-size // len(SCALE_TOPICS)), topic_history.QUERY_LIMIT)
+                timings.append((time.perf_counter() - started) * 1000)
+                payload = max(payload, len(json.dumps(history)))
+            print(f"{size:>10}  {name:<16}{read:>11}{payload:>11}{statistics.median(timings):>9.1f}"
+                  f"{percentile(timings, 0.95):>9.1f}")
+
+
+def estimate(fused=False):
+    def build(*steps):
+        definition = prepare_local_sfn.transform(prepare_local_sfn.load_definition())
+        for step in ((prepare_local_sfn.enable_pre_generation,) if fused else ()) + steps:
+            definition = step(definition)
+        return definition
+
+    base = build()
+    indexed = build(prepare_local_sfn.enable_topic_history)
+    print(f"\nLatency model (sfn_latency.py), text message{' (--fused)' if fused else ''}:")
+    print(f"  {'empty history (Pass)':<40}{sfn_latency.walk(base, sfn_latency.TEXT_KB_SCENARIO)[0]:>8.0f} ms")
+    for label, scenario in (('memory sufficient', sfn_latency.text_memory_scenario(indexed)),
+                            ('Knowledge Base needed', sfn_latency.TEXT_KB_SCENARIO)):
+        if scenario is None:
+            print(f"  {'--topic-history, ' + label:<40}{'n/a':>8}    (no 'Is Sufficient?' Choice)")
+            continue
+        print(f"  {'--topic-history, ' + label:<40}{sfn_latency.walk(indexed, scenario)[0]:>8.0f} ms")
+
+
+def run(dynamodb, args):
+    dynamodb.create_table(
+        TableName=TABLE,
+        AttributeDefinitions=[{'AttributeName': 'pk', 'AttributeType': 'S'},
+                              {'AttributeName': 'sk', 'AttributeType': 'S'},
+                              {'AttributeName': 'recent', 'AttributeType': 'S'}],
+        KeySchema=[{'AttributeName': 'pk', 'KeyType': 'HASH'}, {'AttributeName': 'sk', 'KeyType': 'RANGE'}],
+        LocalSecondaryIndexes=[{
+            'IndexName': topic_history.RECENT_INDEX,
+            'KeySchema': [{'AttributeName': 'pk', 'KeyType': 'HASH'}, {'AttributeName': 'recent', 'KeyType': 'RANGE'}],
+            'Projection': {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': list(topic_history.PROJECTED)},
+        }],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.get_waiter('table_exists').wait(TableName=TABLE)
+
+    aws_clients._clients[('dynamodb', aws_clients.DEFAULT_REGION, aws_clients.LOCAL_ENDPOINT_URL)] = dynamodb
+    topic_history.TOPIC_HISTORY_TABLE = TABLE
+    retrieve = load_handler('history-retrieval-fn').handler
+    record = load_handler('topic-history-fn').handler
+
+    replay(retrieve, record)
+    scale(dynamodb, retrieve, args.summaries, args.queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--moto', action='store_true', help="in-process moto DynamoDB instead of LocalStack")
+    parser.add_argument('--summaries', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--estimate-only', action='store_true', help="only print the latency-model estimate")
+    parser.add_argument('--fused', action='store_true', help="estimate the definition built with --fused")
+    args = parser.parse_args()
+
+    if not args.estimate_only:
+        import boto3
+
+        if args.moto:
+            from moto import mock_aws
+
+            with mock_aws():
+                run(boto3.client('dynamodb', region_name=REGION), args)
+        else:
+            run(boto3.client('dynamodb', endpoint_url=ENDPOINT, region_name=REGION), args)
+    estimate(args.fused)
+
+
+if __name__ == "__main__":
+    main()
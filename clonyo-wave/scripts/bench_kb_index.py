@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Recall and latency of the local KB index (kb_index) vs the remote KB.
+
+1. Corpus: --documents generated clone documents (Italian, one product
+   sheet per document, several paragraphs of facts) are indexed with
+   scripts/build_kb_index.py (hashed embeddings, flat and --ivf lists).
+   Questions are written from one paragraph's facts; reported: build
+   time, index size, open time (memory-mapped), search p50/p95 with and
+   without the query embedding, hit@k (the source paragraph's chunk in
+   the top k) and IVF recall@k against the exact flat search.
+   With --kb-id (and AWS credentials) the same questions also go to the
+   remote KB `retrieve`, for its latency and the overlap of the top k.
+
+2. Scale: clustered random unit vectors of --dimensions at 1k/10k/100k
+   rows, flat vs IVF (sqrt(n) lists) at several nprobe: p50 latency and
+   recall@k against flat.
+
+3. Fallback: through RetrievalCache with the local tier, a KB with an
+   index is served locally and one without goes to the remote KB.
+
+Usage:
+    python3 scripts/bench_kb_index.py [--documents 300] [--ivf 16] [--k 4] [--kb-id PDZQMPE5HM]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'lambdas-local', 'shared'))
+
+import aws_clients
+import build_kb_index
+import embeddings
+import kb_index
+import retrieval_cache
+import sfn_latency
+
+KB_ID = 'bench-local-kb'
+DIMENSIONS = 1024
+
+PRODUCTS = ['fondo', 'polizza', 'mutuo', 'conto', 'carta', 'prestito', 'pac', 'etf', 'pensione', 'deposito']
+FACETS = {
+    'costi': "Le commissioni di {name} sono pari allo {a},{b}% annuo, con spese fisse di {c} euro e nessun "
+             "costo di uscita dopo {d} anni.",
+    'rendimento': "Il rendimento storico di {name} negli ultimi {d} anni è stato del {a},{b}% medio annuo, "
+                  "con una volatilità contenuta e una perdita massima del {c}%.",
+    'requisiti': "Per sottoscrivere {name} servono un documento di identità, il codice fiscale e un versamento "
+                 "minimo di {c}00 euro; l'età massima è {d}0 anni.",
+    'durata': "La durata consigliata di {name} è di {d} anni; il riscatto anticipato è possibile dopo {a} mesi "
+              "con una penale del {b}%.",
+    'fiscalita': "I proventi di {name} sono tassati al {a}{b}% e le minusvalenze sono compensabili entro {d} "
+                 "anni; l'imposta di bollo è dello {c} per mille.",
+    'garanzie': "{name} prevede la garanzia del capitale al {a}{b}% a scadenza e una copertura accessoria fino "
+                "a {c}0.000 euro per {d} anni.",
+}
+QUESTIONS = {
+    'costi': "Quanto costa {name}, quali commissioni e spese?",
+    'rendimento': "Che rendimento ha avuto {name} negli ultimi anni?",
+    'requisiti': "Cosa serve per sottoscrivere {name}, quale versamento minimo?",
+    'durata': "Quanto dura {name} e posso riscattare prima?",
+    'fiscalita': "Come sono tassati i proventi di {name}?",
+    'garanzie': "{name} garantisce il capitale a scadenza?",
+}
+
+
+NAMES = ['Aurora', 'Boreale', 'Cometa', 'Delfino', 'Ermes', 'Fenice', 'Girasole', 'Orizzonte', 'Iride', 'Libeccio',
+         'Maestrale', 'Nettuno', 'Quercia', 'Pegaso', 'Rubino', 'Smeraldo', 'Tramonto', 'Vela', 'Zefiro', 'Ambra',
+         'Bussola', 'Corallo', 'Diamante', 'Eclisse', 'Faro', 'Giada', 'Ulivo', 'Kappa', 'Luna', 'Mirto']
+
+
+def product_name(index):
+    # Names differ in their first letters: the hashed backend keeps 4-letter stems
+    return f"{PRODUCTS[index % len(PRODUCTS)]} {NAMES[index // len(PRODUCTS) % len(NAMES)]}" \
+           f"{'' if index < len(PRODUCTS) * len(NAMES) else ' ' + str(index // (len(PRODUCTS) * len(NAMES)) + 1)}"
+
+
+def write_corpus(directory, documents, rng):
+    """One product sheet per document, one paragraph per facet; returns the questions (text, product, facet)."""
+    questions = []
+    for index in range(documents):
+        name = product_name(index)
+        paragraphs = [f"Scheda prodotto: {name.title()}."]
+        for facet, template in FACETS.items():
+            values = {key: rng.randint(1, 9) for key in 'abcd'}
+            paragraphs.append(template.format(name=name, **values))
+            questions.append((QUESTIONS[facet].format(name=name), name, facet))
+        with open(os.path.join(directory, f"scheda-{index:04d}.md"), 'w') as f:
+            f.write('\n\n'.join(paragraphs))
+    return questions
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def timed(function, items):
+    timings, results = [], []
+    for item in items:
+        started = time.perf_counter()
+        results.append(function(item))
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    return results, statistics.median(timings), percentile(timings, 0.95)
+
+
+def is_hit(chunks, rows, name, facet):
+    """The chunk holding the question's paragraph is among `rows`."""
+    marker = FACETS[facet].split('{name}')[0][:25] or FACETS[facet].split('{name}')[1][:25]
+    return any(name in chunks[row]['text'] and marker in chunks[row]['text'] for row in rows)
+
+
+def recall(found, exact):
+    """Share of the exact top k found, ties at the k-th exact score counting as found."""
+    return statistics.mean(np.mean(f_scores >= e_scores[-1] - 1e-6) for (_, f_scores), (_, e_scores)
+                           in zip(found, exact) if len(e_scores))
+
+
+def corpus(args):
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        source, out = os.path.join(tmp, 'docs'), os.path.join(tmp, 'index')
+        os.makedirs(source)
+        questions = write_corpus(source, args.documents, rng)
+        rng.shuffle(questions)
+        questions = questions[:args.queries]
+
+        started = time.perf_counter()
+        chunks = build_kb_index.collect_chunks(build_kb_index.local_documents(source), args.chunk_chars, args.overlap)
+        vectors = build_kb_index.embed_all([chunk['text'] for chunk in chunks], 'hashed', DIMENSIONS)
+        build_kb_index.build(chunks, vectors, KB_ID, out, 'hashed', DIMENSIONS, embeddings.TITAN_MODEL_ID,
+                             args.chunk_chars, args.overlap, args.ivf)
+        build_s = time.perf_counter() - started
+        size_kb = sum(os.path.getsize(os.path.join(out, name)) for name in os.listdir(out)) / 1024
+
+        started = time.perf_counter()
+        index = kb_index.KbIndex(out)
+        open_ms = (time.perf_counter() - started) * 1000
+        print(f"{args.documents} documents -> {len(index.chunks)} chunks of ~{args.chunk_chars} chars, "
+              f"{DIMENSIONS} dims, {size_kb:.0f} KB; build {build_s:.1f} s (hashed embeddings), "
+              f"open {open_ms:.1f} ms (mmap)\n")
+
+        query_vectors = [index.embed(text) for text, _, _ in questions]
+        exact, flat_p50, flat_p95 = timed(lambda q: index.search_vector(q, args.k, nprobe=0), query_vectors)
+        print(f"{'search':<22}{'p50 us':>9}{'p95 us':>9}{'hit@' + str(args.k):>8}{'recall@' + str(args.k):>11}")
+        rows = [('flat (exact)', exact, flat_p50, flat_p95)]
+        if index.centroids is not None:
+            for nprobe in sorted({1, 2, kb_index.DEFAULT_NPROBE, args.ivf // 2}):
+                found, p50, p95 = timed(lambda q: index.search_vector(q, args.k, nprobe=nprobe), query_vectors)
+                rows.append((f"ivf {args.ivf} nprobe {nprobe}", found, p50, p95))
+        for label, found, p50, p95 in rows:
+            hits = statistics.mean(is_hit(index.chunks, found_rows, name, facet)
+                                   for (found_rows, _), (_, name, facet) in zip(found, questions))
+            print(f"{label:<22}{p50:>9.1f}{p95:>9.1f}{hits:>8.1%}{recall(found, exact):>11.1%}")
+
+        _, e2e_p50, e2e_p95 = timed(lambda q: index.search(q[0], args.k), questions)
+        print(f"{'embed + search':<22}{e2e_p50:>9.1f}{e2e_p95:>9.1f}   (hashed embedding; Titan adds a Bedrock "
+              f"round trip)")
+        remote_ms = sfn_latency.SERVICE_LATENCY_MS['arn:aws:states:::aws-sdk:bedrockagentruntime:retrieve']
+        print(f"{'remote KB (model)':<22}{remote_ms * 1000:>9.0f}{'':>9}   sfn_latency.py estimate of `retrieve` "
+              f"({remote_ms} ms)")
+
+        if args.kb_id:
+            remote(args, index, questions)
+
+        fallback(out)
+
+
+def remote(args, index, questions):
+    """Same questions on the real KB: latency and top-k overlap with the local index."""
+    client = aws_clients.bedrock_agent_runtime()
+    timings, overlaps = [], []
+    for text, _, _ in questions[:args.remote_queries]:
+        started = time.perf_counter()
+        results = client.retrieve(
+            knowledgeBaseId=args.kb_id, retrievalQuery={'text': text},
+            retrievalConfiguration={'vectorSearchConfiguration': {'numberOfResults': args.k}}
+        )['retrievalResults']
+        timings.append((time.perf_counter() - started) * 1000)
+        local = {result['content']['text'][:200] for result in index.search(text, args.k)}
+        overlaps.append(len(local & {r['content']['text'][:200] for r in results}) / max(1, len(results)))
+    print(f"{'remote KB ' + args.kb_id:<22}{statistics.median(timings) * 1000:>9.0f}"
+          f"{percentile(timings, 0.95) * 1000:>9.0f}   top-{args.k} overlap with local {statistics.mean(overlaps):.1%}")
+
+
+class CountingKb:
+
+    def __init__(self):
+        self.calls = 0
+
+    def retrieve(self, **kwargs):
+        self.calls += 1
+        return {'retrievalResults': [{'content': {'text': 'remote'}, 'score': 0.5, 'location': None}]}
+
+
+def fallback(out):
+    kb_index.KB_INDEX_DIR = os.path.dirname(out)
+    os.rename(out, os.path.join(os.path.dirname(out), KB_ID))
+    remote_kb = CountingKb()
+    cache = retrieval_cache.RetrievalCache(table_name=None, local_search=kb_index.search)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, indexed = cache.retrieve(remote_kb, KB_ID, "Quanto costa il fondo Alfa 1?", 4)
+        _, other = cache.retrieve(remote_kb, 'kb-without-index', "Quanto costa il fondo Alfa 1?", 4)
+    print(f"\nRetrievalCache: {KB_ID} served from '{indexed}', kb-without-index from '{other}' "
+          f"({remote_kb.calls} remote retrieve call)")
+
+
+def clustered(n, dimensions, clusters, rng):
+    centers = rng.standard_normal((clusters, dimensions)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, dimensions)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def scale(args):
+    rng = np.random.default_rng(7)
+    print(f"\n{'rows':>8}{'flat p50 us':>13}", end='')
+    probes = (1, 4, 16)
+    for nprobe in probes:
+        print(f"{'ivf/' + str(nprobe) + ' p50 us':>15}{'recall':>8}", end='')
+    print(f"{'lists':>7}")
+    for n in args.scale:
+        vectors = clustered(n, args.dimensions, max(8, n // 100), rng)
+        lists = int(np.sqrt(n))
+        with tempfile.TemporaryDirectory() as out:
+            chunks = [{'text': str(i), 'location': None} for i in range(n)]
+            build_kb_index.build(chunks, vectors, KB_ID, out, 'hashed', args.dimensions, embeddings.TITAN_MODEL_ID,
+                                 0, 0, lists)
+            index = kb_index.KbIndex(out)
+            queries = clustered(args.queries, args.dimensions, max(8, n // 100), rng)
+            exact, flat_p50, _ = timed(lambda q: index.search_vector(q, args.k, nprobe=0), queries)
+            print(f"{n:>8}{flat_p50:>13.1f}", end='')
+            for nprobe in probes:
+                found, p50, _ = timed(lambda q: index.search_vector(q, args.k, nprobe=nprobe), queries)
+                print(f"{p50:>15.1f}{recall(found, exact):>8.1%}", end='')
+            print(f"{lists:>7}")
+            del index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=300)
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--k', type=int, default=kb_index.DEFAULT_RESULTS)
+    parser.add_argument('--ivf', type=int, default=16, help="IVF lists of the corpus index (0: flat only)")
+    parser.add_argument('--chunk-chars', type=int, default=400)
+    parser.add_argument('--overlap', type=int, default=80)
+    parser.add_argument('--scale', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--dimensions', type=int, default=DIMENSIONS)
+    parser.add_argument('--kb-id', help="also query this remote Knowledge Base (needs AWS credentials)")
+    parser.add_argument('--remote-queries', type=int, default=20)
+    args = parser.parse_args()
+
+    corpus(args)
+    scale(args)
+
+
+if __name__ == "__main__":
+    main()
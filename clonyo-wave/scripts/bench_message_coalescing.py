@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Executions started and latency added by the per-contact coalescing window.
+
+The test-payloads/conversation-flow conversation is replayed as WhatsApp
+users type it: each payload's text is split into short messages sent a
+--gap apart (one "thought"), with a pause for the reply between thoughts.
+A last contact never stops typing (a message every --typer-gap seconds),
+to check the max wait bound. Messages go through the wa-message-router-fn
+handler one SQS record at a time, plus one SQS redelivery per thought
+(and, when coalescing, another one of its first message after the flush);
+the flush queue is polled into message-coalescer-fn like an event source
+mapping. DynamoDB and SQS are LocalStack, or moto with --moto;
+StartExecution is a fake that records the input.
+
+  direct     COALESCE_WINDOW_SECONDS=0: one execution per message
+  coalesced  --window / --max-wait
+
+Reported: executions per thought, added latency (last message -> start)
+and wait of the first message (first message -> start, against
+--max-wait), and whether every message reached exactly one execution, in
+order.
+
+Usage:
+    python3 scripts/bench_message_coalescing.py [--moto] [--window 3] [--max-wait 10] [--gap 1.0]
+"""
+
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'lambdas-local', 'shared'))
+
+import aws_clients
+import config_store
+import message_coalescer
+import wa_router
+from fake_wa_events import sqs_record
+
+ENDPOINT = os.environ.get('AWS_ENDPOINT_URL', 'http://localhost:4566')
+REGION = 'eu-west-1'
+CONFIG_TABLE = 'bench-coalesce-config-table'
+CONFIG_VERSION_TABLE = 'bench-coalesce-config-version-table'
+BUFFER_TABLE = 'bench-message-buffer-table'
+QUEUE = 'bench-message-coalesce-queue'
+FLOW_DIR = os.path.join(ROOT, 'test-payloads', 'conversation-flow')
+SFN_ARN = 'arn:aws:states:eu-west-1:000000000000:stateMachine:bench-wa-message-processor'
+TYPER_WA_ID = '393339999999'
+
+
+class FakeStepFunctions:
+
+    def __init__(self):
+        self.executions = []  # (started_at, input)
+        self._lock = threading.Lock()
+
+    def start_execution(self, stateMachineArn, name, input):
+        with self._lock:
+            self.executions.append((time.time(), json.loads(input)))
+        return {'executionArn': f"{stateMachineArn}:{name}"}
+
+    def for_contact(self, wa_id, since=0):
+        with self._lock:
+            return [(at, sfn_input) for at, sfn_input in self.executions
+                    if sfn_input['wa_contact']['wa_id'] == wa_id and at >= since]
+
+
+def load_handler(name):
+    path = os.path.join(ROOT, 'lambdas-local', name, 'handler.py')
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def fragments(text):
+    """A payload's text as a user would type it on WhatsApp: a message per sentence or clause."""
+    parts = [part.strip() for part in re.split(r'(?<=[.?!])\s+|,\s+', text) if part.strip()]
+    return parts or [text]
+
+
+def thoughts():
+    payloads = [json.load(open(path)) for path in sorted(glob.glob(os.path.join(FLOW_DIR, '0*.json')))]
+    return payloads, [fragments(payload['text']['body']) for payload in payloads]
+
+
+def flush_poller(sqs, queue_url, handler, stop):
+    """Event source mapping of the flush queue."""
+    while not stop.is_set():
+        messages = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10, WaitTimeSeconds=1).get('Messages')
+        if not messages:
+            continue
+        records = [{'messageId': m['MessageId'], 'body': m['Body'], 'receiptHandle': m['ReceiptHandle']}
+                   for m in messages]
+        failed = {f['itemIdentifier'] for f in handler({'Records': records}, None)['batchItemFailures']}
+        for record in records:
+            if record['messageId'] not in failed:
+                sqs.delete_message(QueueUrl=queue_url, ReceiptHandle=record['receiptHandle'])
+
+
+def send(router_handler, arn, wa_id, text, ts, redeliver=None):
+    record = redeliver or sqs_record(arn, wa_id, text, timestamp=ts)
+    response = router_handler({'Records': [record]}, None)
+    assert not response['batchItemFailures'], response
+    return record
+
+
+def wait_for(stepfunctions, wa_id, since, count, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if len(stepfunctions.for_contact(wa_id, since)) >= count:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def replay(stepfunctions, router_handler, payloads, parts, args, coalesced, rng):
+    """Returns one row per thought: (messages, executions, added ms, first-message wait ms, text ok)."""
+    rows = []
+    ts = int(time.time())
+    for payload, texts in zip(payloads, parts):
+        arn = payload['config']['wa_phone_number_arn']
+        wa_id = payload['wa_contact']['wa_id']
+        since = time.time()
+        first_at = last_at = None
+        redelivered = None
+        for text in texts:
+            ts += 1
+            last_at = time.time()
+            first_at = first_at or last_at
+            record = send(router_handler, arn, wa_id, text, ts)
+            if not redelivered:
+                # SQS at-least-once: the same record again
+                send(router_handler, arn, wa_id, text, ts, redeliver=record)
+                redelivered = record
+            if text is not texts[-1]:
+                time.sleep(max(0.05, rng.gauss(args.gap, args.gap / 3)))
+        expected = 1 if coalesced else len(texts)
+        wait_for(stepfunctions, wa_id, since, expected, args.max_wait + 5)
+        time.sleep(0.5 if coalesced else 0.0)
+        if coalesced:
+            # A redelivery after the flush must not start a second execution
+            send(router_handler, arn, wa_id, None, None, redeliver=redelivered)
+            time.sleep(args.window + 0.5)
+        started = stepfunctions.for_contact(wa_id, since)
+        bodies = [sfn_input['text']['body'] for _, sfn_input in started]
+        # Without coalescing the redelivery starts a second execution of the same message
+        text_ok = '\n'.join(bodies) == '\n'.join(texts)
+        rows.append((len(texts), len(started), (started[-1][0] - last_at) * 1000 if started else None,
+                     (started[0][0] - first_at) * 1000 if started else None, text_ok))
+    return rows
+
+
+def typer(stepfunctions, router_handler, arn, args):
+    """A contact who never pauses longer than the window: the first message must not wait past max wait."""
+    since = time.time()
+    sent = []
+    ts = int(time.time())
+    for i in range(args.typer_messages):
+        ts += 1
+        sent.append(time.time())
+        send(router_handler, arn, TYPER_WA_ID, f"Messaggio {i + 1}", ts)
+        time.sleep(args.typer_gap)
+    wait_for(stepfunctions, TYPER_WA_ID, since, 1, args.max_wait + 5)
+    time.sleep(args.window + 2)
+    started = stepfunctions.for_contact(TYPER_WA_ID, since)
+    # Wait of the oldest message of each execution
+    waits, index = [], 0
+    for at, sfn_input in started:
+        waits.append((at - sent[index]) * 1000)
+        index += sfn_input.get('coalesced', {}).get('messages', 1)
+    return len(started), waits, index
+
+
+def run(dynamodb, sqs, args):
+    dynamodb.create_table(
+        TableName=CONFIG_TABLE,
+        AttributeDefinitions=[{'AttributeName': 'wa_phone_number_arn', 'AttributeType': 'S'}],
+        KeySchema=[{'AttributeName': 'wa_phone_number_arn', 'KeyType': 'HASH'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.create_table(
+        TableName=CONFIG_VERSION_TABLE,
+        AttributeDefinitions=[{'AttributeName': 'name', 'AttributeType': 'S'}],
+        KeySchema=[{'AttributeName': 'name', 'KeyType': 'HASH'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.create_table(
+        TableName=BUFFER_TABLE,
+        AttributeDefinitions=[{'AttributeName': 'buffer_key', 'AttributeType': 'S'}],
+        KeySchema=[{'AttributeName': 'buffer_key', 'KeyType': 'HASH'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    for table in (CONFIG_TABLE, CONFIG_VERSION_TABLE, BUFFER_TABLE):
+        dynamodb.get_waiter('table_exists').wait(TableName=table)
+    queue_url = sqs.create_queue(QueueName=QUEUE)['QueueUrl']
+
+    payloads, parts = thoughts()
+    store = config_store.ConfigStore(table_name=CONFIG_TABLE, version_table_name=CONFIG_VERSION_TABLE, dynamodb=dynamodb)
+    # ConfigData always has the clone name (execution names); the fixture payloads carry only what the SFN reads
+    store.put(dict(payloads[0]['config'], name="Consulente Test"))
+
+    # Handlers as deployed, on the bench tables/queue and a recording StartExecution
+    stepfunctions = FakeStepFunctions()
+    aws_clients._clients[('dynamodb', aws_clients.DEFAULT_REGION, aws_clients.LOCAL_ENDPOINT_URL)] = dynamodb
+    aws_clients._clients[('sqs', aws_clients.DEFAULT_REGION, aws_clients.LOCAL_ENDPOINT_URL)] = sqs
+    aws_clients._clients[('stepfunctions', aws_clients.DEFAULT_REGION, aws_clients.LOCAL_ENDPOINT_URL)] = stepfunctions
+    config_store._default = store
+    wa_router.SFN_ARN = SFN_ARN
+    message_coalescer.COALESCE_TABLE = BUFFER_TABLE
+    message_coalescer.COALESCE_QUEUE_URL = queue_url
+    message_coalescer.COALESCE_MAX_WAIT_SECONDS = args.max_wait
+    router_handler = load_handler('wa-message-router-fn').handler
+    flush_handler = load_handler('message-coalescer-fn').handler
+
+    stop = threading.Event()
+    poller = threading.Thread(target=flush_poller, args=(sqs, queue_url, flush_handler, stop), daemon=True)
+    poller.start()
+
+    total = sum(len(texts) for texts in parts)
+    print(f"{len(parts)} thoughts, {total} messages (+{len(parts)} SQS redeliveries), "
+          f"window {args.window} s, max wait {args.max_wait} s, gap ~{args.gap} s\n")
+    print(f"{'mode':<10}{'messages':>9}{'executions':>12}{'exec/thought':>14}"
+          f"{'added ms p50':>14}{'added ms max':>14}{'first wait max':>16}{'text ok':>9}")
+    try:
+        for mode, window in (('direct', 0), ('coalesced', args.window)):
+            message_coalescer.COALESCE_WINDOW_SECONDS = window
+            rows = replay(stepfunctions, router_handler, payloads, parts, args, window > 0, random.Random(7))
+            added = [row[2] for row in rows if row[2] is not None]
+            first = [row[3] for row in rows if row[3] is not None]
+            executions = sum(row[1] for row in rows)
+            print(f"{mode:<10}{total:>9}{executions:>12}{executions / len(rows):>14.2f}"
+                  f"{statistics.median(added):>14.0f}{max(added):>14.0f}{max(first):>16.0f}"
+                  f"{sum(row[4] for row in rows):>6}/{len(rows)}")
+
+        message_coalescer.COALESCE_WINDOW_SECONDS = args.window
+        executions, waits, covered = typer(stepfunctions, router_handler, payloads[0]['config']['wa_phone_number_arn'],
+                                           args)
+        print(f"\nnon-stop typer: {args.typer_messages} messages every {args.typer_gap} s -> {executions} executions "
+              f"covering {covered} messages, oldest message waited {', '.join(f'{w:.0f}' for w in waits)} ms "
+              f"(bound {args.max_wait * 1000} ms)")
+    finally:
+        stop.set()
+        poller.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--moto', action='store_true', help="in-process moto DynamoDB/SQS instead of LocalStack")
+    parser.add_argument('--window', type=int, default=3, help="seconds of quiet before the flush")
+    parser.add_argument('--max-wait', type=int, default=10, help="bound on the wait of the first message, seconds")
+    parser.add_argument('--gap', type=float, default=1.0, help="mean seconds between the messages of a thought")
+    parser.add_argument('--typer-gap', type=float, default=2.0)
+    parser.add_argument('--typer-messages', type=int, default=10)
+    args = parser.parse_args()
+
+    import boto3
+
+    if args.moto:
+        from moto import mock_aws
+
+        with mock_aws():
+            run(boto3.client('dynamodb', region_name=REGION), boto3.client('sqs', region_name=REGION), args)
+    else:
+        run(boto3.client('dynamodb', endpoint_url=ENDPOINT, region_name=REGION),
+            boto3.client('sqs', endpoint_url=ENDPOINT, region_name=REGION), args)
+
+
+if __name__ == "__main__":
+    main()
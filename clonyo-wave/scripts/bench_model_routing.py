@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Latency of complexity_factor routing (model_router) vs one model for every reply.
+
+The text bodies of test-payloads/ plus the short follow-ups of
+bench_reply_strategy.py get their complexity_factor from the local reply
+classifier and go through the generate-response-fn handler, with the
+clone config stored in a config table (config_store, moto) and passed in
+the event as the router does. Three clones:
+
+    unrouted   routing disabled: Sonnet 3.5, max_tokens 4096, as the PHP
+    routed     default bands
+    override   per-clone override: standard band on the fast tier, light
+               band capped at 300 tokens
+
+The Bedrock stand-in answers after a first-token delay plus a per-token
+time of the model (assumed figures, MODEL_PROFILES), with an answer as
+long as the message category needs (ANSWER_TOKENS) but cut at max_tokens
+(stop_reason max_tokens). Sleeps are scaled by --time-scale and reported
+back at full scale. The KB stand-in counts the results requested.
+
+Printed per clone: replies per band and model, p50/mean/p95 reply latency,
+KB results requested and answers cut at max_tokens; with --verbose, the
+route of every message as logged by the handler.
+
+Usage:
+    python3 scripts/bench_model_routing.py [--time-scale 0.02] [--verbose]
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'lambdas-local', 'shared'))
+
+import aws_clients
+import bench_reply_strategy
+import config_store
+import model_router
+import reply_classifier
+import retrieval_cache
+
+REGION = 'eu-west-1'
+CONFIG_TABLE = 'bench-config-table'
+CONFIG_VERSION_TABLE = 'bench-config-version-table'
+MESSAGES_TABLE = 'sidea-ai-clone-prod-messages-table'
+SONNET = 'eu.anthropic.claude-3-5-sonnet-20240620-v1:0'
+
+# Assumed warm figures: (first token ms, ms per output token)
+MODEL_PROFILES = {
+    model_router.TIERS['fast']: (350, 8),
+    SONNET: (900, 18),
+    model_router.DEFAULT_MODEL_ID: (1000, 20),
+}
+# Output tokens a complete answer takes, per reply classifier label
+ANSWER_TOKENS = {
+    'small_talk': 40, 'info_lookup': 180, 'simple_comparison': 350, 'finance_advice': 600,
+    'finance_technical': 800, 'personal': 600, 'work_values': 600,
+}
+
+CLONES = {
+    'unrouted': {'routing': {'enabled': False}},
+    'routed': {},
+    'override': {'routing': {'bands': {'light': {'max_tokens': 300}, 'standard': {'tier': 'fast'}}}},
+}
+
+
+class FakeBedrock:
+    """invoke_model answering with the scripted length, at the speed of the model."""
+
+    def __init__(self, time_scale):
+        self.time_scale = time_scale
+        self.answer_tokens = 0
+
+    def invoke_model(self, modelId, body, **kwargs):
+        request = json.loads(body)
+        first_token_ms, token_ms = MODEL_PROFILES[modelId]
+        tokens = min(self.answer_tokens, request['max_tokens'])
+        time.sleep((first_token_ms + tokens * token_ms) / 1000 * self.time_scale)
+        response = {
+            'content': [{'type': 'text', 'text': 'parola ' * tokens}],
+            'stop_reason': 'max_tokens' if tokens < self.answer_tokens else 'end_turn',
+            'usage': {'input_tokens': 500, 'output_tokens': tokens},
+        }
+        return {'body': io.BytesIO(json.dumps(response).encode('utf-8'))}
+
+
+class FakeKb:
+
+    def __init__(self):
+        self.results = 0
+
+    def retrieve(self, retrievalConfiguration=None, **kwargs):
+        count = (retrievalConfiguration or {}).get('vectorSearchConfiguration', {}).get('numberOfResults', 5)
+        self.results += count
+        return {'retrievalResults': [{'content': {'text': f"Documento {i}."}, 'score': 0.5, 'location': None}
+                                     for i in range(count)]}
+
+
+def load_handler(name):
+    path = os.path.join(ROOT, 'lambdas-local', name, 'handler.py')
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def create_tables(dynamodb):
+    dynamodb.create_table(
+        TableName=CONFIG_TABLE,
+        AttributeDefinitions=[{'AttributeName': 'wa_phone_number_arn', 'AttributeType': 'S'}],
+        KeySchema=[{'AttributeName': 'wa_phone_number_arn', 'KeyType': 'HASH'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.create_table(
+        TableName=CONFIG_VERSION_TABLE,
+        AttributeDefinitions=[{'AttributeName': 'name', 'AttributeType': 'S'}],
+        KeySchema=[{'AttributeName': 'name', 'KeyType': 'HASH'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.create_table(
+        TableName=MESSAGES_TABLE,
+        AttributeDefinitions=[{'AttributeName': 'pk', 'AttributeType': 'S'},
+                              {'AttributeName': 'sk', 'AttributeType': 'S'}],
+        KeySchema=[{'AttributeName': 'pk', 'KeyType': 'HASH'}, {'AttributeName': 'sk', 'KeyType': 'RANGE'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+
+def clone_config(name, overrides):
+    return {
+        'wa_phone_number_arn': f"arn:aws:social-messaging:eu-central-1:000000000000:phone-number-id/bench-{name}",
+        'name': f"Bench {name}",
+        'response_generator': dict({'kb_id': 'BENCHKB', 'model_id': SONNET, 'max_tokens': 4096, 'temperature': 0.5,
+                                    'system_prompt': "Sei un consulente finanziario esperto."}, **overrides),
+    }
+
+
+def run(handler, store, bedrock, kb, clone, messages, args):
+    config = store.get(clone['wa_phone_number_arn'])
+    retrieval_cache._default = retrieval_cache.RetrievalCache(table_name=None)
+    kb.results = 0
+    latencies, bands, cut = [], Counter(), 0
+    for message, classification in messages:
+        bedrock.answer_tokens = ANSWER_TOKENS[classification.label]
+        event = {
+            'userInput': message,
+            # As the router passes it: the clone's response_generator options
+            'config': config['response_generator'],
+            'messages_key': f"S#{clone['wa_phone_number_arn']}#C#393330000000",
+            'complexity_factor': classification.complexity_factor,
+        }
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = handler(event, None)
+        route = result['metrics']['route']
+        latencies.append(route['latency_ms'] / args.time_scale)
+        bands[(route['band'] or 'unrouted', route['model_id'].split('.')[-1][:22], route['max_tokens'])] += 1
+        cut += route['stop_reason'] == 'max_tokens'
+        if args.verbose:
+            print(f"  {classification.complexity_factor:<5}{route['band'] or '-':<10}{route['model_id'][:38]:<40}"
+                  f"{route['max_tokens']:>6}{str(route['retrieval_results']):>6}{latencies[-1]:>8.0f} ms  {message[:40]}")
+    return latencies, bands, cut, kb.results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--time-scale', type=float, default=0.02, help="fraction of the modelled latency slept")
+    parser.add_argument('--verbose', action='store_true', help="print the route of every message")
+    args = parser.parse_args()
+
+    import boto3
+    from moto import mock_aws
+
+    messages = [(message, reply_classifier.classify(message))
+                for message in bench_reply_strategy.payload_messages() + bench_reply_strategy.FOLLOW_UPS]
+    print(f"{len(messages)} messages, complexity_factor "
+          f"{dict(sorted(Counter(c.complexity_factor for _, c in messages).items()))}; "
+          f"latency profiles (first token ms, ms/token): "
+          f"{ {model.split('.')[-1][:22]: profile for model, profile in MODEL_PROFILES.items()} }\n")
+
+    with mock_aws():
+        dynamodb = boto3.client('dynamodb', region_name=REGION)
+        create_tables(dynamodb)
+        bedrock, kb = FakeBedrock(args.time_scale), FakeKb()
+        aws_clients._clients[('dynamodb', aws_clients.DEFAULT_REGION, aws_clients.LOCAL_ENDPOINT_URL)] = dynamodb
+        aws_clients._clients[('bedrock-runtime', aws_clients.DEFAULT_REGION, None)] = bedrock
+        aws_clients._clients[('bedrock-agent-runtime', aws_clients.DEFAULT_REGION, None)] = kb
+        store = config_store.ConfigStore(table_name=CONFIG_TABLE, version_table_name=CONFIG_VERSION_TABLE, dynamodb=dynamodb)
+        handler = load_handler('generate-response-fn').handler
+
+        print(f"{'clone':<10}{'p50 ms':>8}{'mean ms':>9}{'p95 ms':>8}{'KB results':>12}{'cut':>5}  replies per band")
+        for name, overrides in CLONES.items():
+            clone = clone_config(name, overrides)
+            store.put(clone)
+            if args.verbose:
+                print(f"{name}:")
+            latencies, bands, cut, results = run(handler, store, bedrock, kb, clone, messages, args)
+            ordered = sorted(latencies)
+            per_band = ', '.join(f"{band}/{model}/{tokens}: {count}" for (band, model, tokens), count in bands.items())
+            print(f"{name:<10}{statistics.median(latencies):>8.0f}{statistics.mean(latencies):>9.0f}"
+                  f"{ordered[int(0.95 * (len(ordered) - 1))]:>8.0f}{results:>12}{cut:>5}  {per_band}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+End-to-end wall time: chained AnalyzeTopic -> Check Sufficiency -> Get reply
+strategy vs the fused pre-generation-fn.
+
+Always prints the latency-model estimate of both flows (sfn_latency.py).
+With --localstack it also creates the two MOCKED definitions on LocalStack
+and measures real execution wall time (state transitions only, since
+mocked states are Pass states).
+
+Usage:
+    python3 scripts/bench_pre_generation.py [--localstack] [--runs 5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT)
+
+import prepare_local_sfn
+import prepare_local_sfn_mock
+import sfn_latency
+
+ENDPOINT = os.environ.get('AWS_ENDPOINT_URL', 'http://localhost:4566')
+REGION = 'eu-west-1'
+ROLE_ARN = 'arn:aws:iam::000000000000:role/service-role/StepFunctionRole'
+PAYLOAD = os.path.join(ROOT, 'test-payloads', 'text', '01-simple-question.json')
+
+
+def build_definitions():
+    os.chdir(ROOT)
+    chained = prepare_local_sfn.transform(prepare_local_sfn.load_definition())
+    fused = prepare_local_sfn.enable_pre_generation(
+        prepare_local_sfn.transform(prepare_local_sfn.load_definition())
+    )
+    return {'chained': chained, 'fused': fused}
+
+
+def estimate(definitions):
+    print("=== Latency model estimate (warm, text message, KB path) ===\n")
+    totals = {}
+    for name, definition in definitions.items():
+        totals[name], path = sfn_latency.walk(definition)
+        print(f"{name}: {totals[name]:.0f} ms")
+        print(sfn_latency.format_path(path))
+        print()
+    print(f"Saved by fusing: {totals['chained'] - totals['fused']:.0f} ms\n")
+
+
+def run_localstack(definitions, runs):
+    import boto3
+
+    sfn = boto3.client('stepfunctions', endpoint_url=ENDPOINT, region_name=REGION)
+    with open(PAYLOAD) as f:
+        payload = f.read()
+
+    print(f"=== LocalStack mocked executions ({runs} runs each) ===\n")
+    results = {}
+    for name, definition in definitions.items():
+        mocked = prepare_local_sfn_mock.transform_to_mock(json.loads(json.dumps(definition)))
+        arn = sfn.create_state_machine(
+            name=f"bench-pre-generation-{name}",
+            definition=json.dumps(mocked),
+            roleArn=ROLE_ARN
+        )['stateMachineArn']
+
+        durations = []
+        for _ in range(runs):
+            execution_arn = sfn.start_execution(stateMachineArn=arn, input=payload)['executionArn']
+            while True:
+                execution = sfn.describe_execution(executionArn=execution_arn)
+                if execution['status'] != 'RUNNING':
+                    break
+                time.sleep(0.1)
+            if execution['status'] != 'SUCCEEDED':
+                print(f"  {name}: execution {execution['status']}")
+                continue
+            durations.append((execution['stopDate'] - execution['startDate']).total_seconds() * 1000)
+
+        sfn.delete_state_machine(stateMachineArn=arn)
+        if durations:
+            results[name] = statistics.median(durations)
+            print(f"{name:<10}{results[name]:>10.0f} ms (median)")
+
+    if len(results) == 2:
+        print(f"\nSaved by fusing: {results['chained'] - results['fused']:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--localstack', action='store_true')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    definitions = build_definitions()
+    estimate(definitions)
+    if args.localstack:
+        run_localstack(definitions, args.runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+How many messages the reply-strategy-fn local classifier answers without
+Bedrock, and how long it takes.
+
+Runs the classifier on the text bodies of test-payloads/ plus a few typical
+short follow-ups, and prints the path each one would take (rules / model /
+bedrock), the classifier time and the Bedrock time saved according to the
+latency model (sfn_latency.py). Then checks the explicit mode requests and
+refusals of EXPLICIT_MODES and exits non-zero if one resolves to the wrong
+mode.
+
+Usage:
+    python3 scripts/bench_reply_strategy.py [--min-confidence 0.7]
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import timeit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'lambdas-local', 'shared'))
+
+import reply_classifier
+import sfn_latency
+
+FOLLOW_UPS = [
+    'Ok', 'Grazie!', 'Si grazie', 'ciao', 'Perfetto, grazie mille', '👍',
+    'Mandami un audio', 'ETF o azioni?', 'Dove trovo il tuo podcast?', 'E poi?',
+]
+
+# Explicit requests and refusals -> the mode they must resolve to (None: ambiguous, the model decides)
+EXPLICIT_MODES = [
+    ('Mandami un audio', 'audio'),
+    ('No, mandami un audio', 'audio'),
+    ('No grazie, preferisco un vocale', 'audio'),
+    ("Non ho capito, me lo spieghi con un audio?", 'audio'),
+    ('Non mandarmi un audio, scrivimi', 'text'),
+    ('Non mi mandare vocali per favore', 'text'),
+    ('Niente audio, sono in ufficio', 'text'),
+    ('Senza vocali, grazie', 'text'),
+    ('No audio per favore', 'text'),
+    ('Scrivimi, non posso ascoltare', 'text'),
+    ('Voglio un messaggio di testo non un audio', 'text'),
+    ('Rispondimi per iscritto, non con un vocale', 'text'),
+    ('Testo o audio, fai tu', None),
+]
+
+
+def payload_messages():
+    messages = []
+    for path in sorted(glob.glob(os.path.join(ROOT, 'test-payloads', '**', '*.json'), recursive=True)):
+        with open(path) as f:
+            body = json.load(f).get('text', {}).get('body')
+        if body:
+            messages.append(body)
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--min-confidence', type=float, default=reply_classifier.MIN_CONFIDENCE)
+    args = parser.parse_args()
+
+    messages = payload_messages() + FOLLOW_UPS
+    local = 0
+    for message in messages:
+        result = reply_classifier.classify(message)
+        path = result.source if result.confident(args.min_confidence) else 'bedrock'
+        local += path != 'bedrock'
+        us = timeit.timeit(lambda: reply_classifier.classify(message), number=200) / 200 * 1_000_000
+        print(f"{path:<8}{result.mode:<6}{result.complexity_factor:<5}{result.confidence:>6.2f}{us:>9.1f} us  {message[:60]}")
+
+    bedrock_ms = sfn_latency.LAMBDA_LATENCY_MS['reply-strategy-fn']
+    print(f"\nAnswered locally: {local}/{len(messages)}")
+    print(f"Bedrock time saved: ~{local * bedrock_ms} ms over {len(messages)} messages ({bedrock_ms} ms per call)")
+
+    print("\nExplicit mode requests:")
+    wrong = 0
+    for message, expected in EXPLICIT_MODES:
+        mode = reply_classifier.explicit_mode(reply_classifier.normalize(message))
+        wrong += mode != expected
+        print(f"{'ok' if mode == expected else 'WRONG':<7}{str(mode):<7}{message}")
+    print(f"{len(EXPLICIT_MODES) - wrong}/{len(EXPLICIT_MODES)} resolved to the requested mode")
+    if wrong:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
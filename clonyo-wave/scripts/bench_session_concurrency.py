@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Concurrent ManageSession invocations for one contact: sessions created.
+
+--concurrency invocations for the same contact are released together
+(a burst of messages, or SQS redeliveries) against a sessions table with
+the wa_contact_id_index GSI, for a contact that is:
+
+  new       no session yet
+  active    last active a minute ago (must be resumed)
+  expired   last active past the 30 minute timeout (one new session)
+
+with:
+
+  php       SessionManagerHandler: GSI query, then putItem/updateItem
+  python    session-manager-fn (session_manager.resolve): conditional
+            UpdateItem on the contact's current-session item
+
+Each scenario is repeated --rounds times with a fresh contact. Reported:
+session items created per round (max), rounds where the invocations did
+not all get the same session, DynamoDB requests per invocation and p50
+latency. Exits non-zero if the Python handler ever creates more than one
+session, hands out different ones or loses the previous session's topic. DynamoDB is LocalStack, or moto
+with --moto (writes serialized, as DynamoDB does for each item:
+moto alone lets concurrent conditional updates interleave).
+
+Usage:
+    python3 scripts/bench_session_concurrency.py [--moto] [--concurrency 25] [--rounds 10]
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'lambdas-local', 'shared'))
+
+import aws_clients
+import session_manager
+
+ENDPOINT = os.environ.get('AWS_ENDPOINT_URL', 'http://localhost:4566')
+REGION = 'eu-west-1'
+TABLE = 'bench-sessions-table'
+HANDLER = os.path.join(ROOT, 'lambdas-local', 'session-manager-fn', 'handler.py')
+TIMEOUT = 30 * 60
+SEED_TOPIC = 'topic-investimenti'
+
+
+class RequestCounter:
+
+    def __init__(self, client):
+        self.count = 0
+        self._lock = threading.Lock()
+        client.meta.events.register('before-call.dynamodb', self._before_call)
+
+    def _before_call(self, **kwargs):
+        with self._lock:
+            self.count += 1
+
+
+def php_session_manager(dynamodb, wa_contact_id, now):
+    """SessionManagerHandler::handle, as written."""
+    items = dynamodb.query(
+        TableName=TABLE,
+        IndexName='wa_contact_id_index',
+        KeyConditionExpression='wa_contact_id = :contact_id',
+        ExpressionAttributeValues={':contact_id': {'S': wa_contact_id}},
+        Limit=1,
+        ScanIndexForward=False
+    ).get('Items', [])
+    session_id, topic_id, is_new = None, None, True
+    if items:
+        latest = items[0]
+        topic_id = latest.get('current_topic_id', {}).get('S')
+        if now - int(latest.get('last_active_at', {}).get('N', '0')) < TIMEOUT:
+            session_id, is_new = latest['session_id']['S'], False
+    if session_id is None:
+        session_id = str(uuid.uuid4())
+        item = {'session_id': {'S': session_id}, 'wa_contact_id': {'S': wa_contact_id},
+                'started_at': {'N': str(now)}, 'last_active_at': {'N': str(now)}, 'status': {'S': 'ACTIVE'}}
+        if topic_id:
+            item['current_topic_id'] = {'S': topic_id}
+        dynamodb.put_item(TableName=TABLE, Item=item)
+    else:
+        dynamodb.update_item(TableName=TABLE, Key={'session_id': {'S': session_id}},
+                             UpdateExpression='SET last_active_at = :now',
+                             ExpressionAttributeValues={':now': {'N': str(now)}})
+    return {'session_id': session_id, 'topic_id': topic_id, 'is_new_session': is_new}
+
+
+def store_session_meta(dynamodb, session_id, wa_contact_id, topic_id, now):
+    """'Update Session Meta' and 'Update Current Session Topic' of the state machine after a reply."""
+    dynamodb.update_item(TableName=TABLE, Key={'session_id': {'S': session_id}},
+                         UpdateExpression='SET last_active_at = :now, current_topic_id = :topic',
+                         ExpressionAttributeValues={':now': {'N': str(now)}, ':topic': {'S': topic_id}})
+    dynamodb.update_item(TableName=TABLE, Key={'session_id': {'S': session_manager.current_key(wa_contact_id)}},
+                         UpdateExpression='SET current_topic_id = :topic',
+                         ExpressionAttributeValues={':topic': {'S': topic_id}})
+
+
+def seed(dynamodb, wa_contact_id, scenario, mode, now):
+    """Previous session of the contact: one message handled by each implementation and the state machine."""
+    if scenario == 'new':
+        return None
+    last_active = now - 60 if scenario == 'active' else now - TIMEOUT - 60
+    if mode == 'php':
+        session_id = php_session_manager(dynamodb, wa_contact_id, last_active)['session_id']
+    else:
+        session_id = session_manager.resolve(dynamodb, wa_contact_id, now=last_active, table_name=TABLE)['session_id']
+    store_session_meta(dynamodb, session_id, wa_contact_id, SEED_TOPIC, last_active)
+    return session_id
+
+
+def sessions_of(dynamodb, wa_contact_id):
+    items = dynamodb.scan(
+        TableName=TABLE, FilterExpression='wa_contact_id = :contact_id',
+        ExpressionAttributeValues={':contact_id': {'S': wa_contact_id}}
+    )['Items']
+    return {item['session_id']['S'] for item in items}
+
+
+def burst(invoke, concurrency):
+    barrier = threading.Barrier(concurrency)
+    results, timings = [None] * concurrency, [None] * concurrency
+
+    def worker(index):
+        barrier.wait()
+        started = time.perf_counter()
+        results[index] = invoke()
+        timings[index] = (time.perf_counter() - started) * 1000
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, timings
+
+
+def serialize_moto_writes():
+    """
+    DynamoDB applies the writes to an item one at a time (condition and
+    update included); moto does not, so concurrent if_not_exists/conditional
+    updates can interleave there. Give moto's backend that guarantee.
+    """
+    from moto.dynamodb.models import DynamoDBBackend
+
+    lock = threading.Lock()
+
+    def serialized(method):
+        def wrapper(*args, **kwargs):
+            with lock:
+                return method(*args, **kwargs)
+        return wrapper
+
+    for name in ('put_item', 'update_item', 'delete_item', 'transact_write_items'):
+        setattr(DynamoDBBackend, name, serialized(getattr(DynamoDBBackend, name)))
+
+
+def run(dynamodb, args):
+    dynamodb.create_table(
+        TableName=TABLE,
+        AttributeDefinitions=[{'AttributeName': 'session_id', 'AttributeType': 'S'},
+                              {'AttributeName': 'wa_contact_id', 'AttributeType': 'S'}],
+        KeySchema=[{'AttributeName': 'session_id', 'KeyType': 'HASH'}],
+        GlobalSecondaryIndexes=[{'IndexName': 'wa_contact_id_index',
+                                 'KeySchema': [{'AttributeName': 'wa_contact_id', 'KeyType': 'HASH'}],
+                                 'Projection': {'ProjectionType': 'ALL'}}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.get_waiter('table_exists').wait(TableName=TABLE)
+    counter = RequestCounter(dynamodb)
+
+    aws_clients._clients[('dynamodb', aws_clients.DEFAULT_REGION, aws_clients.LOCAL_ENDPOINT_URL)] = dynamodb
+    session_manager.SESSIONS_TABLE = TABLE
+    spec = importlib.util.spec_from_file_location('session_manager_handler', HANDLER)
+    handler = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(handler)
+
+    print(f"{args.concurrency} concurrent invocations per contact, {args.rounds} rounds\n")
+    print(f"{'scenario':<10}{'mode':<8}{'sessions/round max':>20}{'split rounds':>14}"
+          f"{'requests/inv':>14}{'p50 ms':>9}")
+    violations = 0
+    for scenario in ('new', 'active', 'expired'):
+        for mode in ('php', 'python'):
+            created_max, split_rounds, requests, timings = 0, 0, 0, []
+            for _ in range(args.rounds):
+                wa_contact_id = f"3933{uuid.uuid4().int % 10 ** 8:08d}"
+                now = int(time.time())
+                previous = seed(dynamodb, wa_contact_id, scenario, mode, now)
+                before = counter.count
+                if mode == 'php':
+                    invoke = lambda: php_session_manager(dynamodb, wa_contact_id, now)
+                else:
+                    invoke = lambda: handler.handler({'wa_contact_id': wa_contact_id}, None)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results, round_timings = burst(invoke, args.concurrency)
+                requests += counter.count - before
+                timings.extend(round_timings)
+
+                created = len(sessions_of(dynamodb, wa_contact_id) - {previous})
+                handed_out = {result['session_id'] for result in results}
+                created_max = max(created_max, created)
+                split_rounds += len(handed_out) > 1
+                expected_created = 0 if scenario == 'active' else 1
+                # The previous session's topic is resumed or carried over
+                expected_topic = None if scenario == 'new' else SEED_TOPIC
+                topic_ok = all(result['topic_id'] == expected_topic for result in results)
+                if mode == 'python' and (created != expected_created or len(handed_out) != 1 or not topic_ok):
+                    violations += 1
+            print(f"{scenario:<10}{mode:<8}{created_max:>20}{split_rounds:>14}"
+                  f"{requests / (args.rounds * args.concurrency):>14.2f}{statistics.median(timings):>9.1f}")
+
+    print(f"\npython: {'exactly one session in every round' if not violations else f'{violations} rounds FAILED'}")
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--moto', action='store_true', help="in-process moto DynamoDB instead of LocalStack")
+    parser.add_argument('--concurrency', type=int, default=25)
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    import boto3
+    from botocore.config import Config
+
+    config = Config(max_pool_connections=args.concurrency * 2)
+    if args.moto:
+        from moto import mock_aws
+
+        serialize_moto_writes()
+        with mock_aws():
+            violations = run(boto3.client('dynamodb', region_name=REGION, config=config), args)
+    else:
+        violations = run(boto3.client('dynamodb', endpoint_url=ENDPOINT, region_name=REGION, config=config), args)
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Time-to-first-byte: blocking invoke_model vs streaming response mode.
+
+Runs both modes against the local streaming stand-in (no AWS calls) and
+prints when the first WhatsApp-sized chunk would be ready to send.
+
+Usage:
+    python3 scripts/bench_streaming_ttfb.py [--token-delay 0.02] [--runs 3]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambdas-local', 'shared'))
+
+import bedrock_stream
+
+SAMPLE_ANSWER = (
+    "Gli ETF sono fondi indicizzati quotati in borsa che replicano l'andamento di un indice. "
+    "Per iniziare ti serve un conto titoli presso una banca o un broker online. "
+    "Poi scegli ETF coerenti con il tuo profilo di rischio e con il tuo orizzonte temporale. "
+    "Gli ETF ad accumulazione reinvestono i dividendi e sfruttano l'interesse composto. "
+    "Ricorda di guardare il TER, la replica fisica o sintetica e la liquidità dello strumento. "
+    "Infine, investi con costanza: un piano di accumulo mensile riduce l'impatto della volatilità. "
+) * 3
+
+
+def run_blocking(client):
+    started = time.perf_counter()
+    response = client.invoke_model(modelId='local', body='{}')
+    json.loads(response['body'].read())
+    elapsed = (time.perf_counter() - started) * 1000
+    return elapsed, elapsed
+
+
+def run_streaming(client):
+    _, _, metrics = bedrock_stream.generate_streaming(client, 'local', {})
+    return metrics.first_chunk_ms, metrics.total_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--token-delay', type=float, default=0.02)
+    parser.add_argument('--first-token-delay', type=float, default=0.3)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    client = bedrock_stream.LocalStreamingBedrock(SAMPLE_ANSWER, args.token_delay, args.first_token_delay)
+
+    results = {}
+    for name, run in (('blocking', run_blocking), ('streaming', run_streaming)):
+        ttfb, total = zip(*(run(client) for _ in range(args.runs)))
+        results[name] = (statistics.median(ttfb), statistics.median(total))
+
+    print(f"{'mode':<12}{'first chunk (ms)':>18}{'total (ms)':>14}")
+    for name, (ttfb, total) in results.items():
+        print(f"{name:<12}{ttfb:>18.1f}{total:>14.1f}")
+
+    saved = results['blocking'][0] - results['streaming'][0]
+    print(f"\nTime-to-first-byte saved: {saved:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
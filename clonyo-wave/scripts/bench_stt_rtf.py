@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Real-time factor of the local speech-to-text backend on CPU.
+
+Transcribes voice notes with speech-to-text's LocalWhisperBackend for each
+model size / compute type / thread count and reports, per clip:
+
+  decode ms         Ogg/Opus -> 16 kHz mono PCM (PyAV)
+  first partial ms  first segment out of the decoder
+  total ms          decode + transcription, model already loaded
+  RTF               total / audio duration (< 1 is faster than real time)
+
+Pass real WhatsApp voice notes (.ogg, e.g. copied from audio/in/ in the
+media bucket) with --audio. Without them, speech-like synthetic clips are
+encoded to Ogg/Opus at the --durations given; the VAD filter is turned
+off for those, so the decoder does the full work on every clip.
+
+With --transcribe the same clips also go through an Amazon Transcribe
+batch job (LocalStack S3 + Transcribe at AWS_ENDPOINT_URL) as the
+reference: start, poll every second, read the transcript JSON.
+
+Needs faster-whisper (pip install faster-whisper); models are downloaded
+on first use, or read from STT_MODEL_DIR.
+
+Usage:
+    python3 scripts/bench_stt_rtf.py [--audio note1.ogg note2.ogg] [--durations 3,10,30]
+        [--models tiny,base,small] [--compute-types int8] [--threads 2,4] [--transcribe]
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'lambdas-local', 'shared'))
+
+import speech_to_text
+
+ENDPOINT = os.environ.get('AWS_ENDPOINT_URL', 'http://localhost:4566')
+REGION = 'eu-west-1'
+BUCKET = 'bench-stt-media'
+
+
+def synthetic_voice_note(seconds, sample_rate=48000, seed=3):
+    """Speech-like Ogg/Opus: voiced harmonics with syllable-rate envelope and pitch glide, plus breath noise."""
+    import av
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.7 * t) + 10 * rng.standard_normal(1)
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 12))
+    syllables = np.clip(np.sin(2 * np.pi * 4.5 * t + rng.uniform(0, np.pi)), 0, None) ** 0.6
+    pauses = (np.sin(2 * np.pi * 0.25 * t) > -0.8).astype(float)
+    signal = (0.25 * voiced * syllables + 0.01 * rng.standard_normal(len(t))) * pauses
+    pcm = (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+
+    buffer = io.BytesIO()
+    with av.open(buffer, 'w', format='ogg') as container:
+        stream = container.add_stream('libopus', rate=sample_rate)
+        stream.layout = 'mono'
+        stream.bit_rate = 24000
+        frame_size = 960
+        for offset in range(0, len(pcm), frame_size):
+            chunk = pcm[offset:offset + frame_size]
+            frame = av.AudioFrame.from_ndarray(chunk.reshape(1, -1), format='s16', layout='mono')
+            frame.sample_rate = sample_rate
+            frame.pts = offset
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return buffer.getvalue()
+
+
+def load_clips(args):
+    if args.audio:
+        clips = []
+        for path in args.audio:
+            with open(path, 'rb') as f:
+                clips.append((os.path.basename(path), f.read(), True))
+        return clips
+    return [
+        (f"synthetic {float(d):g}s", synthetic_voice_note(float(d)), False)
+        for d in args.durations.split(',')
+    ]
+
+
+def run_local(clips, args):
+    print(f"{'model':<14}{'threads':>8}  {'clip':<18}{'audio s':>8}{'decode ms':>11}"
+          f"{'1st partial ms':>16}{'total ms':>10}{'RTF':>7}")
+    summary = []
+    for model in args.models.split(','):
+        for compute_type in args.compute_types.split(','):
+            for threads in (int(n) for n in args.threads.split(',')):
+                backend = speech_to_text.LocalWhisperBackend(
+                    model=model, compute_type=compute_type, cpu_threads=threads, beam_size=args.beam_size
+                )
+                backend.load()
+                label = f"{model}/{compute_type}"
+                # Warm-up pass: first call pays for the ONNX VAD and allocator warm-up
+                backend.transcribe_audio(clips[0][1], vad_filter=clips[0][2])
+                rtfs = []
+                for name, data, real in clips:
+                    results = [backend.transcribe_audio(data, vad_filter=real) for _ in range(args.repeat)]
+                    result = min(results, key=lambda r: r['total_ms'])
+                    rtfs.append(result['rtf'])
+                    first = result['first_partial_ms'] if result['first_partial_ms'] is not None else float('nan')
+                    print(f"{label:<14}{threads:>8}  {name:<18}{result['audio_seconds']:>8.1f}{result['decode_ms']:>11.1f}"
+                          f"{first:>16.0f}{result['total_ms']:>10.0f}{result['rtf']:>7.3f}")
+                summary.append((label, threads, backend.load_ms, statistics.median(rtfs)))
+        print()
+
+    print(f"{'model':<14}{'threads':>8}{'load ms':>10}{'median RTF':>12}")
+    for label, threads, load_ms, rtf in summary:
+        print(f"{label:<14}{threads:>8}{load_ms:>10.0f}{rtf:>12.3f}")
+
+
+def run_transcribe(clips):
+    import boto3
+
+    s3 = boto3.client('s3', endpoint_url=ENDPOINT, region_name=REGION)
+    s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': REGION})
+    backend = speech_to_text.TranscribeBackend(
+        output_bucket=BUCKET,
+        transcribe=boto3.client('transcribe', endpoint_url=ENDPOINT, region_name=REGION),
+        s3=s3
+    )
+    print(f"\n{'Transcribe batch':<18}{'clip':<18}{'polls':>6}{'total ms':>10}")
+    for index, (name, data, _) in enumerate(clips):
+        key = f"audio/in/bench-{index}.ogg"
+        s3.put_object(Bucket=BUCKET, Key=key, Body=data)
+        result = backend.transcribe(f"s3://{BUCKET}/{key}")
+        print(f"{'':<18}{name:<18}{result['polls']:>6}{result['total_ms']:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--audio', nargs='*', help="voice notes to transcribe (default: synthetic clips)")
+    parser.add_argument('--durations', default='3,10,30', help="synthetic clip lengths (s)")
+    parser.add_argument('--models', default='tiny,base,small')
+    parser.add_argument('--compute-types', default='int8', help="e.g. int8,float32")
+    parser.add_argument('--threads', default=str(speech_to_text.STT_CPU_THREADS), help="CPU threads, e.g. 2,4")
+    parser.add_argument('--beam-size', type=int, default=speech_to_text.STT_BEAM_SIZE)
+    parser.add_argument('--repeat', type=int, default=3, help="runs per clip (best is reported)")
+    parser.add_argument('--transcribe', action='store_true', help="also run the clips through Amazon Transcribe (LocalStack)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    clips = load_clips(args)
+    print(f"{len(clips)} clips ready in {(time.perf_counter() - started) * 1000:.0f} ms, {os.cpu_count()} CPUs\n")
+    run_local(clips, args)
+    if args.transcribe:
+        run_transcribe(clips)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Topic assignment by embedding (topic_registry) vs md5(topic name).
+
+1. A conversation is replayed through the topic-analyzer-fn handler: the
+   test-payloads/conversation-flow messages plus an ETF thread, with a
+   fake Haiku that names the topic the way the model drifts ("ETF",
+   "Investimenti ETF", "Costi ETF"...). Printed per message: md5 topic id
+   vs registry topic and decision (registry continuation = no Haiku call,
+   matched, named, minted), then distinct topics and Haiku calls of each.
+   Embeddings are the local hashed backend (no Bedrock), so the default
+   thresholds here are the ones calibrated for it, lower than the
+   topic_registry defaults meant for Titan.
+
+2. Assignment latency at 10/100/1000 topics per contact, with Titan v2
+   sized (--dimensions) unit centroids: NumPy matrix-vector match vs a
+   per-topic Python cosine loop, plus the DynamoDB side on LocalStack or
+   moto (--moto): cold load of the registry (paginated Query) and the
+   warm version check done on every message.
+
+Usage:
+    python3 scripts/bench_topic_registry.py [--moto] [--topics 10 100 1000] [--dimensions 256] [--matches 2000]
+"""
+
+import argparse
+import contextlib
+import glob
+import importlib.util
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'lambdas-local', 'shared'))
+
+import aws_clients
+import embeddings
+import topic_registry
+from retrieval_cache import cosine
+
+ENDPOINT = os.environ.get('AWS_ENDPOINT_URL', 'http://localhost:4566')
+REGION = 'eu-west-1'
+TABLE = 'bench-topic-registry-table'
+FLOW_DIR = os.path.join(ROOT, 'test-payloads', 'conversation-flow')
+# Hashed embeddings of short messages are less similar than Titan ones
+HASHED_ASSIGN_THRESHOLD = 0.45
+HASHED_CONTINUATION_THRESHOLD = 0.55
+MESSAGES_KEY = 'S#arn:aws:social-messaging:eu-central-1:533267110337:phone-number-id/test-phone-001#C#393331234567'
+
+# Topic name the model gives each conversation-flow message, then an ETF thread
+FLOW_TOPICS = ['Investimenti', 'Fondi obbligazionari', 'Polizza vita', 'Assicurazione vita', 'Mutuo prima casa',
+               'PAC', 'Orari filiale']
+ETF_THREAD = [
+    ("Cosa ne pensi degli ETF per investire?", 'ETF'),
+    ("Quali ETF azionari globali consigli per investire a lungo termine?", 'Investimenti ETF'),
+    ("E gli ETF azionari globali ad accumulazione?", 'ETF accumulazione'),
+    ("Gli ETF azionari hanno costi più bassi dei fondi comuni?", 'Costi ETF'),
+    ("Quanto costa una polizza vita per mia moglie?", 'Polizza vita coniuge'),
+    ("La polizza vita per mia moglie copre anche la malattia?", 'Copertura malattia'),
+    ("E per gli ETF azionari quale piattaforma mi consigli?", 'Piattaforme ETF'),
+]
+
+
+class FakeBedrock:
+    """invoke_model of Haiku answering with the scripted topic name."""
+
+    def __init__(self, names):
+        self.names = names
+        self.calls = 0
+
+    def invoke_model(self, modelId, body, **kwargs):
+        self.calls += 1
+        text = json.loads(body)['messages'][0]['content'].split('\n')[0][len('User Input: '):]
+        answer = {'topic': self.names[text], 'keywords': self.names[text].lower().split()[:3]}
+        return {'body': io.BytesIO(json.dumps({'content': [{'text': json.dumps(answer)}]}).encode('utf-8'))}
+
+
+def load_handler(name):
+    path = os.path.join(ROOT, 'lambdas-local', name, 'handler.py')
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def create_table(dynamodb):
+    dynamodb.create_table(
+        TableName=TABLE,
+        AttributeDefinitions=[{'AttributeName': 'pk', 'AttributeType': 'S'},
+                              {'AttributeName': 'sk', 'AttributeType': 'S'}],
+        KeySchema=[{'AttributeName': 'pk', 'KeyType': 'HASH'}, {'AttributeName': 'sk', 'KeyType': 'RANGE'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.get_waiter('table_exists').wait(TableName=TABLE)
+
+
+def conversation():
+    texts = [json.load(open(path))['text']['body'] for path in sorted(glob.glob(os.path.join(FLOW_DIR, '0*.json')))]
+    return list(zip(texts, FLOW_TOPICS)) + ETF_THREAD
+
+
+def replay(handler, bedrock):
+    print(f"{'#':<4}{'message':<52}{'model name':<22}{'md5 id':<10}{'registry':<10}{'decision':<14}")
+    messages = conversation()
+    current, md5_ids, registry_ids = None, set(), set()
+    for index, (text, name) in enumerate(messages, start=1):
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = handler({'text': text, 'current_topic_id': current, 'messages_key': MESSAGES_KEY}, None)
+        current = result['topic_id']
+        md5_id = topic_registry.topic_id_for(name)
+        md5_ids.add(md5_id)
+        registry_ids.add(current)
+        label = name if result.get('source') != 'registry' else '(not asked)'
+        print(f"{index:02d}  {text[:50]:<52}{label:<22}{md5_id[:8]:<10}{current[:8]:<10}"
+              f"{result.get('source', '-'):<14}")
+    print(f"\nmd5(topic name): {len(md5_ids)} topics, {len(messages)} Haiku calls; "
+          f"registry: {len(registry_ids)} topics, {bedrock.calls} Haiku calls "
+          f"({len(messages) - bedrock.calls} continuations skipped the model)")
+
+
+def registry_of(dynamodb, key, topics, dimensions, rng):
+    """A contact with `topics` random unit centroids, written as TopicRegistry.mint does."""
+    registry = topic_registry.TopicRegistry(dynamodb, key, TABLE, dimensions)
+    registry.version = 0
+    for index in range(topics):
+        embedding = embeddings.unit(rng.standard_normal(dimensions))
+        registry.mint(f"bench-topic-{index:05d}", f"Topic {index}", embedding, ['bench'])
+    return registry
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    return statistics.median(timings), percentile(timings, 0.95)
+
+
+def latency(dynamodb, sizes, dimensions, matches):
+    rng = np.random.default_rng(7)
+    print(f"\n{'topics':>7}{'numpy p50 us':>14}{'p95 us':>9}{'loop p50 us':>13}{'p95 us':>9}"
+          f"{'cold load ms':>14}{'version check ms':>18}{'registry KB':>13}")
+    for size in sizes:
+        key = f"S#bench#C#topics-{size}"
+        registry = registry_of(dynamodb, key, size, dimensions, rng)
+        queries = [embeddings.unit(rng.standard_normal(dimensions)) for _ in range(64)]
+        current = registry.ids[0]
+
+        queue = iter(range(10 ** 9))
+        numpy_p50, numpy_p95 = timed(lambda: registry.match(queries[next(queue) % 64], current), matches)
+
+        rows = [list(map(float, row)) for row in registry.matrix]
+        plain = [list(map(float, query)) for query in queries]
+
+        def loop_match():
+            query = plain[next(queue) % 64]
+            return max(range(size), key=lambda row: cosine(query, rows[row]))
+
+        loop_p50, loop_p95 = timed(loop_match, max(20, matches // 50))
+
+        cold = []
+        for _ in range(5):
+            started = time.perf_counter()
+            topic_registry.TopicRegistry(dynamodb, key, TABLE, dimensions).load()
+            cold.append((time.perf_counter() - started) * 1000)
+        check_p50, _ = timed(registry.remote_version, 20)
+        print(f"{size:>7}{numpy_p50:>14.1f}{numpy_p95:>9.1f}{loop_p50:>13.1f}{loop_p95:>9.1f}"
+              f"{statistics.median(cold):>14.1f}{check_p50 / 1000:>18.2f}{registry.matrix.nbytes / 1024:>13.0f}")
+
+
+def run(dynamodb, args):
+    create_table(dynamodb)
+    topic_registry.TOPIC_REGISTRY_TABLE = TABLE
+    topic_registry.EMBEDDING_BACKEND = 'hashed'
+    topic_registry.ASSIGN_THRESHOLD = args.assign_threshold
+    topic_registry.CONTINUATION_THRESHOLD = args.continuation_threshold
+
+    bedrock = FakeBedrock(dict(conversation()))
+    aws_clients._clients[('dynamodb', aws_clients.DEFAULT_REGION, aws_clients.LOCAL_ENDPOINT_URL)] = dynamodb
+    aws_clients._clients[('bedrock-runtime', aws_clients.DEFAULT_REGION, None)] = bedrock
+    handler = load_handler('topic-analyzer-fn').handler
+
+    print(f"hashed embeddings, assign >= {args.assign_threshold}, continuation >= {args.continuation_threshold}\n")
+    replay(handler, bedrock)
+    latency(dynamodb, args.topics, args.dimensions, args.matches)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--moto', action='store_true', help="in-process moto DynamoDB instead of LocalStack")
+    parser.add_argument('--topics', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--dimensions', type=int, default=topic_registry.EMBEDDING_DIMENSIONS)
+    parser.add_argument('--matches', type=int, default=2000, help="timed matches per registry size")
+    parser.add_argument('--assign-threshold', type=float, default=HASHED_ASSIGN_THRESHOLD)
+    parser.add_argument('--continuation-threshold', type=float, default=HASHED_CONTINUATION_THRESHOLD)
+    args = parser.parse_args()
+
+    import boto3
+
+    if args.moto:
+        from moto import mock_aws
+
+        with mock_aws():
+            run(boto3.client('dynamodb', region_name=REGION), args)
+    else:
+        run(boto3.client('dynamodb', endpoint_url=ENDPOINT, region_name=REGION), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Payload size, time and peak memory of fetching a Transcribe transcript.
+
+For Transcribe output files of growing recording length (word items with
+timestamps and alternatives, as Transcribe writes them) compares:
+
+  full       the PHP GetFileContentsHandler path: read the whole file,
+             return it as `content`, JSON-parse it to get the transcript
+  stream     transcript_json.extract: stop at the transcript
+  stream+cs  transcript_json.extract with word-confidence stats
+
+Payload is what goes back into the Step Functions state (limit 256 KB).
+Time is measured reading from S3 (LocalStack by default, or moto
+in-process with --moto); memory is the tracemalloc peak of the same
+parse over 64 KB chunks already in memory, so the S3 client's own
+buffering is left out.
+
+Usage:
+    python3 scripts/bench_transcript_extract.py [--minutes 1,10,60] [--moto]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'lambdas-local', 'shared'))
+
+import transcript_json
+
+ENDPOINT = os.environ.get('AWS_ENDPOINT_URL', 'http://localhost:4566')
+REGION = 'eu-west-1'
+BUCKET = 'bench-transcript-extract'
+STATE_PAYLOAD_LIMIT = 256 * 1024
+WORDS_PER_SECOND = 2.5
+
+WORDS = ("allora vorrei capire se conviene investire in un ETF azionario globale oppure "
+         "tenere la liquidità sul conto deposito visto che i tassi sono scesi").split()
+
+
+def transcribe_output(minutes, seed=5):
+    """Transcribe JSON for `minutes` of speech, items before the audio segments as in the real files."""
+    rng = random.Random(seed)
+    items, words = [], []
+    at = 0.0
+    for index in range(int(minutes * 60 * WORDS_PER_SECOND)):
+        word = rng.choice(WORDS)
+        duration = rng.uniform(0.15, 0.5)
+        items.append({
+            'id': len(items),
+            'start_time': f"{at:.3f}",
+            'end_time': f"{at + duration:.3f}",
+            'alternatives': [{'confidence': f"{rng.betavariate(8, 1):.4f}", 'content': word}],
+            'type': 'pronunciation',
+        })
+        words.append(word)
+        at += duration + 0.05
+        if index % 12 == 11:
+            items.append({'id': len(items), 'alternatives': [{'confidence': '0.0', 'content': '.'}], 'type': 'punctuation'})
+            words[-1] += '.'
+    transcript = ' '.join(words)
+    return json.dumps({
+        'jobName': f"bench-{minutes}",
+        'accountId': '000000000000',
+        'status': 'COMPLETED',
+        'results': {
+            'transcripts': [{'transcript': transcript}],
+            'items': items,
+            'audio_segments': [{'id': 0, 'transcript': transcript, 'start_time': '0.0',
+                                'end_time': f"{at:.3f}", 'items': list(range(len(items)))}],
+        },
+    }).encode()
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def memory_chunks(data):
+    return (data[i:i + transcript_json.CHUNK_SIZE] for i in range(0, len(data), transcript_json.CHUNK_SIZE))
+
+
+def full(chunks, file_uri):
+    content = b''.join(chunks).decode()
+    transcript = json.loads(content)['results']['transcripts'][0]['transcript']
+    return {'file_uri': file_uri, 'content': content}, transcript
+
+
+def stream(chunks, file_uri, confidence):
+    result = transcript_json.extract(chunks, confidence=confidence)
+    return {'file_uri': file_uri, 'transcript': result['transcript'], 'confidence': result['confidence']}, result['transcript']
+
+
+def run(s3, args):
+    s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': REGION})
+    print(f"{'minutes':>8}{'file KB':>9}  {'mode':<11}{'ms':>8}{'peak KB':>10}{'payload KB':>12}  fits state")
+    for minutes in (float(m) for m in args.minutes.split(',')):
+        data = transcribe_output(minutes)
+        key = f"transcripts/bench-{minutes:g}.json"
+        file_uri = f"s3://{BUCKET}/{key}"
+        s3.put_object(Bucket=BUCKET, Key=key, Body=data)
+        expected = json.loads(data)['results']['transcripts'][0]['transcript']
+        modes = [
+            ('full', lambda chunks: full(chunks, file_uri)),
+            ('stream', lambda chunks: stream(chunks, file_uri, False)),
+            ('stream+cs', lambda chunks: stream(chunks, file_uri, True)),
+        ]
+        for mode, fn in modes:
+            # Time over S3; memory over chunks already in memory, so only the parsing is counted
+            (payload, transcript), elapsed = timed(lambda: fn(transcript_json.s3_chunks(s3, BUCKET, key)))
+            assert transcript == expected, mode
+            peak = peak_memory(lambda: fn(memory_chunks(data)))
+            size = len(json.dumps(payload).encode())
+            print(f"{minutes:>8g}{len(data) / 1024:>9.0f}  {mode:<11}{elapsed:>8.1f}{peak / 1024:>10.0f}"
+                  f"{size / 1024:>12.1f}  {'yes' if size <= STATE_PAYLOAD_LIMIT else 'NO'}")
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--minutes', default='1,10,60', help="recording lengths")
+    parser.add_argument('--moto', action='store_true', help="in-process moto S3 instead of LocalStack")
+    args = parser.parse_args()
+
+    import boto3
+
+    if args.moto:
+        from moto import mock_aws
+
+        with mock_aws():
+            run(boto3.client('s3', region_name=REGION), args)
+    else:
+        run(boto3.client('s3', endpoint_url=ENDPOINT, region_name=REGION), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Wall time saved per voice note by the transcription callback path.
+
+For each voice note a fake Transcribe job "runs" for its transcription
+time, then writes transcripts/<job>.json to the media bucket, and the
+completion is detected in two ways:
+
+  polling   the original loop: Wait 5 s -> GetTranscriptionJob -> Job finished?
+  callback  transcription-callback-fn: the 'Wait for transcript' state
+            registers its task token, the fake S3-event emitter delivers the
+            ObjectCreated event, the handler sends the task result
+
+The lag is the time between the transcript landing and the execution
+resuming. Transcribe and the Wait state run on a clock scaled by --scale
+(reported back in real seconds); the callback chain runs in real time, so
+its lag includes the S3 event delivery (--delivery-ms) and the handler.
+S3 and the rendezvous table are LocalStack by default, or moto in-process
+with --moto.
+
+Usage:
+    python3 scripts/bench_transcription_callback.py [--durations 0,3.2,6.8,9.5,14.1] [--scale 0.1] [--moto]
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'lambdas-local', 'shared'))
+
+import aws_clients
+import transcription_callback
+from fake_s3_events import S3EventEmitter
+
+ENDPOINT = os.environ.get('AWS_ENDPOINT_URL', 'http://localhost:4566')
+REGION = 'eu-west-1'
+BUCKET = 'bench-transcripts-media'
+TABLE = 'bench-transcription-callbacks-table'
+WAIT_SECONDS = 5
+GET_JOB_MS = 100  # GetTranscriptionJob round-trip (sfn_latency)
+
+
+class FakeTranscribe:
+    """Jobs complete after `duration` scaled seconds, writing their transcript like Transcribe does."""
+
+    def __init__(self, s3, scale):
+        self.s3 = s3
+        self.scale = scale
+        self.jobs = {}
+
+    def start_transcription_job(self, job_name, duration):
+        self.jobs[job_name] = {'status': 'IN_PROGRESS', 'landed': None}
+        self.s3.put_object(Bucket=BUCKET, Key=f"{transcription_callback.TRANSCRIPTS_PREFIX}.write_access_check_file.temp", Body=b'')
+        threading.Timer(duration * self.scale, self._complete, args=(job_name,)).start()
+
+    def _complete(self, job_name):
+        body = {'jobName': job_name, 'results': {'transcripts': [{'transcript': f"Messaggio vocale {job_name}"}]}}
+        self.s3.put_object(
+            Bucket=BUCKET, Key=f"{transcription_callback.TRANSCRIPTS_PREFIX}{job_name}.json", Body=json.dumps(body)
+        )
+        self.jobs[job_name].update(status='COMPLETED', landed=time.perf_counter())
+
+    def get_transcription_job(self, job_name):
+        time.sleep(GET_JOB_MS / 1000 * self.scale)
+        return {'TranscriptionJob': {'TranscriptionJobName': job_name, 'TranscriptionJobStatus': self.jobs[job_name]['status']}}
+
+
+class FakeStepFunctions:
+    """send_task_success/failure recorder, with the client's exception classes."""
+
+    class exceptions:
+        class TaskTimedOut(Exception):
+            pass
+
+        class TaskDoesNotExist(Exception):
+            pass
+
+        class InvalidToken(Exception):
+            pass
+
+    def __init__(self):
+        self.results = {}
+        self.events = {}
+
+    def wait_for(self, token):
+        return self.events.setdefault(token, threading.Event())
+
+    def send_task_success(self, taskToken, output):
+        if taskToken in self.results:
+            raise self.exceptions.InvalidToken('Task already completed')
+        self.results[taskToken] = (time.perf_counter(), json.loads(output))
+        self.wait_for(taskToken).set()
+
+    def send_task_failure(self, taskToken, error, cause):
+        self.results[taskToken] = (time.perf_counter(), {'error': error, 'cause': cause})
+        self.wait_for(taskToken).set()
+
+
+def load_handler():
+    path = os.path.join(ROOT, 'lambdas-local', 'transcription-callback-fn', 'handler.py')
+    spec = importlib.util.spec_from_file_location('transcription_callback_handler', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def polling(transcribe, duration, scale):
+    job_name = f"poll-{uuid.uuid4().hex[:8]}"
+    transcribe.start_transcription_job(job_name, duration)
+    while True:
+        time.sleep(WAIT_SECONDS * scale)
+        job = transcribe.get_transcription_job(job_name)['TranscriptionJob']
+        if job['TranscriptionJobStatus'] == 'COMPLETED':
+            return (time.perf_counter() - transcribe.jobs[job_name]['landed']) / scale
+
+
+def callback(transcribe, handler, sfn, duration):
+    job_name = f"cb-{uuid.uuid4().hex[:8]}"
+    token = f"token-{job_name}"
+    transcribe.start_transcription_job(job_name, duration)
+    handler.handler({'task_token': token, 'job_name': job_name}, None)
+    if not sfn.wait_for(token).wait(timeout=60):
+        raise RuntimeError(f"No callback for {job_name}")
+    resumed_at, output = sfn.results[token]
+    assert output['transcript'] == f"Messaggio vocale {job_name}", output
+    return max(0.0, resumed_at - transcribe.jobs[job_name]['landed'])
+
+
+def run(s3, dynamodb, args):
+    s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': REGION})
+    dynamodb.create_table(
+        TableName=TABLE,
+        AttributeDefinitions=[{'AttributeName': 'job_name', 'AttributeType': 'S'}],
+        KeySchema=[{'AttributeName': 'job_name', 'KeyType': 'HASH'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.get_waiter('table_exists').wait(TableName=TABLE)
+
+    sfn = FakeStepFunctions()
+    aws_clients._clients[('s3', aws_clients.DEFAULT_REGION, aws_clients.LOCAL_ENDPOINT_URL)] = s3
+    aws_clients._clients[('dynamodb', aws_clients.DEFAULT_REGION, aws_clients.LOCAL_ENDPOINT_URL)] = dynamodb
+    aws_clients._clients[('stepfunctions', aws_clients.DEFAULT_REGION, aws_clients.LOCAL_ENDPOINT_URL)] = sfn
+    transcription_callback.TRANSCRIPTION_CALLBACK_TABLE = TABLE
+    handler = load_handler()
+    transcribe = FakeTranscribe(s3, args.scale)
+
+    durations = [float(d) for d in args.durations.split(',')]
+    emitter = S3EventEmitter(
+        s3, BUCKET, transcription_callback.TRANSCRIPTS_PREFIX, handler.handler,
+        delivery_delay=args.delivery_ms / 1000
+    )
+    with emitter:
+        print(f"{'transcribe s':>12}{'polling lag s':>15}{'callback lag ms':>17}{'saved s':>9}")
+        saved = []
+        for duration in durations:
+            results = {}
+            threads = [
+                threading.Thread(target=lambda: results.update(poll=polling(transcribe, duration, args.scale))),
+                threading.Thread(target=lambda: results.update(cb=callback(transcribe, handler, sfn, duration))),
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            saved.append(results['poll'] - results['cb'])
+            print(f"{duration:>12.1f}{results['poll']:>15.2f}{results['cb'] * 1000:>17.0f}{saved[-1]:>9.2f}")
+    print(f"\nmedian saved per voice note: {statistics.median(saved):.2f} s "
+          f"(polling lag is uniform in 0-{WAIT_SECONDS} s, plus {GET_JOB_MS} ms per poll)")
+    if emitter.errors:
+        print(f"emitter errors: {emitter.errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--durations', default='0,3.2,6.8,9.5,14.1', help="transcription times (s)")
+    parser.add_argument('--scale', type=float, default=0.1, help="clock scale for Transcribe and the Wait state")
+    parser.add_argument('--delivery-ms', type=float, default=200, help="S3 event -> Lambda delivery delay")
+    parser.add_argument('--moto', action='store_true', help="in-process moto S3/DynamoDB instead of LocalStack")
+    args = parser.parse_args()
+
+    import boto3
+
+    if args.moto:
+        from moto import mock_aws
+
+        with mock_aws():
+            run(boto3.client('s3', region_name=REGION), boto3.client('dynamodb', region_name=REGION), args)
+    else:
+        run(boto3.client('s3', endpoint_url=ENDPOINT, region_name=REGION),
+            boto3.client('dynamodb', endpoint_url=ENDPOINT, region_name=REGION), args)
+
+
+if __name__ == "__main__":
+    main()
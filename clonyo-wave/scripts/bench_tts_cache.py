@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Hit rate, latency and eviction of the TTS audio cache.
+
+Replays a mix of audio replies through lambdas-local/text-to-speech-fn:
+canned replies (greetings, "dove trovo il podcast", disclaimers) drawn with
+a Zipf-like skew, mixed with unique answers, against the fake TTS server.
+S3 and the cache index are LocalStack by default, or moto in-process with
+--moto. A small --max-kb bound shows the size-bounded eviction at work
+(the grace period is set to 0 for the run, which also turns off the
+in-process tier: every hit goes through the DynamoDB index).
+
+Usage:
+    python3 scripts/bench_tts_cache.py [--moto] [--replies 200] [--unique 0.3] [--max-kb 2048]
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'lambdas-local', 'shared'))
+
+import aws_clients
+import tts_cache
+import tts_stream
+from fake_tts_server import FakeTtsServer
+
+ENDPOINT = os.environ.get('AWS_ENDPOINT_URL', 'http://localhost:4566')
+REGION = 'eu-west-1'
+BUCKET = 'bench-tts-cache-media'
+TABLE = 'bench-tts-cache-table'
+PHONE_NUMBER_ARN = 'arn:aws:social-messaging:eu-west-1:000000000000:phone-number-id/bench'
+
+CANNED = [
+    "Ciao! Che piacere sentirti, come posso aiutarti oggi?",
+    "Trovi il podcast su Spotify e su tutte le principali piattaforme, cercando il mio nome.",
+    "Ricorda che quello che ti dico non è una consulenza finanziaria personalizzata.",
+    "Grazie a te, a presto!",
+    "Buongiorno! Dimmi pure.",
+    "Per una consulenza individuale puoi prenotare una call dal link nella mia bio.",
+    "Non ho capito bene la domanda, me la puoi riformulare?",
+    "Ottima domanda. Ne parlo spesso nelle puntate del podcast.",
+]
+
+
+class Context:
+    def __init__(self, request_id):
+        self.aws_request_id = request_id
+
+    def get_remaining_time_in_millis(self):
+        return 60000
+
+
+def load_handler():
+    path = os.path.join(ROOT, 'lambdas-local', 'text-to-speech-fn', 'handler.py')
+    spec = importlib.util.spec_from_file_location('text_to_speech_handler', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def replies(count, unique_share, seed=7):
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(CANNED))]
+    for i in range(count):
+        if rng.random() < unique_share:
+            yield f"Risposta numero {i}: dipende dal tuo orizzonte temporale e da quanto rischio sei disposto a correre."
+        else:
+            yield rng.choices(CANNED, weights)[0]
+
+
+def run(s3, dynamodb, args):
+    s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': REGION})
+    dynamodb.create_table(
+        TableName=TABLE,
+        AttributeDefinitions=[{'AttributeName': 'cache_key', 'AttributeType': 'S'},
+                              {'AttributeName': 'lru_shard', 'AttributeType': 'S'},
+                              {'AttributeName': 'last_hit_at', 'AttributeType': 'N'}],
+        KeySchema=[{'AttributeName': 'cache_key', 'KeyType': 'HASH'}],
+        GlobalSecondaryIndexes=[{
+            'IndexName': tts_cache.LRU_INDEX,
+            'KeySchema': [{'AttributeName': 'lru_shard', 'KeyType': 'HASH'},
+                          {'AttributeName': 'last_hit_at', 'KeyType': 'RANGE'}],
+            'Projection': {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': ['s3_key', 'bytes']},
+        }],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.get_waiter('table_exists').wait(TableName=TABLE)
+
+    # DynamoDB requests of the cache by operation, and how many touch the STATS item
+    requests = Counter()
+
+    def count_request(params, model, **kwargs):
+        requests[model.name] += 1
+        if params.get('Key', {}).get('cache_key', {}).get('S') == tts_cache.STATS_KEY:
+            requests['STATS'] += 1
+    dynamodb.meta.events.register('provide-client-params.dynamodb.*', count_request)
+
+    # The handler goes through aws_clients: hand it these clients
+    aws_clients._clients[('s3', aws_clients.DEFAULT_REGION, aws_clients.LOCAL_ENDPOINT_URL)] = s3
+    aws_clients._clients[('dynamodb', aws_clients.DEFAULT_REGION, aws_clients.LOCAL_ENDPOINT_URL)] = dynamodb
+    handler = load_handler()
+    handler.WA_MEDIA_BUCKET = BUCKET
+    tts_cache._default = tts_cache.TtsCache(
+        BUCKET, table_name=TABLE, max_bytes=args.max_kb * 1024, eviction_grace=0, dynamodb=dynamodb, s3=s3
+    )
+
+    server = FakeTtsServer(chunk_delay=0.02, first_byte_delay=0.3)
+    with server as base_url:
+        tts_stream.ELEVENLABS_BASE_URL = base_url
+        timings = {'hit': [], 'miss': [], 'uncached': []}
+        for i, text in enumerate(replies(args.replies, args.unique)):
+            before = tts_cache._default.stats()
+            started = time.perf_counter()
+            result = handler.handler(
+                {'text': text, 'config': {'api_key': 'bench', 'voice_id': 'bench-voice'},
+                 'wa_phone_number_arn': PHONE_NUMBER_ARN},
+                Context(f"bench-{i}")
+            )
+            elapsed = (time.perf_counter() - started) * 1000
+            after = result['cache']
+            kind = 'hit' if after['hits'] > before['hits'] else 'miss' if after['misses'] > before['misses'] else 'uncached'
+            timings[kind].append(elapsed)
+            s3.head_object(Bucket=result['bucket_name'], Key=result['key'])
+
+    stats = tts_cache._default.stats()
+    lookup_requests = dict(requests)
+    totals = tts_cache._default.global_stats()
+    objects = s3.list_objects_v2(Bucket=BUCKET, Prefix=tts_cache.CACHE_PREFIX).get('KeyCount', 0)
+
+    print(f"{'kind':<10}{'count':>7}{'median ms':>11}{'p95 ms':>9}")
+    for kind, values in timings.items():
+        if values:
+            p95 = sorted(values)[int(len(values) * 0.95) - 1 if len(values) > 1 else 0]
+            print(f"{kind:<10}{len(values):>7}{statistics.median(values):>11.1f}{p95:>9.1f}")
+    print()
+    print(f"hit rate (cacheable)  {stats['hit_rate']:.1%}   memory hits {stats['memory_hits']}")
+    print(f"TTS requests          {sum(server.requests.values())} for {args.replies} replies   "
+          f"audio not re-uploaded {stats['bytes_saved'] / 1024:.0f} KB")
+    print(f"cache size            {totals.get('total_bytes', 0) / 1024:.0f} KB in {totals.get('entries', 0)} entries "
+          f"({objects} objects), bound {args.max_kb} KB, evictions {totals.get('evictions', 0)}")
+    print(f"DynamoDB requests     {sum(v for k, v in lookup_requests.items() if k != 'STATS')} for "
+          f"{args.replies} replies ({', '.join(f'{k} {v}' for k, v in sorted(lookup_requests.items()) if k != 'STATS')}), "
+          f"{lookup_requests.get('STATS', 0)} on the STATS item")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--moto', action='store_true', help="in-process moto S3/DynamoDB instead of LocalStack")
+    parser.add_argument('--replies', type=int, default=200)
+    parser.add_argument('--unique', type=float, default=0.3, help="share of one-off answers")
+    parser.add_argument('--max-kb', type=int, default=2048, help="cache size bound")
+    args = parser.parse_args()
+
+    import boto3
+
+    if args.moto:
+        from moto import mock_aws
+
+        with mock_aws():
+            run(boto3.client('s3', region_name=REGION), boto3.client('dynamodb', region_name=REGION), args)
+    else:
+        run(boto3.client('s3', endpoint_url=ENDPOINT, region_name=REGION),
+            boto3.client('dynamodb', endpoint_url=ENDPOINT, region_name=REGION), args)
+
+
+if __name__ == "__main__":
+    main()
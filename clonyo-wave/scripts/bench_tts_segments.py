@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Monolithic vs sentence-segmented parallel TTS, against the fake TTS server
+in opus_48000_32 (the production format).
+
+  monolithic  one /stream request for the whole answer (ElevenlabsService)
+  segmented   tts_segments.synthesize: sentence groups on a bounded pool,
+              Ogg pages remuxed into one logical stream
+
+Prints wall time, time until the first segment is ready, the sum of the
+per-segment times and the duration of the resulting audio, and checks that
+the stitched file is one Ogg Opus stream holding the audio of every
+segment (plus the end padding kept at each boundary).
+
+Usage:
+    TTS_MAX_WORKERS=8 python3 scripts/bench_tts_segments.py [--chars 300,1000,3000] [--workers 8]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'lambdas-local', 'shared'))
+
+import ogg_opus
+import tts_segments
+import tts_stream
+from fake_tts_server import FakeTtsServer, synthetic_opus
+
+VOICE_ID = 'bench-voice'
+SENTENCES = (
+    "Investire in modo consapevole significa conoscere i propri obiettivi e il proprio orizzonte temporale. ",
+    "Un portafoglio diversificato riduce il rischio senza rinunciare al rendimento atteso. ",
+    "Prima di scegliere uno strumento, chiediti quanto potresti perdere senza cambiare i tuoi piani! ",
+    "Ne parliamo con calma? ",
+)
+
+
+def answer(chars):
+    text = ''
+    while len(text) < chars:
+        text += SENTENCES[len(text) % len(SENTENCES)]
+    return text.strip()
+
+
+def audio_info(data):
+    """(logical streams, final granule) of an Ogg Opus file."""
+    pages = list(ogg_opus.parse_pages(data))
+    return len({page.serial for page in pages}), pages[-1].granule
+
+
+def monolithic(base_url, text):
+    started = time.perf_counter()
+    audio, _ = tts_segments.synthesize_segment(
+        text, VOICE_ID, 'bench', tts_segments.DEFAULT_OUTPUT_FORMAT, base_url=base_url
+    )
+    total_ms = round((time.perf_counter() - started) * 1000, 2)
+    return audio, {'total_ms': total_ms, 'first_segment_ms': total_ms, 'synthesis_ms': total_ms, 'segment_count': 1}
+
+
+def segmented(base_url, text, workers):
+    out = bytearray()
+    report = tts_segments.synthesize(text, VOICE_ID, 'bench', out.extend, base_url=base_url, max_workers=workers)
+    return bytes(out), report
+
+
+def segments_samples(text, workers):
+    """Samples of the segments synthesized one by one, end trimming included."""
+    workers = min(workers, tts_segments.MAX_WORKERS)
+    min_chars = min(tts_segments.MAX_SEGMENT_CHARS, max(tts_segments.MIN_SEGMENT_CHARS, len(text) // workers))
+    segments = tts_segments.split_segments(text, min_chars)
+    return sum(audio_info(synthetic_opus(segment, VOICE_ID))[1] for segment in segments)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chars', default='300,1000,3000')
+    parser.add_argument('--workers', type=int, default=tts_segments.MAX_WORKERS)
+    args = parser.parse_args()
+
+    # ~0.5 s to first byte, then generation time proportional to the audio length
+    with FakeTtsServer(chunk_delay=0.05, first_byte_delay=0.5) as base_url:
+        tts_stream.http_session()
+        print(f"{'chars':>6}  {'mode':<11}{'segments':>9}{'wall ms':>9}{'first ms':>10}{'sum ms':>9}{'audio s':>9}{'streams':>8}")
+        for chars in (int(n) for n in args.chars.split(',')):
+            text = answer(chars)
+            for name, run in (('monolithic', lambda: monolithic(base_url, text)),
+                              ('segmented', lambda: segmented(base_url, text, args.workers))):
+                audio, report = run()
+                streams, granule = audio_info(audio)
+                print(f"{chars:>6}  {name:<11}{report['segment_count']:>9}{report['total_ms']:>9.0f}"
+                      f"{report['first_segment_ms']:>10.0f}{report['synthesis_ms']:>9.0f}"
+                      f"{granule / ogg_opus.SAMPLE_RATE:>9.2f}{streams:>8}")
+            padding_ms = (granule - segments_samples(text, args.workers)) / 48
+            print(f"        stitched - sum of segments: {padding_ms:+.1f} ms of boundary padding")
+            print()
+
+
+if __name__ == "__main__":
+    main()
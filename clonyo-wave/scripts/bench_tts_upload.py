@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Buffered vs streaming ElevenLabs -> S3 upload, against the fake TTS server.
+
+  buffered   requests.post + response.content + put_object (old voice-clone Lambda)
+  streaming  tts_stream.stream_tts_to_s3: chunks fed to an S3 multipart upload
+
+Prints total time, time to first audio byte, the largest amount of audio
+held by the handler at once, and (LocalStack only) the peak Python memory
+from tracemalloc. S3 is LocalStack by default, or moto in-process with
+--moto (moto keeps and copies the uploaded object in this process, so the
+tracemalloc figure is skipped).
+
+Usage:
+    python3 scripts/bench_tts_upload.py [--moto] [--chars 500,3000,15000]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'lambdas-local', 'shared'))
+
+import requests
+
+import tts_stream
+from fake_tts_server import BYTES_PER_CHAR, FakeTtsServer
+
+ENDPOINT = os.environ.get('AWS_ENDPOINT_URL', 'http://localhost:4566')
+REGION = 'eu-west-1'
+BUCKET = 'bench-tts-upload'
+VOICE_ID = 'bench-voice'
+SENTENCE = "Investire in modo consapevole significa conoscere i propri obiettivi e il proprio orizzonte temporale. "
+
+
+def buffered(s3, base_url, text, key):
+    started = time.perf_counter()
+    response = requests.post(
+        f"{base_url}/v1/text-to-speech/{VOICE_ID}/stream",
+        params={'optimize_streaming_latency': 0, 'output_format': 'mp3_22050_32'},
+        headers={'Content-Type': 'application/json', 'xi-api-key': 'bench'},
+        json={'text': text}
+    )
+    response.raise_for_status()
+    s3.put_object(Bucket=BUCKET, Key=key, Body=response.content, ContentType='audio/mpeg')
+    return {
+        'total_ms': round((time.perf_counter() - started) * 1000, 2),
+        'first_byte_ms': None,
+        'peak_buffer_bytes': len(response.content)
+    }
+
+
+def streaming(s3, base_url, text, key):
+    return tts_stream.stream_tts_to_s3(s3, text, VOICE_ID, 'bench', BUCKET, key, base_url=base_url)
+
+
+def measure(fn, *args, trace=True):
+    if not trace:
+        return fn(*args), None
+    tracemalloc.start()
+    report = fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return report, peak / (1024 * 1024)
+
+
+def run(s3, lengths, trace=True):
+    s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': REGION})
+    with FakeTtsServer(chunk_delay=0.001, first_byte_delay=0.1) as base_url:
+        print(f"{'chars':>7}{'audio MB':>10}  {'mode':<10}{'total ms':>10}{'first byte':>12}{'held MB':>9}{'peak MB':>9}")
+        for chars in lengths:
+            text = (SENTENCE * (chars // len(SENTENCE) + 1))[:chars]
+            audio_mb = chars * BYTES_PER_CHAR / (1024 * 1024)
+            for name, fn in (('buffered', buffered), ('streaming', streaming)):
+                report, peak_mb = measure(fn, s3, base_url, text, f"{name}/{chars}.mp3", trace=trace)
+                first_byte = f"{report['first_byte_ms']:.0f}" if report['first_byte_ms'] else '-'
+                held_mb = report['peak_buffer_bytes'] / (1024 * 1024)
+                peak = f"{peak_mb:.1f}" if peak_mb is not None else '-'
+                print(f"{chars:>7}{audio_mb:>10.1f}  {name:<10}{report['total_ms']:>10.0f}{first_byte:>12}{held_mb:>9.1f}{peak:>9}")
+            print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--moto', action='store_true', help="in-process moto S3 instead of LocalStack")
+    parser.add_argument('--chars', default='500,3000,15000')
+    args = parser.parse_args()
+    lengths = [int(n) for n in args.chars.split(',')]
+
+    import boto3
+
+    if args.moto:
+        from moto import mock_aws
+
+        with mock_aws():
+            run(boto3.client('s3', region_name=REGION), lengths, trace=False)
+    else:
+        run(boto3.client('s3', endpoint_url=ENDPOINT, region_name=REGION), lengths)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Throughput of the WhatsApp message router on SQS batches of 1, 10 and 100.
+
+A stream of text and voice-note messages from --contacts contacts of
+--clones clones is pushed through fake_sqs (queue + event source mapping)
+into the wa-message-router-fn handler in two modes:
+
+  serial    records one by one, the whole batch failed and redelivered on
+            the first error (PHP WaMessageRouterHandler::handleSqs)
+  parallel  wa_router.route_batch: contacts in parallel on the bounded pool,
+            in order per contact, only failed records redelivered
+
+StartExecution and GetWhatsAppMessageMedia are fakes with latency
+(media downloads are lognormal, with a 3 s outlier now and then, and fail
+with --failure-rate); configs come from a DynamoDB config table on
+LocalStack, or moto with --moto. Reported: messages/s, deliveries per
+message, executions started more than once (whole-batch retries) and
+per-contact ordering violations.
+
+Usage:
+    python3 scripts/bench_wa_router.py [--moto] [--messages 300] [--contacts 40] [--workers 8]
+                                       [--failure-rate 0.02] [--batch-sizes 1,10,100]
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'lambdas-local', 'shared'))
+
+import aws_clients
+import config_store
+import wa_router
+from fake_sqs import FakeQueue, drain
+from fake_wa_events import phone_number_arn, sqs_record
+
+ENDPOINT = os.environ.get('AWS_ENDPOINT_URL', 'http://localhost:4566')
+REGION = 'eu-west-1'
+TABLE = 'bench-router-config-table'
+VERSION_TABLE = 'bench-router-config-version-table'
+HANDLER = os.path.join(ROOT, 'lambdas-local', 'wa-message-router-fn', 'handler.py')
+SFN_ARN = 'arn:aws:states:eu-west-1:000000000000:stateMachine:bench-wa-message-processor'
+
+
+class FakeStepFunctions:
+    """start_execution with a fixed latency; records what was started, per contact, in order."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.started = {}  # wa_id -> [message_ts ...]
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def start_execution(self, stateMachineArn, name, input):
+        time.sleep(self.latency)
+        payload = json.loads(input)
+        with self._lock:
+            self.count += 1
+            self.started.setdefault(payload['wa_contact']['wa_id'], []).append(int(payload['message_ts']))
+        return {'executionArn': f"{stateMachineArn}:{name}"}
+
+
+class FakeSocialMessaging:
+    """get_whatsapp_message_media: lognormal download time, rare slow outliers, random failures."""
+
+    def __init__(self, median, failure_rate, seed=5):
+        self.median = median
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def get_whatsapp_message_media(self, **kwargs):
+        with self._lock:
+            delay = self.median * self._rng.lognormvariate(0, 0.4)
+            if self._rng.random() < 0.02:
+                delay = 3.0
+            failed = self._rng.random() < self.failure_rate
+        time.sleep(delay)
+        if failed:
+            raise RuntimeError("Media download failed (throttled)")
+        return {'mimeType': 'audio/ogg'}
+
+
+def load_handler():
+    spec = importlib.util.spec_from_file_location('wa_message_router_handler', HANDLER)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def messages(args, seed=3):
+    """(phone number ARN, wa_id, timestamp, audio?) in arrival order; timestamps grow per contact."""
+    rng = random.Random(seed)
+    contacts = [(phone_number_arn(c % args.clones), f"3934{c:08d}") for c in range(args.contacts)]
+    next_ts = {}
+    for _ in range(args.messages):
+        arn, wa_id = rng.choice(contacts)
+        ts = next_ts.get(wa_id, 1748013932)
+        next_ts[wa_id] = ts + 1
+        yield arn, wa_id, ts, rng.random() < args.audio_share
+
+
+def ordering_violations(started):
+    return sum(1 for stamps in started.values() for a, b in zip(stamps, stamps[1:]) if b < a)
+
+
+def serial_handler(router):
+    """handleSqs: one record after the other, any exception fails the whole batch."""
+
+    def handler(event, context):
+        for raw in event['Records']:
+            try:
+                router.process(wa_router.Record(raw))
+            except wa_router.UnsupportedMessage:
+                continue
+        return {}
+
+    return handler
+
+
+def run(dynamodb, args):
+    dynamodb.create_table(
+        TableName=TABLE,
+        AttributeDefinitions=[{'AttributeName': 'wa_phone_number_arn', 'AttributeType': 'S'}],
+        KeySchema=[{'AttributeName': 'wa_phone_number_arn', 'KeyType': 'HASH'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.create_table(
+        TableName=VERSION_TABLE,
+        AttributeDefinitions=[{'AttributeName': 'name', 'AttributeType': 'S'}],
+        KeySchema=[{'AttributeName': 'name', 'KeyType': 'HASH'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    for table in (TABLE, VERSION_TABLE):
+        dynamodb.get_waiter('table_exists').wait(TableName=table)
+    store = config_store.ConfigStore(table_name=TABLE, version_table_name=VERSION_TABLE, dynamodb=dynamodb)
+    for index in range(args.clones):
+        store.put({'wa_phone_number_arn': phone_number_arn(index), 'name': f"Bench Clone {index}",
+                   'response_generator': {'temperature': 0.5, 'max_tokens': 1024}})
+
+    # The handler builds its own clients through aws_clients: hand it the fakes
+    config_store._default = store
+    module = load_handler()
+    workload = list(messages(args))
+
+    print(f"{len(workload)} messages ({args.audio_share:.0%} voice notes), {args.contacts} contacts, "
+          f"{args.clones} clones, {args.workers} workers, media failure rate {args.failure_rate:.0%}\n")
+    print(f"{'batch':>6}{'mode':>10}{'msgs/s':>9}{'wall s':>8}{'invocations':>13}"
+          f"{'deliveries/msg':>16}{'duplicates':>12}{'dlq':>6}{'out of order':>14}")
+    for batch_size in args.batch_sizes:
+        for mode in ('serial', 'parallel'):
+            stepfunctions = FakeStepFunctions(args.sfn_latency)
+            social_messaging = FakeSocialMessaging(args.media_latency, args.failure_rate)
+            router = wa_router.Router(store, stepfunctions, social_messaging, media_bucket='bench-wa-media',
+                                      base_sfn_arn=SFN_ARN, dev_wa_ids=[])
+            aws_clients._clients[('stepfunctions', aws_clients.DEFAULT_REGION, aws_clients.LOCAL_ENDPOINT_URL)] = \
+                stepfunctions
+            aws_clients._clients[('socialmessaging', aws_clients.DEFAULT_REGION, None)] = social_messaging
+
+            if mode == 'serial':
+                handler = serial_handler(router)
+            else:
+                def handler(event, context, router=router):
+                    failures, _ = wa_router.route_batch(event['Records'], router.process,
+                                                        max_workers=args.workers)
+                    return {'batchItemFailures': failures}
+
+            queue = FakeQueue(max_receive_count=args.max_receive_count)
+            for arn, wa_id, ts, audio in workload:
+                queue.send(sqs_record(arn, wa_id, f"Messaggio {ts}", timestamp=ts,
+                                      audio_id=f"{ts}{wa_id}" if audio else None))
+            stats = drain(queue, handler, batch_size)
+
+            print(f"{batch_size:>6}{mode:>10}{len(workload) / stats['elapsed_s']:>9.1f}{stats['elapsed_s']:>8.1f}"
+                  f"{stats['invocations']:>13}{stats['deliveries'] / len(workload):>16.2f}"
+                  f"{stepfunctions.count - (len(workload) - stats['dead_letters']):>12}"
+                  f"{stats['dead_letters']:>6}{ordering_violations(stepfunctions.started):>14}")
+
+    # One batch through the real handler module, to check the wiring
+    queue = FakeQueue()
+    for arn, wa_id, ts, audio in workload[:10]:
+        queue.send(sqs_record(arn, wa_id, f"Messaggio {ts}", timestamp=ts))
+    module.wa_router.SFN_ARN = SFN_ARN
+    print(f"\nhandler.py, one batch of 10: {drain(queue, module.handler, 10)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--moto', action='store_true', help="in-process moto DynamoDB instead of LocalStack")
+    parser.add_argument('--messages', type=int, default=300)
+    parser.add_argument('--contacts', type=int, default=40)
+    parser.add_argument('--clones', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--audio-share', type=float, default=0.3)
+    parser.add_argument('--failure-rate', type=float, default=0.02)
+    parser.add_argument('--max-receive-count', type=int, default=5)
+    parser.add_argument('--sfn-latency', type=float, default=0.05, help="seconds per StartExecution")
+    parser.add_argument('--media-latency', type=float, default=0.3, help="median seconds per media download")
+    parser.add_argument('--batch-sizes', type=lambda s: [int(v) for v in s.split(',')], default=[1, 10, 100])
+    args = parser.parse_args()
+
+    import boto3
+
+    if args.moto:
+        from moto import mock_aws
+
+        with mock_aws():
+            run(boto3.client('dynamodb', region_name=REGION), args)
+    else:
+        run(boto3.client('dynamodb', endpoint_url=ENDPOINT, region_name=REGION), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Build the local vector index (kb_index) of a Knowledge Base, offline.
+
+The source documents are read from the KB's S3 data sources (--from-kb,
+through bedrock-agent), an S3 prefix (--source-s3) or a local directory
+(--source-dir): .txt/.md/.html, and .pdf when pypdf is installed. They
+are split into overlapping chunks of about --chunk-chars characters,
+embedded (Titan v2, or the local hashed backend) and written as the
+directory kb_index opens: manifest.json, vectors.npy, chunks.json and,
+with --ivf N, an inverted file layer of N lists (spherical k-means).
+
+The result goes to --out (default build/kb-index/<kb_id>), to be shipped
+with the function (KB_INDEX_DIR, e.g. a layer at /opt/kb-index), and with
+--upload s3://bucket/prefix to <prefix>/<kb_id>/, where functions fetch it
+(KB_INDEX_BUCKET/KB_INDEX_PREFIX). Rebuild whenever the KB is re-synced.
+
+Usage:
+    python3 scripts/build_kb_index.py --kb-id PDZQMPE5HM --from-kb [--ivf 16] [--upload s3://bucket/kb-index]
+    python3 scripts/build_kb_index.py --kb-id local-test --source-dir docs/ --embedding hashed
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, 'lambdas-local', 'shared'))
+
+import aws_clients
+import embeddings
+import kb_index
+
+REGION = 'eu-west-1'
+TEXT_EXTENSIONS = ('.txt', '.md')
+HTML_EXTENSIONS = ('.html', '.htm')
+KMEANS_ITERATIONS = 20
+
+
+class TextExtractor(HTMLParser):
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style'):
+            self._skip += 1
+        elif tag in ('p', 'br', 'div', 'li', 'h1', 'h2', 'h3', 'h4', 'tr'):
+            self.parts.append('\n\n')
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style') and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def document_text(name, body):
+    """Plain text of a source document, or None for formats we cannot read."""
+    lower = name.lower()
+    if lower.endswith(TEXT_EXTENSIONS):
+        return body.decode('utf-8', errors='replace')
+    if lower.endswith(HTML_EXTENSIONS):
+        parser = TextExtractor()
+        parser.feed(body.decode('utf-8', errors='replace'))
+        return ''.join(parser.parts)
+    if lower.endswith('.pdf'):
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            print(f"Skipping {name}: reading PDFs needs pypdf (pip install pypdf)")
+            return None
+        import io
+        return '\n\n'.join(page.extract_text() or '' for page in PdfReader(io.BytesIO(body)).pages)
+    print(f"Skipping {name}: unsupported format")
+    return None
+
+
+def chunk_text(text, chunk_chars, overlap):
+    """Paragraph-packed chunks of at most ~chunk_chars, each starting with the tail of the previous one."""
+    paragraphs = [re.sub(r'\s+', ' ', p).strip() for p in re.split(r'\n\s*\n', text)]
+    pieces = []
+    for paragraph in filter(None, paragraphs):
+        # Paragraphs longer than a chunk are cut at sentence ends
+        while len(paragraph) > chunk_chars:
+            cut = paragraph.rfind('. ', 0, chunk_chars)
+            cut = cut + 1 if cut > chunk_chars // 2 else chunk_chars
+            pieces.append(paragraph[:cut].strip())
+            paragraph = paragraph[cut:].strip()
+        pieces.append(paragraph)
+
+    chunks, current = [], ''
+    for piece in pieces:
+        if current and len(current) + len(piece) + 1 > chunk_chars:
+            chunks.append(current)
+            tail = current[-overlap:] if overlap else ''
+            current = tail[tail.find(' ') + 1:] if ' ' in tail else tail
+        current = f"{current} {piece}".strip()
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def local_documents(source_dir):
+    for base, _, files in os.walk(source_dir):
+        for name in sorted(files):
+            path = os.path.join(base, name)
+            with open(path, 'rb') as f:
+                body = f.read()
+            location = {'type': 'CUSTOM', 'customDocumentLocation': {'id': os.path.relpath(path, source_dir)}}
+            yield name, body, location
+
+
+def s3_documents(bucket, prefixes):
+    s3 = aws_clients.s3()
+    for prefix in prefixes or ['']:
+        for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                if item['Key'].endswith('/') or item['Key'].endswith('.metadata.json'):
+                    continue
+                body = s3.get_object(Bucket=bucket, Key=item['Key'])['Body'].read()
+                yield item['Key'], body, {'type': 'S3', 's3Location': {'uri': f"s3://{bucket}/{item['Key']}"}}
+
+
+def kb_documents(kb_id):
+    """Documents of every S3 data source of the KB."""
+    agent = aws_clients.get_client('bedrock-agent')
+    sources = agent.list_data_sources(knowledgeBaseId=kb_id)['dataSourceSummaries']
+    for summary in sources:
+        source = agent.get_data_source(knowledgeBaseId=kb_id, dataSourceId=summary['dataSourceId'])['dataSource']
+        s3_config = source['dataSourceConfiguration'].get('s3Configuration')
+        if not s3_config:
+            print(f"Skipping data source {summary['name']}: not S3")
+            continue
+        bucket = s3_config['bucketArn'].split(':::')[-1]
+        yield from s3_documents(bucket, s3_config.get('inclusionPrefixes'))
+
+
+def collect_chunks(documents, chunk_chars, overlap):
+    chunks = []
+    for name, body, location in documents:
+        text = document_text(name, body)
+        if not text:
+            continue
+        for part in chunk_text(text, chunk_chars, overlap):
+            chunks.append({'text': part, 'location': location})
+    return chunks
+
+
+def embed_all(texts, backend, dimensions, model_id=embeddings.TITAN_MODEL_ID, workers=8):
+    embed = lambda text: embeddings.embed(text, backend, dimensions, model_id)
+    if backend == 'hashed':
+        return np.vstack([embed(text) for text in texts]) if texts else np.zeros((0, dimensions), np.float32)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return np.vstack(list(pool.map(embed, texts)))
+
+
+def kmeans(vectors, lists, iterations=KMEANS_ITERATIONS, seed=7):
+    """Spherical k-means: unit centroids, assignment by dot product. Returns (centroids, assignment)."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for i in range(lists):
+            members = vectors[assignment == i]
+            if len(members):
+                centroids[i] = embeddings.unit(members.sum(axis=0))
+            else:
+                # Empty list: restart it on the vector worst served by its centroid
+                worst = np.argmin(np.sum(vectors * centroids[assignment], axis=1))
+                centroids[i] = vectors[worst]
+    return centroids.astype(np.float32), np.argmax(vectors @ centroids.T, axis=1)
+
+
+def build(chunks, vectors, kb_id, out, backend, dimensions, model_id, chunk_chars, overlap, ivf_lists=0):
+    """Write the index directory; with `ivf_lists`, rows are grouped by list."""
+    os.makedirs(out, exist_ok=True)
+    ivf = None
+    if ivf_lists and len(chunks) > ivf_lists:
+        centroids, assignment = kmeans(vectors, ivf_lists)
+        order = np.argsort(assignment, kind='stable')
+        vectors, chunks = vectors[order], [chunks[i] for i in order]
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=ivf_lists))]).astype(np.int64)
+        np.save(os.path.join(out, 'ivf_centroids.npy'), centroids)
+        np.save(os.path.join(out, 'ivf_offsets.npy'), offsets)
+        ivf = {'lists': int(ivf_lists), 'nprobe': min(kb_index.DEFAULT_NPROBE, int(ivf_lists))}
+    else:
+        for name in kb_index.IVF_FILES:
+            if os.path.exists(os.path.join(out, name)):
+                os.remove(os.path.join(out, name))
+
+    np.save(os.path.join(out, 'vectors.npy'), np.ascontiguousarray(vectors, dtype=np.float32))
+    with open(os.path.join(out, 'chunks.json'), 'w') as f:
+        json.dump(chunks, f, ensure_ascii=False)
+    manifest = {
+        'kb_id': kb_id,
+        'embedding': {'backend': backend, 'model_id': model_id, 'dimensions': dimensions},
+        'chunking': {'chunk_chars': chunk_chars, 'overlap': overlap},
+        'count': len(chunks),
+        'ivf': ivf,
+        'built_at': int(time.time()),
+    }
+    # Manifest last: an index directory with a manifest is complete
+    with open(os.path.join(out, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def upload(out, kb_id, target):
+    bucket, _, prefix = target[len('s3://'):].partition('/')
+    s3 = aws_clients.s3()
+    names = sorted(os.listdir(out), key=lambda name: name == 'manifest.json')
+    for name in names:
+        s3.upload_file(os.path.join(out, name), bucket, f"{prefix.rstrip('/')}/{kb_id}/{name}")
+    print(f"Uploaded to s3://{bucket}/{prefix.rstrip('/')}/{kb_id}/")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--kb-id', required=True)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--from-kb', action='store_true', help="read the S3 data sources of the KB")
+    source.add_argument('--source-s3', help="s3://bucket/prefix of the source documents")
+    source.add_argument('--source-dir', help="local directory of source documents")
+    parser.add_argument('--embedding', choices=embeddings.BACKENDS, default='titan')
+    parser.add_argument('--model-id', default=embeddings.TITAN_MODEL_ID)
+    parser.add_argument('--dimensions', type=int, default=1024, choices=(256, 512, 1024))
+    parser.add_argument('--chunk-chars', type=int, default=1200)
+    parser.add_argument('--overlap', type=int, default=200)
+    parser.add_argument('--ivf', type=int, default=0, help="inverted file lists (0: flat index only)")
+    parser.add_argument('--out', help="output directory (default build/kb-index/<kb_id>)")
+    parser.add_argument('--upload', help="s3://bucket/prefix to publish the index to")
+    args = parser.parse_args()
+
+    if args.from_kb:
+        documents = kb_documents(args.kb_id)
+    elif args.source_s3:
+        bucket, _, prefix = args.source_s3[len('s3://'):].partition('/')
+        documents = s3_documents(bucket, [prefix])
+    else:
+        documents = local_documents(args.source_dir)
+
+    started = time.perf_counter()
+    chunks = collect_chunks(documents, args.chunk_chars, args.overlap)
+    if not chunks:
+        sys.exit("No chunks: no readable source documents")
+    vectors = embed_all([chunk['text'] for chunk in chunks], args.embedding, args.dimensions, args.model_id)
+    out = args.out or os.path.join(ROOT, 'build', 'kb-index', args.kb_id)
+    manifest = build(chunks, vectors, args.kb_id, out, args.embedding, args.dimensions, args.model_id,
+                     args.chunk_chars, args.overlap, args.ivf)
+    size = sum(os.path.getsize(os.path.join(out, name)) for name in os.listdir(out))
+    print(f"{manifest['count']} chunks, {args.dimensions} dims, ivf {manifest['ivf']}, {size / 1024:.0f} KB "
+          f"in {out} ({time.perf_counter() - started:.1f} s)")
+    if args.upload:
+        upload(out, args.kb_id, args.upload)
+
+
+if __name__ == "__main__":
+    main()
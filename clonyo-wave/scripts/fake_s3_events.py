@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for S3 event notifications.
+
+LocalStack/moto buckets have no notification target for the Python
+Lambdas run in-process, so S3EventEmitter polls a prefix and calls a
+handler with the same event S3 would deliver (ObjectCreated:Put, one
+record per new object), after an optional `delivery_delay`.
+
+Usage (library):
+    with S3EventEmitter(s3, 'bucket', 'transcripts/', handler.handler):
+        ...
+"""
+
+import threading
+import time
+from datetime import datetime, timezone
+
+REGION = 'eu-west-1'
+
+
+def s3_event(bucket, key, size=0, event_name='ObjectCreated:Put'):
+    """S3 notification event with one record."""
+    return {
+        'Records': [{
+            'eventVersion': '2.1',
+            'eventSource': 'aws:s3',
+            'awsRegion': REGION,
+            'eventTime': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            'eventName': event_name,
+            's3': {
+                's3SchemaVersion': '1.0',
+                'bucket': {'name': bucket, 'arn': f"arn:aws:s3:::{bucket}"},
+                'object': {'key': key, 'size': size},
+            },
+        }]
+    }
+
+
+class S3EventEmitter:
+    """
+    Background poller: every `interval` seconds lists `prefix` and emits an
+    event per object not seen before. Keys present when it starts are
+    ignored. `emitted` maps key -> perf_counter() of the delivery.
+    """
+
+    def __init__(self, s3, bucket, prefix, handler, interval=0.02, delivery_delay=0.0):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.handler = handler
+        self.interval = interval
+        self.delivery_delay = delivery_delay
+        self.emitted = {}
+        self.errors = []
+        self._seen = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _list(self):
+        keys = {}
+        params = {'Bucket': self.bucket, 'Prefix': self.prefix}
+        while True:
+            response = self.s3.list_objects_v2(**params)
+            for obj in response.get('Contents', []):
+                keys[obj['Key']] = obj['Size']
+            if not response.get('IsTruncated'):
+                return keys
+            params['ContinuationToken'] = response['NextContinuationToken']
+
+    def _deliver(self, key, size):
+        time.sleep(self.delivery_delay)
+        try:
+            self.handler(s3_event(self.bucket, key, size), None)
+        except Exception as e:
+            self.errors.append((key, str(e)))
+        self.emitted[key] = time.perf_counter()
+
+    def _run(self):
+        while not self._stop.is_set():
+            for key, size in self._list().items():
+                if key in self._seen:
+                    continue
+                self._seen.add(key)
+                threading.Thread(target=self._deliver, args=(key, size), daemon=True).start()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._seen = set(self._list())
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
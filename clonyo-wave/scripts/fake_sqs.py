@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+In-memory stand-in for an SQS queue and the Lambda event source mapping.
+
+FakeQueue keeps messages in send order; received messages are invisible
+until deleted or released. Released (failed) messages become visible again
+in their original position, and move to `dead_letters` after
+`max_receive_count` receives, like a redrive policy.
+
+drain() plays the event source mapping: it receives batches of up to
+`batch_size`, calls the handler with an SQS event, deletes what succeeded
+and releases the `batchItemFailures` (or the whole batch if the handler
+raised), until the queue is empty.
+
+Usage (library):
+    queue = FakeQueue()
+    queue.send(record)
+    stats = drain(queue, handler.handler, batch_size=10)
+"""
+
+import bisect
+import threading
+import time
+import uuid
+
+
+class FakeQueue:
+
+    def __init__(self, max_receive_count=5):
+        self.max_receive_count = max_receive_count
+        self.dead_letters = []
+        self._visible = []  # sorted (seq, message_id)
+        self._messages = {}  # message_id -> {'seq', 'record', 'receive_count'}
+        self._in_flight = set()
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def send(self, record):
+        """Enqueue an SQS record (its messageId is kept, or a new one assigned)."""
+        with self._lock:
+            message_id = record.setdefault('messageId', str(uuid.uuid4()))
+            self._messages[message_id] = {'seq': self._seq, 'record': record, 'receive_count': 0}
+            self._visible.append((self._seq, message_id))
+            self._seq += 1
+        return message_id
+
+    def receive(self, max_messages):
+        with self._lock:
+            batch, self._visible = self._visible[:max_messages], self._visible[max_messages:]
+            records = []
+            for _, message_id in batch:
+                message = self._messages[message_id]
+                message['receive_count'] += 1
+                self._in_flight.add(message_id)
+                record = dict(message['record'])
+                record['attributes'] = dict(record.get('attributes') or {},
+                                            ApproximateReceiveCount=str(message['receive_count']))
+                records.append(record)
+            return records
+
+    def delete(self, message_ids):
+        with self._lock:
+            for message_id in message_ids:
+                self._in_flight.discard(message_id)
+                self._messages.pop(message_id, None)
+
+    def release(self, message_ids):
+        with self._lock:
+            for message_id in message_ids:
+                self._in_flight.discard(message_id)
+                message = self._messages.get(message_id)
+                if message is None:
+                    continue
+                if message['receive_count'] >= self.max_receive_count:
+                    self.dead_letters.append(self._messages.pop(message_id)['record'])
+                else:
+                    bisect.insort(self._visible, (message['seq'], message_id))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._messages)
+
+
+def drain(queue, handler, batch_size, context=None, max_invocations=100000):
+    """Feed the queue to `handler` in batches until it is empty. Returns delivery stats."""
+    stats = {'invocations': 0, 'deliveries': 0, 'retried': 0, 'batch_errors': 0}
+    started = time.perf_counter()
+    while len(queue) and stats['invocations'] < max_invocations:
+        records = queue.receive(batch_size)
+        if not records:
+            break
+        stats['invocations'] += 1
+        stats['deliveries'] += len(records)
+        ids = [record['messageId'] for record in records]
+        try:
+            response = handler({'Records': records}, context) or {}
+            failed = {failure['itemIdentifier'] for failure in response.get('batchItemFailures', [])}
+        except Exception:
+            stats['batch_errors'] += 1
+            failed = set(ids)
+        stats['retried'] += len(failed)
+        queue.delete([message_id for message_id in ids if message_id not in failed])
+        queue.release([message_id for message_id in ids if message_id in failed])
+    stats['elapsed_s'] = time.perf_counter() - started
+    stats['dead_letters'] = len(queue.dead_letters)
+    return stats
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the ElevenLabs text-to-speech endpoints.
+
+POST /v1/text-to-speech/<voice_id>/stream   -> chunked audio bytes
+POST /v1/text-to-speech/<voice_id>          -> same bytes, one response
+
+The audio is synthetic: BYTES_PER_CHAR bytes per character of `text`,
+sent in CHUNK_SIZE pieces with `chunk_delay` seconds between them (and
+`first_byte_delay` before the first) to mimic generation speed. With an
+`output_format=opus_*` query parameter the bytes are a structurally valid
+Ogg Opus file (20 ms packets, ~12 characters per second). Requests are
+counted per path so callers can check connection reuse and cache hits, and
+the peak number of concurrent requests is kept in `max_in_flight`.
+
+Usage:
+    python3 scripts/fake_tts_server.py [--port 8765]
+    ELEVENLABS_BASE_URL=http://localhost:8765 ...
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambdas-local', 'shared'))
+
+import ogg_opus
+
+BYTES_PER_CHAR = 400  # ~32 kbps audio at ~12 characters per second
+CHUNK_SIZE = 16 * 1024
+OPUS_PACKETS_PER_CHAR = 4  # 20 ms packets: ~12 characters per second
+OPUS_PACKET_BYTES = 80     # 32 kbps
+OPUS_CELT_20MS_TOC = 0xF8  # CELT fullband, 20 ms, one frame
+
+
+def synthetic_audio(text, voice_id=''):
+    """Deterministic bytes for a text, so identical requests give identical audio."""
+    seed = (sum(text.encode('utf-8')) + sum(voice_id.encode('utf-8'))) % 251
+    size = max(1, len(text)) * BYTES_PER_CHAR
+    block = bytes((seed + i) % 256 for i in range(256))
+    return (block * (size // 256 + 1))[:size]
+
+
+def synthetic_opus(text, voice_id=''):
+    """Deterministic Ogg Opus file, its duration proportional to the text length."""
+    payload = synthetic_audio(text, voice_id)[:OPUS_PACKET_BYTES - 1]
+    payload = (payload * OPUS_PACKET_BYTES)[:OPUS_PACKET_BYTES - 1]
+    packets = [bytes([OPUS_CELT_20MS_TOC]) + payload] * (max(1, len(text)) * OPUS_PACKETS_PER_CHAR)
+    serial = sum(text.encode('utf-8')) & 0xFFFFFFFF
+    return ogg_opus.build_stream(packets, serial=serial, end_trim=120)
+
+
+class FakeTtsServer:
+    """Threaded fake server, usable as a context manager: `with FakeTtsServer() as url:`."""
+
+    def __init__(self, port=0, chunk_delay=0.002, first_byte_delay=0.2, audio_fn=synthetic_audio):
+        self.chunk_delay = chunk_delay
+        self.first_byte_delay = first_byte_delay
+        self.audio_fn = audio_fn
+        self.requests = {}
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.bodies = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                server.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                with server._lock:
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    self._synthesize()
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def _synthesize(self):
+                path, _, query = self.path.partition('?')
+                output_format = parse_qs(query).get('output_format', ['mp3_44100_128'])[0]
+                server.requests[path] = server.requests.get(path, 0) + 1
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+                server.bodies.append(body)
+                parts = path.strip('/').split('/')
+                if len(parts) < 3 or parts[:2] != ['v1', 'text-to-speech']:
+                    self.send_error(404)
+                    return
+
+                if output_format.startswith('opus'):
+                    audio, content_type = synthetic_opus(body.get('text', ''), parts[2]), 'audio/ogg'
+                else:
+                    audio, content_type = server.audio_fn(body.get('text', ''), parts[2]), 'audio/mpeg'
+                time.sleep(server.first_byte_delay)
+
+                if parts[-1] != 'stream':
+                    self.send_response(200)
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Length', str(len(audio)))
+                    self.end_headers()
+                    self.wfile.write(audio)
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for start in range(0, len(audio), CHUNK_SIZE):
+                    chunk = audio[start:start + CHUNK_SIZE]
+                    self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                    time.sleep(server.chunk_delay)
+                self.wfile.write(b"0\r\n\r\n")
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--chunk-delay', type=float, default=0.002)
+    parser.add_argument('--first-byte-delay', type=float, default=0.2)
+    args = parser.parse_args()
+
+    server = FakeTtsServer(args.port, args.chunk_delay, args.first_byte_delay)
+    print(f"Fake TTS server on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
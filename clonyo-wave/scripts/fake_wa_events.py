@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+WhatsApp inbound messages as the router receives them: SQS records
+wrapping the SNS notification of AWS End User Messaging Social, built from
+the recorded test events of wa-message-router-fn with a different clone
+(phone number ARN), contact and text or voice note.
+
+Usage (library):
+    record = sqs_record(phone_number_arn, '393400000001', "Ciao!")
+    record = sqs_record(phone_number_arn, '393400000001', audio_id='1738433820214014')
+"""
+
+import copy
+import json
+import os
+import uuid
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+TEMPLATE_DIR = os.path.join(ROOT, 'lambdas', 'generate-response-fn', 'test-events', 'wa-message-router-fn')
+
+_templates = {}
+
+
+def _template_record(message_type):
+    if message_type not in _templates:
+        with open(os.path.join(TEMPLATE_DIR, f"{message_type}-message.json")) as f:
+            _templates[message_type] = json.load(f)['Records'][0]
+    return _templates[message_type]
+
+
+def phone_number_arn(index):
+    return f"arn:aws:social-messaging:eu-west-1:000000000000:phone-number-id/bench{index:04d}"
+
+
+def sqs_record(phone_number_arn, wa_id, text=None, timestamp=1748013932, audio_id=None):
+    """
+    SQS record of one message from `wa_id` to the clone behind
+    `phone_number_arn`: a text message, or a voice note if `audio_id` is set.
+    """
+    record = copy.deepcopy(_template_record('audio' if audio_id else 'text'))
+    body = json.loads(record['body'])
+    message = json.loads(body['Message'])
+    entry = json.loads(message['whatsAppWebhookEntry'])
+
+    message['context']['MetaPhoneNumberIds'][0]['arn'] = phone_number_arn
+    value = entry['changes'][0]['value']
+    value['contacts'][0]['wa_id'] = wa_id
+    received = value['messages'][0]
+    received.update({'from': wa_id, 'id': f"wamid.{uuid.uuid4().hex}", 'timestamp': str(timestamp)})
+    if audio_id:
+        received['audio']['id'] = audio_id
+    else:
+        received['text']['body'] = text
+
+    message['whatsAppWebhookEntry'] = json.dumps(entry)
+    body['Message'] = json.dumps(message)
+    body['MessageId'] = str(uuid.uuid4())
+    record['body'] = json.dumps(body)
+    record['messageId'] = str(uuid.uuid4())
+    return record
+
+
+def sqs_event(records):
+    return {'Records': list(records)}
@@ -0,0 +1,65 @@
+#!/bin/bash
+set -e
+
+# Clonyo Wave - Package the shared Python helpers as a Lambda layer
+# lambdas-local/shared/*.py go under python/ in the ZIP, so the runtime puts
+# them on sys.path (/opt/python) for the lambdas-local handlers and the
+# lambdas/*/_python prototypes. Third-party modules the helpers import
+# (requests, numpy) are installed next to them for the Lambda platform.
+#
+# Usage: ./scripts/package-shared-layer.sh [--publish]
+
+LAYER_NAME="sidea-ai-clone-shared"
+PYTHON_VERSION="3.12"
+PLATFORM="manylinux2014_x86_64"
+PIP_PACKAGES=("requests" "numpy")
+
+REGION="eu-central-1"
+PROFILE="sirio"
+
+# Safety check
+if [ "$1" == "--publish" ] && [ "$AWS_REGION" == "eu-west-1" ]; then
+  echo "❌ ERROR: Cannot publish to eu-west-1 (production region)"
+  exit 1
+fi
+
+cd "$(dirname "$0")/.."
+
+BUILD_DIR="dist/shared-layer"
+ZIP_FILE="dist/$LAYER_NAME.zip"
+
+echo "📦 Packaging lambdas-local/shared as $LAYER_NAME..."
+rm -rf "$BUILD_DIR" "$ZIP_FILE"
+mkdir -p "$BUILD_DIR/python"
+
+cp lambdas-local/shared/*.py "$BUILD_DIR/python/"
+
+echo "  → Installing ${PIP_PACKAGES[*]} for $PLATFORM / Python $PYTHON_VERSION..."
+pip install "${PIP_PACKAGES[@]}" \
+  --target "$BUILD_DIR/python" \
+  --platform "$PLATFORM" \
+  --python-version "$PYTHON_VERSION" \
+  --only-binary=:all: \
+  --quiet
+
+(cd "$BUILD_DIR" && zip -r "../$LAYER_NAME.zip" python -x "*__pycache__*" -q)
+
+ZIP_SIZE=$(du -h "$ZIP_FILE" | cut -f1)
+echo "  → ZIP size: $ZIP_SIZE"
+
+if [ "$1" == "--publish" ]; then
+  echo "  → Publishing layer version..."
+  LAYER_ARN=$(aws lambda publish-layer-version \
+    --layer-name "$LAYER_NAME" \
+    --zip-file "fileb://$ZIP_FILE" \
+    --compatible-runtimes "python$PYTHON_VERSION" \
+    --region $REGION \
+    --profile $PROFILE \
+    --query LayerVersionArn \
+    --output text)
+  echo "  ✅ Published $LAYER_ARN"
+  echo ""
+  echo "Attach it to the Python functions (Layers: $LAYER_ARN)"
+else
+  echo "  ✅ $ZIP_FILE ready (rerun with --publish to publish it)"
+fi
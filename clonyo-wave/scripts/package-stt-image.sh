@@ -0,0 +1,58 @@
+#!/bin/bash
+set -e
+
+# Clonyo Wave - Build the speech-to-text-fn container image
+# The local STT backend needs faster-whisper and the Whisper model, too big
+# for the shared layer: lambdas-local/speech-to-text-fn/Dockerfile bakes
+# both into a Lambda image (STT_BACKEND=local). Functions deployed from a
+# ZIP default to Amazon Transcribe instead.
+#
+# Usage: ./scripts/package-stt-image.sh [--publish]
+
+FUNCTION_NAME="speech-to-text-fn"
+IMAGE_NAME="sidea-ai-clone-speech-to-text"
+STT_MODEL="${STT_MODEL:-small}"
+STT_COMPUTE_TYPE="${STT_COMPUTE_TYPE:-int8}"
+
+REGION="eu-central-1"
+PROFILE="sirio"
+
+# Safety check
+if [ "$1" == "--publish" ] && [ "$AWS_REGION" == "eu-west-1" ]; then
+  echo "❌ ERROR: Cannot publish to eu-west-1 (production region)"
+  exit 1
+fi
+
+cd "$(dirname "$0")/.."
+
+echo "🐳 Building $IMAGE_NAME (model $STT_MODEL, $STT_COMPUTE_TYPE)..."
+docker build \
+  --platform linux/amd64 \
+  --build-arg STT_MODEL="$STT_MODEL" \
+  --build-arg STT_COMPUTE_TYPE="$STT_COMPUTE_TYPE" \
+  -f lambdas-local/speech-to-text-fn/Dockerfile \
+  -t "$IMAGE_NAME:latest" \
+  lambdas-local
+
+if [ "$1" == "--publish" ]; then
+  ACCOUNT_ID=$(aws sts get-caller-identity --query Account --output text --region $REGION --profile $PROFILE)
+  REPOSITORY="$ACCOUNT_ID.dkr.ecr.$REGION.amazonaws.com/$IMAGE_NAME"
+
+  echo "  → Pushing to $REPOSITORY..."
+  aws ecr describe-repositories --repository-names "$IMAGE_NAME" --region $REGION --profile $PROFILE >/dev/null 2>&1 \
+    || aws ecr create-repository --repository-name "$IMAGE_NAME" --region $REGION --profile $PROFILE >/dev/null
+  aws ecr get-login-password --region $REGION --profile $PROFILE \
+    | docker login --username AWS --password-stdin "$ACCOUNT_ID.dkr.ecr.$REGION.amazonaws.com"
+  docker tag "$IMAGE_NAME:latest" "$REPOSITORY:latest"
+  docker push "$REPOSITORY:latest"
+
+  echo "  → Updating $FUNCTION_NAME..."
+  aws lambda update-function-code \
+    --function-name "$FUNCTION_NAME" \
+    --image-uri "$REPOSITORY:latest" \
+    --region $REGION \
+    --profile $PROFILE >/dev/null
+  echo "  ✅ $FUNCTION_NAME runs $REPOSITORY:latest"
+else
+  echo "  ✅ $IMAGE_NAME:latest ready (rerun with --publish to push it and update $FUNCTION_NAME)"
+fi
@@ -0,0 +1,157 @@
+"""
+Latency model for the Step Function definitions.
+
+Walks a definition from StartAt for a given scenario (which branch each
+Choice takes) and adds up an estimated warm latency per state, using the
+figures of ENHANCEMENT_PLAN_CONTEXT.md section 4. Parallel states cost the
+slowest of their branches, so the same walk gives the critical path.
+"""
+
+# Warm invocation estimates (ms) per Lambda, LLM round-trip included
+LAMBDA_LATENCY_MS = {
+    'session-manager-fn': 100,
+    'topic-analyzer-fn': 500,
+    'context-evaluator-fn': 500,
+    'reply-strategy-fn': 2000,
+    'pre-generation-fn': 700,
+    'generate-response-fn': 4500,
+    'text-to-speech-fn': 3000,
+    'get-file-contents-fn': 150,
+    'history-window-fn': 150,
+    # One Query on the topic history table (<= 20 small items) + ranking
+    'history-retrieval-fn': 60,
+    'topic-history-fn': 80,
+    # S3 event delivery + transcript read + SendTaskSuccess, after the transcript lands
+    'transcription-callback-fn': 400,
+    # S3 fetch + Opus decode + Whisper small int8 on CPU for a ~10 s voice note (RTF ~0.15)
+    'speech-to-text-fn': 1500,
+}
+DEFAULT_LAMBDA_LATENCY_MS = 300
+
+# Direct service integrations, matched on the Resource prefix
+SERVICE_LATENCY_MS = {
+    'arn:aws:states:::dynamodb:': 50,
+    'arn:aws:states:::aws-sdk:bedrockagentruntime:retrieve': 1000,
+    'arn:aws:states:::aws-sdk:socialmessaging:': 300,
+    'arn:aws:states:::aws-sdk:transcribe:startTranscriptionJob': 200,
+    'arn:aws:states:::aws-sdk:transcribe:getTranscriptionJob': 100,
+}
+DEFAULT_SERVICE_LATENCY_MS = 100
+
+# Step Functions overhead per state transition
+TRANSITION_MS = 25
+
+# Default scenario: text message, memory not sufficient, text reply
+TEXT_KB_SCENARIO = {
+    'Evaluate message type': 'TransformForResponse',
+    'Is Sufficient?': 'Query Static KB',
+    'Choose output type': 'Reply to WA User with text',
+    'Already delivered?': 'Choose output type',
+}
+
+# Audio message, transcription done after the first poll, audio reply
+AUDIO_KB_SCENARIO = dict(TEXT_KB_SCENARIO, **{
+    'Evaluate message type': 'StartTranscriptionJob',
+    'Job finished?': 'Get transcript file content',
+    'Choose output type': 'Generate audio from text',
+})
+
+# Audio message transcribed in-process by speech-to-text-fn (--stt-backend local)
+AUDIO_LOCAL_STT_SCENARIO = dict(AUDIO_KB_SCENARIO, **{
+    'Evaluate message type': 'Select transcription backend',
+    'Select transcription backend': 'Transcribe locally',
+})
+
+
+
+def find_state(definition, name):
+    """State `name` of the definition or of one of its Parallel branches, or None."""
+    states = definition['States']
+    if name in states:
+        return states[name]
+    for state in states.values():
+        for branch in state.get('Branches', []):
+            found = find_state(branch, name)
+            if found is not None:
+                return found
+    return None
+
+
+def text_memory_scenario(definition):
+    """
+    Text message answered from the topic history, no KB retrieve: the
+    'Is Sufficient?' branch taken when the memory is enough (Get reply
+    strategy, or Build Knowledge based response with --fused). None if
+    the definition has no sufficiency Choice.
+    """
+    choice = find_state(definition, 'Is Sufficient?')
+    if choice is None or not choice.get('Choices'):
+        return None
+    return dict(TEXT_KB_SCENARIO, **{'Is Sufficient?': choice['Choices'][0]['Next']})
+
+
+def function_name(state):
+    arguments = state.get('Arguments', {})
+    name = arguments.get('FunctionName', '') if isinstance(arguments, dict) else ''
+    return name.rsplit(':', 1)[-1] if name else None
+
+
+def state_latency_ms(state, overrides=None):
+    """Estimated latency of a single (non Parallel) state."""
+    overrides = overrides or {}
+    state_type = state.get('Type')
+
+    if state_type == 'Wait':
+        return state.get('Seconds', 0) * 1000
+    if state_type != 'Task':
+        return 0
+
+    resource = state.get('Resource', '')
+    if resource.startswith('arn:aws:states:::lambda:invoke'):
+        name = function_name(state)
+        return overrides.get(name, LAMBDA_LATENCY_MS.get(name, DEFAULT_LAMBDA_LATENCY_MS))
+
+    for prefix, latency in SERVICE_LATENCY_MS.items():
+        if resource.startswith(prefix):
+            return overrides.get(resource, latency)
+    return overrides.get(resource, DEFAULT_SERVICE_LATENCY_MS)
+
+
+def _next(name, state, scenario):
+    if state.get('Type') == 'Choice':
+        if name in scenario:
+            return scenario[name]
+        return state.get('Default')
+    if state.get('End') or state.get('Type') in ('Succeed', 'Fail'):
+        return None
+    return state.get('Next')
+
+
+def walk(definition, scenario=None, overrides=None, max_steps=200):
+    """
+    Follow the definition for `scenario` and return (total_ms, path) where
+    path is a list of (state name, ms) including the transition overhead.
+    """
+    scenario = TEXT_KB_SCENARIO if scenario is None else scenario
+    states = definition['States']
+    name = definition['StartAt']
+    path = []
+
+    while name is not None and len(path) < max_steps:
+        state = states[name]
+        if state.get('Type') == 'Parallel':
+            latency = max(
+                (walk(branch, scenario, overrides, max_steps)[0] for branch in state['Branches']),
+                default=0
+            )
+        else:
+            latency = state_latency_ms(state, overrides)
+        path.append((name, latency + TRANSITION_MS))
+        name = _next(name, state, scenario)
+
+    return sum(ms for _, ms in path), path
+
+
+def format_path(path):
+    return '\n'.join(f"  {name:<36}{ms:>8.0f} ms" for name, ms in path)
+